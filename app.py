@@ -1,47 +1,190 @@
 import os
+import atexit
 import logging
+import threading
+import click
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
 from sqlalchemy.orm import DeclarativeBase
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
 
+logger = logging.getLogger(__name__)
+
 class Base(DeclarativeBase):
     pass
 
 db = SQLAlchemy(model_class=Base)
-migrate = Migrate()
+# Flask-Migrate 实例，仅在命令行中创建（见 create_app）
+migrate = None
+
+# 后台服务每个进程只启动一次
+_services_lock = threading.Lock()
+_services_started = False
+_schema_ready = False
+# 持有调度器文件锁的文件对象，进程退出时由操作系统释放
+_scheduler_lock_file = None
+# 未拿到调度器锁的进程重试的间隔（秒）
+SCHEDULER_LOCK_RETRY = 30
+
+
+def create_app(config=None):
+    """
+    Create and configure the Flask application
+
+    Creating the app has no side effects: no database connection is opened,
+    no tables are created and no background thread is started. This keeps
+    imports cheap and makes the app safe to preload in a gunicorn master
+    before forking. Call prepare_database() and start_services() to bring
+    the process up.
+
+    Args:
+        config (dict): Configuration overriding the environment defaults
+
+    Returns:
+        Flask: The application
+    """
+    global migrate
+    app = Flask(__name__)
+    app.secret_key = os.environ.get("SESSION_SECRET", "resticly-default-secret")
+
+    # configure the database using PostgreSQL from environment
+    app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL")
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+        "pool_recycle": 300,
+        "pool_pre_ping": True,
+    }
+    # 启动时自动建表；使用迁移管理数据库结构时可设为0
+    app.config["AUTO_CREATE_SCHEMA"] = os.environ.get("RESTICLY_AUTO_CREATE_SCHEMA", "1") != "0"
+    # 运行调度器等单例服务的进程：auto（抢占文件锁）、1（总是）、0（从不）
+    app.config["SCHEDULER_MODE"] = os.environ.get("RESTICLY_SCHEDULER", "auto")
+    app.config["SCHEDULER_LOCK_FILE"] = os.environ.get("RESTICLY_SCHEDULER_LOCK", "/tmp/resticly-scheduler.lock")
+    # 没有通过 gunicorn 钩子启动服务时，在第一个请求时启动
+    app.config["START_SERVICES_ON_REQUEST"] = True
+    if config:
+        app.config.update(config)
+
+    # initialize the app with the extensions
+    db.init_app(app)
+
+    # Import models here to avoid circular imports
+    import models
+
+    # Initialize Flask-Migrate; alembic is slow to import and only the
+    # `flask db` commands need it, so web workers skip it
+    if app.config.get("ENABLE_MIGRATIONS", click.get_current_context(silent=True) is not None):
+        from flask_migrate import Migrate
+        if migrate is None:
+            migrate = Migrate()
+        migrate.init_app(app, db)
+
+    # Track per-table change counters and compress large responses
+    import http_cache
+    http_cache.init_app(app)
+
+    # Register the views
+    from routes import bp
+    app.register_blueprint(bp)
+
+    if app.config["START_SERVICES_ON_REQUEST"]:
+        @app.before_request
+        def _start_services_on_first_request():
+            if not _services_started:
+                start_services(app)
+
+    return app
+
+
+def prepare_database(app):
+    """
+    Create missing tables and change counters, then release all connections
+
+    Runs at most once per process. Forked workers inherit the flag, so with
+    a preloading server this only runs in the master.
+
+    Args:
+        app: Flask application
+    """
+    global _schema_ready
+    if _schema_ready or not app.config["AUTO_CREATE_SCHEMA"]:
+        return
+    import http_cache
+
+    with app.app_context():
+        db.create_all()
+        http_cache.ensure_table_versions(db)
+        # 不把已打开的连接带进 fork 出的工作进程
+        db.engine.dispose()
+    _schema_ready = True
+
+
+def start_services(app):
+    """
+    Start the background services of this process
+
+    The event bridge runs in every process. The scheduler, the health
+    prober and the snapshot enricher must run exactly once per deployment,
+    so they only start in the process selected by SCHEDULER_MODE; in 'auto'
+    mode the first process to lock SCHEDULER_LOCK_FILE wins and the others
+    keep retrying in case it exits.
+
+    Args:
+        app: Flask application
+    """
+    global _services_started
+    with _services_lock:
+        if _services_started:
+            return
+        _services_started = True
+
+    prepare_database(app)
+
+    # Start relaying events between worker processes
+    from events import event_broker
+    event_broker.start(app)
+
+    mode = app.config["SCHEDULER_MODE"]
+    if mode == "0":
+        logger.info("Scheduler disabled in this process")
+    elif mode == "1" or _acquire_scheduler_lock(app.config["SCHEDULER_LOCK_FILE"]):
+        _start_singleton_services(app)
+    else:
+        logger.info(f"Scheduler runs in another process (pid {os.getpid()} will retry)")
+        threading.Thread(target=_wait_for_scheduler_lock, args=(app,),
+                         name='SchedulerElection', daemon=True).start()
 
-# create the app
-app = Flask(__name__)
-app.secret_key = os.environ.get("SESSION_SECRET", "resticly-default-secret")
 
-# configure the database using PostgreSQL from environment
-app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL")
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-    "pool_recycle": 300,
-    "pool_pre_ping": True,
-}
+def _acquire_scheduler_lock(path):
+    global _scheduler_lock_file
+    import fcntl
 
-# initialize the app with the extensions
-db.init_app(app)
+    fh = open(path, "a")
+    try:
+        fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        fh.close()
+        return False
+    _scheduler_lock_file = fh
+    return True
 
-# Import models here to avoid circular imports
-import models
 
-# Initialize Flask-Migrate
-migrate.init_app(app, db)
+def _wait_for_scheduler_lock(app):
+    while not _acquire_scheduler_lock(app.config["SCHEDULER_LOCK_FILE"]):
+        threading.Event().wait(SCHEDULER_LOCK_RETRY)
+    logger.info(f"Process {os.getpid()} took over the scheduler")
+    _start_singleton_services(app)
 
-# Import routes to register them with the app
-import routes
 
-# Initialize database tables
-with app.app_context():
-    db.create_all()
+def _start_singleton_services(app):
+    from scheduler import init_scheduler, safe_shutdown_scheduler
+    from health import health_prober
+    from enrichment import snapshot_enricher
 
-# Initialize scheduler outside app context to avoid issues with teardown
-from scheduler import init_scheduler
-init_scheduler(app)
+    init_scheduler(app)
+    atexit.register(safe_shutdown_scheduler)
+    # Start the background repository health prober
+    health_prober.start(app)
+    # Start the background snapshot size enrichment
+    snapshot_enricher.start(app)
@@ -0,0 +1,249 @@
+import os
+import random
+import shutil
+import logging
+import secrets
+import tempfile
+import time
+
+from excludes import ExcludeMatcher, ExcludeRules
+from restic_wrapper import ResticWrapper, COMPRESSION_MODES, validate_write_options
+
+logger = logging.getLogger(__name__)
+
+# 压缩基准测试从源路径抽取的样本大小
+BENCHMARK_SAMPLE_BYTES = int(os.environ.get('RESTICLY_BENCHMARK_SAMPLE_BYTES', str(256 * 1024 * 1024)))
+# 抽样时保留的候选文件数（蓄水池抽样）及遍历的最大条目数
+BENCHMARK_MAX_FILES = int(os.environ.get('RESTICLY_BENCHMARK_MAX_FILES', '100000'))
+BENCHMARK_MAX_ENTRIES = int(os.environ.get('RESTICLY_BENCHMARK_MAX_ENTRIES', '10000000'))
+# 样本和临时仓库所在目录，默认为系统临时目录
+BENCHMARK_DIR = os.environ.get('RESTICLY_BENCHMARK_DIR') or None
+# 未指定时比较的设置：每种压缩模式，包大小使用 restic 默认值
+DEFAULT_SETTINGS = [{'compression': mode, 'pack_size': None} for mode in COMPRESSION_MODES]
+
+
+def normalize_settings(settings):
+    """
+    Validate the settings of a benchmark request
+
+    Args:
+        settings (list): Dicts with 'compression' and optional 'pack_size'
+
+    Returns:
+        list: Settings with both keys; a missing compression means 'auto',
+            the restic default
+
+    Raises:
+        ValueError: If a setting is invalid
+    """
+    if not settings:
+        return [dict(setting) for setting in DEFAULT_SETTINGS]
+    if not isinstance(settings, list) or not all(isinstance(setting, dict) for setting in settings):
+        raise ValueError('settings must be a list of objects with compression and pack_size')
+    normalized = []
+    for setting in settings:
+        compression = setting.get('compression') or 'auto'
+        pack_size = setting.get('pack_size') or None
+        validate_write_options(compression, pack_size)
+        normalized.append({'compression': compression, 'pack_size': pack_size})
+    return normalized
+
+
+def sample_files(source_path, rules=None, max_files=BENCHMARK_MAX_FILES, max_entries=BENCHMARK_MAX_ENTRIES,
+                 seed=None):
+    """
+    Walk a source path and pick a random sample of the files a backup would read
+
+    Uses reservoir sampling so every file has the same chance to be picked
+    regardless of where it is in the tree. Exclude rules are applied the
+    way restic applies them.
+
+    Returns:
+        tuple: (sampled (path, size) pairs in random order, totals dict with
+            files, bytes and truncated)
+
+    Raises:
+        ValueError: If the source path cannot be read
+    """
+    try:
+        root_stat = os.stat(source_path)
+    except OSError as e:
+        raise ValueError(f"Cannot read source path {source_path}: {str(e)}")
+    rng = random.Random(seed)
+    if not os.path.isdir(source_path):
+        return [(source_path, root_stat.st_size)], {'files': 1, 'bytes': root_stat.st_size, 'truncated': False}
+
+    matcher = ExcludeMatcher(rules or ExcludeRules(), root_stat)
+    reservoir = []
+    totals = {'files': 0, 'bytes': 0, 'truncated': False}
+    entries = 0
+    stack = [(source_path, None)]
+    while stack:
+        path, inherited = stack.pop()
+        try:
+            with os.scandir(path) as children:
+                for child in children:
+                    entries += 1
+                    if entries > max_entries:
+                        totals['truncated'] = True
+                        break
+                    try:
+                        is_dir = child.is_dir(follow_symlinks=False)
+                        stat = child.stat(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    rule = matcher.rule(child.path, is_dir, stat, inherited)
+                    if is_dir:
+                        if not matcher.can_prune(rule):
+                            stack.append((child.path, rule))
+                        continue
+                    if rule is not None or not child.is_file(follow_symlinks=False):
+                        continue
+                    totals['files'] += 1
+                    totals['bytes'] += stat.st_size
+                    if len(reservoir) < max_files:
+                        reservoir.append((child.path, stat.st_size))
+                    else:
+                        index = rng.randrange(totals['files'])
+                        if index < max_files:
+                            reservoir[index] = (child.path, stat.st_size)
+        except OSError as e:
+            logger.debug(f"Cannot scan {path}: {str(e)}")
+        if totals['truncated']:
+            break
+    rng.shuffle(reservoir)
+    return reservoir, totals
+
+
+def build_sample(files, sample_dir, sample_bytes=BENCHMARK_SAMPLE_BYTES):
+    """
+    Copy sampled files into a directory until it holds sample_bytes
+
+    The last file that does not fit is cut to the remaining budget, so
+    sources made of a few large files (media, images) are sampled too.
+    The copies stay in the page cache, which keeps disk reads out of the
+    comparison between settings.
+
+    Returns:
+        dict: Number of files and bytes in the sample
+    """
+    os.makedirs(sample_dir, exist_ok=True)
+    copied = {'files': 0, 'bytes': 0}
+    for index, (path, size) in enumerate(files):
+        remaining = sample_bytes - copied['bytes']
+        if remaining <= 0:
+            break
+        target = os.path.join(sample_dir, f'{index:06d}-{os.path.basename(path)}')
+        try:
+            with open(path, 'rb') as src, open(target, 'wb') as dst:
+                written = 0
+                while written < min(size, remaining):
+                    chunk = src.read(min(1024 * 1024, remaining - written))
+                    if not chunk:
+                        break
+                    dst.write(chunk)
+                    written += len(chunk)
+        except OSError as e:
+            logger.debug(f"Cannot sample {path}: {str(e)}")
+            continue
+        copied['files'] += 1
+        copied['bytes'] += written
+    return copied
+
+
+def _recommend(results, upload_rate):
+    """Pick the setting with the shortest estimated backup time; None without an upload rate"""
+    candidates = [r for r in results if r.get('estimated_seconds') is not None]
+    if not upload_rate or not candidates:
+        return None
+    best = min(candidates, key=lambda r: r['estimated_seconds'])
+    return {'compression': best['compression'], 'pack_size': best['pack_size']}
+
+
+def run_benchmark(source_path, rules=None, settings=None, sample_bytes=BENCHMARK_SAMPLE_BYTES,
+                  upload_rate=None, on_progress=None):
+    """
+    Compare compression and pack size settings on a sample of a source
+
+    A random sample of the source (at most sample_bytes) is backed up once
+    per setting, each time into a fresh temporary local repository so
+    deduplication between runs does not skew the numbers. The repository
+    the source is normally backed up to is not touched.
+
+    Throughput measures restic reading, chunking and compressing the
+    sample; it does not include the network. With upload_rate (bytes/s
+    to the real repository) each result gets an estimated time for a full
+    backup of the source, the longer of compressing it and uploading the
+    compressed data, and the fastest setting is recommended.
+
+    Args:
+        source_path (str): Path to sample
+        rules (ExcludeRules): Exclude rules of the task
+        settings (list): Settings to compare, see normalize_settings
+        sample_bytes (int): Size of the sample
+        upload_rate (float): Optional upload bandwidth in bytes/s
+        on_progress (callable): Optional callback receiving progress keyword arguments
+
+    Returns:
+        dict: Source totals, sample size, one result per setting and the
+            recommended setting
+    """
+    settings = normalize_settings(settings)
+    workdir = tempfile.mkdtemp(prefix='resticly-benchmark-', dir=BENCHMARK_DIR)
+    try:
+        files, source = sample_files(source_path, rules)
+        sample = build_sample(files, os.path.join(workdir, 'sample'), sample_bytes)
+        if not sample['files']:
+            raise ValueError(f'No readable files to sample in {source_path}')
+        if on_progress:
+            on_progress(settings_total=len(settings), settings_done=0, sample_bytes=sample['bytes'])
+
+        results = []
+        for index, setting in enumerate(settings):
+            restic = ResticWrapper(os.path.join(workdir, f'repo-{index}'), secrets.token_hex(16),
+                                   compression=setting['compression'], pack_size=setting['pack_size'])
+            result = dict(setting)
+            success, message = restic.init_repository()
+            if success:
+                start = time.monotonic()
+                success, output = restic.create_backup(os.path.join(workdir, 'sample'))
+                duration = time.monotonic() - start
+                message = output.get('message')
+            if not success:
+                logger.warning(f"Benchmark of {setting} on {source_path} failed: {message}")
+                result['error'] = message
+                results.append(result)
+                continue
+
+            processed = output.get('total_bytes_processed') or sample['bytes']
+            added = output.get('data_added') or 0
+            stored = output.get('data_added_packed')
+            throughput = processed / duration if duration > 0 else None
+            result.update({
+                'duration': round(duration, 3),
+                'bytes_processed': processed,
+                'bytes_added': added,
+                'bytes_stored': stored,
+                # restic 0.17 之前的版本不报告 data_added_packed，无法计算压缩比
+                'ratio': round(stored / added, 4) if stored is not None and added else None,
+                'throughput_bytes_per_sec': round(throughput) if throughput else None,
+                'projected_stored_bytes': round(source['bytes'] * stored / processed)
+                if stored is not None and processed else None
+            })
+            if upload_rate and throughput and result['projected_stored_bytes'] is not None:
+                result['estimated_seconds'] = round(max(source['bytes'] / throughput,
+                                                        result['projected_stored_bytes'] / upload_rate), 1)
+            results.append(result)
+            if on_progress:
+                on_progress(settings_done=index + 1, current=setting)
+
+        return {
+            'source_path': source_path,
+            'source': source,
+            'sample': sample,
+            'upload_rate': upload_rate,
+            'results': results,
+            'recommended': _recommend(results, upload_rate)
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
@@ -0,0 +1,448 @@
+#!/usr/bin/env python3
+"""
+可配置的 restic 模拟可执行文件，用于性能基准测试
+
+Emulates the subset of the restic CLI used by resticly (init, check, backup,
+snapshots, ls, stats, forget, restore, cat, list, dump) and produces the same
+output shapes as the real binary, including NDJSON progress streams. The size
+of the simulated world is controlled through environment variables:
+
+    FAKE_RESTIC_SNAPSHOTS   number of snapshots per repository (default 100)
+    FAKE_RESTIC_FILES       number of files in each snapshot tree (default 1000)
+    FAKE_RESTIC_FILE_SIZE   average file size in bytes (default 65536)
+    FAKE_RESTIC_RATE        simulated backup throughput in bytes/s (default 1 GiB/s)
+    FAKE_RESTIC_LATENCY     fixed startup latency per invocation in seconds (default 0.02)
+    FAKE_RESTIC_STATUS_INTERVAL  seconds between NDJSON status lines (default 0.1)
+    FAKE_RESTIC_SEED        seed for the generated world (default 'resticly')
+    FAKE_RESTIC_STATE       optional directory for snapshots created/forgotten at runtime
+
+The repository is selected from RESTIC_REPOSITORY, so several repositories
+can be simulated at once with different snapshot ids.
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+import random
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+PROGRAM_VERSION = 'restic 0.18.0 (fake)'
+
+
+def _env_int(name, default):
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def _env_float(name, default):
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+SNAPSHOTS = _env_int('FAKE_RESTIC_SNAPSHOTS', 100)
+FILES = _env_int('FAKE_RESTIC_FILES', 1000)
+FILE_SIZE = _env_int('FAKE_RESTIC_FILE_SIZE', 64 * 1024)
+RATE = _env_float('FAKE_RESTIC_RATE', 1024 ** 3)
+LATENCY = _env_float('FAKE_RESTIC_LATENCY', 0.02)
+STATUS_INTERVAL = _env_float('FAKE_RESTIC_STATUS_INTERVAL', 0.1)
+SEED = os.environ.get('FAKE_RESTIC_SEED', 'resticly')
+STATE_DIR = os.environ.get('FAKE_RESTIC_STATE')
+
+# 所有生成的快照时间都以此为基准，保证多次调用结果一致
+EPOCH = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+
+def _digest(*parts):
+    return hashlib.sha256('-'.join(str(p) for p in parts).encode()).hexdigest()
+
+
+def _emit(obj):
+    sys.stdout.write(json.dumps(obj) + '\n')
+
+
+def _iso(dt):
+    return dt.isoformat().replace('+00:00', 'Z')
+
+
+class FakeRepository:
+    """Deterministic repository keyed by RESTIC_REPOSITORY"""
+
+    def __init__(self, location):
+        self.location = location or 'default'
+        self.key = _digest(SEED, self.location)[:16]
+
+    # ------------------------------------------------------------------
+    # 运行时状态（新建/删除的快照），保存在 FAKE_RESTIC_STATE 目录
+    # ------------------------------------------------------------------
+    @contextmanager
+    def _state(self, write=False):
+        if not STATE_DIR:
+            yield {'added': [], 'forgotten': []}
+            return
+
+        os.makedirs(STATE_DIR, exist_ok=True)
+        path = os.path.join(STATE_DIR, f'{self.key}.json')
+        with open(path, 'a+') as fh:
+            fcntl.flock(fh, fcntl.LOCK_EX if write else fcntl.LOCK_SH)
+            fh.seek(0)
+            content = fh.read()
+            state = json.loads(content) if content else {'added': [], 'forgotten': []}
+            yield state
+            if write:
+                fh.seek(0)
+                fh.truncate()
+                fh.write(json.dumps(state))
+            fcntl.flock(fh, fcntl.LOCK_UN)
+
+    def _base_snapshot(self, index):
+        snapshot_id = _digest(self.key, 'snapshot', index)
+        return {
+            'time': _iso(EPOCH + timedelta(hours=index)),
+            'tree': _digest(self.key, 'tree', index),
+            'paths': [f'/data/source{index % 10}'],
+            'hostname': f'host-{index % 5}',
+            'username': 'root',
+            'uid': 0,
+            'gid': 0,
+            'tags': ['bench', f'group{index % 3}'],
+            'program_version': PROGRAM_VERSION,
+            'summary': self._summary(index),
+            'id': snapshot_id,
+            'short_id': snapshot_id[:8],
+        }
+
+    def _summary(self, index):
+        rng = random.Random(f'{self.key}-{index}')
+        files_new = rng.randint(0, max(FILES // 10, 1))
+        return {
+            'files_new': files_new,
+            'files_changed': rng.randint(0, max(FILES // 20, 1)),
+            'files_unmodified': FILES - files_new,
+            'data_added': files_new * FILE_SIZE,
+            'data_added_packed': files_new * FILE_SIZE // 2,
+            'total_files_processed': FILES,
+            'total_bytes_processed': FILES * FILE_SIZE,
+        }
+
+    def snapshots(self):
+        with self._state() as state:
+            forgotten = set(state['forgotten'])
+            result = [self._base_snapshot(i) for i in range(SNAPSHOTS)]
+            result.extend(state['added'])
+        return [s for s in result if s['id'] not in forgotten]
+
+    def find(self, snapshot_id):
+        if snapshot_id == 'latest':
+            snapshots = self.snapshots()
+            return snapshots[-1] if snapshots else None
+        for snapshot in self.snapshots():
+            if snapshot['id'].startswith(snapshot_id):
+                return snapshot
+        return None
+
+    def nodes(self, snapshot):
+        """Yield file tree nodes of a snapshot in restic ls order"""
+        root = snapshot['paths'][0]
+        mtime = snapshot['time']
+        dirs_emitted = set()
+        for i in range(FILES):
+            directory = f'{root}/dir{i // 100:04d}'
+            if directory not in dirs_emitted:
+                dirs_emitted.add(directory)
+                yield {
+                    'name': directory.rsplit('/', 1)[-1], 'type': 'dir', 'path': directory,
+                    'uid': 0, 'gid': 0, 'mode': 2147484141, 'permissions': 'drwxr-xr-x',
+                    'mtime': mtime, 'atime': mtime, 'ctime': mtime,
+                    'struct_type': 'node', 'message_type': 'node',
+                }
+            name = f'file{i:06d}.dat'
+            yield {
+                'name': name, 'type': 'file', 'path': f'{directory}/{name}',
+                'uid': 0, 'gid': 0, 'size': FILE_SIZE + (i % 7) * 13, 'mode': 420,
+                'permissions': '-rw-r--r--', 'mtime': mtime, 'atime': mtime, 'ctime': mtime,
+                'inode': i + 1, 'struct_type': 'node', 'message_type': 'node',
+            }
+
+    def add_snapshot(self, snapshot):
+        with self._state(write=True) as state:
+            state['added'].append(snapshot)
+
+    def forget(self, snapshot_ids):
+        removed = []
+        with self._state(write=True) as state:
+            for snapshot in [self._base_snapshot(i) for i in range(SNAPSHOTS)] + state['added']:
+                if any(snapshot['id'].startswith(s) for s in snapshot_ids):
+                    state['forgotten'].append(snapshot['id'])
+                    removed.append(snapshot['id'])
+        return removed
+
+
+def _positional(args):
+    """Return positional arguments, skipping options and their values"""
+    with_value = {'--tag', '--target', '--include', '--exclude', '--host', '--path',
+                  '--keep-last', '--keep-hourly', '--keep-daily', '--keep-weekly',
+                  '--keep-monthly', '--keep-yearly', '--mode', '--archive',
+                  '--stdin-filename', '--files-from', '--compression', '--pack-size',
+                  '--from-repo', '--exclude-larger-than', '--exclude-file',
+                  '--limit-upload', '--limit-download', '--repository-version'}
+    result = []
+    skip = False
+    for index, arg in enumerate(args):
+        if skip:
+            skip = False
+            continue
+        if arg == '--':
+            result.extend(args[index + 1:])
+            break
+        if arg in with_value:
+            skip = True
+        elif not arg.startswith('-'):
+            result.append(arg)
+    return result
+
+
+def _option(args, name, default=None):
+    values = [args[i + 1] for i, arg in enumerate(args[:-1]) if arg == name]
+    return values if values else default
+
+
+def cmd_backup(repo, args):
+    paths = _positional(args)
+    for list_file in _option(args, '--files-from', []):
+        with open(list_file, encoding='utf-8') as fh:
+            paths.extend(line.rstrip('\n') for line in fh if line.strip())
+    paths = paths or ['/data/source']
+    tags = _option(args, '--tag', [])
+    total_bytes = FILES * FILE_SIZE
+    duration = total_bytes / RATE if RATE > 0 else 0
+    start = time.monotonic()
+    json_output = '--json' in args
+
+    # 按配置的速率输出进度流
+    elapsed = 0.0
+    while elapsed < duration:
+        time.sleep(min(STATUS_INTERVAL, duration - elapsed))
+        elapsed = time.monotonic() - start
+        done = min(elapsed / duration, 1.0) if duration else 1.0
+        if json_output:
+            _emit({
+                'message_type': 'status',
+                'seconds_elapsed': int(elapsed),
+                'percent_done': done,
+                'total_files': FILES,
+                'files_done': int(FILES * done),
+                'total_bytes': total_bytes,
+                'bytes_done': int(total_bytes * done),
+            })
+            sys.stdout.flush()
+
+    snapshot_id = _digest(repo.key, 'backup', time.time_ns(), os.getpid())
+    files_new = max(FILES // 10, 1)
+    summary = {
+        'message_type': 'summary',
+        'files_new': files_new,
+        'files_changed': FILES // 20,
+        'files_unmodified': FILES - files_new,
+        'dirs_new': 1,
+        'dirs_changed': 0,
+        'dirs_unmodified': FILES // 100,
+        'data_blobs': files_new,
+        'tree_blobs': 2,
+        'data_added': files_new * FILE_SIZE,
+        'data_added_packed': files_new * FILE_SIZE // 2,
+        'total_files_processed': FILES,
+        'total_bytes_processed': total_bytes,
+        'total_duration': time.monotonic() - start,
+        'backup_start': _iso(datetime.now(timezone.utc)),
+        'backup_end': _iso(datetime.now(timezone.utc)),
+        'snapshot_id': snapshot_id,
+    }
+    if '--dry-run' in args:
+        summary.pop('snapshot_id')
+    else:
+        repo.add_snapshot({
+            'time': _iso(datetime.now(timezone.utc)),
+            'tree': _digest(snapshot_id, 'tree'),
+            'paths': paths,
+            'hostname': os.uname().nodename,
+            'username': 'root',
+            'tags': tags,
+            'program_version': PROGRAM_VERSION,
+            'summary': {k: v for k, v in summary.items() if k != 'message_type'},
+            'id': snapshot_id,
+            'short_id': snapshot_id[:8],
+        })
+
+    if json_output:
+        _emit(summary)
+    else:
+        print(f'snapshot {snapshot_id[:8]} saved')
+    return 0
+
+
+def cmd_snapshots(repo, args):
+    snapshots = repo.snapshots()
+    if '--json' in args:
+        sys.stdout.write(json.dumps(snapshots))
+    else:
+        for snapshot in snapshots:
+            print(f"{snapshot['short_id']}  {snapshot['time']}  {snapshot['hostname']}")
+    return 0
+
+
+def cmd_ls(repo, args):
+    positional = _positional(args)
+    snapshot = repo.find(positional[0]) if positional else None
+    if not snapshot:
+        sys.stderr.write('Fatal: no matching ID found\n')
+        return 1
+
+    prefixes = positional[1:]
+    header = dict(snapshot, struct_type='snapshot', message_type='snapshot')
+    header.pop('summary', None)
+    _emit(header)
+    for node in repo.nodes(snapshot):
+        if prefixes and not any(node['path'].startswith(p) for p in prefixes):
+            continue
+        _emit(node)
+    return 0
+
+
+def cmd_stats(repo, args):
+    snapshots = repo.snapshots()
+    positional = _positional(args)
+    if positional:
+        snapshots = [s for s in snapshots if any(s['id'].startswith(p) for p in positional)]
+    mode = (_option(args, '--mode') or ['restore-size'])[0]
+    if mode == 'raw-data':
+        added = sum(s.get('summary', {}).get('data_added', 0) for s in snapshots)
+        stats = {
+            'total_size': added // 2,
+            'total_uncompressed_size': added,
+            'compression_ratio': 2.0,
+            'compression_progress': 100,
+            'compression_space_saving': 50.0,
+            'total_blob_count': len(snapshots) * FILES // 10,
+            'snapshots_count': len(snapshots),
+        }
+    else:
+        stats = {
+            'total_size': len(snapshots) * FILES * FILE_SIZE,
+            'total_file_count': len(snapshots) * FILES,
+            'snapshots_count': len(snapshots),
+        }
+    _emit(stats)
+    return 0
+
+
+def cmd_forget(repo, args):
+    ids = _positional(args)
+    removed = repo.forget(ids) if ids else []
+    if '--json' in args:
+        _emit([{'tags': None, 'host': '', 'paths': None,
+                'keep': [], 'remove': [{'id': i, 'short_id': i[:8]} for i in removed]}])
+    else:
+        print(f'removed {len(removed)} snapshots')
+    return 0
+
+
+def cmd_restore(repo, args):
+    positional = _positional(args)
+    snapshot = repo.find(positional[0]) if positional else None
+    if not snapshot:
+        sys.stderr.write('Fatal: no matching ID found\n')
+        return 1
+    total_bytes = FILES * FILE_SIZE
+    time.sleep(total_bytes / RATE if RATE > 0 else 0)
+    if '--json' in args:
+        _emit({'message_type': 'summary', 'seconds_elapsed': 0, 'total_files': FILES,
+               'files_restored': FILES, 'files_skipped': 0, 'total_bytes': total_bytes,
+               'bytes_restored': total_bytes, 'bytes_skipped': 0})
+    else:
+        print(f"restoring snapshot {snapshot['short_id']}")
+    return 0
+
+
+def cmd_dump(repo, args):
+    positional = _positional(args)
+    snapshot = repo.find(positional[0]) if len(positional) > 1 else None
+    if not snapshot:
+        sys.stderr.write('Fatal: no matching ID found\n')
+        return 1
+    # 以确定性字节内容模拟文件数据
+    chunk = (_digest(snapshot['id'], positional[1]) * 1024).encode()[:64 * 1024]
+    remaining = FILE_SIZE
+    out = sys.stdout.buffer
+    while remaining > 0:
+        piece = chunk[:remaining]
+        out.write(piece)
+        remaining -= len(piece)
+    out.flush()
+    return 0
+
+
+def cmd_cat(repo, args):
+    positional = _positional(args)
+    if positional[:1] == ['config']:
+        _emit({'version': 2, 'id': _digest(repo.key, 'config'),
+               'chunker_polynomial': '3da3358b4bc8'})
+        return 0
+    sys.stderr.write('Fatal: unsupported cat target\n')
+    return 1
+
+
+def cmd_list(repo, args):
+    if _positional(args)[:1] == ['locks']:
+        return 0
+    sys.stderr.write('Fatal: unsupported list type\n')
+    return 1
+
+
+def cmd_check(repo, args):
+    print('using temporary cache\nload indexes\ncheck all packs\nno errors were found')
+    return 0
+
+
+def cmd_init(repo, args):
+    print(f'created restic repository {repo.key[:10]} at {repo.location}')
+    return 0
+
+
+COMMANDS = {
+    'backup': cmd_backup,
+    'snapshots': cmd_snapshots,
+    'ls': cmd_ls,
+    'stats': cmd_stats,
+    'forget': cmd_forget,
+    'restore': cmd_restore,
+    'dump': cmd_dump,
+    'cat': cmd_cat,
+    'list': cmd_list,
+    'check': cmd_check,
+    'init': cmd_init,
+}
+
+
+def main(argv):
+    if not argv or argv[0] not in COMMANDS:
+        sys.stderr.write(f'Fatal: unknown command {argv[:1]}\n')
+        return 1
+    if LATENCY > 0:
+        time.sleep(LATENCY)
+    repo = FakeRepository(os.environ.get('RESTIC_REPOSITORY'))
+    return COMMANDS[argv[0]](repo, argv[1:])
+
+
+if __name__ == '__main__':
+    try:
+        sys.exit(main(sys.argv[1:]))
+    except BrokenPipeError:
+        sys.exit(1)
@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+"""
+Resticly 性能基准测试
+
+Drives the Flask application against the fake restic executable in
+benchmarks/fake_restic.py and reports latency, throughput, memory high-water
+mark and SQL query counts for the main code paths:
+
+    sync        POST /api/repositories/<id>/snapshots/sync
+    list        GET  /api/snapshots (all and per repository)
+    files       GET  /api/snapshots/<id>/files
+    dashboard   GET  /, /api/repositories, /api/backups, /api/scheduled-tasks
+    backups     concurrent scheduler.run_backup_task runs
+    startup     importing main.py (creating the app) in a fresh interpreter
+
+Example:
+
+    python benchmarks/run_benchmarks.py --repos 5 --snapshots 2000 --files 5000 \\
+        --output bench.json
+    python benchmarks/run_benchmarks.py --baseline bench.json --tolerance 0.25
+
+With --baseline the run exits with status 1 if any scenario's p95 latency or
+queries per operation regressed by more than the tolerance.
+"""
+
+import argparse
+import json
+import logging
+import os
+import resource
+import stat
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Resticly performance benchmarks')
+    parser.add_argument('--repos', type=int, default=3, help='number of repositories')
+    parser.add_argument('--snapshots', type=int, default=500, help='snapshots per repository')
+    parser.add_argument('--files', type=int, default=2000, help='files per snapshot tree')
+    parser.add_argument('--file-size', type=int, default=64 * 1024, help='average file size in bytes')
+    parser.add_argument('--rate', type=float, default=2 * 1024 ** 3,
+                        help='simulated backup throughput in bytes/s')
+    parser.add_argument('--latency', type=float, default=0.02,
+                        help='simulated restic startup latency in seconds')
+    parser.add_argument('--iterations', type=int, default=20, help='iterations for read scenarios')
+    parser.add_argument('--concurrency', type=int, default=4, help='parallel clients for read scenarios')
+    parser.add_argument('--backups', type=int, default=8, help='concurrent scheduled backups')
+    parser.add_argument('--startup-runs', type=int, default=5, help='interpreters started by the startup scenario')
+    parser.add_argument('--scenarios', default='sync,list,files,dashboard,backups,startup',
+                        help='comma separated list of scenarios to run')
+    parser.add_argument('--database-url', help='database URL (defaults to a temporary SQLite file)')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--baseline', help='compare against a previous --output file')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed relative regression against the baseline')
+    parser.add_argument('--verbose', action='store_true', help='keep application debug logging')
+    return parser.parse_args(argv)
+
+
+def prepare_environment(args, workdir):
+    """Put a fake `restic` on PATH and configure the database before importing the app"""
+    bin_dir = os.path.join(workdir, 'bin')
+    os.makedirs(bin_dir, exist_ok=True)
+    shim = os.path.join(bin_dir, 'restic')
+    with open(shim, 'w') as fh:
+        fh.write(f'#!/bin/sh\nexec "{sys.executable}" "{os.path.join(BENCH_DIR, "fake_restic.py")}" "$@"\n')
+    os.chmod(shim, os.stat(shim).st_mode | stat.S_IEXEC)
+
+    os.environ['PATH'] = bin_dir + os.pathsep + os.environ.get('PATH', '')
+    os.environ['FAKE_RESTIC_SNAPSHOTS'] = str(args.snapshots)
+    os.environ['FAKE_RESTIC_FILES'] = str(args.files)
+    os.environ['FAKE_RESTIC_FILE_SIZE'] = str(args.file_size)
+    os.environ['FAKE_RESTIC_RATE'] = str(args.rate)
+    os.environ['FAKE_RESTIC_LATENCY'] = str(args.latency)
+    os.environ['FAKE_RESTIC_STATE'] = os.path.join(workdir, 'state')
+    os.environ['DATABASE_URL'] = args.database_url or f'sqlite:///{os.path.join(workdir, "bench.db")}'
+
+    if ROOT_DIR not in sys.path:
+        sys.path.insert(0, ROOT_DIR)
+
+
+class QueryCounter:
+    """Counts SQL statements executed on any engine"""
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, *args, **kwargs):
+        with self._lock:
+            self.count += 1
+
+    def install(self):
+        from sqlalchemy import event
+        from sqlalchemy.engine import Engine
+        event.listen(Engine, 'before_cursor_execute', self)
+
+
+class Benchmark:
+    def __init__(self, app, counter, concurrency):
+        self.app = app
+        self.counter = counter
+        self.concurrency = concurrency
+        self.results = {}
+
+    def measure(self, name, operations, concurrency=None):
+        """
+        Run operations and record latency, throughput, memory and query counts
+
+        Args:
+            name (str): Scenario name
+            operations (list): Callables to time; each is one operation
+            concurrency (int): Number of worker threads (defaults to --concurrency)
+        """
+        concurrency = concurrency or self.concurrency
+        latencies = []
+        errors = []
+
+        def timed(op):
+            start = time.perf_counter()
+            try:
+                op()
+            except Exception as e:
+                errors.append(str(e))
+            latencies.append(time.perf_counter() - start)
+
+        queries_before = self.counter.count
+        tracemalloc.reset_peak()
+        wall_start = time.perf_counter()
+        if concurrency > 1:
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                list(pool.map(timed, operations))
+        else:
+            for op in operations:
+                timed(op)
+        wall = time.perf_counter() - wall_start
+        peak = tracemalloc.get_traced_memory()[1]
+        queries = self.counter.count - queries_before
+
+        latencies.sort()
+        n = len(latencies)
+        result = {
+            'operations': n,
+            'errors': len(errors),
+            'p50_ms': round(statistics.median(latencies) * 1000, 2) if n else 0,
+            'p95_ms': round(latencies[min(n - 1, int(n * 0.95))] * 1000, 2) if n else 0,
+            'max_ms': round(latencies[-1] * 1000, 2) if n else 0,
+            'throughput_ops': round(n / wall, 2) if wall else 0,
+            'queries_per_op': round(queries / n, 2) if n else 0,
+            'peak_mem_mb': round(peak / 1024 / 1024, 2),
+        }
+        if errors:
+            result['first_error'] = errors[0]
+        self.results[name] = result
+        return result
+
+    def request(self, method, url, expect=200, **kwargs):
+        def op():
+            with self.app.test_client() as client:
+                response = client.open(url, method=method, **kwargs)
+                if response.status_code != expect:
+                    raise RuntimeError(f'{method} {url} returned {response.status_code}')
+        return op
+
+
+def create_repositories(app, count):
+    repo_ids = []
+    with app.test_client() as client:
+        for i in range(count):
+            response = client.post('/api/repositories', json={
+                'name': f'bench-{i}-{int(time.time() * 1000)}',
+                'repo_type': 'local',
+                'location': f'/bench/repo{i}',
+                'password': 'bench',
+            })
+            if response.status_code != 201:
+                raise RuntimeError(f'Failed to create repository: {response.get_json()}')
+            repo_ids.append(response.get_json()['id'])
+    return repo_ids
+
+
+def run_backup_scenario(bench, app, repo_ids, count):
+    from app import db
+    from models import ScheduledTask
+    from scheduler import run_backup_task
+
+    with app.app_context():
+        task_ids = []
+        for i in range(count):
+            task = ScheduledTask(
+                repository_id=repo_ids[i % len(repo_ids)],
+                name=f'bench-task-{i}',
+                source_path=f'/data/bench{i}',
+                schedule_type='interval',
+                interval_seconds=86400,
+                enabled=False,
+            )
+            db.session.add(task)
+            db.session.flush()
+            task_ids.append(task.id)
+        db.session.commit()
+
+    ops = [lambda task_id=task_id: run_backup_task(task_id, app=app) for task_id in task_ids]
+    return bench.measure('backups', ops, concurrency=count)
+
+
+# 在新的解释器中导入 main.py，报告导入耗时、线程数和打开的数据库连接数
+STARTUP_PROBE = """
+import json, sys, threading, time
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+connections = []
+event.listen(Engine, 'connect', lambda *args: connections.append(1))
+start = time.perf_counter()
+import main
+print(json.dumps({
+    'import_ms': (time.perf_counter() - start) * 1000,
+    'threads': threading.active_count(),
+    'db_connections': len(connections),
+}))
+"""
+
+
+def run_startup_scenario(bench, runs):
+    """Measure how long a worker takes to import the app and what it starts on import"""
+    probes = []
+
+    def op():
+        output = subprocess.run([sys.executable, '-c', STARTUP_PROBE], cwd=ROOT_DIR,
+                                capture_output=True, text=True, check=True).stdout
+        probes.append(json.loads(output.strip().splitlines()[-1]))
+
+    result = bench.measure('startup', [op] * runs, concurrency=1)
+    if probes:
+        result['import_ms'] = round(statistics.median(p['import_ms'] for p in probes), 2)
+        result['threads'] = max(p['threads'] for p in probes)
+        result['db_connections'] = max(p['db_connections'] for p in probes)
+    return result
+
+
+def compare(results, baseline, tolerance):
+    """Return a list of human readable regressions against a baseline"""
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if not previous:
+            continue
+        for metric in ('p95_ms', 'queries_per_op'):
+            old, new = previous.get(metric, 0), current.get(metric, 0)
+            if old and new > old * (1 + tolerance):
+                regressions.append(f'{name}.{metric}: {old} -> {new} (+{(new / old - 1) * 100:.0f}%)')
+    return regressions
+
+
+def print_report(results):
+    columns = ['operations', 'errors', 'p50_ms', 'p95_ms', 'max_ms',
+               'throughput_ops', 'queries_per_op', 'peak_mem_mb']
+    extra = ['import_ms', 'threads', 'db_connections']
+    print(f"{'scenario':<12}" + ''.join(f'{c:>16}' for c in columns))
+    for name, result in results.items():
+        print(f'{name:<12}' + ''.join(f'{result.get(c, ""):>16}' for c in columns))
+    for name, result in results.items():
+        if any(c in result for c in extra):
+            print(f'\n{name}: ' + ', '.join(f'{c}={result[c]}' for c in extra if c in result))
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f'\nprocess max RSS: {max_rss / 1024:.1f} MB')
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    scenarios = [s.strip() for s in args.scenarios.split(',') if s.strip()]
+
+    with tempfile.TemporaryDirectory(prefix='resticly-bench-') as workdir:
+        prepare_environment(args, workdir)
+        tracemalloc.start()
+
+        from app import create_app, prepare_database
+        app = create_app({'START_SERVICES_ON_REQUEST': False})
+        prepare_database(app)
+        if not args.verbose:
+            # 应用默认DEBUG日志会输出完整的restic输出，影响测量结果
+            logging.getLogger().setLevel(logging.WARNING)
+        counter = QueryCounter()
+        counter.install()
+        bench = Benchmark(app, counter, args.concurrency)
+
+        repo_ids = create_repositories(app, args.repos)
+
+        if 'sync' in scenarios or 'list' in scenarios or 'files' in scenarios:
+            bench.measure('sync', [
+                bench.request('POST', f'/api/repositories/{repo_id}/snapshots/sync')
+                for repo_id in repo_ids
+            ], concurrency=1)
+
+        if 'list' in scenarios:
+            ops = []
+            for i in range(args.iterations):
+                ops.append(bench.request('GET', '/api/snapshots'))
+                ops.append(bench.request('GET', f'/api/snapshots?repository_id={repo_ids[i % len(repo_ids)]}'))
+            bench.measure('list', ops)
+
+        if 'files' in scenarios:
+            from models import Snapshot
+            with app.app_context():
+                snapshot_ids = [row.snapshot_id for row in Snapshot.query.limit(args.iterations).all()]
+            bench.measure('files', [
+                bench.request('GET', f'/api/snapshots/{snapshot_id}/files')
+                for snapshot_id in snapshot_ids
+            ])
+
+        if 'dashboard' in scenarios:
+            ops = []
+            for _ in range(args.iterations):
+                ops.extend([
+                    bench.request('GET', '/'),
+                    bench.request('GET', '/api/repositories'),
+                    bench.request('GET', '/api/backups'),
+                    bench.request('GET', '/api/scheduled-tasks'),
+                ])
+            bench.measure('dashboard', ops)
+
+        if 'backups' in scenarios:
+            run_backup_scenario(bench, app, repo_ids, args.backups)
+
+        if 'startup' in scenarios:
+            run_startup_scenario(bench, args.startup_runs)
+
+        print_report(bench.results)
+
+        if args.output:
+            with open(args.output, 'w') as fh:
+                json.dump(bench.results, fh, indent=2)
+
+        if args.baseline:
+            with open(args.baseline) as fh:
+                regressions = compare(bench.results, json.load(fh), args.tolerance)
+            if regressions:
+                print('\nPerformance regressions:')
+                for line in regressions:
+                    print(f'  {line}')
+                return 1
+            print('\nNo regressions against baseline')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,327 @@
+import os
+import json
+import shutil
+import logging
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timedelta
+
+from excludes import ExcludeMatcher, ExcludeRules
+from events import event_broker
+
+logger = logging.getLogger(__name__)
+
+# 源路径扫描的并发线程数（scandir/stat 会释放 GIL，网络文件系统上收益明显）
+SCAN_WORKERS = int(os.environ.get('RESTICLY_SCAN_WORKERS', '16'))
+# 单次扫描最多检查的条目数，超出时结果标记为 truncated
+SCAN_MAX_ENTRIES = int(os.environ.get('RESTICLY_SCAN_MAX_ENTRIES', '10000000'))
+# 计算仓库增长速度时使用的备份历史窗口（天）
+FORECAST_WINDOW_DAYS = int(os.environ.get('RESTICLY_FORECAST_WINDOW_DAYS', '30'))
+# 预计在这么多天内写满的仓库标记为 warning / critical
+CAPACITY_WARN_DAYS = float(os.environ.get('RESTICLY_CAPACITY_WARN_DAYS', '30'))
+CAPACITY_CRITICAL_DAYS = float(os.environ.get('RESTICLY_CAPACITY_CRITICAL_DAYS', '7'))
+
+# 各仓库最近一次检查得到的容量状态，状态变化时才发出事件
+_last_status = {}
+_last_status_lock = threading.Lock()
+
+
+def scan_source(source_path, rules=None, workers=SCAN_WORKERS, max_entries=SCAN_MAX_ENTRIES):
+    """
+    Count the files and bytes a backup of a source path would read
+
+    Directories are scanned concurrently, one directory per work item, and
+    the exclude rules of the task are applied the way restic applies them,
+    so excluded subtrees are not walked at all.
+
+    Args:
+        source_path (str): Path to back up
+        rules (ExcludeRules): Optional exclude rules
+        workers (int): Number of scanning threads
+        max_entries (int): Stop after this many entries
+
+    Returns:
+        dict: files, dirs, bytes, unreadable directories, duration and
+            whether the scan was truncated
+
+    Raises:
+        ValueError: If the source path cannot be read
+    """
+    start = time.monotonic()
+    try:
+        root_stat = os.stat(source_path)
+    except OSError as e:
+        raise ValueError(f"Cannot read source path {source_path}: {str(e)}")
+    if not os.path.isdir(source_path):
+        return {'source_path': source_path, 'files': 1, 'dirs': 0, 'bytes': root_stat.st_size,
+                'unreadable': 0, 'truncated': False, 'duration': 0.0}
+
+    matcher = ExcludeMatcher(rules or ExcludeRules(), root_stat)
+
+    def scan_dir(path, inherited):
+        files = size = dirs = 0
+        subdirs = []
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    try:
+                        is_dir = entry.is_dir(follow_symlinks=False)
+                        stat = entry.stat(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    rule = matcher.rule(entry.path, is_dir, stat, inherited)
+                    if is_dir:
+                        if not matcher.can_prune(rule):
+                            subdirs.append((entry.path, rule))
+                        dirs += rule is None
+                    elif rule is None:
+                        files += 1
+                        size += stat.st_size
+        except OSError as e:
+            logger.debug(f"Cannot scan {path}: {str(e)}")
+            return 0, 0, 0, [], 1
+        return files, size, dirs, subdirs, 0
+
+    totals = {'files': 0, 'dirs': 1, 'bytes': 0, 'unreadable': 0}
+    entries = 0
+    truncated = False
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='SourceScan') as pool:
+        pending = {pool.submit(scan_dir, source_path, None)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                files, size, dirs, subdirs, unreadable = future.result()
+                totals['files'] += files
+                totals['bytes'] += size
+                totals['dirs'] += dirs
+                totals['unreadable'] += unreadable
+                entries += files + len(subdirs)
+                if entries > max_entries:
+                    truncated = True
+                    continue
+                for path, rule in subdirs:
+                    pending.add(pool.submit(scan_dir, path, rule))
+            if truncated:
+                for future in pending:
+                    future.cancel()
+                pending = set()
+
+    return dict(totals, source_path=source_path, truncated=truncated,
+                duration=round(time.monotonic() - start, 3))
+
+
+def history_ratio(history, repository_id, source_path, source_bytes):
+    """
+    Estimate the share of a source that a backup adds to the repository
+
+    Uses the median bytes added by the recent backups of the same source
+    path. Without history the whole source counts as new data, which is
+    an upper bound (deduplication against other sources is ignored).
+
+    Returns:
+        tuple: (ratio, basis) with basis 'history' or 'first_backup'
+    """
+    estimate = history.get((repository_id, source_path))
+    if estimate and estimate.bytes_p50 is not None and source_bytes:
+        return min(1.0, estimate.bytes_p50 / source_bytes), 'history'
+    return 1.0, 'first_backup'
+
+
+def estimate_source(repository, source_path, rules=None, dry_run=False, session=None):
+    """
+    Estimate what backing up a source path to a repository would push
+
+    The source is scanned for file and byte totals. The share of new data
+    comes from `restic backup --dry-run --json` when dry_run is set (exact
+    but reads every file, so it is slow for large sources), otherwise from
+    the history of the same source path in the repository.
+
+    Args:
+        repository: Target Repository object
+        source_path (str): Path to back up
+        rules (ExcludeRules): Exclude rules of the task
+        dry_run (bool): Ask restic for the data a backup would add
+        session: SQLAlchemy session, defaults to db.session
+
+    Returns:
+        dict: Scan totals, new data ratio and its basis, expected bytes
+            added, and the capacity forecast of the repository including
+            the new data
+    """
+    from planner import backup_history
+    from restic_wrapper import ResticWrapper
+
+    scan = scan_source(source_path, rules)
+    result = {'scan': scan, 'dry_run': None}
+    if dry_run:
+        restic = ResticWrapper.from_repository(repository)
+        success, output = restic.create_backup(source_path, dry_run=True,
+                                               **(rules.backup_args() if rules else {}))
+        if not success:
+            raise RuntimeError(f"Dry run failed: {output.get('message')}")
+        processed = output.get('total_bytes_processed') or 0
+        added = output.get('data_added') or 0
+        result['dry_run'] = {
+            'files_processed': output.get('total_files_processed'),
+            'bytes_processed': processed,
+            'data_added': added
+        }
+        ratio, basis = (added / processed if processed else 0.0), 'dry_run'
+        expected = added
+    else:
+        history = backup_history(session, repository.id, source_path)
+        ratio, basis = history_ratio(history, repository.id, source_path, scan['bytes'])
+        expected = round(scan['bytes'] * ratio)
+
+    forecast = forecast_repository(repository, session)
+    remaining = forecast['remaining_bytes']
+    result.update({
+        'new_data_ratio': round(ratio, 4),
+        'ratio_basis': basis,
+        'expected_bytes_added': expected,
+        'fits': remaining >= expected if remaining is not None else None,
+        'remaining_after_bytes': remaining - expected if remaining is not None else None,
+        'forecast': forecast
+    })
+    return result
+
+
+def _used_bytes(repository, session):
+    """Return the bytes stored in a repository and where the figure comes from"""
+    from sqlalchemy import func
+    from models import RepositoryStats, Backup
+
+    row = session.query(RepositoryStats).filter_by(repository_id=repository.id, mode='raw-data').first()
+    if row and row.stats:
+        total_size = json.loads(row.stats).get('total_size')
+        if total_size is not None:
+            return total_size, 'stats'
+    # 没有缓存的 raw-data 统计时，按历次备份新增的数据量累计（忽略压缩与 prune）
+    added = session.query(func.coalesce(func.sum(Backup.bytes_added), 0)) \
+        .filter(Backup.repository_id == repository.id, Backup.status == 'completed').scalar()
+    return int(added or 0), 'backups'
+
+
+def _disk_usage(repository):
+    if repository.repo_type != 'local':
+        return None
+    # 仓库目录可能尚未创建或暂时不可访问，取最近的已存在上级目录所在的文件系统
+    path = os.path.abspath(repository.location)
+    while not os.path.exists(path) and os.path.dirname(path) != path:
+        path = os.path.dirname(path)
+    try:
+        return shutil.disk_usage(path)
+    except OSError:
+        return None
+
+
+def forecast_repository(repository, session=None, now=None, window_days=FORECAST_WINDOW_DAYS):
+    """
+    Forecast when a repository runs out of space
+
+    Growth is the bytes added by completed backups during the last
+    `window_days`, per day. Space is limited by the configured
+    capacity_bytes and, for local repositories, by the free space of the
+    file system holding the repository, whichever is smaller. Growth
+    ignores forget/prune, so the forecast is pessimistic for repositories
+    with a retention policy.
+
+    Args:
+        repository: Repository object
+        session: SQLAlchemy session, defaults to db.session
+        now (datetime): Naive UTC reference time
+
+    Returns:
+        dict: used, capacity, remaining, growth per day (total and per
+            source path), days until full and status
+            ('ok', 'warning', 'critical' or 'unknown')
+    """
+    from app import db
+    from models import Backup, ScheduledTask
+
+    session = session or db.session
+    now = now or datetime.utcnow()
+    since = now - timedelta(days=window_days)
+
+    used, used_basis = _used_bytes(repository, session)
+    capacity = repository.capacity_bytes
+    remaining = capacity - used if capacity else None
+    capacity_basis = 'configured' if capacity else None
+    disk = _disk_usage(repository)
+    if disk and (remaining is None or disk.free < remaining):
+        capacity, remaining, capacity_basis = disk.total, disk.free, 'disk'
+
+    rows = session.query(Backup.source_path, Backup.start_time, Backup.bytes_added) \
+        .filter(Backup.repository_id == repository.id, Backup.status == 'completed',
+                Backup.start_time >= since).all()
+    # 历史不足一个窗口时按实际覆盖的天数计算，至少一天
+    first = min((row.start_time for row in rows), default=None)
+    span_days = max(1.0, (now - first).total_seconds() / 86400) if first else float(window_days)
+    per_source = defaultdict(int)
+    for source_path, _, bytes_added in rows:
+        per_source[source_path] += bytes_added or 0
+    growth = sum(per_source.values()) / span_days
+
+    tasks = defaultdict(list)
+    for task_id, source_path in session.query(ScheduledTask.id, ScheduledTask.source_path) \
+            .filter(ScheduledTask.repository_id == repository.id).all():
+        tasks[source_path].append(task_id)
+
+    if remaining is not None and remaining <= 0:
+        days_until_full = 0.0
+    else:
+        days_until_full = remaining / growth if remaining is not None and growth > 0 else None
+    if remaining is None:
+        status = 'unknown'
+    elif remaining <= 0 or (days_until_full is not None and days_until_full <= CAPACITY_CRITICAL_DAYS):
+        status = 'critical'
+    elif days_until_full is not None and days_until_full <= CAPACITY_WARN_DAYS:
+        status = 'warning'
+    else:
+        status = 'ok'
+
+    return {
+        'repository_id': repository.id,
+        'repository_name': repository.name,
+        'used_bytes': used,
+        'used_basis': used_basis,
+        'capacity_bytes': capacity,
+        'capacity_basis': capacity_basis,
+        'remaining_bytes': remaining,
+        'growth_bytes_per_day': round(growth),
+        'window_days': round(span_days, 1),
+        'days_until_full': round(days_until_full, 1) if days_until_full is not None else None,
+        'full_at': (now + timedelta(days=days_until_full)).isoformat()
+        if days_until_full is not None and days_until_full < 36500 else None,
+        'status': status,
+        'sources': sorted(({
+            'source_path': source_path,
+            'task_ids': tasks.get(source_path, []),
+            'growth_bytes_per_day': round(added / span_days)
+        } for source_path, added in per_source.items()), key=lambda item: -item['growth_bytes_per_day'])
+    }
+
+
+def check_capacity(repository, session=None):
+    """
+    Warn when the capacity status of a repository gets worse
+
+    Called after backups; publishes 'repository.capacity' when the status
+    changes to or between 'warning' and 'critical'.
+
+    Returns:
+        dict: The forecast
+    """
+    forecast = forecast_repository(repository, session)
+    status = forecast['status']
+    with _last_status_lock:
+        previous = _last_status.get(repository.id)
+        _last_status[repository.id] = status
+    if status in ('warning', 'critical') and status != previous:
+        logger.warning(f"Repository {repository.name} is {status}: {forecast['remaining_bytes']} bytes left, "
+                       f"growing {forecast['growth_bytes_per_day']} bytes/day, "
+                       f"full in {forecast['days_until_full']} days")
+        event_broker.publish('repository.capacity', **forecast)
+    return forecast
@@ -0,0 +1,248 @@
+import os
+import gzip
+import json
+import logging
+import threading
+import uuid
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+# 计划任务的变更检测模式：skip（无变化时跳过本次运行）、files_from（只备份变化的子树）
+CHANGE_DETECTION_MODES = ('skip', 'files_from')
+# 启用变更检测的任务每隔这么久仍做一次完整备份（秒），覆盖目录修改时间无法发现的文件内容修改
+FULL_BACKUP_INTERVAL = int(os.environ.get('RESTICLY_FULL_BACKUP_INTERVAL', str(7 * 86400)))
+# 变化的路径超过该数量时改为完整备份
+MAX_CHANGED_PATHS = int(os.environ.get('RESTICLY_MAX_CHANGED_PATHS', '10000'))
+# 保存各任务目录指纹的目录
+STATE_DIR = os.environ.get('RESTICLY_CHANGE_STATE_DIR', os.path.expanduser('~/.cache/resticly/changes'))
+# 内存中保留的变更提示数量上限
+MAX_HINTS = 100000
+# 部分备份快照的标签
+PARTIAL_TAG = 'resticly-partial'
+
+
+def scan_directories(root):
+    """
+    Record the modification time of every directory below a path
+
+    Only directories are stat'ed: a directory's mtime changes whenever an
+    entry is created, removed or renamed in it, so comparing two scans
+    finds the changed subtrees at a fraction of the cost of stat'ing every
+    file. In-place modifications of existing files are not visible here;
+    they are picked up by watcher hints and by the periodic full backup.
+
+    Args:
+        root (str): Source path of a task
+
+    Returns:
+        dict: Mapping of directory path to mtime in nanoseconds; a file
+            source maps its own path to (mtime, size)
+    """
+    try:
+        stat = os.stat(root)
+    except OSError:
+        return {}
+    if not os.path.isdir(root):
+        return {root: [stat.st_mtime_ns, stat.st_size]}
+
+    dirs = {root: stat.st_mtime_ns}
+    stack = [root]
+    while stack:
+        path = stack.pop()
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    try:
+                        # d_type 通常可以直接判断，不需要对普通文件执行 stat
+                        if entry.is_dir(follow_symlinks=False):
+                            dirs[entry.path] = entry.stat(follow_symlinks=False).st_mtime_ns
+                            stack.append(entry.path)
+                    except OSError:
+                        continue
+        except OSError as e:
+            logger.debug(f"Cannot scan {path}: {str(e)}")
+    return dirs
+
+
+def collapse_paths(paths):
+    """Drop paths whose ancestor is also in the list"""
+    result = []
+    for path in sorted(set(paths)):
+        if result and (path == result[-1] or path.startswith(result[-1].rstrip('/') + '/')):
+            continue
+        result.append(path)
+    return result
+
+
+class ChangeTracker:
+    """
+    Paths reported as changed by a resident watcher
+
+    Hints cover what the directory fingerprint cannot see, such as files
+    modified in place. Every hint gets a sequence number; each task
+    remembers up to which number it has backed up, so several tasks can
+    share a source path and a failed run sees the same hints again.
+    """
+
+    def __init__(self, max_hints=MAX_HINTS):
+        self.max_hints = max_hints
+        # 进程重启后序号从头开始，任务保存的游标随之失效
+        self.epoch = uuid.uuid4().hex
+        self._paths = {}
+        self._seq = 0
+        self._floor = 0
+        self._lock = threading.Lock()
+
+    def mark(self, path):
+        with self._lock:
+            self._seq += 1
+            self._paths.pop(path, None)
+            self._paths[path] = self._seq
+            if len(self._paths) > self.max_hints:
+                # 丢弃最旧的一半；游标早于丢弃位置的任务需要完整备份
+                for _ in range(len(self._paths) // 2):
+                    old_path = next(iter(self._paths))
+                    self._floor = self._paths.pop(old_path)
+
+    def since(self, root, epoch=None, cursor=0):
+        """
+        Return the hints at or below a source path newer than a cursor
+
+        Returns:
+            tuple: (set of paths or None if hints were dropped, new cursor)
+        """
+        if epoch != self.epoch:
+            cursor = 0
+        prefix = root.rstrip('/') + '/'
+        with self._lock:
+            if cursor < self._floor:
+                return None, self._seq
+            paths = {path for path, seq in self._paths.items()
+                     if seq > cursor and (path == root or path.startswith(prefix))}
+            return paths, self._seq
+
+
+change_tracker = ChangeTracker()
+
+
+class ChangePlan:
+    """
+    Outcome of change detection for one run
+
+    Attributes:
+        action (str): 'full', 'partial' or 'skip'
+        paths (list): Changed subtrees to back up for 'partial'
+        reason (str): Human readable explanation
+    """
+
+    def __init__(self, action, reason, paths=None, dirs=None, cursor=0, state=None):
+        self.action = action
+        self.reason = reason
+        self.paths = paths or []
+        self.dirs = dirs
+        self.cursor = cursor
+        self.state = state
+
+
+def _state_file(task_id):
+    return os.path.join(STATE_DIR, f'task-{task_id}.json.gz')
+
+
+def load_state(task_id):
+    try:
+        with gzip.open(_state_file(task_id), 'rt', encoding='utf-8') as fh:
+            return json.load(fh)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning(f"Discarding unreadable change state of task {task_id}: {str(e)}")
+        return None
+
+
+def save_state(task_id, state):
+    os.makedirs(STATE_DIR, exist_ok=True)
+    path = _state_file(task_id)
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with gzip.open(tmp, 'wt', encoding='utf-8', compresslevel=3) as fh:
+        json.dump(state, fh, separators=(',', ':'))
+    os.replace(tmp, path)
+
+
+def discard_state(task_id):
+    try:
+        os.remove(_state_file(task_id))
+    except FileNotFoundError:
+        pass
+
+
+def plan_run(task, now=None):
+    """
+    Decide how a scheduled run of a task with change detection should back up
+
+    Args:
+        task: ScheduledTask with change_detection set
+        now (datetime): Naive UTC reference time
+
+    Returns:
+        ChangePlan: Full backup, partial backup of the changed subtrees, or skip
+    """
+    now = now or datetime.utcnow()
+    root = task.source_path
+    dirs = scan_directories(root)
+    state = load_state(task.id)
+    if state:
+        hints, cursor = change_tracker.since(root, state.get('hint_epoch'), state.get('hint_seq', 0))
+    else:
+        hints, cursor = change_tracker.since(root)
+
+    if not dirs:
+        return ChangePlan('full', 'source path cannot be scanned', cursor=cursor)
+    if not state or state.get('root') != root or state.get('mode') != task.change_detection:
+        return ChangePlan('full', 'no previous fingerprint', dirs=dirs, cursor=cursor)
+    full_at = datetime.fromisoformat(state['full_at'])
+    if now - full_at >= timedelta(seconds=FULL_BACKUP_INTERVAL):
+        return ChangePlan('full', f'last full backup at {full_at}', dirs=dirs, cursor=cursor, state=state)
+    if hints is None:
+        return ChangePlan('full', 'change hints were dropped', dirs=dirs, cursor=cursor, state=state)
+
+    previous = state['dirs']
+    changed = [path for path, mtime in dirs.items() if previous.get(path) != mtime]
+    changed.extend(hints)
+    if not changed:
+        return ChangePlan('skip', 'no changes since the last backup')
+    if task.change_detection == 'skip':
+        return ChangePlan('full', f'{len(changed)} changed path(s)', dirs=dirs, cursor=cursor, state=state)
+
+    # 已删除的路径由其父目录（修改时间已变化）覆盖
+    paths = [path for path in collapse_paths(changed) if os.path.lexists(path)]
+    if not paths:
+        return ChangePlan('full', 'changed paths no longer exist', dirs=dirs, cursor=cursor, state=state)
+    if len(paths) > MAX_CHANGED_PATHS:
+        return ChangePlan('full', f'{len(paths)} changed subtrees', dirs=dirs, cursor=cursor, state=state)
+    return ChangePlan('partial', f'{len(paths)} changed subtree(s)', paths=paths, dirs=dirs,
+                      cursor=cursor, state=state)
+
+
+def commit_run(task, plan, now=None):
+    """
+    Record the fingerprint of a successful run as the baseline of the next one
+
+    Nothing is recorded for failed runs, so the next run sees the same
+    changes again.
+    """
+    if plan.dirs is None:
+        return
+    now = now or datetime.utcnow()
+    full_at = now.isoformat() if plan.action == 'full' else plan.state['full_at']
+    try:
+        save_state(task.id, {
+            'root': task.source_path,
+            'mode': task.change_detection,
+            'full_at': full_at,
+            'hint_epoch': change_tracker.epoch,
+            'hint_seq': plan.cursor,
+            'dirs': plan.dirs
+        })
+    except OSError as e:
+        logger.warning(f"Could not save change state of task {task.id}: {str(e)}")
@@ -0,0 +1,251 @@
+import os
+import logging
+import threading
+from datetime import datetime, timedelta
+
+from restic_wrapper import ResticWrapper
+from events import event_broker
+
+logger = logging.getLogger(__name__)
+
+# 定期扫描未补全快照的间隔（秒），0 表示禁用后台补全
+ENRICH_INTERVAL = int(os.environ.get('RESTICLY_ENRICH_INTERVAL', '600'))
+# 每批处理的快照数量
+ENRICH_BATCH = int(os.environ.get('RESTICLY_ENRICH_BATCH', '20'))
+# 两次 restic stats 调用之间的间隔（秒）
+ENRICH_DELAY = float(os.environ.get('RESTICLY_ENRICH_DELAY', '1'))
+# 有备份运行时的轮询间隔（秒）
+BACKUP_POLL_INTERVAL = 5
+# 超过该时长仍为 running 的备份视为已中断，不再阻塞补全
+BACKUP_STALE_AFTER = timedelta(hours=24)
+
+ENRICHED_FIELDS = ('size', 'file_count', 'data_added', 'size_source', 'enriched_at')
+
+
+def apply_summary(snapshot, summary):
+    """
+    Fill in snapshot sizes from a restic backup summary
+
+    Works with both the summary returned by ResticWrapper.create_backup and
+    the 'summary' object of `restic snapshots --json` (restic >= 0.17).
+
+    Args:
+        snapshot: Snapshot object
+        summary (dict): Backup summary
+
+    Returns:
+        bool: True if the summary contained the totals
+    """
+    if not summary or summary.get('total_bytes_processed') is None:
+        return False
+    snapshot.size = summary['total_bytes_processed']
+    snapshot.file_count = summary.get('total_files_processed')
+    snapshot.data_added = summary.get('data_added')
+    snapshot.size_source = 'summary'
+    snapshot.enriched_at = datetime.utcnow()
+    return True
+
+
+class SnapshotEnricher:
+    """Background worker filling in per-snapshot sizes with restic stats"""
+
+    def __init__(self, interval=ENRICH_INTERVAL, batch_size=ENRICH_BATCH, delay=ENRICH_DELAY):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.delay = delay
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._app = None
+
+    def start(self, app):
+        """Start the enrichment loop in a daemon thread"""
+        if self.interval <= 0 or (self._thread and self._thread.is_alive()):
+            return
+        self._app = app
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name='SnapshotEnricher', daemon=True)
+        self._thread.start()
+        event_broker.on(['snapshot'], self._on_event, name='SnapshotEnrichRequests')
+        logger.info(f"Snapshot enricher started (interval {self.interval}s, batch {self.batch_size})")
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+
+    def enqueue(self, repository_id):
+        """Ask the loop to enrich a repository's snapshots soon, in whichever process runs it"""
+        if self._thread and self._thread.is_alive():
+            with self._lock:
+                self._pending.add(repository_id)
+            self._wakeup.set()
+        else:
+            # 补全线程只在运行后台服务的进程中，交给它处理
+            event_broker.publish('snapshot.enrich_requested', repository_id=repository_id)
+
+    def _on_event(self, event):
+        repository_id = event['data'].get('repository_id')
+        if event['type'] == 'snapshot.enrich_requested' and repository_id is not None:
+            with self._lock:
+                self._pending.add(repository_id)
+            self._wakeup.set()
+
+    def _loop(self):
+        sweep = True
+        while not self._stop.is_set():
+            with self._lock:
+                pending, self._pending = self._pending, set()
+            try:
+                if sweep:
+                    self.enrich_all()
+                for repository_id in pending:
+                    self.enrich_repository(repository_id)
+            except Exception as e:
+                logger.error(f"Error enriching snapshots: {str(e)}")
+            # 被唤醒时只处理排队的仓库，超时则全量扫描
+            sweep = not self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+
+    def enrich_all(self):
+        from models import Repository
+
+        with self._app.app_context():
+            repository_ids = [row[0] for row in Repository.query.with_entities(Repository.id).all()]
+        return sum(self.enrich_repository(repository_id) for repository_id in repository_ids)
+
+    def _wait_for_idle_backups(self):
+        """Block while any backup is running so enrichment never competes with it"""
+        from models import Backup
+        from app import db
+
+        while not self._stop.is_set():
+            running = Backup.query.filter(
+                Backup.status == 'running',
+                Backup.start_time > datetime.utcnow() - BACKUP_STALE_AFTER
+            ).count()
+            db.session.remove()
+            if not running:
+                return True
+            logger.debug(f"Snapshot enrichment paused, {running} backup(s) running")
+            self._stop.wait(BACKUP_POLL_INTERVAL)
+        return False
+
+    def _raw_data(self, restic, snapshot_ids, cache):
+        """Deduplicated size of the data referenced by the given snapshots, or None"""
+        key = frozenset(snapshot_ids)
+        if key not in cache:
+            success, stats = restic.get_stats(mode='raw-data', snapshot_ids=sorted(key))
+            if success and isinstance(stats, dict) and 'total_size' in stats:
+                # 取未压缩大小，与备份摘要中的 data_added 口径一致
+                cache[key] = stats.get('total_uncompressed_size') or stats['total_size']
+            else:
+                cache[key] = None
+            self._stop.wait(self.delay)
+        return cache[key]
+
+    def _data_added(self, restic, snapshot_id, parent_id, cache):
+        """
+        Estimate the data a snapshot added on top of its parent
+
+        Computed as the raw data of parent and snapshot together minus the raw
+        data of the parent alone. Without a parent all of the snapshot's data
+        counts as added, and when the parent has been forgotten the value
+        stays unknown.
+        """
+        combined = self._raw_data(restic, [snapshot_id] + ([parent_id] if parent_id else []), cache)
+        if combined is None or not parent_id:
+            return combined
+        parent = self._raw_data(restic, [parent_id], cache)
+        if parent is None:
+            return None
+        return max(combined - parent, 0)
+
+    def enrich_repository(self, repository_id):
+        """
+        Enrich the snapshots of a repository that have no accurate size yet
+
+        restic stats sums over all snapshots given to it and cannot report
+        per-snapshot values in one call, so each snapshot still needs a
+        restore-size call plus raw-data calls for data_added (the parent's
+        raw data is shared with its child and only fetched once). Parents
+        come from a single `restic snapshots` call per run. Snapshots are
+        processed in batches with a pause between calls and one commit per
+        batch.
+
+        Args:
+            repository_id (int): ID of the repository
+
+        Returns:
+            int: Number of snapshots enriched
+        """
+        from app import db
+        from models import Repository, Snapshot
+
+        enriched = 0
+        failed = set()
+        parents = None
+        raw_cache = {}
+        with self._app.app_context():
+            repository = Repository.query.get(repository_id)
+            if not repository:
+                return 0
+            restic = ResticWrapper.from_repository(repository)
+
+            while not self._stop.is_set():
+                query = Snapshot.query.filter(
+                    Snapshot.repository_id == repository_id,
+                    Snapshot.enriched_at.is_(None)
+                )
+                if failed:
+                    query = query.filter(Snapshot.id.notin_(failed))
+                batch = [(row.id, row.snapshot_id) for row in
+                         query.order_by(Snapshot.created_at.desc()).limit(self.batch_size).all()]
+                db.session.remove()
+                if not batch:
+                    break
+
+                if parents is None:
+                    # restic 只在快照列表中记录父快照，整个仓库查询一次
+                    success, listing = restic.list_snapshots()
+                    parents = {item.get('id'): item.get('parent') for item in listing} if success else {}
+
+                results = {}
+                for row_id, snapshot_id in batch:
+                    if not self._wait_for_idle_backups():
+                        break
+                    success, stats = restic.get_stats(mode='restore-size', snapshot_ids=[snapshot_id])
+                    self._stop.wait(self.delay)
+                    if success and isinstance(stats, dict) and 'total_size' in stats:
+                        stats['data_added'] = self._data_added(restic, snapshot_id, parents.get(snapshot_id),
+                                                               raw_cache)
+                        results[row_id] = stats
+                    else:
+                        failed.add(row_id)
+                        logger.warning(f"Could not get stats for snapshot {snapshot_id[:8]}: {stats}")
+
+                try:
+                    for row_id, stats in results.items():
+                        Snapshot.query.filter_by(id=row_id).update({
+                            'size': stats['total_size'],
+                            'file_count': stats.get('total_file_count'),
+                            'data_added': stats['data_added'],
+                            'size_source': 'stats',
+                            'enriched_at': datetime.utcnow()
+                        }, synchronize_session=False)
+                    db.session.commit()
+                    enriched += len(results)
+                    if results:
+                        event_broker.publish('snapshot.enriched', repository_id=repository_id,
+                                             count=len(results))
+                except Exception as e:
+                    db.session.rollback()
+                    logger.error(f"Error saving snapshot stats: {str(e)}")
+                    break
+
+        if enriched:
+            logger.info(f"Enriched {enriched} snapshots of repository {repository_id}")
+        return enriched
+
+snapshot_enricher = SnapshotEnricher()
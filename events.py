@@ -0,0 +1,277 @@
+import json
+import time
+import uuid
+import queue
+import select
+import logging
+import itertools
+import threading
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# PostgreSQL 通知频道，用于在多个 gunicorn worker 之间转发事件
+EVENT_CHANNEL = 'resticly_events'
+# 每个订阅者最多缓存的事件数量，超出后要求客户端重新加载
+SUBSCRIBER_QUEUE_SIZE = 500
+# SSE 心跳间隔（秒），防止代理关闭空闲连接
+HEARTBEAT_INTERVAL = 15
+# NOTIFY 负载上限为 8000 字节
+MAX_NOTIFY_PAYLOAD = 7900
+
+
+class Subscription:
+    """Queue of events for one connected client"""
+
+    def __init__(self, types=None):
+        # types 为事件类型前缀，例如 'backup' 匹配 'backup.progress'
+        self.types = tuple(types) if types else None
+        self.queue = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+
+    def wants(self, event_type):
+        return self.types is None or event_type == 'resync' or event_type.split('.')[0] in self.types
+
+    def put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            # 客户端处理太慢，丢弃积压的事件并让其整体刷新一次
+            while True:
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    break
+            self.queue.put_nowait({'id': None, 'type': 'resync', 'data': {}})
+
+    def get(self, timeout=HEARTBEAT_INTERVAL):
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class EventBroker:
+    """
+    In-process publish/subscribe hub for domain events
+
+    When the database is PostgreSQL, events are also sent with NOTIFY and a
+    listener thread relays events from other processes, so clients
+    connected to any gunicorn worker see every event.
+    """
+
+    def __init__(self):
+        self.origin = uuid.uuid4().hex
+        self._ids = itertools.count(1)
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._throttle = {}
+        self._engine = None
+        self._notify_conn = None
+        self._notify_lock = threading.Lock()
+        self._listener = None
+        self._stop = threading.Event()
+
+    def start(self, app):
+        """Start the cross-process bridge if the database supports it"""
+        from app import db
+
+        with app.app_context():
+            engine = db.engine
+        if engine.url.get_backend_name() != 'postgresql':
+            logger.info("Event bridge disabled, events are delivered within this process only")
+            return
+        if self._listener and self._listener.is_alive():
+            return
+        self._engine = engine
+        self._stop.clear()
+        self._listener = threading.Thread(target=self._listen, name='EventListener', daemon=True)
+        self._listener.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def subscribe(self, types=None):
+        subscription = Subscription(types)
+        with self._lock:
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def on(self, types, handler, name='EventHandler'):
+        """
+        Call a handler for matching events in a daemon thread
+
+        Used by the singleton services to react to requests made in other
+        worker processes.
+
+        Args:
+            types (list): Event type prefixes, as for subscribe()
+            handler (callable): Called with each event dict
+            name (str): Name of the thread
+
+        Returns:
+            Subscription: The subscription feeding the handler
+        """
+        subscription = self.subscribe(types)
+
+        def consume():
+            while not self._stop.is_set():
+                event = subscription.get()
+                if event is None:
+                    continue
+                try:
+                    handler(event)
+                except Exception as e:
+                    logger.error(f"Error handling event {event['type']}: {str(e)}")
+
+        threading.Thread(target=consume, name=name, daemon=True).start()
+        return subscription
+
+    def publish(self, event_type, throttle=None, **data):
+        """
+        Publish an event to all subscribers
+
+        Args:
+            event_type (str): Event type, e.g. 'backup.started'
+            throttle (tuple): Optional (key, seconds); drops the event if
+                another one with the same key was published more recently
+            **data: Event payload (must be JSON serializable)
+        """
+        if throttle:
+            key, seconds = throttle
+            now = time.monotonic()
+            with self._lock:
+                if now - self._throttle.get(key, 0) < seconds:
+                    return
+                if len(self._throttle) > 1000:
+                    self._throttle.clear()
+                self._throttle[key] = now
+
+        event = {
+            'id': f'{self.origin[:8]}-{next(self._ids)}',
+            'type': event_type,
+            'time': datetime.utcnow().isoformat(),
+            'data': data
+        }
+        self._dispatch(event)
+        if self._engine is not None:
+            self._notify(event)
+
+    def _dispatch(self, event):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            if subscription.wants(event['type']):
+                subscription.put(event)
+
+    def _raw_connection(self):
+        connection = self._engine.raw_connection()
+        # 从连接池中分离，长期独占使用
+        connection.detach()
+        connection.driver_connection.autocommit = True
+        return connection
+
+    def _notify(self, event):
+        payload = json.dumps(dict(event, origin=self.origin), default=str)
+        if len(payload) > MAX_NOTIFY_PAYLOAD:
+            # 负载过大时只转发事件类型，客户端自行刷新
+            payload = json.dumps(dict(event, origin=self.origin, data={}, truncated=True))
+        with self._notify_lock:
+            for attempt in range(2):
+                try:
+                    if self._notify_conn is None:
+                        self._notify_conn = self._raw_connection()
+                    cursor = self._notify_conn.cursor()
+                    cursor.execute('SELECT pg_notify(%s, %s)', (EVENT_CHANNEL, payload))
+                    cursor.close()
+                    return
+                except Exception as e:
+                    logger.warning(f"Error sending event notification: {str(e)}")
+                    try:
+                        self._notify_conn.close()
+                    except Exception:
+                        pass
+                    self._notify_conn = None
+
+    def _listen(self):
+        backoff = 1
+        while not self._stop.is_set():
+            connection = None
+            try:
+                connection = self._raw_connection()
+                cursor = connection.cursor()
+                cursor.execute(f'LISTEN {EVENT_CHANNEL}')
+                cursor.close()
+                driver = connection.driver_connection
+                logger.info(f"Listening for events on channel {EVENT_CHANNEL}")
+                backoff = 1
+
+                while not self._stop.is_set():
+                    if select.select([driver], [], [], 5) == ([], [], []):
+                        continue
+                    driver.poll()
+                    while driver.notifies:
+                        notification = driver.notifies.pop(0)
+                        try:
+                            event = json.loads(notification.payload)
+                        except json.JSONDecodeError:
+                            continue
+                        if event.pop('origin', None) == self.origin:
+                            continue
+                        self._dispatch(event)
+            except Exception as e:
+                logger.error(f"Event listener error: {str(e)}, reconnecting in {backoff}s")
+                # 断线期间可能丢失事件，通知客户端整体刷新
+                self._dispatch({'id': None, 'type': 'resync', 'data': {}})
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, 60)
+            finally:
+                if connection is not None:
+                    try:
+                        connection.close()
+                    except Exception:
+                        pass
+
+
+def backup_payload(backup, repository_name=None):
+    """Build the event payload of a backup, matching the /api/backups format"""
+    return {
+        'id': backup.id,
+        'repository_id': backup.repository_id,
+        'repository_name': repository_name,
+        'source_path': backup.source_path,
+        'start_time': backup.start_time.isoformat() if backup.start_time else None,
+        'end_time': backup.end_time.isoformat() if backup.end_time else None,
+        'status': backup.status,
+        'message': backup.message,
+        'files_new': backup.files_new,
+        'files_changed': backup.files_changed,
+        'bytes_added': backup.bytes_added,
+        'snapshot_id': backup.snapshot_id,
+        'predicted_end': backup.predicted_end.isoformat() if backup.predicted_end else None,
+        'sla_deadline': backup.sla_deadline.isoformat() if backup.sla_deadline else None,
+        'sla_status': backup.sla_status
+    }
+
+
+def progress_payload(message):
+    """Extract the interesting fields of a restic status message"""
+    return {key: message.get(key) for key in (
+        'percent_done', 'total_files', 'files_done', 'total_bytes', 'bytes_done',
+        'seconds_elapsed', 'seconds_remaining'
+    ) if key in message}
+
+
+def format_sse(event):
+    """Encode an event as a Server-Sent Events message (dispatched by type on the client)"""
+    lines = []
+    if event.get('id'):
+        lines.append(f"id: {event['id']}")
+    lines.append(f"data: {json.dumps(event, default=str)}")
+    return '\n'.join(lines) + '\n\n'
+
+
+event_broker = EventBroker()
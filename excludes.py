@@ -0,0 +1,310 @@
+import os
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 估算排除规则效果时最多检查的条目数，超出时结果标记为 truncated
+ESTIMATE_MAX_ENTRIES = int(os.environ.get('RESTICLY_EXCLUDE_ESTIMATE_MAX_ENTRIES', '1000000'))
+# CACHEDIR.TAG 文件必须以该签名开头（https://bford.info/cachedir/）
+CACHEDIR_SIGNATURE = b'Signature: 8a477f597d28d172789f06886806bc55'
+# restic --exclude-larger-than 接受的单位
+SIZE_UNITS = {'': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3, 't': 1024 ** 4}
+SIZE_PATTERN = re.compile(r'^\s*(\d+)\s*([kmgt]?)b?\s*$', re.IGNORECASE)
+
+
+def parse_size(value):
+    """
+    Parse a size as accepted by restic --exclude-larger-than ('500M', '2g', '1024')
+
+    Raises:
+        ValueError: If the value is not a valid size
+    """
+    match = SIZE_PATTERN.match(str(value))
+    if not match:
+        raise ValueError(f"Invalid size '{value}', expected a number with an optional K/M/G/T suffix")
+    return int(match.group(1)) * SIZE_UNITS[match.group(2).lower()]
+
+
+def parse_patterns(text):
+    """Split the content of an exclude file into patterns, dropping blank lines and comments"""
+    patterns = []
+    for line in (text or '').splitlines():
+        line = line.strip()
+        if line and not line.startswith('#'):
+            patterns.append(line)
+    return patterns
+
+
+def _translate(component):
+    """Translate one path component of a restic (Go filepath.Match) pattern to a regex"""
+    result = []
+    i = 0
+    while i < len(component):
+        char = component[i]
+        i += 1
+        if char == '*':
+            result.append('[^/]*')
+        elif char == '?':
+            result.append('[^/]')
+        elif char == '\\' and i < len(component):
+            result.append(re.escape(component[i]))
+            i += 1
+        elif char == '[':
+            end = component.find(']', i + 1)
+            if end == -1:
+                result.append(re.escape(char))
+                continue
+            body = component[i:end]
+            i = end + 1
+            if body.startswith('^'):
+                body = '^' + body[1:].replace('\\', '\\\\')
+            else:
+                body = body.replace('\\', '\\\\')
+            result.append(f'[{body}]')
+        else:
+            result.append(re.escape(char))
+    return ''.join(result)
+
+
+class Pattern:
+    """
+    An exclude pattern with restic semantics
+
+    Patterns are matched per path component; `*` does not cross `/` and
+    `**` matches any number of directories. A pattern not starting with
+    `/` may match at any depth, and a pattern matching a directory
+    excludes everything below it. A leading `!` re-includes what earlier
+    patterns excluded. Environment variables are expanded.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        pattern = os.path.expandvars(text.strip())
+        self.negated = pattern.startswith('!')
+        if self.negated:
+            pattern = pattern[1:]
+        absolute = pattern.startswith('/')
+        components = [c for c in pattern.strip('/').split('/') if c]
+        regex = '' if absolute else '(?:[^/]+/)*'
+        for index, component in enumerate(components):
+            last = index == len(components) - 1
+            if component == '**':
+                regex += '.*' if last else '(?:[^/]+/)*'
+            else:
+                regex += _translate(component) + ('' if last else '/')
+        # 匹配某个目录即匹配其下的所有路径
+        self._regex = re.compile(regex + '(?:/.*)?', re.DOTALL)
+
+    def matches(self, path):
+        return self._regex.fullmatch(path.lstrip('/')) is not None
+
+
+def is_cache_dir(path):
+    try:
+        with open(os.path.join(path, 'CACHEDIR.TAG'), 'rb') as fh:
+            return fh.read(len(CACHEDIR_SIGNATURE)) == CACHEDIR_SIGNATURE
+    except OSError:
+        return False
+
+
+class ExcludeRules:
+    """
+    The exclude settings of one backup
+
+    Attributes:
+        patterns (list): Exclude patterns, task patterns first, then the
+            patterns of the referenced exclude files
+        exclude_caches (bool): Skip directories containing a CACHEDIR.TAG
+        exclude_larger_than (str): Skip files larger than this size
+        one_file_system (bool): Do not cross file system boundaries
+    """
+
+    def __init__(self, patterns=None, exclude_caches=False, exclude_larger_than=None,
+                 one_file_system=False, sources=None):
+        self.patterns = list(patterns or [])
+        self.exclude_caches = bool(exclude_caches)
+        self.exclude_larger_than = exclude_larger_than or None
+        self.one_file_system = bool(one_file_system)
+        # 每条模式来自任务本身还是排除文件库，用于估算结果
+        self.sources = list(sources or ['task'] * len(self.patterns))
+
+    def __bool__(self):
+        return bool(self.patterns or self.exclude_caches or self.exclude_larger_than or self.one_file_system)
+
+    def backup_args(self):
+        """Keyword arguments for ResticWrapper.create_backup"""
+        return {
+            'excludes': self.patterns,
+            'exclude_caches': self.exclude_caches,
+            'exclude_larger_than': self.exclude_larger_than,
+            'one_file_system': self.one_file_system
+        }
+
+    def to_dict(self):
+        return {
+            'patterns': self.patterns,
+            'exclude_caches': self.exclude_caches,
+            'exclude_larger_than': self.exclude_larger_than,
+            'one_file_system': self.one_file_system
+        }
+
+
+def rules_for(task, session=None):
+    """
+    Collect the exclude rules of a scheduled task
+
+    Args:
+        task: ScheduledTask
+        session: Optional SQLAlchemy session used to load the referenced
+            exclude files (defaults to the Flask-SQLAlchemy session)
+
+    Returns:
+        ExcludeRules
+    """
+    from models import ExcludeFile
+
+    patterns = list(task.exclude_patterns or [])
+    sources = ['task'] * len(patterns)
+    file_ids = task.exclude_file_ids or []
+    if file_ids:
+        query = session.query(ExcludeFile) if session is not None else ExcludeFile.query
+        exclude_files = {f.id: f for f in query.filter(ExcludeFile.id.in_(file_ids)).all()}
+        for file_id in file_ids:
+            exclude_file = exclude_files.get(file_id)
+            if exclude_file is None:
+                logger.warning(f"Exclude file {file_id} of task {task.id} no longer exists")
+                continue
+            file_patterns = parse_patterns(exclude_file.patterns)
+            patterns.extend(file_patterns)
+            sources.extend([f'file:{exclude_file.name}'] * len(file_patterns))
+    return ExcludeRules(patterns, task.exclude_caches, task.exclude_larger_than,
+                        task.one_file_system, sources)
+
+
+class ExcludeMatcher:
+    """
+    Decide which rule, if any, excludes a path below a source path
+
+    Rules are keyed ('pattern', index), ('one_file_system',),
+    ('exclude_caches',) or ('exclude_larger_than',).
+    """
+
+    def __init__(self, rules, root_stat):
+        self.rules = rules
+        self.patterns = [Pattern(text) for text in rules.patterns]
+        # 存在取反模式时，模式排除的目录下仍可能有被重新包含的路径，不能整体跳过
+        self.has_negation = any(pattern.negated for pattern in self.patterns)
+        self.size_limit = parse_size(rules.exclude_larger_than) if rules.exclude_larger_than else None
+        self.root_dev = root_stat.st_dev
+
+    def can_prune(self, rule):
+        """Whether everything below a directory excluded by rule is excluded too"""
+        return rule is not None and not (rule[0] == 'pattern' and self.has_negation)
+
+    def rule(self, path, is_dir, stat, inherited=None):
+        """
+        Return the rule excluding a path
+
+        Args:
+            inherited: Rule excluding the parent directory
+        """
+        if self.can_prune(inherited):
+            return inherited
+        if is_dir and self.rules.one_file_system and stat.st_dev != self.root_dev:
+            return ('one_file_system',)
+        if is_dir and self.rules.exclude_caches and is_cache_dir(path):
+            return ('exclude_caches',)
+        rule = None
+        for index, pattern in enumerate(self.patterns):
+            if pattern.matches(path):
+                rule = None if pattern.negated else ('pattern', index)
+        if rule is None and not is_dir and self.size_limit is not None and stat.st_size > self.size_limit:
+            rule = ('exclude_larger_than',)
+        return rule
+
+    def labels(self):
+        """Describe every rule that can exclude something"""
+        labels = {}
+        for index, pattern in enumerate(self.patterns):
+            if not pattern.negated:
+                labels[('pattern', index)] = (pattern.text, self.rules.sources[index])
+        if self.rules.one_file_system:
+            labels[('one_file_system',)] = ('--one-file-system', 'option')
+        if self.rules.exclude_caches:
+            labels[('exclude_caches',)] = ('--exclude-caches', 'option')
+        if self.size_limit is not None:
+            labels[('exclude_larger_than',)] = (f'--exclude-larger-than {self.rules.exclude_larger_than}', 'option')
+        return labels
+
+
+def estimate(source_path, rules, max_entries=ESTIMATE_MAX_ENTRIES):
+    """
+    Walk a source path and measure what each exclude rule keeps out of the backup
+
+    Excluded directories are still walked so their size can be reported;
+    each excluded file is attributed to the first rule that excludes it
+    (file system boundary, cache directory, pattern, size limit, in the
+    order restic applies them).
+
+    Args:
+        source_path (str): Path to back up
+        rules (ExcludeRules): Rules to evaluate
+        max_entries (int): Stop after this many entries
+
+    Returns:
+        dict: Totals for the whole source and the backed up part, and
+            files/bytes saved per rule
+    """
+    try:
+        root_stat = os.stat(source_path, follow_symlinks=False)
+    except OSError as e:
+        raise ValueError(f"Cannot read source path {source_path}: {str(e)}")
+    matcher = ExcludeMatcher(rules, root_stat)
+    savings = {key: {'rule': label, 'source': source, 'files': 0, 'bytes': 0}
+               for key, (label, source) in matcher.labels().items()}
+    total = {'files': 0, 'bytes': 0}
+    included = {'files': 0, 'bytes': 0}
+
+    entries = 0
+    truncated = False
+    # 栈中的每一项：(路径, 是否目录, stat, 父目录的排除规则)
+    stack = [(source_path, os.path.isdir(source_path), root_stat, None)]
+    while stack:
+        path, is_dir, stat, inherited = stack.pop()
+        entries += 1
+        if entries > max_entries:
+            truncated = True
+            break
+        rule = matcher.rule(path, is_dir, stat, inherited)
+
+        if not is_dir:
+            total['files'] += 1
+            total['bytes'] += stat.st_size
+            if rule is None:
+                included['files'] += 1
+                included['bytes'] += stat.st_size
+            else:
+                savings[rule]['files'] += 1
+                savings[rule]['bytes'] += stat.st_size
+            continue
+
+        try:
+            with os.scandir(path) as children:
+                for child in children:
+                    try:
+                        child_stat = child.stat(follow_symlinks=False)
+                        stack.append((child.path, child.is_dir(follow_symlinks=False), child_stat, rule))
+                    except OSError:
+                        continue
+        except OSError as e:
+            logger.debug(f"Cannot scan {path}: {str(e)}")
+
+    return {
+        'source_path': source_path,
+        'total': total,
+        'included': included,
+        'excluded': {'files': total['files'] - included['files'], 'bytes': total['bytes'] - included['bytes']},
+        'rules': sorted(savings.values(), key=lambda rule: -rule['bytes']),
+        'truncated': truncated
+    }
@@ -0,0 +1,29 @@
+"""
+Gunicorn configuration for Resticly
+
+The app is imported once in the master (preload_app) and forked into the
+workers. Importing it has no side effects; the database schema is prepared
+in the master before forking and the background services are started in
+each worker after it has booted.
+"""
+
+import os
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("GUNICORN_WORKERS", "4"))
+worker_class = "gthread"
+# SSE 连接会长期占用一个线程
+threads = int(os.environ.get("GUNICORN_THREADS", "32"))
+preload_app = os.environ.get("GUNICORN_PRELOAD", "1") != "0"
+
+
+def when_ready(server):
+    # 在 fork 之前建表，避免多个工作进程并发执行 create_all
+    if preload_app:
+        from app import prepare_database
+        prepare_database(server.app.wsgi())
+
+
+def post_worker_init(worker):
+    from app import start_services
+    start_services(worker.wsgi)
@@ -0,0 +1,202 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+from datetime import datetime, timedelta
+
+from restic_wrapper import ResticWrapper, restic_runner
+from events import event_broker
+
+logger = logging.getLogger(__name__)
+
+# 探测间隔（秒），0 表示禁用后台探测
+PROBE_INTERVAL = int(os.environ.get('RESTICLY_HEALTH_INTERVAL', '300'))
+# 单个仓库探测的超时时间（秒）
+PROBE_TIMEOUT = float(os.environ.get('RESTICLY_HEALTH_TIMEOUT', '10'))
+# 并发探测的仓库数量
+PROBE_WORKERS = int(os.environ.get('RESTICLY_HEALTH_WORKERS', '64'))
+# 缓存结果的有效期
+CACHE_TTL = timedelta(seconds=max(PROBE_INTERVAL * 2, 60))
+
+
+class HealthProber:
+    """Background loop probing repository reachability and caching the results"""
+
+    def __init__(self, interval=PROBE_INTERVAL, timeout=PROBE_TIMEOUT, workers=PROBE_WORKERS, ttl=CACHE_TTL):
+        self.interval = interval
+        self.timeout = timeout
+        self.workers = workers
+        self.ttl = ttl
+        self._cache = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._app = None
+
+    def start(self, app):
+        """Start the refresh loop in a daemon thread"""
+        if self.interval <= 0 or (self._thread and self._thread.is_alive()):
+            return
+        self._app = app
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name='HealthProber', daemon=True)
+        self._thread.start()
+        event_broker.on(['repository'], self._on_event, name='HealthRefresh')
+        logger.info(f"Health prober started (interval {self.interval}s, timeout {self.timeout}s)")
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+
+    def refresh(self):
+        """Wake the loop up to probe all repositories now, in whichever process runs it"""
+        if self._thread and self._thread.is_alive():
+            self._wakeup.set()
+        else:
+            event_broker.publish('repository.health_refresh')
+
+    def _on_event(self, event):
+        if event['type'] == 'repository.health_refresh':
+            self._wakeup.set()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.probe_all()
+            except Exception as e:
+                logger.error(f"Error probing repositories: {str(e)}")
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+
+    def probe_all(self):
+        """
+        Probe every repository concurrently and persist the results
+
+        Returns:
+            dict: Mapping of repository id to health entry
+        """
+        from app import db
+        from models import Repository, RepositoryHealth
+
+        with self._app.app_context():
+            targets = [(repo.id, ResticWrapper.from_repository(repo)) for repo in Repository.query.all()]
+            db.session.remove()
+
+        if not targets:
+            return {}
+
+        # 所有探测在 restic_runner 的事件循环中并发执行，不占用额外线程
+        entries = restic_runner.call(self._probe_many([restic for _, restic in targets]))
+        results = dict(zip((repo_id for repo_id, _ in targets), entries))
+
+        with self._lock:
+            self._cache.update(results)
+
+        # 持久化到单独的表，供其他进程和重启后使用；不修改 repository 表，避免其版本号随每次探测变化
+        with self._app.app_context():
+            try:
+                rows = {row.repository_id: row for row in
+                        RepositoryHealth.query.filter(RepositoryHealth.repository_id.in_(list(results))).all()}
+                # 探测期间被删除的仓库不再写入
+                live = {row[0] for row in Repository.query.with_entities(Repository.id)
+                        .filter(Repository.id.in_(list(results))).all()}
+                for repo_id, entry in results.items():
+                    row = rows.get(repo_id)
+                    if repo_id not in live:
+                        continue
+                    if row is None:
+                        row = RepositoryHealth(repository_id=repo_id)
+                        db.session.add(row)
+                    row.status = entry['status']
+                    row.message = entry['message']
+                    row.lock_count = entry['lock_count']
+                    row.latency_ms = entry['latency_ms']
+                    row.checked_at = entry['checked_at']
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Error saving repository health: {str(e)}")
+
+        event_broker.publish('repository.health', statuses={
+            repo_id: entry['status'] for repo_id, entry in results.items()
+        })
+        logger.debug(f"Probed {len(results)} repositories")
+        return results
+
+    async def _probe_many(self, wrappers):
+        limit = asyncio.Semaphore(self.workers)
+
+        async def probe(restic):
+            async with limit:
+                return await self._probe(restic)
+
+        return await asyncio.gather(*(probe(restic) for restic in wrappers))
+
+    async def _probe(self, restic):
+        start = time.monotonic()
+        try:
+            success, result = await restic.probe_async(timeout=self.timeout)
+        except Exception as e:
+            success, result = False, {'message': str(e), 'timeout': False, 'lock_count': None}
+
+        if success:
+            status = 'ok'
+        elif result.get('timeout'):
+            status = 'timeout'
+        else:
+            status = 'error'
+        return {
+            'status': status,
+            'message': result.get('message'),
+            'lock_count': result.get('lock_count'),
+            'latency_ms': int((time.monotonic() - start) * 1000),
+            'checked_at': datetime.utcnow()
+        }
+
+    def get(self, repository):
+        """
+        Return the health of a repository without touching the backend
+
+        Prefers the in-memory cache and falls back to the values persisted
+        by the last probe (possibly from another process).
+
+        Args:
+            repository: Repository object
+
+        Returns:
+            dict: Health entry with 'expires_at', after which clients should
+                treat it as stale, or None
+        """
+        with self._lock:
+            entry = self._cache.get(repository.id)
+
+        stored = repository.health
+        if not entry or (stored and stored.checked_at and stored.checked_at > entry['checked_at']):
+            if not stored or not stored.checked_at:
+                return None
+            entry = {
+                'status': stored.status,
+                'message': stored.message,
+                'lock_count': stored.lock_count,
+                'latency_ms': stored.latency_ms,
+                'checked_at': stored.checked_at
+            }
+
+        return {
+            'status': entry['status'],
+            'message': entry['message'],
+            'lock_count': entry['lock_count'],
+            'latency_ms': entry['latency_ms'],
+            'checked_at': entry['checked_at'].isoformat(),
+            # 不返回随时间变化的 stale 标志，否则可缓存的响应（ETag 只反映数据变化）会过时
+            'expires_at': (entry['checked_at'] + self.ttl).isoformat()
+        }
+
+    def forget(self, repository_id):
+        with self._lock:
+            self._cache.pop(repository_id, None)
+
+
+health_prober = HealthProber()
@@ -0,0 +1,130 @@
+import os
+import signal
+import shlex
+import logging
+import subprocess
+import tempfile
+import time
+
+from jobs import current_job
+
+logger = logging.getLogger(__name__)
+
+# 钩子的默认超时（秒），任务可单独设置 hook_timeout
+HOOK_TIMEOUT = int(os.environ.get('RESTICLY_HOOK_TIMEOUT', '3600'))
+# 运行钩子的 shell
+HOOK_SHELL = os.environ.get('RESTICLY_HOOK_SHELL', '/bin/sh')
+# 备份记录和日志中保留的钩子输出长度
+HOOK_OUTPUT_LIMIT = 4096
+# 从 stdin 备份时快照中的默认文件名
+DEFAULT_STDIN_FILENAME = 'stdin'
+
+
+def parse_stdin_command(text):
+    """
+    Split the stdin command of a task into arguments
+
+    The command is run without a shell, like restic --stdin-from-command
+    does; use a pre hook or a wrapper script for pipes and redirections.
+
+    Raises:
+        ValueError: If the command is empty or cannot be parsed
+    """
+    try:
+        args = shlex.split(text or '')
+    except ValueError as e:
+        raise ValueError(f'Invalid stdin_command: {str(e)}')
+    if not args:
+        raise ValueError('stdin_command must not be empty')
+    return args
+
+
+def stdin_source_path(filename):
+    """The path restic records for a stdin backup, used as the source path of the task"""
+    return '/' + (filename or DEFAULT_STDIN_FILENAME).lstrip('/')
+
+
+def hook_env(task, repository, backup_id=None, **extra):
+    """
+    Environment variables describing a backup, passed to its hooks
+
+    Args:
+        task: ScheduledTask
+        repository: Repository
+        backup_id (int): ID of the Backup record
+        **extra: Additional variables, e.g. status and snapshot_id for the
+            post hook; names are upper-cased and prefixed with RESTICLY_
+
+    Returns:
+        dict: Variables to add to the process environment
+    """
+    env = {
+        'RESTICLY_TASK_ID': str(task.id),
+        'RESTICLY_TASK_NAME': task.name or '',
+        'RESTICLY_SOURCE_PATH': task.source_path or '',
+        'RESTICLY_REPOSITORY_ID': str(repository.id),
+        'RESTICLY_REPOSITORY_NAME': repository.name or '',
+        'RESTICLY_BACKUP_ID': str(backup_id or ''),
+    }
+    for key, value in extra.items():
+        env[f'RESTICLY_{key.upper()}'] = '' if value is None else str(value)
+    return env
+
+
+def run_hook(stage, command, env=None, timeout=None):
+    """
+    Run a pre or post backup hook through the shell
+
+    The hook runs in its own process group, so a timeout or a cancelled
+    job also stops the processes it started. It is registered on the
+    current job like restic processes are.
+
+    Args:
+        stage (str): 'pre' or 'post', used in messages
+        command (str): Shell command
+        env (dict): Additional environment variables
+        timeout (float): Timeout in seconds, defaults to RESTICLY_HOOK_TIMEOUT
+
+    Returns:
+        tuple: (success (bool), message (str)) where the message carries
+            the exit code and the tail of the combined output on failure
+    """
+    timeout = timeout or HOOK_TIMEOUT
+    start = time.monotonic()
+    with tempfile.TemporaryFile() as output:
+        try:
+            process = subprocess.Popen([HOOK_SHELL, '-c', command], stdin=subprocess.DEVNULL, stdout=output,
+                                       stderr=subprocess.STDOUT, env=dict(os.environ, **(env or {})),
+                                       start_new_session=True)
+        except OSError as e:
+            return False, f'{stage} hook could not be started: {str(e)}'
+        job = current_job.get()
+        if job is not None:
+            job.attach_process(process.pid)
+        try:
+            returncode = process.wait(timeout=timeout)
+            timed_out = False
+        except subprocess.TimeoutExpired:
+            os.killpg(process.pid, signal.SIGKILL)
+            returncode = process.wait()
+            timed_out = True
+        finally:
+            if job is not None:
+                job.detach_process(process.pid)
+        output.seek(0)
+        text = output.read()[-HOOK_OUTPUT_LIMIT:].decode(errors='replace').strip()
+
+    duration = time.monotonic() - start
+    if timed_out:
+        message = f'{stage} hook timed out after {timeout} seconds'
+    elif returncode != 0:
+        message = f'{stage} hook exited with code {returncode}'
+    else:
+        logger.info(f"{stage} hook finished in {duration:.1f}s")
+        if text:
+            logger.debug(f"{stage} hook output: {text}")
+        return True, f'{stage} hook finished in {duration:.1f}s'
+    if text:
+        message += f': {text}'
+    logger.warning(message)
+    return False, message
@@ -0,0 +1,225 @@
+import gzip
+import zlib
+import hashlib
+import logging
+from datetime import datetime
+from functools import wraps
+
+from flask import request, make_response
+from sqlalchemy import event, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# 小于该大小的响应不压缩
+COMPRESS_MIN_SIZE = 1024
+COMPRESS_MIMETYPES = ('application/json', 'application/x-ndjson', 'text/html')
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+VERSION_TABLE = 'table_version'
+# 支持 INSERT ... ON CONFLICT 的数据库，计数行一条语句完成插入或递增
+UPSERT_DIALECTS = {'postgresql': postgresql.insert, 'sqlite': sqlite.insert}
+
+
+def _mark_changed(session, table_names):
+    """Bump the change counters of the given tables in the session's transaction"""
+    from models import TableVersion
+
+    table_names = sorted(set(table_names) - {VERSION_TABLE})
+    if not table_names:
+        return
+    versions = TableVersion.__table__
+    now = datetime.utcnow()
+    # 与数据修改处于同一事务中，提交前其他连接看不到新版本号
+    connection = session.connection()
+    if connection.dialect.name in UPSERT_DIALECTS:
+        # 缺少计数行（例如由迁移管理的数据库未创建）时插入，避免 ETag 永远不变
+        insert = UPSERT_DIALECTS[connection.dialect.name]
+        statement = insert(versions).values([{'table_name': name, 'version': 1, 'updated_at': now}
+                                             for name in table_names])
+        connection.execute(statement.on_conflict_do_update(
+            index_elements=[versions.c.table_name],
+            set_={'version': versions.c.version + 1, 'updated_at': now}
+        ))
+        return
+    result = connection.execute(
+        versions.update()
+        .where(versions.c.table_name.in_(table_names))
+        .values(version=versions.c.version + 1, updated_at=now)
+    )
+    if result.rowcount < len(table_names):
+        existing = {row[0] for row in connection.execute(
+            select(versions.c.table_name).where(versions.c.table_name.in_(table_names)))}
+        connection.execute(versions.insert(), [{'table_name': name, 'version': 1, 'updated_at': now}
+                                               for name in table_names if name not in existing])
+
+
+@event.listens_for(Session, 'after_flush')
+def _after_flush(session, flush_context):
+    tables = set()
+    for obj in list(session.new) + list(session.deleted):
+        tables.add(obj.__table__.name)
+    for obj in session.dirty:
+        if session.is_modified(obj, include_collections=False):
+            tables.add(obj.__table__.name)
+    if tables:
+        _mark_changed(session, tables)
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _after_bulk_execute(orm_execute_state):
+    # Query.update() / Query.delete() 不经过 flush
+    if not (orm_execute_state.is_update or orm_execute_state.is_delete):
+        return None
+    table = getattr(orm_execute_state.statement, 'table', None)
+    if table is None or table.name == VERSION_TABLE:
+        return None
+    result = orm_execute_state.invoke_statement()
+    if result.rowcount:
+        _mark_changed(orm_execute_state.session, [table.name])
+    return result
+
+
+def ensure_table_versions(db):
+    """Create the counter rows of all mapped tables (call inside an app context)"""
+    from models import TableVersion
+
+    existing = {row[0] for row in db.session.query(TableVersion.table_name).all()}
+    for table_name in db.metadata.tables:
+        if table_name != VERSION_TABLE and table_name not in existing:
+            db.session.add(TableVersion(table_name=table_name, version=0, updated_at=datetime.utcnow()))
+    db.session.commit()
+
+
+def get_versions(table_names):
+    """
+    Read the change counters of the given tables
+
+    Returns:
+        tuple: (dict of table name to version, latest update time or None)
+    """
+    from app import db
+    from models import TableVersion
+
+    rows = db.session.query(TableVersion.table_name, TableVersion.version, TableVersion.updated_at) \
+        .filter(TableVersion.table_name.in_(table_names)).all()
+    versions = {row[0]: row[1] for row in rows}
+    updated = [row[2] for row in rows if row[2]]
+    return versions, max(updated) if updated else None
+
+
+def conditional(*table_names):
+    """
+    Serve a GET endpoint with a weak ETag and Last-Modified derived from
+    the change counters of the tables it reads
+
+    When the client already has the current representation, a 304 is
+    returned without running the view.
+
+    Args:
+        *table_names: Tables whose changes alter the response
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            try:
+                versions, last_modified = get_versions(table_names)
+            except Exception as e:
+                logger.warning(f"Could not read table versions: {str(e)}")
+                return view(*args, **kwargs)
+
+            key = request.full_path + '|' + '|'.join(f'{name}:{versions.get(name, 0)}' for name in table_names)
+            etag = hashlib.sha1(key.encode('utf-8')).hexdigest()[:32]
+            if last_modified:
+                # HTTP 日期只精确到秒
+                last_modified = last_modified.replace(microsecond=0)
+
+            not_modified = False
+            if request.if_none_match:
+                not_modified = request.if_none_match.contains_weak(etag)
+            elif request.if_modified_since and last_modified:
+                not_modified = last_modified <= request.if_modified_since.replace(tzinfo=None)
+
+            if not_modified:
+                response = make_response('', 304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+
+            response.set_etag(etag, weak=True)
+            if last_modified:
+                response.last_modified = last_modified
+            # 允许缓存，但每次使用前都需要重新验证
+            response.cache_control.no_cache = True
+            return response
+        return wrapper
+    return decorator
+
+
+def _choose_encoding():
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+
+def _gzip_stream(chunks):
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    try:
+        for chunk in chunks:
+            data = compressor.compress(chunk if isinstance(chunk, bytes) else chunk.encode('utf-8'))
+            if data:
+                yield data
+        yield compressor.flush()
+    finally:
+        # 确保内层生成器（及其应用上下文）被关闭
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+def compress_response(response):
+    """Compress large JSON/HTML responses with brotli (if installed) or gzip"""
+    if (response.status_code != 200 or response.direct_passthrough
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESS_MIMETYPES):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = _choose_encoding()
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        # 流式JSON数组逐块压缩；NDJSON 需要逐行送达，不压缩
+        if response.mimetype != 'application/json' or not request.accept_encodings['gzip']:
+            return response
+        response.response = _gzip_stream(response.response)
+        response.headers['Content-Encoding'] = 'gzip'
+        response.headers.pop('Content-Length', None)
+        return response
+
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_SIZE:
+        return response
+
+    if encoding == 'br':
+        data = brotli.compress(data, quality=BROTLI_QUALITY)
+    else:
+        data = gzip.compress(data, compresslevel=GZIP_LEVEL)
+    response.set_data(data)
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def init_app(app):
+    app.after_request(compress_response)
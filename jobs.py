@@ -0,0 +1,363 @@
+import os
+import heapq
+import uuid
+import signal
+import logging
+import itertools
+import threading
+import contextvars
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# 同时运行的restic作业数量上限
+MAX_WORKERS = int(os.environ.get('RESTICLY_JOB_WORKERS', '4'))
+# 内存中保留的已结束作业数量
+MAX_FINISHED_JOBS = 500
+# 作业类别，按优先级从高到低排列
+JOB_CLASSES = ('interactive', 'manual', 'scheduled', 'maintenance')
+PRIORITIES = {name: index for index, name in enumerate(JOB_CLASSES)}
+# 各作业类型的默认类别
+DEFAULT_CLASSES = {
+    'restore': 'interactive',
+    'backup': 'manual',
+    'estimate': 'manual',
+    'benchmark': 'manual',
+    'copy': 'scheduled',
+    'check': 'maintenance',
+    'forget': 'maintenance',
+    'stats': 'maintenance',
+}
+# 交互式作业需要仓库时如何让出维护作业：pause 发送 SIGSTOP 暂停进程；
+# forget/prune 持有排他锁，暂停会让恢复无法加锁，只能中断（restic 收到 SIGINT 后会删除锁）
+PREEMPT_MODES = {
+    'check': 'pause',
+    'stats': 'pause',
+    'forget': 'cancel',
+}
+# 为交互式作业保留的工作线程数，其他类别的作业不能占满作业池
+INTERACTIVE_RESERVE = int(os.environ.get('RESTICLY_INTERACTIVE_RESERVE', '1'))
+
+# 当前线程正在运行的作业，restic 进程启动时据此登记到作业上
+current_job = contextvars.ContextVar('current_job', default=None)
+
+
+class Job:
+    """A unit of background work tracked by the job pool"""
+
+    def __init__(self, kind, repository_id=None, description=None, job_class=None, preempt=None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.repository_id = repository_id
+        self.description = description
+        self.job_class = job_class or DEFAULT_CLASSES.get(kind, 'maintenance')
+        self.priority = PRIORITIES[self.job_class]
+        self.preempt = preempt if preempt is not None else (
+            PREEMPT_MODES.get(kind, 'pause') if self.job_class == 'maintenance' else None)
+        self.status = 'queued'  # queued, running, paused, completed, failed, cancelled
+        self.progress = {}
+        self.result = None
+        self.error = None
+        self.created_at = datetime.utcnow()
+        self.started_at = None
+        self.finished_at = None
+        self.future = None
+        self.cancelled = False
+        # 让该作业暂停的交互式作业
+        self.paused_by = set()
+        self._pids = set()
+        self._lock = threading.Lock()
+
+    @property
+    def finished(self):
+        return self.status in ('completed', 'failed', 'cancelled')
+
+    def update_progress(self, **progress):
+        """Record progress information reported by the running job"""
+        self.progress.update(progress)
+
+    def attach_process(self, pid):
+        """Register a process started by this job (called by the restic runner)"""
+        with self._lock:
+            self._pids.add(pid)
+            if self.cancelled:
+                self._signal(pid, signal.SIGINT)
+            elif self.paused_by:
+                self._signal(pid, signal.SIGSTOP)
+
+    def detach_process(self, pid):
+        with self._lock:
+            self._pids.discard(pid)
+
+    def _signal(self, pid, signum):
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            pass
+        except OSError as e:
+            logger.warning(f"Could not signal process {pid} of job {self.id}: {str(e)}")
+
+    def pause(self, by):
+        """Stop the processes of the job until resume() is called for every pausing job"""
+        with self._lock:
+            first = not self.paused_by
+            self.paused_by.add(by)
+            if first and not self.finished:
+                self.status = 'paused'
+                for pid in self._pids:
+                    self._signal(pid, signal.SIGSTOP)
+        return first
+
+    def resume(self, by):
+        """
+        Continue the job once no pausing job remains
+
+        Returns:
+            bool: True if the job was resumed
+        """
+        with self._lock:
+            if by not in self.paused_by:
+                return False
+            self.paused_by.discard(by)
+            if self.paused_by:
+                return False
+            for pid in self._pids:
+                self._signal(pid, signal.SIGCONT)
+            if self.status == 'paused':
+                self.status = 'running'
+            return True
+
+    def cancel(self):
+        """Interrupt the processes of the job; restic removes its lock on SIGINT"""
+        with self._lock:
+            self.cancelled = True
+            for pid in self._pids:
+                self._signal(pid, signal.SIGCONT)
+                self._signal(pid, signal.SIGINT)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'job_class': self.job_class,
+            'repository_id': self.repository_id,
+            'description': self.description,
+            'status': self.status,
+            'progress': self.progress,
+            'result': self.result,
+            'error': self.error,
+            'created_at': self.created_at.isoformat(),
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+
+class JobPool:
+    """
+    Bounded pool of worker threads running restic operations as tracked jobs
+
+    Queued jobs start in priority order of their class (interactive restores,
+    manual backups, scheduled backups, maintenance), first come first served
+    within a class. INTERACTIVE_RESERVE workers are kept free for interactive
+    jobs. While an interactive job runs, maintenance jobs on the same
+    repository are paused (SIGSTOP) or interrupted, and paused jobs continue
+    once no interactive job needs the repository any more.
+    """
+
+    def __init__(self, max_workers=MAX_WORKERS, reserve=INTERACTIVE_RESERVE):
+        self.max_workers = max_workers
+        self.reserve = min(reserve, max(0, max_workers - 1))
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._queue = []
+        self._seq = itertools.count()
+        self._busy = 0
+        self._workers = []
+        self._pid = None
+        self._shutdown = False
+
+    def _ensure_workers(self):
+        # 延迟启动工作线程，避免导入时启动线程；fork 出的子进程中需要重新启动
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._busy = 0
+            self._workers = []
+            for index in range(self.max_workers):
+                worker = threading.Thread(target=self._worker, name=f'ResticJob_{index}', daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+    def submit(self, kind, fn, *args, repository_id=None, description=None, job_class=None, **kwargs):
+        """
+        Submit a function to run as a job
+
+        Args:
+            kind (str): Job type, e.g. 'check', 'forget', 'restore'
+            fn (callable): Function called as fn(job, *args, **kwargs); its
+                return value becomes the job result
+            repository_id (int): Optional repository the job works on
+            description (str): Optional human readable description
+            job_class (str): One of JOB_CLASSES, defaults by kind
+
+        Returns:
+            Job: The queued job; job.future resolves to the function result
+        """
+        job = Job(kind, repository_id=repository_id, description=description, job_class=job_class)
+        job.future = Future()
+        with self._cond:
+            self._ensure_workers()
+            self._jobs[job.id] = job
+            self._prune()
+            heapq.heappush(self._queue, (job.priority, next(self._seq), job, fn, args, kwargs))
+            self._cond.notify_all()
+        return job
+
+    def _can_start(self, job):
+        if job.priority == PRIORITIES['interactive']:
+            return self._busy < self.max_workers
+        return self._busy < self.max_workers - self.reserve
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._shutdown and not (self._queue and self._can_start(self._queue[0][2])):
+                    self._cond.wait()
+                if self._shutdown:
+                    return
+                _, _, job, fn, args, kwargs = heapq.heappop(self._queue)
+                self._busy += 1
+            try:
+                if job.future.set_running_or_notify_cancel():
+                    self._execute(job, fn, args, kwargs)
+            finally:
+                with self._cond:
+                    self._busy -= 1
+                    self._cond.notify_all()
+
+    def _execute(self, job, fn, args, kwargs):
+        try:
+            result = self._run(job, fn, args, kwargs)
+        except BaseException as e:
+            job.future.set_exception(e)
+        else:
+            job.future.set_result(result)
+
+    def _run(self, job, fn, args, kwargs):
+        job.status = 'running'
+        job.started_at = datetime.utcnow()
+        token = current_job.set(job)
+        if job.priority == PRIORITIES['interactive']:
+            self._preempt_for(job)
+        elif job.preempt:
+            self._yield_to_running(job)
+        try:
+            job.result = fn(job, *args, **kwargs)
+            job.status = 'cancelled' if job.cancelled else 'completed'
+            return job.result
+        except Exception as e:
+            logger.error(f"Job {job.id} ({job.kind}) failed: {str(e)}")
+            job.error = str(e)
+            job.status = 'cancelled' if job.cancelled else 'failed'
+            raise
+        finally:
+            current_job.reset(token)
+            job.finished_at = datetime.utcnow()
+            if job.priority == PRIORITIES['interactive']:
+                self._release(job)
+
+    @contextmanager
+    def track(self, kind, repository_id=None, description=None, job_class=None):
+        """
+        Track work running in the calling thread as a job, without queueing
+
+        Used for scheduled backups, whose concurrency is limited per backup
+        target by the planner rather than by the pool.
+
+        Yields:
+            Job: The running job
+        """
+        job = Job(kind, repository_id=repository_id, description=description, job_class=job_class)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        job.status = 'running'
+        job.started_at = datetime.utcnow()
+        token = current_job.set(job)
+        try:
+            yield job
+            job.status = 'completed'
+        except Exception as e:
+            job.error = str(e)
+            job.status = 'failed'
+            raise
+        finally:
+            current_job.reset(token)
+            job.finished_at = datetime.utcnow()
+
+    def _preemptible(self, repository_id):
+        with self._lock:
+            return [job for job in self._jobs.values()
+                    if job.preempt and job.status in ('running', 'paused')
+                    and job.repository_id == repository_id]
+
+    def _preempt_for(self, job):
+        """Pause or interrupt the maintenance jobs using the repository of an interactive job"""
+        if job.repository_id is None:
+            return
+        for other in self._preemptible(job.repository_id):
+            if other.preempt == 'cancel':
+                logger.info(f"Interrupting {other.kind} job {other.id} for {job.kind} job {job.id}")
+                other.cancel()
+            elif other.pause(job.id):
+                logger.info(f"Pausing {other.kind} job {other.id} for {job.kind} job {job.id}")
+
+    def _yield_to_running(self, job):
+        """Start a maintenance job paused if an interactive job already uses its repository"""
+        with self._lock:
+            active = [other for other in self._jobs.values()
+                      if other.priority == PRIORITIES['interactive'] and other.status == 'running'
+                      and other.repository_id is not None and other.repository_id == job.repository_id]
+        for other in active:
+            if job.preempt == 'cancel':
+                job.cancel()
+            else:
+                job.pause(other.id)
+
+    def _release(self, job):
+        """Resume the jobs paused for a finished interactive job"""
+        if job.repository_id is None:
+            return
+        for other in self._preemptible(job.repository_id):
+            if other.resume(job.id):
+                logger.info(f"Resuming {other.kind} job {other.id}")
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self, kind=None):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        if kind:
+            jobs = [job for job in jobs if job.kind == kind]
+        return jobs
+
+    def shutdown(self, wait=False):
+        with self._cond:
+            self._shutdown = True
+            self._cond.notify_all()
+        if wait:
+            for worker in self._workers:
+                worker.join()
+
+
+job_pool = JobPool()
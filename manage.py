@@ -10,9 +10,16 @@ import subprocess
 import click
 from flask.cli import FlaskGroup
 
-from app import app, db
+from app import create_app, prepare_database
 
-cli = FlaskGroup(app)
+cli = FlaskGroup(create_app=create_app)
+
+@cli.command("init_db")
+def init_db():
+    """创建缺失的数据表（不使用迁移时）"""
+    from flask import current_app
+    prepare_database(current_app._get_current_object())
+    print("Database tables have been created.")
 
 @cli.command("db_init")
 def db_init():
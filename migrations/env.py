@@ -22,6 +22,13 @@ config.set_main_option(
     "sqlalchemy.url", current_app.config.get("SQLALCHEMY_DATABASE_URI").replace('%', '%%'))
 target_metadata = current_app.extensions['migrate'].db.metadata
 
+# 由 APScheduler 自行创建和管理的表，不参与自动迁移
+EXTERNAL_TABLES = {'apscheduler_jobs'}
+
+
+def include_object(object, name, type_, reflected, compare_to):
+    return not (type_ == 'table' and name in EXTERNAL_TABLES)
+
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
 # my_important_option = config.get_main_option("my_important_option")
@@ -42,7 +49,8 @@ def run_migrations_offline():
     """
     url = config.get_main_option("sqlalchemy.url")
     context.configure(
-        url=url, target_metadata=target_metadata, literal_binds=True
+        url=url, target_metadata=target_metadata, literal_binds=True,
+        include_object=include_object
     )
 
     with context.begin_transaction():
@@ -74,6 +82,7 @@ def run_migrations_online():
             connection=connection,
             target_metadata=target_metadata,
             process_revision_directives=process_revision_directives,
+            include_object=include_object,
             **current_app.extensions['migrate'].configure_args
         )
 
@@ -0,0 +1,44 @@
+"""Add duration prediction and SLA columns
+
+Revision ID: add_backup_sla_columns
+Revises: add_task_catchup_policy
+Create Date: 2026-10-19 20:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_backup_sla_columns'
+down_revision = 'add_task_catchup_policy'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+
+    backup_columns = {column['name'] for column in inspector.get_columns('backup')}
+    for name, column_type in (('predicted_end', sa.DateTime()),
+                              ('sla_deadline', sa.DateTime()),
+                              ('sla_status', sa.String(20))):
+        if name in backup_columns:
+            print(f"Column backup.{name} already exists")
+            continue
+        op.add_column('backup', sa.Column(name, column_type, nullable=True))
+        print(f"Added {name} column to backup table")
+
+    task_columns = {column['name'] for column in inspector.get_columns('scheduled_task')}
+    if 'sla_deadline' in task_columns:
+        print("Column scheduled_task.sla_deadline already exists")
+    else:
+        op.add_column('scheduled_task', sa.Column('sla_deadline', sa.String(5), nullable=True))
+        print("Added sla_deadline column to scheduled_task table")
+
+
+def downgrade():
+    op.drop_column('scheduled_task', 'sla_deadline')
+    op.drop_column('backup', 'sla_status')
+    op.drop_column('backup', 'sla_deadline')
+    op.drop_column('backup', 'predicted_end')
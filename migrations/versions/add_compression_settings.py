@@ -0,0 +1,36 @@
+"""Add compression and pack size settings to repositories and tasks
+
+Revision ID: add_compression_settings
+Revises: add_replication_tables
+Create Date: 2026-10-20 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_compression_settings'
+down_revision = 'add_replication_tables'
+branch_labels = None
+depends_on = None
+
+TABLES = ('repository', 'scheduled_task')
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    for table in TABLES:
+        existing = {column['name'] for column in inspector.get_columns(table)}
+        for name, column_type in (('compression', sa.String(10)), ('pack_size', sa.Integer())):
+            if name in existing:
+                print(f"Column {table}.{name} already exists")
+                continue
+            op.add_column(table, sa.Column(name, column_type, nullable=True))
+            print(f"Added {name} column to {table} table")
+
+
+def downgrade():
+    for table in TABLES:
+        for name in ('pack_size', 'compression'):
+            op.drop_column(table, name)
@@ -0,0 +1,76 @@
+"""Add replication jobs and the snapshots they copied
+
+Revision ID: add_replication_tables
+Revises: add_repository_capacity
+Create Date: 2026-10-20 15:00:00.000000
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_replication_tables'
+down_revision = 'add_repository_capacity'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+
+    # 表可能已由 db.create_all() 创建
+    if inspector.has_table('replication'):
+        print("replication table already exists")
+    else:
+        op.create_table(
+            'replication',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('name', sa.String(100), nullable=False, unique=True),
+            sa.Column('source_repository_id', sa.Integer(), sa.ForeignKey('repository.id'), nullable=False),
+            sa.Column('destination_repository_id', sa.Integer(), sa.ForeignKey('repository.id'), nullable=False),
+            sa.Column('schedule_type', sa.String(50), nullable=True),
+            sa.Column('cron_expression', sa.String(100), nullable=True),
+            sa.Column('interval_seconds', sa.Integer(), nullable=True),
+            sa.Column('enabled', sa.Boolean(), nullable=True),
+            sa.Column('limit_upload', sa.Integer(), nullable=True),
+            sa.Column('limit_download', sa.Integer(), nullable=True),
+            sa.Column('status', sa.String(50), nullable=True),
+            sa.Column('message', sa.Text(), nullable=True),
+            sa.Column('last_run', sa.DateTime(), nullable=True),
+            sa.Column('next_run', sa.DateTime(), nullable=True),
+            sa.Column('job_id', sa.String(32), nullable=True),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+        )
+        print("Created replication table")
+
+    if inspector.has_table('replicated_snapshot'):
+        print("replicated_snapshot table already exists")
+    else:
+        op.create_table(
+            'replicated_snapshot',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('replication_id', sa.Integer(), sa.ForeignKey('replication.id'), nullable=False),
+            sa.Column('source_snapshot_id', sa.String(100), nullable=False),
+            sa.Column('destination_snapshot_id', sa.String(100), nullable=True),
+            sa.Column('copied_at', sa.DateTime(), nullable=True),
+            sa.UniqueConstraint('replication_id', 'source_snapshot_id', name='uq_replicated_snapshot'),
+        )
+        print("Created replicated_snapshot table")
+
+    # 为新表创建变更计数行，否则写入不会改变依赖它的 ETag
+    versions = sa.table('table_version', sa.column('table_name', sa.String), sa.column('version', sa.BigInteger),
+                        sa.column('updated_at', sa.DateTime))
+    existing = {row[0] for row in op.get_bind().execute(sa.select(versions.c.table_name))}
+    rows = [{'table_name': name, 'version': 0, 'updated_at': datetime.utcnow()}
+            for name in ('replication', 'replicated_snapshot') if name not in existing]
+    if rows:
+        op.bulk_insert(versions, rows)
+        print(f"Seeded table versions for {', '.join(row['table_name'] for row in rows)}")
+
+
+def downgrade():
+    op.drop_table('replicated_snapshot')
+    op.drop_table('replication')
@@ -0,0 +1,29 @@
+"""Add a configured capacity to repositories
+
+Revision ID: add_repository_capacity
+Revises: add_task_exclude_rules
+Create Date: 2026-10-20 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_repository_capacity'
+down_revision = 'add_task_exclude_rules'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    existing = {column['name'] for column in sa.inspect(op.get_bind()).get_columns('repository')}
+    if 'capacity_bytes' in existing:
+        print("Column repository.capacity_bytes already exists")
+        return
+    op.add_column('repository', sa.Column('capacity_bytes', sa.BigInteger(), nullable=True))
+    print("Added capacity_bytes column to repository table")
+
+
+def downgrade():
+    op.drop_column('repository', 'capacity_bytes')
@@ -0,0 +1,39 @@
+"""Add repository health columns
+
+Revision ID: add_repository_health_columns
+Revises: add_restore_table
+Create Date: 2026-10-19 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_repository_health_columns'
+down_revision = 'add_restore_table'
+branch_labels = None
+depends_on = None
+
+COLUMNS = [
+    sa.Column('health_status', sa.String(50), nullable=True),
+    sa.Column('health_message', sa.Text(), nullable=True),
+    sa.Column('health_checked_at', sa.DateTime(), nullable=True),
+    sa.Column('health_latency_ms', sa.Integer(), nullable=True),
+    sa.Column('lock_count', sa.Integer(), nullable=True),
+]
+
+
+def upgrade():
+    existing = {column['name'] for column in sa.inspect(op.get_bind()).get_columns('repository')}
+    for column in COLUMNS:
+        if column.name in existing:
+            print(f"Column {column.name} already exists")
+            continue
+        op.add_column('repository', column)
+        print(f"Added {column.name} column to repository table")
+
+
+def downgrade():
+    for column in reversed(COLUMNS):
+        op.drop_column('repository', column.name)
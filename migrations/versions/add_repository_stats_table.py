@@ -0,0 +1,40 @@
+"""Add repository stats table
+
+Revision ID: add_repository_stats_table
+Revises: add_repository_health_columns
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_repository_stats_table'
+down_revision = 'add_repository_health_columns'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # 表可能已由 db.create_all() 创建
+    if sa.inspect(op.get_bind()).has_table('repository_stats'):
+        print("repository_stats table already exists")
+        return
+
+    op.create_table(
+        'repository_stats',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('repository_id', sa.Integer(), sa.ForeignKey('repository.id'), nullable=False),
+        sa.Column('mode', sa.String(50), nullable=False),
+        sa.Column('snapshot_set_hash', sa.String(64), nullable=True),
+        sa.Column('snapshot_count', sa.Integer(), nullable=True),
+        sa.Column('stats', sa.Text(), nullable=True),
+        sa.Column('computed_at', sa.DateTime(), nullable=True),
+        sa.UniqueConstraint('repository_id', 'mode', name='uq_repository_stats_mode'),
+    )
+    print("Created repository_stats table")
+
+
+def downgrade():
+    op.drop_table('repository_stats')
@@ -0,0 +1,50 @@
+"""Add restore table
+
+Revision ID: add_restore_table
+Revises: add_rest_auth_columns
+Create Date: 2026-10-19 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_restore_table'
+down_revision = 'add_rest_auth_columns'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # 表可能已由 db.create_all() 创建
+    if sa.inspect(op.get_bind()).has_table('restore'):
+        print("restore table already exists")
+        return
+
+    op.create_table(
+        'restore',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('repository_id', sa.Integer(), sa.ForeignKey('repository.id'), nullable=False),
+        sa.Column('snapshot_id', sa.String(100), nullable=False),
+        sa.Column('target_path', sa.String(500), nullable=False),
+        sa.Column('include_paths', sa.Text(), nullable=True),
+        sa.Column('partitions', sa.Text(), nullable=True),
+        sa.Column('completed_partitions', sa.Text(), nullable=True),
+        sa.Column('parallel', sa.Integer(), nullable=True),
+        sa.Column('verify', sa.Boolean(), nullable=True),
+        sa.Column('status', sa.String(50), nullable=True),
+        sa.Column('message', sa.Text(), nullable=True),
+        sa.Column('total_bytes', sa.BigInteger(), nullable=True),
+        sa.Column('bytes_restored', sa.BigInteger(), nullable=True),
+        sa.Column('files_restored', sa.Integer(), nullable=True),
+        sa.Column('start_time', sa.DateTime(), nullable=True),
+        sa.Column('end_time', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.Column('job_id', sa.String(32), nullable=True),
+    )
+    print("Created restore table")
+
+
+def downgrade():
+    op.drop_table('restore')
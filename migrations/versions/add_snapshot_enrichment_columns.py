@@ -0,0 +1,38 @@
+"""Add snapshot enrichment columns
+
+Revision ID: add_snapshot_enrichment_columns
+Revises: add_repository_stats_table
+Create Date: 2026-10-19 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_snapshot_enrichment_columns'
+down_revision = 'add_repository_stats_table'
+branch_labels = None
+depends_on = None
+
+COLUMNS = [
+    sa.Column('file_count', sa.Integer(), nullable=True),
+    sa.Column('data_added', sa.BigInteger(), nullable=True),
+    sa.Column('size_source', sa.String(20), nullable=True),
+    sa.Column('enriched_at', sa.DateTime(), nullable=True),
+]
+
+
+def upgrade():
+    existing = {column['name'] for column in sa.inspect(op.get_bind()).get_columns('snapshot')}
+    for column in COLUMNS:
+        if column.name in existing:
+            print(f"Column {column.name} already exists")
+            continue
+        op.add_column('snapshot', column)
+        print(f"Added {column.name} column to snapshot table")
+
+
+def downgrade():
+    for column in reversed(COLUMNS):
+        op.drop_column('snapshot', column.name)
@@ -0,0 +1,53 @@
+"""Add table version counters
+
+Revision ID: add_table_version_table
+Revises: add_snapshot_enrichment_columns
+Create Date: 2026-10-19 14:00:00.000000
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_table_version_table'
+down_revision = 'add_snapshot_enrichment_columns'
+branch_labels = None
+depends_on = None
+
+
+# 本迁移之前已存在的表；之后新增表的迁移各自为新表创建计数行
+TRACKED_TABLES = ('repository', 'backup', 'snapshot', 'restore', 'repository_stats', 'scheduled_task', 'settings')
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+
+    # 表可能已由 db.create_all() 创建
+    if inspector.has_table('table_version'):
+        print("table_version table already exists")
+    else:
+        op.create_table(
+            'table_version',
+            sa.Column('table_name', sa.String(64), primary_key=True),
+            sa.Column('version', sa.BigInteger(), nullable=False),
+            sa.Column('updated_at', sa.DateTime(), nullable=True),
+        )
+        print("Created table_version table")
+
+    # 没有计数行的表写入时版本号不会增加，其 ETag 永远不变
+    versions = sa.table('table_version', sa.column('table_name', sa.String), sa.column('version', sa.BigInteger),
+                        sa.column('updated_at', sa.DateTime))
+    existing = {row[0] for row in bind.execute(sa.select(versions.c.table_name))}
+    rows = [{'table_name': name, 'version': 0, 'updated_at': datetime.utcnow()}
+            for name in TRACKED_TABLES if name not in existing and inspector.has_table(name)]
+    if rows:
+        op.bulk_insert(versions, rows)
+        print(f"Seeded table versions for {', '.join(row['table_name'] for row in rows)}")
+
+
+def downgrade():
+    op.drop_table('table_version')
@@ -0,0 +1,29 @@
+"""Add catch-up policy to scheduled tasks
+
+Revision ID: add_task_catchup_policy
+Revises: convert_json_columns_to_jsonb
+Create Date: 2026-10-19 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_task_catchup_policy'
+down_revision = 'convert_json_columns_to_jsonb'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    existing = {column['name'] for column in sa.inspect(op.get_bind()).get_columns('scheduled_task')}
+    if 'catchup_policy' in existing:
+        print("Column catchup_policy already exists")
+        return
+    op.add_column('scheduled_task', sa.Column('catchup_policy', sa.String(10), nullable=True))
+    print("Added catchup_policy column to scheduled_task table")
+
+
+def downgrade():
+    op.drop_column('scheduled_task', 'catchup_policy')
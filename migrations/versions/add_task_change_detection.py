@@ -0,0 +1,29 @@
+"""Add change detection mode to scheduled tasks
+
+Revision ID: add_task_change_detection
+Revises: add_backup_sla_columns
+Create Date: 2026-10-19 22:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_task_change_detection'
+down_revision = 'add_backup_sla_columns'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    existing = {column['name'] for column in sa.inspect(op.get_bind()).get_columns('scheduled_task')}
+    if 'change_detection' in existing:
+        print("Column change_detection already exists")
+        return
+    op.add_column('scheduled_task', sa.Column('change_detection', sa.String(20), nullable=True))
+    print("Added change_detection column to scheduled_task table")
+
+
+def downgrade():
+    op.drop_column('scheduled_task', 'change_detection')
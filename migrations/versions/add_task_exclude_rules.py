@@ -0,0 +1,68 @@
+"""Add exclude rules to scheduled tasks and the exclude file table
+
+Revision ID: add_task_exclude_rules
+Revises: add_task_on_change_columns
+Create Date: 2026-10-20 09:00:00.000000
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_task_exclude_rules'
+down_revision = 'add_task_on_change_columns'
+branch_labels = None
+depends_on = None
+
+JSON_LIST = sa.JSON(none_as_null=True).with_variant(postgresql.JSONB(none_as_null=True), 'postgresql')
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+
+    existing = {column['name'] for column in inspector.get_columns('scheduled_task')}
+    for name, column_type in (('exclude_patterns', JSON_LIST),
+                              ('exclude_file_ids', JSON_LIST),
+                              ('exclude_caches', sa.Boolean()),
+                              ('exclude_larger_than', sa.String(20)),
+                              ('one_file_system', sa.Boolean())):
+        if name in existing:
+            print(f"Column scheduled_task.{name} already exists")
+            continue
+        op.add_column('scheduled_task', sa.Column(name, column_type, nullable=True))
+        print(f"Added {name} column to scheduled_task table")
+
+    # 表可能已由 db.create_all() 创建
+    if inspector.has_table('exclude_file'):
+        print("exclude_file table already exists")
+    else:
+        op.create_table(
+            'exclude_file',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('name', sa.String(100), nullable=False, unique=True),
+            sa.Column('description', sa.Text(), nullable=True),
+            sa.Column('patterns', sa.Text(), nullable=False),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+            sa.Column('updated_at', sa.DateTime(), nullable=True),
+        )
+        print("Created exclude_file table")
+
+    # 为新表创建变更计数行，否则写入不会改变依赖它的 ETag
+    versions = sa.table('table_version', sa.column('table_name', sa.String), sa.column('version', sa.BigInteger),
+                        sa.column('updated_at', sa.DateTime))
+    existing = {row[0] for row in op.get_bind().execute(sa.select(versions.c.table_name))}
+    rows = [{'table_name': name, 'version': 0, 'updated_at': datetime.utcnow()}
+            for name in ('exclude_file',) if name not in existing]
+    if rows:
+        op.bulk_insert(versions, rows)
+        print(f"Seeded table versions for {', '.join(row['table_name'] for row in rows)}")
+
+
+def downgrade():
+    op.drop_table('exclude_file')
+    for name in ('one_file_system', 'exclude_larger_than', 'exclude_caches', 'exclude_file_ids', 'exclude_patterns'):
+        op.drop_column('scheduled_task', name)
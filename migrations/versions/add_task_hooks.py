@@ -0,0 +1,37 @@
+"""Add backup hooks and stdin backups to scheduled tasks
+
+Revision ID: add_task_hooks
+Revises: add_compression_settings
+Create Date: 2026-10-20 21:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_task_hooks'
+down_revision = 'add_compression_settings'
+branch_labels = None
+depends_on = None
+
+COLUMNS = (('pre_hook', sa.Text()),
+           ('post_hook', sa.Text()),
+           ('hook_timeout', sa.Integer()),
+           ('stdin_command', sa.Text()),
+           ('stdin_filename', sa.String(255)))
+
+
+def upgrade():
+    existing = {column['name'] for column in sa.inspect(op.get_bind()).get_columns('scheduled_task')}
+    for name, column_type in COLUMNS:
+        if name in existing:
+            print(f"Column scheduled_task.{name} already exists")
+            continue
+        op.add_column('scheduled_task', sa.Column(name, column_type, nullable=True))
+        print(f"Added {name} column to scheduled_task table")
+
+
+def downgrade():
+    for name, _ in reversed(COLUMNS):
+        op.drop_column('scheduled_task', name)
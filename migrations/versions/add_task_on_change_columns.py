@@ -0,0 +1,34 @@
+"""Add on_change schedule settings to scheduled tasks
+
+Revision ID: add_task_on_change_columns
+Revises: add_task_change_detection
+Create Date: 2026-10-19 23:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_task_on_change_columns'
+down_revision = 'add_task_change_detection'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    existing = {column['name'] for column in sa.inspect(op.get_bind()).get_columns('scheduled_task')}
+    for name, column_type in (('min_interval', sa.Integer()),
+                              ('debounce_seconds', sa.Integer()),
+                              ('change_threshold', sa.BigInteger())):
+        if name in existing:
+            print(f"Column scheduled_task.{name} already exists")
+            continue
+        op.add_column('scheduled_task', sa.Column(name, column_type, nullable=True))
+        print(f"Added {name} column to scheduled_task table")
+
+
+def downgrade():
+    op.drop_column('scheduled_task', 'change_threshold')
+    op.drop_column('scheduled_task', 'debounce_seconds')
+    op.drop_column('scheduled_task', 'min_interval')
@@ -0,0 +1,83 @@
+"""Convert snapshot paths/tags and task tags to JSONB with indexes
+
+Revision ID: convert_json_columns_to_jsonb
+Revises: add_table_version_table
+Create Date: 2026-10-19 15:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'convert_json_columns_to_jsonb'
+down_revision = 'add_table_version_table'
+branch_labels = None
+depends_on = None
+
+JSON_COLUMNS = [
+    ('snapshot', 'paths'),
+    ('snapshot', 'tags'),
+    ('scheduled_task', 'tags'),
+]
+
+BTREE_INDEXES = [
+    ('ix_snapshot_repository_created', ['repository_id', 'created_at']),
+    ('ix_snapshot_hostname_created', ['hostname', 'created_at']),
+]
+
+GIN_INDEXES = [
+    ('ix_snapshot_tags', 'tags'),
+    ('ix_snapshot_paths', 'paths'),
+]
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    is_postgresql = bind.dialect.name == 'postgresql'
+
+    if is_postgresql:
+        for table, column in JSON_COLUMNS:
+            current = {c['name']: c['type'] for c in inspector.get_columns(table)}[column]
+            if current.__class__.__name__ == 'JSONB':
+                print(f"Column {table}.{column} is already JSONB")
+                continue
+            # 以前存储的是 json.dumps 生成的文本，空字符串视为 NULL
+            op.execute(
+                f"ALTER TABLE {table} ALTER COLUMN {column} TYPE JSONB "
+                f"USING CASE WHEN {column} IS NULL OR btrim({column}) = '' THEN NULL "
+                f"ELSE {column}::jsonb END"
+            )
+            # json.dumps(None) 存入的 'null' 统一为 SQL NULL
+            op.execute(f"UPDATE {table} SET {column} = NULL WHERE {column} = 'null'::jsonb")
+            print(f"Converted {table}.{column} to JSONB")
+    # 其他数据库中 JSON 类型仍以文本存储，无需转换
+
+    existing = {index['name'] for index in inspector.get_indexes('snapshot')}
+    for name, columns in BTREE_INDEXES:
+        if name not in existing:
+            op.create_index(name, 'snapshot', columns)
+            print(f"Created index {name}")
+
+    if is_postgresql:
+        for name, column in GIN_INDEXES:
+            if name not in existing:
+                op.create_index(name, 'snapshot', [column], postgresql_using='gin',
+                                postgresql_ops={column: 'jsonb_path_ops'})
+                print(f"Created index {name}")
+
+
+def downgrade():
+    bind = op.get_bind()
+    is_postgresql = bind.dialect.name == 'postgresql'
+
+    if is_postgresql:
+        for name, _ in GIN_INDEXES:
+            op.drop_index(name, table_name='snapshot')
+    for name, _ in BTREE_INDEXES:
+        op.drop_index(name, table_name='snapshot')
+
+    if is_postgresql:
+        for table, column in JSON_COLUMNS:
+            op.execute(f"ALTER TABLE {table} ALTER COLUMN {column} TYPE TEXT USING {column}::text")
@@ -0,0 +1,77 @@
+"""Move repository health into its own table
+
+Revision ID: move_repository_health_to_table
+Revises: add_task_hooks
+Create Date: 2026-10-21 09:00:00.000000
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'move_repository_health_to_table'
+down_revision = 'add_task_hooks'
+branch_labels = None
+depends_on = None
+
+# repository 表中的旧列与新表列的对应关系
+COLUMNS = (('health_status', 'status', sa.String(50)),
+           ('health_message', 'message', sa.Text()),
+           ('lock_count', 'lock_count', sa.Integer()),
+           ('health_latency_ms', 'latency_ms', sa.Integer()),
+           ('health_checked_at', 'checked_at', sa.DateTime()))
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+
+    # 表可能已由 db.create_all() 创建
+    if inspector.has_table('repository_health'):
+        print("repository_health table already exists")
+    else:
+        op.create_table(
+            'repository_health',
+            sa.Column('repository_id', sa.Integer(), sa.ForeignKey('repository.id'), primary_key=True),
+            *(sa.Column(name, column_type, nullable=True) for _, name, column_type in COLUMNS)
+        )
+        print("Created repository_health table")
+
+    existing = {column['name'] for column in inspector.get_columns('repository')}
+    old_columns = [old for old, _, _ in COLUMNS if old in existing]
+    if old_columns:
+        if 'health_checked_at' in existing:
+            bind.execute(sa.text(
+                'INSERT INTO repository_health (repository_id, '
+                + ', '.join(name for old, name, _ in COLUMNS if old in existing)
+                + ') SELECT id, ' + ', '.join(old_columns)
+                + ' FROM repository WHERE health_checked_at IS NOT NULL'
+                ' AND id NOT IN (SELECT repository_id FROM repository_health)'
+            ))
+            print("Copied repository health into repository_health")
+        with op.batch_alter_table('repository') as batch_op:
+            for old in old_columns:
+                batch_op.drop_column(old)
+        print(f"Dropped {', '.join(old_columns)} from repository table")
+
+    # 为新表创建变更计数行，否则写入不会改变依赖它的 ETag
+    versions = sa.table('table_version', sa.column('table_name', sa.String), sa.column('version', sa.BigInteger),
+                        sa.column('updated_at', sa.DateTime))
+    if not bind.execute(sa.select(versions.c.table_name).where(versions.c.table_name == 'repository_health')).first():
+        op.bulk_insert(versions, [{'table_name': 'repository_health', 'version': 0, 'updated_at': datetime.utcnow()}])
+        print("Seeded table version for repository_health")
+
+
+def downgrade():
+    with op.batch_alter_table('repository') as batch_op:
+        for old, _, column_type in COLUMNS:
+            batch_op.add_column(sa.Column(old, column_type, nullable=True))
+    op.execute(
+        'UPDATE repository SET '
+        + ', '.join(f'{old} = (SELECT {name} FROM repository_health WHERE repository_id = repository.id)'
+                    for old, name, _ in COLUMNS)
+    )
+    op.drop_table('repository_health')
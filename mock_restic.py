@@ -0,0 +1,659 @@
+"""
+进程级的 restic 模拟仓库
+
+Replaces the per-wrapper mock storage with a repository simulator shared by
+every ResticWrapper in the process (and optionally across processes through a
+state file). Commands return raw stdout/stderr in the same shapes as real
+restic, including NDJSON streams for backup, restore and ls, so the wrapper's
+normal parsing path is exercised.
+
+Configuration (environment variables):
+
+    RESTICLY_MOCK_STATE      JSON file shared across processes (default: in memory)
+    RESTICLY_MOCK_LATENCY    mean per-command latency in seconds (default 0)
+    RESTICLY_MOCK_FILES      mean number of files per backup (default 17)
+    RESTICLY_MOCK_FILE_SIZE  median file size in bytes, log-normally distributed (default 1 MiB)
+    RESTICLY_MOCK_RATE       simulated backup/restore/copy throughput in bytes/s (default 0 = instant)
+    RESTICLY_MOCK_STATUS_INTERVAL  seconds between NDJSON status lines (default 0.1)
+"""
+
+import fcntl
+import io
+import json
+import logging
+import os
+import random
+import re
+import subprocess
+import tarfile
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+PROGRAM_VERSION = 'restic 0.18.0 (mock)'
+# 各压缩模式下模拟的存储比例和相对耗时（未指定时 restic 使用 auto）
+COMPRESSION_PROFILES = {'off': (1.0, 1.0), 'auto': (0.5, 1.2), 'max': (0.42, 2.5)}
+
+
+def _env_float(name, default):
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def _utc_iso(dt):
+    return dt.replace(microsecond=0).isoformat() + 'Z'
+
+
+class MockResticBackend:
+    """Thread-safe repository simulator shared by all wrappers in the process"""
+
+    def __init__(self, state_file=None, latency=0.0, files=17, file_size=1024 * 1024,
+                 rate=0.0, status_interval=0.1):
+        self.state_file = state_file
+        self.latency = latency
+        self.files = files
+        self.file_size = file_size
+        self.rate = rate
+        self.status_interval = status_interval
+        self._lock = threading.RLock()
+        self._repositories = {}
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            state_file=os.environ.get('RESTICLY_MOCK_STATE') or None,
+            latency=_env_float('RESTICLY_MOCK_LATENCY', 0.0),
+            files=int(_env_float('RESTICLY_MOCK_FILES', 17)),
+            file_size=int(_env_float('RESTICLY_MOCK_FILE_SIZE', 1024 * 1024)),
+            rate=_env_float('RESTICLY_MOCK_RATE', 0.0),
+            status_interval=_env_float('RESTICLY_MOCK_STATUS_INTERVAL', 0.1),
+        )
+
+    # ------------------------------------------------------------------
+    # 状态管理
+    # ------------------------------------------------------------------
+    @contextmanager
+    def _repositories_state(self):
+        """Yield the repository map under the process lock (and file lock if file-backed)"""
+        with self._lock:
+            if not self.state_file:
+                yield self._repositories
+                return
+
+            with open(self.state_file, 'a+') as fh:
+                fcntl.flock(fh, fcntl.LOCK_EX)
+                try:
+                    fh.seek(0)
+                    content = fh.read()
+                    repositories = json.loads(content) if content else {}
+                    yield repositories
+                    fh.seek(0)
+                    fh.truncate()
+                    fh.write(json.dumps(repositories))
+                finally:
+                    fcntl.flock(fh, fcntl.LOCK_UN)
+
+    @contextmanager
+    def _repository(self, location):
+        with self._repositories_state() as repositories:
+            if location not in repositories:
+                repositories[location] = self._new_repository()
+            yield repositories[location]
+
+    def _new_repository(self):
+        # 预先添加几个示例快照，方便界面演示
+        now = datetime.utcnow()
+        return {
+            'initialized': True,
+            'id': uuid.uuid4().hex,
+            'snapshots': [
+                self._make_snapshot(['/tmp/data2'], ['test'], now - timedelta(days=1), 'mock-host'),
+                self._make_snapshot(['/tmp/data1'], ['test', 'sample'], now, 'mock-host'),
+            ],
+        }
+
+    def _make_snapshot(self, paths, tags, when, hostname, summary=None):
+        snapshot_id = uuid.uuid4().hex + uuid.uuid4().hex
+        rng = random.Random(snapshot_id)
+        file_count = max(1, int(rng.gauss(self.files, self.files * 0.2)))
+        snapshot = {
+            'time': _utc_iso(when),
+            'tree': uuid.uuid4().hex,
+            'paths': paths,
+            'hostname': hostname,
+            'username': 'root',
+            'uid': 0,
+            'gid': 0,
+            'tags': tags,
+            'program_version': PROGRAM_VERSION,
+            'id': snapshot_id,
+            'short_id': snapshot_id[:8],
+            'file_count': file_count,
+        }
+        if summary:
+            snapshot['summary'] = summary
+        return snapshot
+
+    def _file_sizes(self, snapshot):
+        if 'stdin_size' in snapshot:
+            return [snapshot['stdin_size']]
+        rng = random.Random(snapshot['id'])
+        return [int(rng.lognormvariate(0, 1) * self.file_size) for _ in range(snapshot['file_count'])]
+
+    @staticmethod
+    def _find(repo, snapshot_id):
+        if snapshot_id == 'latest':
+            return repo['snapshots'][-1] if repo['snapshots'] else None
+        for snapshot in repo['snapshots']:
+            if snapshot_id and snapshot['id'].startswith(snapshot_id):
+                return snapshot
+        return None
+
+    @staticmethod
+    def _public(snapshot):
+        return {k: v for k, v in snapshot.items() if k not in ('file_count', 'stdin_size')}
+
+    def _sleep(self, rng):
+        if self.latency > 0:
+            time.sleep(rng.expovariate(1 / self.latency))
+
+    def reset(self):
+        """Drop all simulated repositories"""
+        with self._repositories_state() as repositories:
+            repositories.clear()
+
+    # ------------------------------------------------------------------
+    # 命令执行
+    # ------------------------------------------------------------------
+    def run(self, command, env=None, stdin=None):
+        """
+        Execute a restic command against the simulator
+
+        Args:
+            command (list): restic command line
+            env (dict): Environment; RESTIC_REPOSITORY selects the repository
+            stdin: Binary file object read by backup --stdin
+
+        Returns:
+            tuple: (returncode (int), stdout (str), stderr (str))
+        """
+        lines = []
+        try:
+            for line in self.stream(command, env, stdin=stdin):
+                lines.append(line)
+        except MockResticError as e:
+            return e.returncode, ''.join(lines), e.stderr
+        return 0, ''.join(lines), ''
+
+    def stream(self, command, env=None, stdin=None):
+        """
+        Execute a restic command and yield stdout lines as they are produced
+
+        `dump` yields bytes chunks instead of text lines.
+
+        Raises:
+            MockResticError: When the simulated command fails
+        """
+        env = env or {}
+        location = env.get('RESTIC_REPOSITORY', 'default')
+        args = list(command[1:])
+        logger.debug(f"Mocking restic command: {' '.join(command)}")
+
+        self._sleep(random.Random())
+        subcommand = args[0] if args else ''
+        if subcommand == 'copy' and env.get('RESTIC_FROM_REPOSITORY') and '--from-repo' not in args:
+            args.extend(['--from-repo', env['RESTIC_FROM_REPOSITORY']])
+        if subcommand == 'backup':
+            yield from self._cmd_backup(location, args[1:], stdin=stdin)
+            return
+        handler = getattr(self, f'_cmd_{subcommand}', None)
+        if not handler:
+            yield f'{PROGRAM_VERSION}\n'
+            return
+        yield from handler(location, args[1:])
+
+    def _cmd_init(self, location, args):
+        with self._repositories_state() as repositories:
+            repositories[location] = self._new_repository()
+            repo_id = repositories[location]['id']
+        yield f'created restic repository {repo_id[:10]} at {location}\n'
+
+    def _cmd_check(self, location, args):
+        with self._repository(location):
+            pass
+        yield 'using temporary cache\nload indexes\ncheck all packs\nno errors were found\n'
+
+    def _cmd_cat(self, location, args):
+        if args[:1] != ['config']:
+            raise MockResticError('Fatal: unsupported cat target\n')
+        with self._repository(location) as repo:
+            repo_id = repo['id']
+        yield json.dumps({'version': 2, 'id': repo_id, 'chunker_polynomial': '3da3358b4bc8'}) + '\n'
+
+    def _cmd_list(self, location, args):
+        if args[:1] != ['locks']:
+            raise MockResticError('Fatal: unsupported list type\n')
+        with self._repository(location) as repo:
+            locks = list(repo.get('locks', []))
+        for lock_id in locks:
+            yield f'{lock_id}\n'
+
+    def _cmd_snapshots(self, location, args):
+        with self._repository(location) as repo:
+            snapshots = [self._public(s) for s in repo['snapshots']]
+        if '--json' in args:
+            yield json.dumps(snapshots) + '\n'
+        else:
+            for snapshot in snapshots:
+                yield f"{snapshot['short_id']}  {snapshot['time']}  {snapshot['hostname']}\n"
+
+    @staticmethod
+    def _read_stream(stream):
+        size = 0
+        while True:
+            chunk = stream.read(1024 * 1024)
+            if not chunk:
+                return size
+            size += len(chunk)
+
+    def _run_stdin_command(self, command):
+        """Run the command of --stdin-from-command like restic does and return the bytes it printed"""
+        if not command:
+            raise MockResticError('Fatal: --stdin-from-command requires a command after --\n')
+        with tempfile.TemporaryFile() as stderr:
+            try:
+                process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=stderr)
+            except OSError as e:
+                raise MockResticError(f'Fatal: failed to start command {command[0]}: {e.strerror}\n')
+            size = self._read_stream(process.stdout)
+            process.stdout.close()
+            returncode = process.wait()
+            stderr.seek(0)
+            output = stderr.read().decode(errors='replace')
+        if returncode != 0:
+            # restic 把命令的 stderr 原样输出到自己的 stderr
+            raise MockResticError(f'{output}Fatal: unable to save snapshot: {command[0]} failed: '
+                                  f'exit status {returncode}\n')
+        return size
+
+    def _cmd_backup(self, location, args, stdin=None):
+        stdin_command = []
+        if '--' in args:
+            stdin_command = args[args.index('--') + 1:]
+            args = args[:args.index('--')]
+        stdin_size = None
+        if '--stdin-from-command' in args:
+            stdin_size = self._run_stdin_command(stdin_command)
+        elif '--stdin' in args:
+            stdin_size = self._read_stream(stdin) if stdin is not None else 0
+        paths = _positional(args)
+        for list_file in _option(args, '--files-from'):
+            with open(list_file, encoding='utf-8') as fh:
+                paths.extend(line.rstrip('\n') for line in fh if line.strip())
+        paths = paths or ['/mock/data']
+        tags = _option(args, '--tag')
+        json_output = '--json' in args
+        packed_ratio, cost = COMPRESSION_PROFILES.get((_option(args, '--compression') or ['auto'])[-1],
+                                                      COMPRESSION_PROFILES['auto'])
+        start = time.monotonic()
+
+        if stdin_size is not None:
+            paths = ['/' + (_option(args, '--stdin-filename') or ['stdin'])[-1].lstrip('/')]
+        snapshot = self._make_snapshot(paths, tags, datetime.utcnow(), 'replit-mock')
+        if stdin_size is not None:
+            snapshot['file_count'] = 1
+            snapshot['stdin_size'] = stdin_size
+        sizes = self._file_sizes(snapshot)
+        total_bytes = sum(sizes)
+
+        # 按配置的速率输出NDJSON进度
+        duration = total_bytes * cost / self.rate if self.rate > 0 else 0
+        elapsed = 0.0
+        while elapsed < duration:
+            time.sleep(min(self.status_interval, duration - elapsed))
+            elapsed = time.monotonic() - start
+            done = min(elapsed / duration, 1.0)
+            if json_output:
+                yield json.dumps({
+                    'message_type': 'status',
+                    'seconds_elapsed': int(elapsed),
+                    'percent_done': done,
+                    'total_files': len(sizes),
+                    'files_done': int(len(sizes) * done),
+                    'total_bytes': total_bytes,
+                    'bytes_done': int(total_bytes * done),
+                }) + '\n'
+
+        files_new = max(1, len(sizes) // 2)
+        data_added = sum(sizes[:files_new])
+        summary = {
+            'files_new': files_new,
+            'files_changed': len(sizes) // 4,
+            'files_unmodified': len(sizes) - files_new - len(sizes) // 4,
+            'dirs_new': 3,
+            'dirs_changed': 1,
+            'dirs_unmodified': 0,
+            'data_blobs': files_new,
+            'tree_blobs': 4,
+            'data_added': data_added,
+            'data_added_packed': int(data_added * packed_ratio),
+            'total_files_processed': len(sizes),
+            'total_bytes_processed': total_bytes,
+            'total_duration': time.monotonic() - start,
+        }
+        if '--dry-run' not in args:
+            snapshot['summary'] = dict(summary)
+            with self._repository(location) as repo:
+                repo['snapshots'].append(snapshot)
+            summary['snapshot_id'] = snapshot['id']
+
+        if json_output:
+            yield json.dumps(dict(summary, message_type='summary')) + '\n'
+        else:
+            yield f"snapshot {snapshot['short_id']} saved\n"
+
+    def _cmd_copy(self, location, args):
+        from_repo = (_option(args, '--from-repo') or [None])[0]
+        if not from_repo:
+            raise MockResticError('Fatal: Please specify a source repository location (--from-repo or from-repository-file)\n')
+        # 与 ResticWrapper 一致：REST 源仓库的凭据写在 URL 中，模拟仓库按不含凭据的地址查找
+        from_repo = re.sub(r'://[^/@]*@', '://', from_repo)
+        ids = _positional(args)
+        with self._repositories_state() as repositories:
+            for key in (location, from_repo):
+                if key not in repositories:
+                    repositories[key] = self._new_repository()
+            source = [dict(s) for s in repositories[from_repo]['snapshots']
+                      if not ids or any(s['id'].startswith(i) for i in ids)]
+            copies = {s.get('original') for s in repositories[location]['snapshots']}
+            copies.update(s['id'] for s in repositories[location]['snapshots'])
+
+        for snapshot in source:
+            original = snapshot.get('original') or snapshot['id']
+            yield f"\nsnapshot {snapshot['short_id']} of {snapshot['paths']} at {snapshot['time']}\n"
+            if original in copies:
+                with self._repository(location) as repo:
+                    existing = next(s for s in repo['snapshots'] if original in (s.get('original'), s['id']))
+                yield f"skipping source snapshot {snapshot['short_id']}, was already copied to snapshot {existing['short_id']}\n"
+                continue
+            yield '  copy started, this may take a while...\n'
+            # 只传输仓库中的数据，速率与备份相同
+            total_bytes = sum(self._file_sizes(snapshot))
+            if self.rate > 0:
+                time.sleep(total_bytes / self.rate)
+            copy = dict(snapshot, original=original)
+            copy['id'] = uuid.uuid4().hex + uuid.uuid4().hex
+            copy['short_id'] = copy['id'][:8]
+            with self._repository(location) as repo:
+                repo['snapshots'].append(copy)
+            copies.add(original)
+            yield f"snapshot {copy['short_id']} saved\n"
+
+    def _cmd_ls(self, location, args):
+        positional = _positional(args)
+        with self._repository(location) as repo:
+            snapshot = self._find(repo, positional[0] if positional else None)
+            snapshot = dict(snapshot) if snapshot else None
+        if not snapshot:
+            raise MockResticError('Fatal: no matching ID found\n')
+
+        header = self._public(snapshot)
+        header.pop('summary', None)
+        yield json.dumps(dict(header, struct_type='snapshot', message_type='snapshot')) + '\n'
+        prefixes = positional[1:]
+        for node in self._nodes(snapshot):
+            if prefixes and not any(node['path'].startswith(p) for p in prefixes):
+                continue
+            yield json.dumps(node) + '\n'
+
+    def _nodes(self, snapshot):
+        """Return the simulated file tree of a snapshot as restic ls nodes"""
+        nodes = []
+        for path in snapshot['paths']:
+            nodes.append({
+                'name': path.rstrip('/').rsplit('/', 1)[-1], 'type': 'dir', 'path': path,
+                'uid': 0, 'gid': 0, 'mode': 2147484141, 'permissions': 'drwxr-xr-x',
+                'mtime': snapshot['time'], 'atime': snapshot['time'], 'ctime': snapshot['time'],
+                'struct_type': 'node', 'message_type': 'node',
+            })
+            for i, size in enumerate(self._file_sizes(snapshot)):
+                nodes.append({
+                    'name': f'file{i}.txt', 'type': 'file', 'path': f'{path}/file{i}.txt',
+                    'uid': 0, 'gid': 0, 'size': size, 'mode': 420,
+                    'permissions': '-rw-r--r--', 'mtime': snapshot['time'],
+                    'atime': snapshot['time'], 'ctime': snapshot['time'],
+                    'struct_type': 'node', 'message_type': 'node',
+                })
+        return nodes
+
+    @staticmethod
+    def _file_content(node, chunk_size=64 * 1024):
+        """Yield deterministic content for a simulated file node"""
+        pattern = (node['path'].encode() + b'\n') * (chunk_size // (len(node['path']) + 1) + 1)
+        remaining = node.get('size', 0)
+        while remaining > 0:
+            piece = pattern[:min(chunk_size, remaining)]
+            remaining -= len(piece)
+            yield piece
+
+    def _cmd_dump(self, location, args):
+        """Yield bytes chunks of a file, or of a tar/zip archive of a directory"""
+        positional = _positional(args)
+        archive = (_option(args, '--archive') or ['tar'])[0]
+        with self._repository(location) as repo:
+            snapshot = self._find(repo, positional[0] if positional else None)
+            snapshot = dict(snapshot) if snapshot else None
+        if not snapshot or len(positional) < 2:
+            raise MockResticError('Fatal: no matching ID found\n')
+
+        target = positional[1].rstrip('/') or '/'
+        nodes = self._nodes(snapshot)
+        node = next((n for n in nodes if n['path'] == target), None)
+        if not node:
+            raise MockResticError(f'Fatal: cannot dump file: path "{target}" not found in snapshot\n')
+
+        if node['type'] == 'file':
+            yield from self._file_content(node)
+            return
+
+        members = [n for n in nodes if n['type'] == 'file' and n['path'].startswith(target + '/')]
+        buffer = _ChunkBuffer()
+        if archive == 'zip':
+            with zipfile.ZipFile(buffer, 'w') as zf:
+                for member in members:
+                    with zf.open(member['path'].lstrip('/'), 'w') as fh:
+                        for piece in self._file_content(member):
+                            fh.write(piece)
+                            yield from buffer.drain()
+            yield from buffer.drain()
+        else:
+            with tarfile.open(fileobj=buffer, mode='w|') as tf:
+                for member in members:
+                    info = tarfile.TarInfo(member['path'].lstrip('/'))
+                    info.size = member['size']
+                    tf.addfile(info, _GeneratorReader(self._file_content(member)))
+                    yield from buffer.drain()
+            yield from buffer.drain()
+
+    def _cmd_stats(self, location, args):
+        ids = _positional(args)
+        mode = (_option(args, '--mode') or ['restore-size'])[0]
+        with self._repository(location) as repo:
+            snapshots = [s for s in repo['snapshots']
+                         if not ids or any(s['id'].startswith(i) for i in ids)]
+            snapshots = [dict(s) for s in snapshots]
+
+        if mode == 'raw-data':
+            added = sum(s.get('summary', {}).get('data_added', 0) for s in snapshots)
+            stats = {
+                'total_size': added // 2,
+                'total_uncompressed_size': added,
+                'compression_ratio': 2.0,
+                'compression_progress': 100,
+                'compression_space_saving': 50.0,
+                'total_blob_count': sum(s['file_count'] for s in snapshots),
+                'snapshots_count': len(snapshots),
+            }
+        else:
+            stats = {
+                'total_size': sum(sum(self._file_sizes(s)) for s in snapshots),
+                'total_file_count': sum(s['file_count'] for s in snapshots),
+                'snapshots_count': len(snapshots),
+            }
+        yield json.dumps(stats) + '\n'
+
+    def _cmd_forget(self, location, args):
+        ids = _positional(args)
+        with self._repository(location) as repo:
+            if not repo['snapshots']:
+                raise MockResticError('Fatal: no snapshots available\n')
+            removed = [s for s in repo['snapshots'] if any(s['id'].startswith(i) for i in ids)]
+            repo['snapshots'] = [s for s in repo['snapshots'] if s not in removed]
+        if '--json' in args:
+            yield json.dumps([{
+                'tags': None, 'host': '', 'paths': None, 'keep': [],
+                'remove': [self._public(s) for s in removed],
+            }]) + '\n'
+        else:
+            yield f'removed {len(removed)} snapshots\n'
+
+    def _cmd_restore(self, location, args):
+        positional = _positional(args)
+        with self._repository(location) as repo:
+            snapshot = self._find(repo, positional[0] if positional else None)
+            snapshot = dict(snapshot) if snapshot else None
+        if not snapshot:
+            raise MockResticError('Fatal: no matching ID found\n')
+
+        includes = _option(args, '--include')
+        files = [n for n in self._nodes(snapshot) if n['type'] == 'file'
+                 and (not includes or any(n['path'].startswith(i) for i in includes))]
+        sizes = [n['size'] for n in files]
+        total_bytes = sum(sizes)
+        start = time.monotonic()
+        duration = total_bytes / self.rate if self.rate > 0 else 0
+        elapsed = 0.0
+        while elapsed < duration:
+            time.sleep(min(self.status_interval, duration - elapsed))
+            elapsed = time.monotonic() - start
+            done = min(elapsed / duration, 1.0)
+            if '--json' in args:
+                yield json.dumps({
+                    'message_type': 'status', 'seconds_elapsed': int(elapsed),
+                    'percent_done': done, 'total_files': len(sizes),
+                    'files_restored': int(len(sizes) * done), 'files_skipped': 0,
+                    'total_bytes': total_bytes, 'bytes_restored': int(total_bytes * done),
+                    'bytes_skipped': 0,
+                }) + '\n'
+        if '--json' in args:
+            yield json.dumps({
+                'message_type': 'summary', 'seconds_elapsed': 0,
+                'total_files': len(sizes), 'files_restored': len(sizes), 'files_skipped': 0,
+                'total_bytes': total_bytes, 'bytes_restored': total_bytes, 'bytes_skipped': 0,
+            }) + '\n'
+        else:
+            yield f"restoring snapshot {snapshot['short_id']}\n"
+
+
+class _ChunkBuffer(io.RawIOBase):
+    """Write-only stream collecting archive output so it can be yielded in chunks"""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        chunks, self._chunks = self._chunks, []
+        return chunks
+
+
+class _GeneratorReader(io.RawIOBase):
+    """Readable stream over a generator of bytes chunks"""
+
+    def __init__(self, chunks):
+        super().__init__()
+        self._chunks = chunks
+        self._pending = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._pending:
+            try:
+                self._pending = next(self._chunks)
+            except StopIteration:
+                return 0
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        return size
+
+
+class MockResticError(Exception):
+    """Raised by simulated commands that fail"""
+
+    def __init__(self, stderr, returncode=1):
+        super().__init__(stderr.strip())
+        self.stderr = stderr
+        self.returncode = returncode
+
+
+_OPTIONS_WITH_VALUE = {
+    '--tag', '--target', '--include', '--exclude', '--host', '--path', '--mode',
+    '--keep-last', '--keep-hourly', '--keep-daily', '--keep-weekly', '--keep-monthly',
+    '--keep-yearly', '--archive', '--stdin-filename', '--files-from', '--compression',
+    '--pack-size', '--from-repo', '--exclude-larger-than', '--exclude-file',
+    '--limit-upload', '--limit-download', '--repository-version',
+}
+
+
+def _positional(args):
+    """Return positional arguments, skipping options and their values"""
+    result = []
+    skip = False
+    for index, arg in enumerate(args):
+        if skip:
+            skip = False
+        elif arg == '--':
+            # 与 restic 一致，-- 之后的参数都是位置参数
+            result.extend(args[index + 1:])
+            break
+        elif arg in _OPTIONS_WITH_VALUE:
+            skip = True
+        elif not arg.startswith('-'):
+            result.append(arg)
+    return result
+
+
+def _option(args, name):
+    return [args[i + 1] for i, arg in enumerate(args[:-1]) if arg == name]
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_mock_backend():
+    """Return the process-wide mock backend, creating it on first use"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = MockResticBackend.from_env()
+    return _backend
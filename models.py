@@ -1,6 +1,10 @@
 from datetime import datetime
+from sqlalchemy.dialects.postgresql import JSONB
 from app import db
 
+# JSON list column: JSONB on PostgreSQL (indexable with GIN), JSON text elsewhere
+JSONList = db.JSON(none_as_null=True).with_variant(JSONB(none_as_null=True), 'postgresql')
+
 class Repository(db.Model):
     """Model for Restic repositories"""
     id = db.Column(db.Integer, primary_key=True)
@@ -13,6 +17,9 @@ class Repository(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     last_check = db.Column(db.DateTime, nullable=True)
     status = db.Column(db.String(50), default='unknown')  # unknown, ok, error
+    capacity_bytes = db.Column(db.BigInteger, nullable=True)  # Space available to the repository (quota), optional
+    compression = db.Column(db.String(10), nullable=True)  # auto, max, off; NULL uses the restic default
+    pack_size = db.Column(db.Integer, nullable=True)  # Target pack size in MiB; NULL uses the restic default
     
     # Relationships
     backups = db.relationship('Backup', backref='repository', lazy=True, cascade="all, delete-orphan")
@@ -32,6 +39,10 @@ class Backup(db.Model):
     files_changed = db.Column(db.Integer, default=0)
     bytes_added = db.Column(db.BigInteger, default=0)
     snapshot_id = db.Column(db.String(100), nullable=True)
+    # 计划任务运行时根据历史记录预测的结束时间和 SLA 截止时间
+    predicted_end = db.Column(db.DateTime, nullable=True)
+    sla_deadline = db.Column(db.DateTime, nullable=True)
+    sla_status = db.Column(db.String(20), nullable=True)  # ok, over_budget, sla_missed
 
 class Snapshot(db.Model):
     """Model for Restic snapshots"""
@@ -40,9 +51,72 @@ class Snapshot(db.Model):
     snapshot_id = db.Column(db.String(100), nullable=False)  # Actual Restic snapshot ID
     created_at = db.Column(db.DateTime, nullable=False)
     hostname = db.Column(db.String(100), nullable=True)
-    paths = db.Column(db.Text, nullable=True)  # Stored as JSON string
-    tags = db.Column(db.Text, nullable=True)  # Stored as JSON string
-    size = db.Column(db.BigInteger, nullable=True)
+    paths = db.Column(JSONList, nullable=True)
+    tags = db.Column(JSONList, nullable=True)
+    size = db.Column(db.BigInteger, nullable=True)  # Restore size once enriched
+    file_count = db.Column(db.Integer, nullable=True)
+    data_added = db.Column(db.BigInteger, nullable=True)  # Unique data added by this snapshot
+    size_source = db.Column(db.String(20), nullable=True)  # summary, stats
+    enriched_at = db.Column(db.DateTime, nullable=True)
+    
+    __table_args__ = (
+        db.Index('ix_snapshot_repository_created', 'repository_id', 'created_at'),
+        db.Index('ix_snapshot_hostname_created', 'hostname', 'created_at'),
+        # GIN 索引只在 PostgreSQL 上创建，支持 tags @> '["db"]' 之类的包含查询
+        db.Index('ix_snapshot_tags', 'tags', postgresql_using='gin',
+                 postgresql_ops={'tags': 'jsonb_path_ops'}).ddl_if(dialect='postgresql'),
+        db.Index('ix_snapshot_paths', 'paths', postgresql_using='gin',
+                 postgresql_ops={'paths': 'jsonb_path_ops'}).ddl_if(dialect='postgresql'),
+    )
+
+class Restore(db.Model):
+    """Model for restore jobs, split into include-path partitions"""
+    id = db.Column(db.Integer, primary_key=True)
+    repository_id = db.Column(db.Integer, db.ForeignKey('repository.id'), nullable=False)
+    snapshot_id = db.Column(db.String(100), nullable=False)
+    target_path = db.Column(db.String(500), nullable=False)
+    include_paths = db.Column(db.Text, nullable=True)  # Stored as JSON string
+    partitions = db.Column(db.Text, nullable=True)  # JSON list of include-path lists
+    completed_partitions = db.Column(db.Text, nullable=True)  # JSON list of partition indexes
+    parallel = db.Column(db.Integer, default=1)
+    verify = db.Column(db.Boolean, default=False)
+    status = db.Column(db.String(50), default='queued')  # queued, running, completed, failed, interrupted
+    message = db.Column(db.Text, nullable=True)
+    total_bytes = db.Column(db.BigInteger, default=0)
+    bytes_restored = db.Column(db.BigInteger, default=0)
+    files_restored = db.Column(db.Integer, default=0)
+    start_time = db.Column(db.DateTime, default=datetime.utcnow)
+    end_time = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)  # Heartbeat while running
+    job_id = db.Column(db.String(32), nullable=True)  # In-memory job running this restore
+    
+    repository = db.relationship('Repository', backref=db.backref('restores', lazy=True, cascade="all, delete-orphan"))
+
+class RepositoryHealth(db.Model):
+    """Last result of the background health probe, kept out of the repository table"""
+    repository_id = db.Column(db.Integer, db.ForeignKey('repository.id'), primary_key=True)
+    status = db.Column(db.String(50), nullable=True)  # ok, error, timeout
+    message = db.Column(db.Text, nullable=True)
+    lock_count = db.Column(db.Integer, nullable=True)
+    latency_ms = db.Column(db.Integer, nullable=True)
+    checked_at = db.Column(db.DateTime, nullable=True)
+    
+    repository = db.relationship('Repository', backref=db.backref('health', uselist=False, lazy=True,
+                                                                  cascade="all, delete-orphan"))
+
+class RepositoryStats(db.Model):
+    """Cached output of restic stats for the snapshot set it was computed from"""
+    id = db.Column(db.Integer, primary_key=True)
+    repository_id = db.Column(db.Integer, db.ForeignKey('repository.id'), nullable=False)
+    mode = db.Column(db.String(50), nullable=False)  # restore-size, raw-data
+    snapshot_set_hash = db.Column(db.String(64), nullable=True)  # sha256 of the sorted snapshot IDs
+    snapshot_count = db.Column(db.Integer, default=0)
+    stats = db.Column(db.Text, nullable=True)  # Stored as JSON string
+    computed_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    repository = db.relationship('Repository', backref=db.backref('stats', lazy=True, cascade="all, delete-orphan"))
+    
+    __table_args__ = (db.UniqueConstraint('repository_id', 'mode', name='uq_repository_stats_mode'),)
 
 class ScheduledTask(db.Model):
     """Model for scheduled backup tasks"""
@@ -50,14 +124,81 @@ class ScheduledTask(db.Model):
     repository_id = db.Column(db.Integer, db.ForeignKey('repository.id'), nullable=False)
     name = db.Column(db.String(100), nullable=False)
     source_path = db.Column(db.String(500), nullable=False)
-    schedule_type = db.Column(db.String(50), nullable=False)  # cron, interval
+    schedule_type = db.Column(db.String(50), nullable=False)  # cron, interval, on_change
+    cron_expression = db.Column(db.String(100), nullable=True)
+    interval_seconds = db.Column(db.Integer, nullable=True)  # on_change: longest time between runs
+    enabled = db.Column(db.Boolean, default=True)
+    last_run = db.Column(db.DateTime, nullable=True)
+    next_run = db.Column(db.DateTime, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    tags = db.Column(JSONList, nullable=True)
+    catchup_policy = db.Column(db.String(10), nullable=True)  # skip, once, all; NULL uses the default
+    sla_deadline = db.Column(db.String(5), nullable=True)  # HH:MM (UTC) by which each run should finish
+    change_detection = db.Column(db.String(20), nullable=True)  # skip, files_from; NULL scans the whole source
+    # on_change 任务：两次运行的最短间隔、变更平息的等待时间（秒）、触发备份的变更字节数；NULL 使用默认值
+    min_interval = db.Column(db.Integer, nullable=True)
+    debounce_seconds = db.Column(db.Integer, nullable=True)
+    change_threshold = db.Column(db.BigInteger, nullable=True)
+    # 排除规则：任务自身的模式、引用的排除文件库条目，以及 restic 的排除选项
+    exclude_patterns = db.Column(JSONList, nullable=True)
+    exclude_file_ids = db.Column(JSONList, nullable=True)
+    exclude_caches = db.Column(db.Boolean, default=False)
+    exclude_larger_than = db.Column(db.String(20), nullable=True)  # e.g. 2G
+    one_file_system = db.Column(db.Boolean, default=False)
+    # 压缩模式与包大小，为空时使用仓库的设置
+    compression = db.Column(db.String(10), nullable=True)
+    pack_size = db.Column(db.Integer, nullable=True)
+    # 备份前后运行的 shell 命令，以及从命令标准输出备份时的命令和快照中的文件名
+    pre_hook = db.Column(db.Text, nullable=True)
+    post_hook = db.Column(db.Text, nullable=True)
+    hook_timeout = db.Column(db.Integer, nullable=True)  # Seconds; NULL uses RESTICLY_HOOK_TIMEOUT
+    stdin_command = db.Column(db.Text, nullable=True)  # e.g. pg_dump -Fc mydb; backs up its stdout instead of source_path
+    stdin_filename = db.Column(db.String(255), nullable=True)
+
+class ExcludeFile(db.Model):
+    """Model for reusable exclude pattern lists shared between tasks"""
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), unique=True, nullable=False)
+    description = db.Column(db.Text, nullable=True)
+    patterns = db.Column(db.Text, nullable=False, default='')  # One pattern per line, as in a restic exclude file
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class Replication(db.Model):
+    """Model for replication jobs copying snapshots between two repositories with restic copy"""
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), unique=True, nullable=False)
+    source_repository_id = db.Column(db.Integer, db.ForeignKey('repository.id'), nullable=False)
+    destination_repository_id = db.Column(db.Integer, db.ForeignKey('repository.id'), nullable=False)
+    schedule_type = db.Column(db.String(50), default='manual')  # manual, cron, interval
     cron_expression = db.Column(db.String(100), nullable=True)
     interval_seconds = db.Column(db.Integer, nullable=True)
     enabled = db.Column(db.Boolean, default=True)
+    limit_upload = db.Column(db.Integer, nullable=True)  # KiB/s, restic --limit-upload
+    limit_download = db.Column(db.Integer, nullable=True)  # KiB/s, restic --limit-download
+    status = db.Column(db.String(50), default='idle')  # idle, running, completed, failed
+    message = db.Column(db.Text, nullable=True)
     last_run = db.Column(db.DateTime, nullable=True)
     next_run = db.Column(db.DateTime, nullable=True)
+    job_id = db.Column(db.String(32), nullable=True)  # In-memory job of the current or last run
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    tags = db.Column(db.Text, nullable=True)  # Stored as JSON string
+    
+    source_repository = db.relationship('Repository', foreign_keys=[source_repository_id],
+                                        backref=db.backref('replications_out', lazy=True, cascade="all, delete-orphan"))
+    destination_repository = db.relationship('Repository', foreign_keys=[destination_repository_id],
+                                             backref=db.backref('replications_in', lazy=True, cascade="all, delete-orphan"))
+    copied_snapshots = db.relationship('ReplicatedSnapshot', backref='replication', lazy=True,
+                                       cascade="all, delete-orphan")
+
+class ReplicatedSnapshot(db.Model):
+    """A source snapshot already copied by a replication, so later runs skip it"""
+    id = db.Column(db.Integer, primary_key=True)
+    replication_id = db.Column(db.Integer, db.ForeignKey('replication.id'), nullable=False)
+    source_snapshot_id = db.Column(db.String(100), nullable=False)
+    destination_snapshot_id = db.Column(db.String(100), nullable=True)
+    copied_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (db.UniqueConstraint('replication_id', 'source_snapshot_id', name='uq_replicated_snapshot'),)
 
 class Settings(db.Model):
     """Model for application settings"""
@@ -65,3 +206,9 @@ class Settings(db.Model):
     key = db.Column(db.String(100), unique=True, nullable=False)
     value = db.Column(db.Text, nullable=True)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class TableVersion(db.Model):
+    """Change counter per table, bumped in the same transaction as every write"""
+    table_name = db.Column(db.String(64), primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -0,0 +1,438 @@
+import os
+import heapq
+import hashlib
+import itertools
+import logging
+import threading
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlparse
+
+from apscheduler.triggers.base import BaseTrigger
+
+logger = logging.getLogger(__name__)
+
+# 每个任务确定性抖动的最大秒数
+SCHEDULE_JITTER = int(os.environ.get('RESTICLY_SCHEDULE_JITTER', '300'))
+# 同一备份目标（REST 服务器、SFTP 主机、本地磁盘）同时运行的计划备份数量
+TARGET_CONCURRENCY = int(os.environ.get('RESTICLY_TARGET_CONCURRENCY', '2'))
+# 计划推迟的上限（秒），超过时截断并记录警告
+MAX_OFFSET = int(os.environ.get('RESTICLY_SCHEDULE_MAX_OFFSET', str(4 * 3600)))
+# 没有历史记录时假定的备份时长（秒）
+DEFAULT_DURATION = int(os.environ.get('RESTICLY_DEFAULT_BACKUP_DURATION', '600'))
+# 估算时长使用的最近成功备份数量
+HISTORY_SIZE = 10
+# 读取历史时最多扫描的备份记录数
+HISTORY_ROWS = 5000
+# 至少有这么多次历史记录才判断是否超出预算
+MIN_SAMPLES = 3
+# 运行时间超过 p90 的该倍数（且至少比 p50 多 OVERRUN_MIN_SLACK 秒）视为超出预算
+OVERRUN_FACTOR = float(os.environ.get('RESTICLY_OVERRUN_FACTOR', '1.5'))
+OVERRUN_MIN_SLACK = 60
+# 相邻两次备份之间预留的间隔（秒）
+GAP = 30
+
+
+class OffsetTrigger(BaseTrigger):
+    """
+    Wrap a trigger and fire a fixed number of seconds after it
+
+    Used to shift cron schedules like `0 2 * * *` by a per-task offset
+    without changing the expression the user entered.
+
+    Args:
+        trigger: Base trigger (e.g. CronTrigger)
+        offset (int): Delay in seconds added to every fire time
+    """
+
+    def __init__(self, trigger, offset):
+        self.trigger = trigger
+        self.offset = int(offset)
+
+    def get_next_fire_time(self, previous_fire_time, now):
+        delta = timedelta(seconds=self.offset)
+        base = self.trigger.get_next_fire_time(
+            previous_fire_time - delta if previous_fire_time else None,
+            now - delta
+        )
+        return base + delta if base else None
+
+    def __str__(self):
+        return f'{self.trigger}+{self.offset}s'
+
+    def __repr__(self):
+        return f'<OffsetTrigger ({self.trigger!r}, offset={self.offset})>'
+
+
+def task_jitter(task_id, spread=SCHEDULE_JITTER):
+    """Deterministic delay in [0, spread) seconds derived from the task id"""
+    if spread <= 0:
+        return 0
+    digest = hashlib.sha1(f'resticly-task-{task_id}'.encode('utf-8')).hexdigest()
+    return int(digest[:8], 16) % spread
+
+
+def target_of(repository):
+    """
+    Return the key of the backend a repository is stored on
+
+    Repositories on the same REST server or SFTP/S3 host compete for the
+    same network and disks; all local repositories are treated as one
+    target.
+
+    Args:
+        repository: Repository object
+
+    Returns:
+        str: Target key, e.g. 'rest:backup.example.com:8000' or 'local'
+    """
+    location = repository.location or ''
+    if repository.repo_type == 'rest-server':
+        return f'rest:{urlparse(location).netloc or location}'
+    scheme, sep, rest = location.partition(':')
+    if sep and scheme in ('sftp', 's3', 'rest', 'swift', 'b2', 'azure', 'gs', 'rclone'):
+        if '//' in rest:
+            host = urlparse(rest if '://' in rest else 'x:' + rest).netloc
+        else:
+            host = rest.split(':', 1)[0].split('/', 1)[0]
+        return f'{scheme}:{host.rsplit("@", 1)[-1]}'
+    return 'local'
+
+
+def _percentile(values, q):
+    """Nearest-rank percentile of a non-empty list"""
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(q * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+class DurationEstimate:
+    """
+    Duration and size distribution of the recent backups of a task
+
+    Args:
+        durations (list): Durations in seconds, newest first
+        sizes (list): Bytes added by the same backups
+    """
+
+    def __init__(self, durations, sizes):
+        self.samples = len(durations)
+        self.p50 = _percentile(durations, 0.5)
+        self.p90 = _percentile(durations, 0.9)
+        self.bytes_p50 = _percentile(sizes, 0.5) if sizes else None
+        self.bytes_p90 = _percentile(sizes, 0.9) if sizes else None
+
+    @property
+    def budget(self):
+        """Seconds after which a run is considered over its predicted budget"""
+        return max(self.p90 * OVERRUN_FACTOR, self.p50 + OVERRUN_MIN_SLACK)
+
+    @property
+    def reliable(self):
+        return self.samples >= MIN_SAMPLES
+
+    def to_dict(self):
+        return {
+            'samples': self.samples,
+            'duration_p50': round(self.p50),
+            'duration_p90': round(self.p90),
+            'budget': round(self.budget),
+            'bytes_p50': self.bytes_p50,
+            'bytes_p90': self.bytes_p90
+        }
+
+
+def backup_history(session=None, repository_id=None, source_path=None):
+    """
+    Learn the duration and size distribution of each (repository, source path)
+    from its last HISTORY_SIZE completed backups
+
+    Args:
+        session: SQLAlchemy session, defaults to db.session
+        repository_id (int): Only learn the backups of this repository
+        source_path (str): Only learn the backups of this source path
+
+    Returns:
+        dict: Mapping of (repository_id, source_path) to DurationEstimate
+    """
+    from app import db
+    from models import Backup
+
+    session = session or db.session
+    query = session.query(Backup.repository_id, Backup.source_path, Backup.start_time,
+                          Backup.end_time, Backup.bytes_added) \
+        .filter(Backup.status == 'completed', Backup.end_time.isnot(None))
+    if repository_id is not None:
+        query = query.filter(Backup.repository_id == repository_id)
+    if source_path is not None:
+        query = query.filter(Backup.source_path == source_path)
+    limit = HISTORY_SIZE if source_path is not None else HISTORY_ROWS
+    rows = query.order_by(Backup.start_time.desc()).limit(limit).all()
+
+    durations = defaultdict(list)
+    sizes = defaultdict(list)
+    for repository_id, source_path, start_time, end_time, bytes_added in rows:
+        key = (repository_id, source_path)
+        if len(durations[key]) < HISTORY_SIZE and start_time:
+            durations[key].append(max(0.0, (end_time - start_time).total_seconds()))
+            if bytes_added is not None:
+                sizes[key].append(bytes_added)
+    return {key: DurationEstimate(values, sizes[key]) for key, values in durations.items()}
+
+
+def estimate_for(history, repository_id, source_path):
+    """Return the DurationEstimate of a task, or None without history"""
+    return history.get((repository_id, source_path))
+
+
+def sla_deadline_after(deadline, start):
+    """
+    Return the first occurrence of an 'HH:MM' (UTC) deadline after a time
+
+    Args:
+        deadline (str): Time of day, e.g. '06:00'
+        start (datetime): Naive or aware UTC datetime
+
+    Returns:
+        datetime: Deadline with the same tz-awareness as start, or None
+    """
+    if not deadline:
+        return None
+    hour, minute = parse_deadline(deadline)
+    candidate = start.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if candidate <= start:
+        candidate += timedelta(days=1)
+    return candidate
+
+
+def sla_status_of(when, budget_end, deadline):
+    """
+    Classify a run that is still going or ended at a given time
+
+    Returns:
+        str: 'sla_missed', 'over_budget', 'ok', or None without prediction or SLA
+    """
+    if deadline and when > deadline:
+        return 'sla_missed'
+    if budget_end and when > budget_end:
+        return 'over_budget'
+    if deadline or budget_end:
+        return 'ok'
+    return None
+
+
+def parse_deadline(value):
+    """
+    Parse an 'HH:MM' deadline
+
+    Raises:
+        ValueError: If the value is not a valid time of day
+    """
+    hour, sep, minute = str(value).partition(':')
+    if not sep or not hour.isdigit() or not minute.isdigit() or int(hour) > 23 or int(minute) > 59:
+        raise ValueError(f"Invalid SLA deadline '{value}', expected HH:MM")
+    return int(hour), int(minute)
+
+
+def _next_base_run(task, now):
+    """Return the next run of a task as entered (without offset) and the period until the one after"""
+    from apscheduler.triggers.cron import CronTrigger
+
+    if task.schedule_type == 'cron' and task.cron_expression:
+        trigger = CronTrigger.from_crontab(task.cron_expression)
+        base = trigger.get_next_fire_time(None, now)
+        following = trigger.get_next_fire_time(base, base + timedelta(seconds=1)) if base else None
+        period = (following - base).total_seconds() if following else None
+        return base, period
+    if task.schedule_type == 'interval' and task.interval_seconds and task.next_run:
+        # 间隔任务的相位由创建时间决定，使用调度器保存的下次运行时间
+        base = task.next_run.replace(tzinfo=timezone.utc)
+        while base < now:
+            base += timedelta(seconds=task.interval_seconds)
+        return base, task.interval_seconds
+    return None, None
+
+
+def plan(tasks, history, now=None, concurrency=TARGET_CONCURRENCY):
+    """
+    Spread the next runs of cron tasks over time
+
+    Tasks are taken in order of their cron fire time, longest predicted
+    duration first among tasks firing together, and placed, per
+    target, on `concurrency` lanes: a task starts at its fire time plus
+    its deterministic jitter, or when a lane of its target becomes free,
+    whichever is later. Lanes are kept busy for the task's historical
+    duration. The resulting delay is the task's offset; it is capped at
+    MAX_OFFSET and at half the task's period so frequent tasks are never
+    pushed into their next run.
+
+    Interval tasks are not shifted (they are already spread by their
+    creation time) but occupy their target's lanes.
+
+    Args:
+        tasks (list): Enabled ScheduledTask objects, with their repository loaded
+        history (dict): Output of backup_history()
+        now (datetime): Aware reference time, defaults to now
+        concurrency (int): Lanes per target
+
+    Returns:
+        list: Plan entries (dicts) sorted by planned start
+    """
+    now = now or datetime.now(timezone.utc)
+    candidates = []
+    for task in tasks:
+        try:
+            base, period = _next_base_run(task, now)
+        except Exception as e:
+            logger.warning(f"Skipping task {task.id} in plan: {str(e)}")
+            continue
+        if base is None:
+            continue
+        candidates.append((base, period, task))
+
+    lanes = defaultdict(lambda: [now] * max(1, concurrency))
+    entries = []
+    def predicted(task):
+        estimate = estimate_for(history, task.repository_id, task.source_path)
+        return estimate.p50 if estimate else DEFAULT_DURATION
+
+    # 同时触发的任务中最长的先开始（LPT），整个窗口结束得最早
+    for base, period, task in sorted(candidates, key=lambda c: (c[0], -predicted(c[2]), c[2].id)):
+        target = target_of(task.repository)
+        estimate = estimate_for(history, task.repository_id, task.source_path)
+        duration = predicted(task)
+        target_lanes = lanes[target]
+        lane = min(range(len(target_lanes)), key=lambda i: target_lanes[i])
+
+        if task.schedule_type == 'cron':
+            limit = min(MAX_OFFSET, int(period // 2)) if period else MAX_OFFSET
+            start = max(base + timedelta(seconds=min(task_jitter(task.id), limit)), target_lanes[lane])
+            offset = int((start - base).total_seconds())
+            if offset > limit:
+                logger.warning(f"Task {task.id} would be delayed by {offset}s, capped to {limit}s")
+                offset = limit
+                start = base + timedelta(seconds=offset)
+        else:
+            start, offset = base, 0
+
+        end = start + timedelta(seconds=duration)
+        target_lanes[lane] = max(target_lanes[lane], end + timedelta(seconds=GAP))
+        end_p90 = start + timedelta(seconds=estimate.p90 if estimate else duration)
+        deadline = sla_deadline_after(task.sla_deadline, base)
+        entries.append({
+            'task_id': task.id,
+            'name': task.name,
+            'repository_id': task.repository_id,
+            'repository_name': task.repository.name,
+            'target': target,
+            'schedule_type': task.schedule_type,
+            'scheduled_time': base,
+            'offset': offset,
+            'planned_start': start,
+            'predicted_duration': round(duration),
+            'predicted_end': end,
+            'predicted_end_p90': end_p90,
+            'history': estimate.to_dict() if estimate else None,
+            'sla_deadline': deadline,
+            'sla_at_risk': bool(deadline and end_p90 > deadline)
+        })
+    entries.sort(key=lambda entry: (entry['planned_start'], entry['task_id']))
+    return entries
+
+
+class TargetSlots:
+    """
+    Counting semaphore admitting the longest predicted backup first
+
+    Backups waiting for a busy target are admitted in order of their
+    predicted duration (longest first, then arrival), so long runs are not
+    left to start at the end of the window.
+
+    Args:
+        limit (int): Backups allowed to run at once
+    """
+
+    def __init__(self, limit):
+        self.limit = max(1, limit)
+        self.running = 0
+        self._waiting = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+
+    def acquire(self, priority=0):
+        with self._cond:
+            entry = (-priority, next(self._seq))
+            heapq.heappush(self._waiting, entry)
+            while self.running >= self.limit or self._waiting[0] != entry:
+                self._cond.wait()
+            heapq.heappop(self._waiting)
+            self.running += 1
+            # 队首已变化，唤醒其他等待者检查是否轮到自己
+            self._cond.notify_all()
+
+    def release(self):
+        with self._cond:
+            self.running -= 1
+            self._cond.notify_all()
+
+    @property
+    def waiting(self):
+        with self._cond:
+            return len(self._waiting)
+
+
+class SchedulePlanner:
+    """Keeps the current offsets of the scheduler process and guards per-target concurrency"""
+
+    def __init__(self, concurrency=TARGET_CONCURRENCY):
+        self.concurrency = concurrency
+        self._offsets = {}
+        self._lock = threading.Lock()
+        self._slots = {}
+
+    def offset(self, task_id):
+        with self._lock:
+            return self._offsets.get(task_id, 0)
+
+    def replan(self, tasks, history, now=None):
+        """
+        Recompute the offsets of all tasks
+
+        Returns:
+            list: The plan entries
+        """
+        entries = plan(tasks, history, now=now, concurrency=self.concurrency)
+        with self._lock:
+            self._offsets = {entry['task_id']: entry['offset'] for entry in entries}
+        return entries
+
+    def _slot(self, target):
+        with self._lock:
+            if target not in self._slots:
+                self._slots[target] = TargetSlots(self.concurrency)
+            return self._slots[target]
+
+    def acquire(self, repository, predicted_duration=0):
+        """
+        Wait for a free slot on the repository's target
+
+        The plan only predicts durations; this keeps the limit when backups
+        run longer than expected. Waiting backups with the longest
+        predicted duration are admitted first.
+
+        Args:
+            repository: Repository object
+            predicted_duration (float): Predicted run time in seconds
+
+        Returns:
+            callable: Releases the slot
+        """
+        target = target_of(repository)
+        slot = self._slot(target)
+        if slot.running >= slot.limit:
+            logger.info(f"Waiting for a free backup slot on {target}")
+        slot.acquire(priority=predicted_duration)
+        return slot.release
+
+
+schedule_planner = SchedulePlanner()
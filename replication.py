@@ -0,0 +1,241 @@
+import os
+import logging
+import threading
+from datetime import datetime
+
+from flask import current_app
+
+from jobs import job_pool
+from events import event_broker
+from restic_wrapper import ResticWrapper
+
+logger = logging.getLogger(__name__)
+
+# 复制作业未设置限速时使用的默认上传/下载限速（KiB/s，0 表示不限速）
+DEFAULT_LIMIT_UPLOAD = int(os.environ.get('RESTICLY_COPY_LIMIT_UPLOAD', '0'))
+DEFAULT_LIMIT_DOWNLOAD = int(os.environ.get('RESTICLY_COPY_LIMIT_DOWNLOAD', '0'))
+# 复制作业的计划类型
+SCHEDULE_TYPES = ('manual', 'cron', 'interval')
+
+# 正在运行的复制作业，同一对仓库同时只运行一次
+_running = set()
+_running_lock = threading.Lock()
+
+
+def _snapshot_key(snapshot):
+    """Identity of a snapshot across copies: restic keeps the first snapshot's ID as 'original'"""
+    return snapshot.get('original') or snapshot['id']
+
+
+def pending_snapshots(source_snapshots, copied_ids):
+    """
+    Return the source snapshots a replication still has to copy
+
+    Args:
+        source_snapshots (list): Output of restic snapshots --json on the source
+        copied_ids (set): Source snapshot IDs recorded as copied
+
+    Returns:
+        list: Snapshots not copied yet, oldest first
+    """
+    pending = [s for s in source_snapshots if s['id'] not in copied_ids]
+    return sorted(pending, key=lambda s: s.get('time', ''))
+
+
+def start_replication(replication, job_class=None):
+    """
+    Queue a run of a replication on the job pool
+
+    Must be called inside an application context. Runs of different
+    replications are independent jobs, so pairs of repositories copy in
+    parallel up to the size of the pool.
+
+    Args:
+        replication: Replication object
+        job_class (str): Job class, defaults to 'manual'
+
+    Returns:
+        Job: The queued job
+    """
+    return job_pool.submit(
+        'copy',
+        run_replication,
+        current_app._get_current_object(),
+        replication.id,
+        repository_id=replication.destination_repository_id,
+        description=f'Replicate {replication.name}',
+        job_class=job_class or 'manual'
+    )
+
+
+def run_replication(job, app, replication_id, acquire_slots=None):
+    """
+    Copy the snapshots a replication has not copied yet
+
+    Only restic copy runs: snapshot data is read from the source
+    repository, never from the paths that were backed up. Source snapshots
+    are compared with the ones recorded in the database and only the
+    missing IDs are passed to restic. Afterwards the destination is listed
+    and every copy is recorded by the ID of its original, including copies
+    made outside Resticly, so they are not copied again.
+
+    Args:
+        job (Job): The job running this replication
+        app: Flask application
+        replication_id (int): ID of the Replication
+        acquire_slots (callable): Optional function taking the source and
+            destination repositories and returning a release callable, used
+            by scheduled runs to respect the per-target concurrency
+
+    Returns:
+        dict: status, message and number of snapshots copied
+    """
+    from app import db
+    from models import Replication, ReplicatedSnapshot
+    from enrichment import snapshot_enricher, apply_summary
+    from stats import schedule_stats_refresh
+
+    with _running_lock:
+        if replication_id in _running:
+            logger.info(f"Replication {replication_id} is already running, skipping")
+            return {'status': 'skipped', 'message': 'Replication is already running', 'copied': 0}
+        _running.add(replication_id)
+
+    release = None
+    try:
+        with app.app_context():
+            replication = Replication.query.get(replication_id)
+            if not replication:
+                logger.error(f"Replication {replication_id} not found")
+                return None
+            source_repo = replication.source_repository
+            destination_repo = replication.destination_repository
+
+            replication.status = 'running'
+            replication.message = None
+            replication.last_run = datetime.utcnow()
+            replication.job_id = job.id if job else None
+            db.session.commit()
+            event_broker.publish('replication.started', id=replication_id, job_id=replication.job_id)
+
+            try:
+                source = ResticWrapper.from_repository(source_repo)
+                destination = ResticWrapper.from_repository(destination_repo)
+
+                success, snapshots = source.list_snapshots()
+                if not success:
+                    raise RuntimeError(f'Cannot list snapshots of {source_repo.name}')
+                copied_ids = {row[0] for row in db.session.query(ReplicatedSnapshot.source_snapshot_id)
+                              .filter_by(replication_id=replication_id).all()}
+                pending = pending_snapshots(snapshots, copied_ids)
+
+                result = {'copied': [], 'skipped': [], 'message': 'Destination is up to date'}
+                success = True
+                if pending:
+                    if acquire_slots:
+                        release = acquire_slots(source_repo, destination_repo)
+                    progress = {'snapshots_total': len(pending), 'snapshots_copied': 0,
+                                'snapshots_skipped': 0, 'current': None}
+
+                    def on_progress(event):
+                        if event['event'] == 'started':
+                            progress['current'] = event['snapshot_id']
+                        elif event['event'] == 'saved':
+                            progress['snapshots_copied'] += 1
+                        else:
+                            progress['snapshots_skipped'] += 1
+                        if job:
+                            job.update_progress(**progress)
+                        event_broker.publish('replication.progress', id=replication_id,
+                                             job_id=replication.job_id, **progress)
+
+                    success, result = destination.copy_snapshots(
+                        source,
+                        [s['id'] for s in pending],
+                        on_progress=on_progress,
+                        limit_upload=replication.limit_upload or DEFAULT_LIMIT_UPLOAD or None,
+                        limit_download=replication.limit_download or DEFAULT_LIMIT_DOWNLOAD or None
+                    )
+
+                    # 失败时已保存的快照同样记录，下次只复制剩余部分
+                    new_copies = _record_copies(db, replication_id, pending, destination)
+                    added = _add_destination_snapshots(db, destination_repo.id, new_copies, apply_summary)
+                    db.session.commit()
+                    if new_copies:
+                        schedule_stats_refresh(destination_repo.id)
+                    if added:
+                        snapshot_enricher.enqueue(destination_repo.id)
+
+                replication.status = 'completed' if success else 'failed'
+                replication.message = result['message']
+                db.session.commit()
+                logger.info(f"Replication {replication_id} finished with status {replication.status}: "
+                            f"{replication.message}")
+                event_broker.publish('replication.finished', id=replication_id, job_id=replication.job_id,
+                                     status=replication.status, message=replication.message,
+                                     copied=len(result['copied']))
+                return {'status': replication.status, 'message': replication.message,
+                        'copied': len(result['copied'])}
+
+            except Exception as e:
+                logger.error(f"Error running replication {replication_id}: {str(e)}")
+                db.session.rollback()
+                replication = Replication.query.get(replication_id)
+                if replication:
+                    replication.status = 'failed'
+                    replication.message = str(e)
+                    db.session.commit()
+                event_broker.publish('replication.finished', id=replication_id, status='failed', message=str(e))
+                raise
+    finally:
+        if release:
+            release()
+        with _running_lock:
+            _running.discard(replication_id)
+
+
+def _record_copies(db, replication_id, pending, destination):
+    """
+    Record which pending source snapshots now have a copy in the destination
+
+    Returns:
+        list: (source snapshot, destination snapshot) pairs newly recorded
+    """
+    from models import ReplicatedSnapshot
+
+    success, destination_snapshots = destination.list_snapshots()
+    if not success:
+        logger.warning(f"Cannot list the destination snapshots of replication {replication_id}")
+        return []
+    copies = {_snapshot_key(s): s for s in destination_snapshots}
+    recorded = []
+    for snapshot in pending:
+        copy = copies.get(_snapshot_key(snapshot))
+        if copy:
+            db.session.add(ReplicatedSnapshot(replication_id=replication_id, source_snapshot_id=snapshot['id'],
+                                              destination_snapshot_id=copy['id']))
+            recorded.append((snapshot, copy))
+    return recorded
+
+
+def _add_destination_snapshots(db, repository_id, copies, apply_summary):
+    """Add the new copies to the snapshot table of the destination; returns True if any needs enrichment"""
+    from models import Snapshot
+
+    known = {row[0] for row in db.session.query(Snapshot.snapshot_id).filter_by(repository_id=repository_id).all()}
+    needs_enrichment = False
+    for _, copy in copies:
+        if copy['id'] in known:
+            continue
+        snapshot = Snapshot(
+            repository_id=repository_id,
+            snapshot_id=copy['id'],
+            created_at=datetime.fromisoformat(copy.get('time', '').replace('Z', '+00:00')),
+            hostname=copy.get('hostname', ''),
+            paths=copy.get('paths', []),
+            tags=copy.get('tags', [])
+        )
+        if not apply_summary(snapshot, copy.get('summary')):
+            needs_enrichment = True
+        db.session.add(snapshot)
+    return needs_enrichment
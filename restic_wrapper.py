@@ -1,11 +1,19 @@
 import os
+import re
+import sys
 import json
+import queue
+import asyncio
 import logging
+import posixpath
+import threading
 import subprocess
 import tempfile
 import shutil
-import uuid
-from datetime import datetime
+from urllib.parse import quote
+
+from mock_restic import get_mock_backend, MockResticError
+from jobs import current_job
 
 logger = logging.getLogger(__name__)
 
@@ -14,10 +22,342 @@ MOCK_RESTIC = not shutil.which('restic')
 if MOCK_RESTIC:
     logger.warning("Restic not found, using mock implementation")
 
+# restic dump 流式输出时每次读取的字节数
+DUMP_CHUNK_SIZE = 64 * 1024
+# 同时运行的 restic 进程上限（每个进程）
+MAX_RESTIC_PROCESSES = int(os.environ.get('RESTICLY_RESTIC_CONCURRENCY', '64'))
+# 流式读取时单行输出的最大长度
+STREAM_LINE_LIMIT = 16 * 1024 * 1024
+# restic copy 的文本输出（没有 --json 支持）
+COPY_STARTED = re.compile(r'^snapshot ([0-9a-f]+) of ')
+COPY_SAVED = re.compile(r'^snapshot ([0-9a-f]+) saved')
+COPY_SKIPPED = re.compile(r'^skipping source snapshot ([0-9a-f]+), was already copied to snapshot ([0-9a-f]+)')
+# restic --compression 的取值（需要 v2 仓库格式）及 --pack-size 的范围（MiB）
+COMPRESSION_MODES = ('auto', 'max', 'off')
+PACK_SIZE_MIN = 4
+PACK_SIZE_MAX = 128
+# 从命令的标准输出备份时，是否由 restic 自己运行命令（--stdin-from-command，需要 restic 0.17+）；
+# 关闭时由 Resticly 启动命令并通过管道传给 restic --stdin
+STDIN_FROM_COMMAND = os.environ.get('RESTICLY_STDIN_FROM_COMMAND', '1').lower() not in ('0', 'false', 'no')
+# 错误信息中保留的命令 stderr 长度
+STDERR_TAIL = 4096
+
+_STREAM_END = object()
+
+
+def validate_write_options(compression=None, pack_size=None):
+    """
+    Validate compression and pack size settings
+    
+    Args:
+        compression (str): 'auto', 'max', 'off' or None for the restic default
+        pack_size (int): Target pack size in MiB or None for the restic default
+        
+    Raises:
+        ValueError: If a value is not accepted by restic
+    """
+    if compression is not None and compression not in COMPRESSION_MODES:
+        raise ValueError(f"Invalid compression '{compression}'. Must be one of {', '.join(COMPRESSION_MODES)}")
+    if pack_size is not None:
+        if not isinstance(pack_size, int) or isinstance(pack_size, bool) \
+                or not PACK_SIZE_MIN <= pack_size <= PACK_SIZE_MAX:
+            raise ValueError(f'pack_size must be an integer between {PACK_SIZE_MIN} and {PACK_SIZE_MAX} (MiB)')
+
+
+class ResticRunner:
+    """
+    Run restic processes on a single asyncio event loop thread
+
+    Waiting processes cost no thread: the loop reads stdout and stderr of
+    every running process concurrently, and a semaphore limits how many
+    run at the same time. Synchronous callers use run_sync() and stream(),
+    which block only the calling thread; asynchronous code (e.g. probing
+    many repositories at once) awaits run() through call().
+    """
+
+    def __init__(self, max_processes=MAX_RESTIC_PROCESSES):
+        self.max_processes = max_processes
+        self._loop = None
+        self._semaphore = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _get_loop(self):
+        # 事件循环线程在首次使用时启动；fork 出的子进程中需要重新创建
+        with self._lock:
+            if self._loop is None or self._pid != os.getpid():
+                loop = asyncio.new_event_loop()
+                if sys.version_info < (3, 12) and hasattr(os, 'pidfd_open'):
+                    # Python 3.11 默认每个子进程占用一个等待线程，改用 pidfd 由事件循环等待
+                    watcher = asyncio.PidfdChildWatcher()
+                    watcher.attach_loop(loop)
+                    asyncio.set_child_watcher(watcher)
+                self._semaphore = asyncio.Semaphore(self.max_processes)
+                threading.Thread(target=loop.run_forever, name='ResticRunner', daemon=True).start()
+                self._loop, self._pid = loop, os.getpid()
+            return self._loop
+
+    def call(self, coro):
+        """Run a coroutine on the runner loop and wait for its result"""
+        return asyncio.run_coroutine_threadsafe(coro, self._get_loop()).result()
+
+    async def run(self, command, env=None, timeout=None, on_line=None, stdin=None):
+        """
+        Run a restic command and collect its output
+
+        Args:
+            command (list): Command and arguments as a list
+            env (dict): Environment of the process
+            timeout (float): Optional timeout in seconds, not counting the
+                time spent waiting for a free process slot
+            on_line (callable): When given, called with each stdout line as
+                it arrives (on the loop thread) instead of collecting stdout
+            stdin: Optional file object or descriptor to use as the standard
+                input of the process (e.g. for backup --stdin)
+
+        Returns:
+            tuple: (returncode (int), stdout (str), stderr (str))
+
+        Raises:
+            subprocess.TimeoutExpired: When the timeout was exceeded; the
+                process has been killed
+        """
+        async with self._semaphore:
+            process = await asyncio.create_subprocess_exec(
+                *command,
+                env=env,
+                stdin=stdin if stdin is not None else asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                limit=STREAM_LINE_LIMIT
+            )
+            # 登记到调用方的作业上，作业被抢占时可以暂停或中断该进程
+            job = current_job.get()
+            if job is not None:
+                job.attach_process(process.pid)
+
+            async def read_stdout():
+                if on_line is None:
+                    return await process.stdout.read()
+                while True:
+                    line = await process.stdout.readline()
+                    if not line:
+                        return b''
+                    on_line(line.decode(errors='replace'))
+
+            try:
+                # 同时读取 stdout 和 stderr，避免任一管道写满导致进程阻塞
+                stdout, stderr, returncode = await asyncio.wait_for(
+                    asyncio.gather(read_stdout(), process.stderr.read(), process.wait()),
+                    timeout
+                )
+            except asyncio.TimeoutError:
+                process.kill()
+                await process.wait()
+                raise subprocess.TimeoutExpired(command, timeout)
+            except BaseException:
+                if process.returncode is None:
+                    process.kill()
+                    await process.wait()
+                raise
+            finally:
+                if job is not None:
+                    job.detach_process(process.pid)
+            return returncode, stdout.decode(errors='replace'), stderr.decode(errors='replace')
+
+    def run_sync(self, command, env=None, timeout=None, stdin=None):
+        """Blocking version of run() for synchronous callers"""
+        return self.call(self.run(command, env=env, timeout=timeout, stdin=stdin))
+
+    def stream(self, command, env=None, stdin=None):
+        """
+        Run a restic command and yield its stdout lines in the calling thread
+
+        Lines are handed over through a queue, so callbacks run by the
+        consumer keep its thread (and application context).
+
+        Returns:
+            generator: Yields lines; its return value is (returncode, stderr)
+        """
+        lines = queue.Queue()
+
+        def on_line(line):
+            lines.put(line)
+
+        future = asyncio.run_coroutine_threadsafe(
+            self.run(command, env=env, on_line=on_line, stdin=stdin), self._get_loop())
+        future.add_done_callback(lambda _: lines.put(_STREAM_END))
+        try:
+            while True:
+                line = lines.get()
+                if line is _STREAM_END:
+                    break
+                yield line
+            returncode, _, stderr = future.result()
+            return returncode, stderr
+        finally:
+            # 消费者提前退出时终止进程
+            future.cancel()
+
+    def stream_bytes(self, command, env=None, chunk_size=DUMP_CHUNK_SIZE):
+        """
+        Run a restic command and yield its raw stdout in chunks in the calling thread
+
+        Each chunk is read on the loop only when the consumer asks for the
+        next one, so at most one chunk is held in memory and a slow consumer
+        slows restic down instead of buffering its output.
+
+        Returns:
+            generator: Yields bytes; raises RuntimeError when restic fails
+        """
+        async def start():
+            await self._semaphore.acquire()
+            try:
+                return await asyncio.create_subprocess_exec(
+                    *command,
+                    env=env,
+                    stdin=asyncio.subprocess.DEVNULL,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE
+                )
+            except BaseException:
+                self._semaphore.release()
+                raise
+
+        async def finish(process):
+            try:
+                if process.returncode is None:
+                    process.kill()
+                await process.wait()
+            finally:
+                self._semaphore.release()
+
+        loop = self._get_loop()
+        process = self.call(start())
+        # stderr 同时在事件循环中读取，避免管道写满导致进程阻塞
+        stderr = asyncio.run_coroutine_threadsafe(process.stderr.read(), loop)
+        job = current_job.get()
+        if job is not None:
+            job.attach_process(process.pid)
+        try:
+            while True:
+                chunk = self.call(process.stdout.read(chunk_size))
+                if not chunk:
+                    break
+                yield chunk
+            returncode = self.call(process.wait())
+            if returncode != 0:
+                message = stderr.result().decode(errors='replace')
+                raise RuntimeError(message or f"{' '.join(command[:2])} exited with code {returncode}")
+        finally:
+            # 消费者提前退出时终止进程
+            self.call(finish(process))
+            if job is not None:
+                job.detach_process(process.pid)
+
+    def spawn(self, command, stdout):
+        """
+        Start a helper process on the loop, e.g. the command whose output is
+        piped into backup --stdin
+
+        It does not take a process slot: the restic process reading its
+        output needs one, and the helper would otherwise block it.
+
+        Args:
+            command (list): Command and arguments as a list
+            stdout: File descriptor the process writes to
+
+        Returns:
+            tuple: (pid (int), concurrent.futures.Future resolving to
+                (returncode, stderr tail) once the process has exited)
+
+        Raises:
+            OSError: When the command cannot be started
+        """
+        async def start():
+            return await asyncio.create_subprocess_exec(
+                *command,
+                stdin=asyncio.subprocess.DEVNULL,
+                stdout=stdout,
+                stderr=asyncio.subprocess.PIPE
+            )
+
+        async def wait(process):
+            tail = b''
+            while True:
+                chunk = await process.stderr.read(STDERR_TAIL)
+                if not chunk:
+                    break
+                tail = (tail + chunk)[-STDERR_TAIL:]
+            return await process.wait(), tail
+
+        process = self.call(start())
+        return process.pid, asyncio.run_coroutine_threadsafe(wait(process), self._get_loop())
+
+
+restic_runner = ResticRunner()
+
+class DumpStream:
+    """Iterator over the output of `restic dump` that never holds more than one chunk"""
+    
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = []
+    
+    def prefetch(self):
+        """
+        Read the first chunk so that startup errors surface before a response is sent
+        
+        Returns:
+            str: Error message, or None if the dump started successfully
+        """
+        try:
+            self._buffer.append(next(self._chunks))
+        except StopIteration:
+            pass
+        except Exception as e:
+            self.close()
+            return str(e).strip() or 'Failed to dump snapshot path'
+        return None
+    
+    def __iter__(self):
+        try:
+            while self._buffer:
+                yield self._buffer.pop(0)
+            yield from self._chunks
+        finally:
+            self.close()
+    
+    def iter_range(self, start, stop):
+        """
+        Yield only bytes [start, stop) of the stream
+        
+        restic dump cannot seek, so leading bytes are read and discarded;
+        the process is stopped as soon as the range has been sent.
+        """
+        position = 0
+        try:
+            for chunk in self:
+                end = position + len(chunk)
+                if end > start:
+                    yield chunk[max(0, start - position):min(len(chunk), stop - position)]
+                position = end
+                if position >= stop:
+                    break
+        finally:
+            self.close()
+    
+    def close(self):
+        # 关闭生成器时由 restic_runner 终止仍在运行的进程
+        close = getattr(self._chunks, 'close', None)
+        if close:
+            close()
+
 class ResticWrapper:
     """Wrapper for Restic command-line operations"""
     
-    def __init__(self, repository_path, password, repo_type='local', rest_user=None, rest_pass=None):
+    def __init__(self, repository_path, password, repo_type='local', rest_user=None, rest_pass=None,
+                 compression=None, pack_size=None):
         """
         Initialize with repository path and password
         
@@ -27,281 +367,286 @@ class ResticWrapper:
             repo_type (str): Repository type ('local', 'rest-server', etc.)
             rest_user (str, optional): Username for REST server authentication
             rest_pass (str, optional): Password for REST server authentication
+            compression (str, optional): Default --compression for commands
+                writing data (backup, copy, prune)
+            pack_size (int, optional): Default --pack-size in MiB for the same commands
         """
         self.repository_path = repository_path
         self.password = password
         self.repo_type = repo_type
         self.rest_user = rest_user
         self.rest_pass = rest_pass
+        self.compression = compression
+        self.pack_size = pack_size
+    
+    @classmethod
+    def from_repository(cls, repository):
+        """
+        Create a wrapper for a Repository model instance
+        
+        Args:
+            repository: Repository object
+            
+        Returns:
+            ResticWrapper: Wrapper configured for the repository type
+        """
+        write_options = {'compression': repository.compression, 'pack_size': repository.pack_size}
+        if repository.repo_type == 'rest-server':
+            return cls(
+                repository.location,
+                repository.password,
+                repo_type='rest-server',
+                rest_user=repository.rest_user,
+                rest_pass=repository.rest_pass,
+                **write_options
+            )
+        return cls(repository.location, repository.password, repo_type=repository.repo_type, **write_options)
     
-    def _execute_command(self, command, env=None):
+    def _write_options(self, compression=None, pack_size=None):
+        """Return the --compression/--pack-size flags, falling back to the repository defaults"""
+        compression = compression or self.compression
+        pack_size = pack_size or self.pack_size
+        options = []
+        if compression:
+            options.extend(['--compression', compression])
+        if pack_size:
+            options.extend(['--pack-size', str(int(pack_size))])
+        return options
+    
+    def _build_env(self, env=None):
+        """
+        Build the environment for a restic process
+
+        Args:
+            env (dict): Additional environment variables
+
+        Returns:
+            dict: Environment including repository location and credentials
+        """
+        command_env = os.environ.copy()
+        
+        # Set repository path based on type
+        if self.repo_type == 'rest-server':
+            # For REST server, the format is 'rest:https://hostname:8000/'
+            command_env['RESTIC_REPOSITORY'] = f'rest:{self.repository_path}'
+            
+            # Set REST server credentials if provided
+            if self.rest_user and self.rest_pass:
+                command_env['RESTIC_REST_USER'] = self.rest_user
+                command_env['RESTIC_REST_PASS'] = self.rest_pass
+        else:
+            # For local or other repository types
+            command_env['RESTIC_REPOSITORY'] = self.repository_path
+        
+        command_env['RESTIC_PASSWORD'] = self.password
+        
+        # Add additional environment variables
+        if env:
+            command_env.update(env)
+        return command_env
+    
+    def _execute_command(self, command, env=None, timeout=None, stdin=None):
         """
         Execute a restic command and return the result
         
         Args:
             command (list): Command and arguments as a list
             env (dict): Additional environment variables
+            timeout (float): Optional timeout in seconds; the process is killed when exceeded
+            stdin: Optional file object to use as the standard input of restic
             
         Returns:
             tuple: (success (bool), output (dict))
         """
-        # 如果使用模拟实现
-        if MOCK_RESTIC:
-            return self._mock_execute_command(command)
-        
         try:
-            # Prepare environment
-            command_env = os.environ.copy()
-            
-            # Set repository path based on type
-            if self.repo_type == 'rest-server':
-                # For REST server, the format is 'rest:https://hostname:8000/'
-                command_env['RESTIC_REPOSITORY'] = f'rest:{self.repository_path}'
-                
-                # Set REST server credentials if provided
-                if self.rest_user and self.rest_pass:
-                    command_env['RESTIC_REST_USER'] = self.rest_user
-                    command_env['RESTIC_REST_PASS'] = self.rest_pass
-            else:
-                # For local or other repository types
-                command_env['RESTIC_REPOSITORY'] = self.repository_path
-            
-            command_env['RESTIC_PASSWORD'] = self.password
-            
-            # Add additional environment variables
-            if env:
-                command_env.update(env)
+            command_env = self._build_env(env)
             
             # Execute the command
             logger.debug(f"Executing command: {' '.join(command)}")
             
-            result = subprocess.run(
-                command,
-                env=command_env,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                check=False  # We'll handle errors ourselves
-            )
-            
-            # Log the result
-            logger.debug(f"Command exit code: {result.returncode}")
-            logger.debug(f"Command stdout: {result.stdout}")
-            logger.debug(f"Command stderr: {result.stderr}")
+            if MOCK_RESTIC:
+                # 使用进程级模拟仓库，输出格式与真实restic一致
+                returncode, stdout, stderr = get_mock_backend().run(command, command_env, stdin=stdin)
+            else:
+                returncode, stdout, stderr = restic_runner.run_sync(command, command_env, timeout=timeout,
+                                                                    stdin=stdin)
+            return self._command_result(returncode, stdout, stderr)
+        
+        except subprocess.TimeoutExpired:
+            logger.warning(f"Command timed out after {timeout}s: {' '.join(command)}")
+            return False, {'message': f'Command timed out after {timeout} seconds', 'timeout': True}
+        except Exception as e:
+            logger.error(f"Error executing command: {str(e)}")
+            return False, {'message': str(e)}
+    
+    async def _execute_command_async(self, command, env=None, timeout=None):
+        """
+        Coroutine version of _execute_command, to be run on restic_runner
+        
+        Returns:
+            tuple: (success (bool), output (dict))
+        """
+        try:
+            command_env = self._build_env(env)
+            logger.debug(f"Executing command: {' '.join(command)}")
             
-            # Parse output if it's JSON
-            if result.returncode == 0:
-                try:
-                    if result.stdout and result.stdout.strip():
-                        if result.stdout.strip()[0] == '{' or result.stdout.strip()[0] == '[':
-                            output = json.loads(result.stdout)
-                        else:
-                            output = {'message': result.stdout}
-                    else:
-                        output = {'message': 'Command executed successfully'}
-                except json.JSONDecodeError:
-                    output = {'message': result.stdout}
-                
-                return True, output
+            if MOCK_RESTIC:
+                # 模拟仓库是同步实现，放到线程池中执行以免阻塞事件循环
+                returncode, stdout, stderr = await asyncio.get_running_loop().run_in_executor(
+                    None, get_mock_backend().run, command, command_env)
             else:
-                return False, {'message': result.stderr or 'Command failed without error message'}
+                returncode, stdout, stderr = await restic_runner.run(command, command_env, timeout=timeout)
+            return self._command_result(returncode, stdout, stderr)
         
+        except subprocess.TimeoutExpired:
+            logger.warning(f"Command timed out after {timeout}s: {' '.join(command)}")
+            return False, {'message': f'Command timed out after {timeout} seconds', 'timeout': True}
         except Exception as e:
             logger.error(f"Error executing command: {str(e)}")
             return False, {'message': str(e)}
+    
+    def _command_result(self, returncode, stdout, stderr):
+        # Log the result
+        logger.debug(f"Command exit code: {returncode}")
+        logger.debug(f"Command stdout: {stdout}")
+        logger.debug(f"Command stderr: {stderr}")
+        
+        # Parse output if it's JSON
+        if returncode == 0:
+            return True, self._parse_output(stdout)
+        else:
+            return False, {'message': stderr or 'Command failed without error message'}
             
-    def _mock_execute_command(self, command):
+    def _execute_streaming(self, command, on_message=None, env=None, on_text=None, stdin=None):
         """
-        模拟执行restic命令（用于Replit环境测试）
+        Execute a restic command printing NDJSON and handle messages as they arrive
         
         Args:
-            command (list): 命令和参数列表
+            command (list): Command and arguments as a list (must include --json)
+            on_message (callable): Optional callback receiving each decoded message
+            env (dict): Additional environment variables
+            on_text (callable): Optional callback receiving each line that is
+                not JSON, for commands without JSON output such as copy
+            stdin: Optional file object to use as the standard input of restic
             
         Returns:
-            tuple: (success (bool), output (dict or list))
-        """
-        logger.debug(f"Mocking restic command: {' '.join(command)}")
-        
-        # 初始化模拟存储（如果尚未存在）
-        from datetime import timedelta
-        
-        if not hasattr(self, '_mock_storage'):
-            # 预先添加几个示例快照
-            self._mock_storage = {
-                'initialized': True,  # 默认将仓库设置为已初始化
-                'snapshots': [
-                    {
-                        'id': 'abcdef1234567890abcdef1234567890',
-                        'short_id': 'abcdef12',
-                        'time': datetime.utcnow().replace(microsecond=0).isoformat() + 'Z',
-                        'hostname': 'mock-host',
-                        'paths': ['/tmp/data1'],
-                        'tags': ['test', 'sample'],
-                        'size': 1024 * 1024 * 10  # 10MB
-                    },
-                    {
-                        'id': 'bcdef1234567890abcdef1234567890',
-                        'short_id': 'bcdef123',
-                        'time': (datetime.utcnow() - timedelta(days=1)).replace(microsecond=0).isoformat() + 'Z',
-                        'hostname': 'mock-host',
-                        'paths': ['/tmp/data2'],
-                        'tags': ['test'],
-                        'size': 1024 * 1024 * 5  # 5MB
-                    }
-                ],
-                'stats': {
-                    'total_size': 1024 * 1024 * 15,  # 15MB
-                    'total_file_count': 20
-                }
-            }
+            tuple: (success (bool), output (dict)) where output is the summary
+                message on success or {'message': error} on failure
+        """
+        summary = {}
         
-        # 基于命令类型分发到不同的模拟处理函数
-        if len(command) > 1:
-            cmd = command[1]  # restic命令的第二个参数是子命令
-            
-            if cmd == 'init':
-                return self._mock_init()
-            elif cmd == 'backup':
-                source_path = command[3] if len(command) > 3 else "/mock/data"
-                tags = []
-                if '--tag' in command:
-                    idx = command.index('--tag')
-                    if idx + 1 < len(command):
-                        tags.append(command[idx + 1])
-                return self._mock_backup(source_path, tags)
-            elif cmd == 'snapshots':
-                return self._mock_list_snapshots()
-            elif cmd == 'check':
-                return self._mock_check()
-            elif cmd == 'stats':
-                return self._mock_stats()
-            elif cmd == 'forget':
-                return self._mock_forget()
-            elif cmd == 'restore':
-                return self._mock_restore()
-            elif cmd == 'ls':
-                snapshot_id = command[3] if len(command) > 3 else None
-                return self._mock_ls(snapshot_id)
-        
-        # 默认情况下返回成功
-        return True, {'message': 'Mock command executed successfully'}
-        
-    def _mock_init(self):
-        """模拟初始化仓库"""
-        self._mock_storage['initialized'] = True
-        return True, {'message': 'Repository has been initialized successfully'}
-        
-    def _mock_check(self):
-        """模拟检查仓库"""
-        if not self._mock_storage['initialized']:
-            # 如果未初始化，则自动初始化仓库
-            self._mock_storage['initialized'] = True
-            logger.info("Auto-initializing mock repository for testing")
-            return True, {'message': 'Repository initialized and integrity check passed'}
-        return True, {'message': 'Repository integrity check successful'}
-        
-    def _mock_backup(self, source_path, tags=None):
-        """模拟创建备份"""
-        if not self._mock_storage['initialized']:
-            # 如果未初始化，则自动初始化仓库
-            self._mock_storage['initialized'] = True
-            logger.info("Auto-initializing mock repository before backup")
-            
-        # 生成一个随机的快照ID
-        snapshot_id = str(uuid.uuid4())
-        
-        # 创建一个模拟的快照
-        snapshot = {
-            'id': snapshot_id,
-            'short_id': snapshot_id[:8],
-            'time': datetime.utcnow().isoformat(),
-            'hostname': 'replit-mock',
-            'paths': [source_path],
-            'tags': tags or []
-        }
-        
-        # 模拟备份统计信息
-        backup_stats = {
-            'files_new': 10,
-            'files_changed': 5,
-            'files_unmodified': 2,
-            'dirs_new': 3,
-            'dirs_changed': 1, 
-            'dirs_unmodified': 0,
-            'bytes_added': 1024 * 1024 * 10,  # 10MB (与routes.py中字段名匹配)
-            'data_added': 1024 * 1024 * 10,   # 保留与restic输出格式一致的字段名
-            'total_files_processed': 17,
-            'total_bytes_processed': 1024 * 1024 * 15,  # 15MB
-            'snapshot_id': snapshot_id
-        }
-        
-        # 更新模拟存储
-        self._mock_storage['snapshots'].append(snapshot)
-        self._mock_storage['stats']['total_size'] += backup_stats['data_added']
-        self._mock_storage['stats']['total_file_count'] += backup_stats['files_new']
-        
-        return True, backup_stats
-        
-    def _mock_list_snapshots(self):
-        """模拟列出快照"""
-        if not self._mock_storage['initialized']:
-            # 如果未初始化，则自动初始化仓库
-            self._mock_storage['initialized'] = True
-            logger.info("Auto-initializing mock repository before listing snapshots")
-            
-        return True, self._mock_storage['snapshots']
+        def handle(line):
+            nonlocal summary
+            line = line.strip()
+            if not line:
+                return
+            try:
+                message = json.loads(line)
+            except json.JSONDecodeError:
+                if on_text:
+                    on_text(line)
+                else:
+                    logger.debug(f"Ignoring non-JSON output: {line}")
+                return
+            if isinstance(message, dict) and message.get('message_type') == 'summary':
+                summary = message
+            if on_message:
+                on_message(message)
         
-    def _mock_ls(self, snapshot_id):
-        """模拟列出快照内容"""
-        if not self._mock_storage['initialized']:
-            return False, {'message': 'Repository not initialized'}
-            
-        # 查找匹配的快照
-        for snapshot in self._mock_storage['snapshots']:
-            if snapshot['id'].startswith(snapshot_id):
-                # 生成模拟的文件列表
-                files = [
-                    {'path': f'{path}/file{i}.txt', 'size': 1024 * (i + 1)} 
-                    for i in range(5) 
-                    for path in snapshot['paths']
-                ]
-                return True, files
-                
-        return False, {'message': 'Snapshot not found'}
-        
-    def _mock_restore(self):
-        """模拟恢复快照"""
-        if not self._mock_storage['initialized'] or not self._mock_storage['snapshots']:
-            return False, {'message': 'Repository not initialized or no snapshots available'}
+        try:
+            command_env = self._build_env(env)
+            logger.debug(f"Executing command: {' '.join(command)}")
             
-        return True, {'message': 'Snapshot restored successfully'}
-        
-    def _mock_forget(self):
-        """模拟删除快照"""
-        if not self._mock_storage['initialized'] or not self._mock_storage['snapshots']:
-            return False, {'message': 'Repository not initialized or no snapshots available'}
+            if MOCK_RESTIC:
+                try:
+                    for line in get_mock_backend().stream(command, command_env, stdin=stdin):
+                        handle(line)
+                except MockResticError as e:
+                    return False, {'message': e.stderr}
+                return True, summary or {'message': 'Command executed successfully'}
             
-        # 简单地移除最旧的快照
-        if self._mock_storage['snapshots']:
-            self._mock_storage['snapshots'].pop(0)
+            # 每行到达时立即解析，不缓存完整输出
+            lines = restic_runner.stream(command, command_env, stdin=stdin)
+            try:
+                while True:
+                    try:
+                        handle(next(lines))
+                    except StopIteration as stop:
+                        returncode, stderr = stop.value
+                        break
+            finally:
+                lines.close()
             
-        return True, {'message': 'Snapshots forgotten successfully'}
+            logger.debug(f"Command exit code: {returncode}")
+            if returncode != 0:
+                return False, {'message': stderr or 'Command failed without error message'}
+            return True, summary or {'message': 'Command executed successfully'}
         
-    def _mock_stats(self):
-        """模拟获取统计信息"""
-        if not self._mock_storage['initialized']:
-            return False, {'message': 'Repository not initialized'}
-            
-        return True, self._mock_storage['stats']
+        except Exception as e:
+            logger.error(f"Error executing command: {str(e)}")
+            return False, {'message': str(e)}
     
+    @staticmethod
+    def _parse_output(stdout):
+        """
+        Parse restic stdout into JSON objects
+
+        Most commands print a single JSON document with --json, but backup,
+        restore and ls print NDJSON (one message per line). NDJSON output is
+        returned as a list of the decoded messages.
+
+        Args:
+            stdout (str): Raw command output
+
+        Returns:
+            dict or list: Parsed output, or {'message': stdout} for plain text
+        """
+        text = stdout.strip() if stdout else ''
+        if not text:
+            return {'message': 'Command executed successfully'}
+        if text[0] not in '{[':
+            return {'message': stdout}
+
+        try:
+            return json.loads(text)
+        except json.JSONDecodeError:
+            pass
+
+        # NDJSON：逐行解析
+        messages = []
+        for line in text.splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                messages.append(json.loads(line))
+            except json.JSONDecodeError:
+                return {'message': stdout}
+        return messages
+
+    @staticmethod
+    def _find_message(output, message_type):
+        """Return the last NDJSON message of the given type, or the output itself if it is a dict"""
+        if isinstance(output, dict):
+            return output
+        for message in reversed(output or []):
+            if isinstance(message, dict) and message.get('message_type') == message_type:
+                return message
+        return {}
+
     def init_repository(self):
         """
         Initialize a new repository
         
+        When a compression mode is configured the repository is created
+        with format version 2, which is required for compression.
+        
         Returns:
             tuple: (success (bool), message (str))
         """
         command = ['restic', 'init']
+        if self.compression:
+            command.extend(['--repository-version', '2'])
         success, output = self._execute_command(command)
         
         if success:
@@ -324,39 +669,276 @@ class ResticWrapper:
         else:
             return False, output.get('message', 'Repository check failed')
     
-    def create_backup(self, source_path, tags=None):
+    def probe(self, timeout=10):
+        """
+        Cheaply check that the repository is reachable and count its locks
+        
+        Uses `restic cat config` and `restic list locks` with --no-lock, so
+        no lock file is created and no pack data is read.
+        
+        Args:
+            timeout (float): Timeout in seconds for each command
+            
+        Returns:
+            tuple: (success (bool), result (dict)) with 'message' and 'lock_count'
+        """
+        return restic_runner.call(self.probe_async(timeout=timeout))
+    
+    async def probe_async(self, timeout=10):
+        """Coroutine version of probe(), to be run on restic_runner"""
+        success, output = await self._execute_command_async(['restic', 'cat', 'config', '--no-lock'], timeout=timeout)
+        if not success:
+            return False, {
+                'message': output.get('message', 'Repository is not reachable'),
+                'timeout': output.get('timeout', False),
+                'lock_count': None
+            }
+        
+        success, output = await self._execute_command_async(['restic', 'list', 'locks', '--no-lock'], timeout=timeout)
+        lock_count = None
+        if success:
+            text = output.get('message', '') if isinstance(output, dict) else ''
+            lock_count = 0 if text == 'Command executed successfully' else len(text.split())
+        return True, {'message': 'Repository is reachable', 'timeout': False, 'lock_count': lock_count}
+    
+    def create_backup(self, source_path, tags=None, on_progress=None, files_from=None,
+                      excludes=None, exclude_caches=False, exclude_larger_than=None, one_file_system=False,
+                      dry_run=False, compression=None, pack_size=None, stdin_command=None, stdin_filename=None):
         """
         Create a new backup
         
         Args:
             source_path (str): Path to backup
             tags (list): Optional list of tags
+            on_progress (callable): Optional callback receiving restic status messages
+            files_from (list): Back up only these paths (passed with --files-from)
+                instead of source_path
+            excludes (list): Exclude patterns (passed with --exclude-file)
+            exclude_caches (bool): Skip directories containing a CACHEDIR.TAG file
+            exclude_larger_than (str): Skip files larger than this size, e.g. '2G'
+            one_file_system (bool): Do not cross file system boundaries
+            dry_run (bool): Read and chunk the source without writing to
+                the repository (--dry-run); the summary reports the data
+                a real backup would add
+            compression (str): --compression for this backup, overriding
+                the repository default
+            pack_size (int): --pack-size in MiB for this backup, overriding
+                the repository default
+            stdin_command (list): Back up the standard output of this
+                command (e.g. pg_dump) instead of source_path, streamed
+                into restic without touching the disk. With
+                RESTICLY_STDIN_FROM_COMMAND restic runs the command itself
+                (--stdin-from-command), otherwise it is piped to --stdin.
+                A failing command fails the backup and its stderr is part
+                of the error message. files_from and the exclude options
+                do not apply.
+            stdin_filename (str): File name of the stream in the snapshot
+                (--stdin-filename)
             
         Returns:
             tuple: (success (bool), output (dict))
         """
-        command = ['restic', 'backup', '--json', source_path]
+        command = ['restic', 'backup', '--json'] + self._write_options(compression, pack_size)
+        if dry_run:
+            command.append('--dry-run')
+        if stdin_command:
+            return self._backup_stdin(command, stdin_command, stdin_filename, tags, on_progress)
+        list_files = []
+        if files_from:
+            # 路径列表可能很长，通过文件传给 restic
+            list_files.append(self._write_list_file('resticly-files-', files_from))
+            command.extend(['--files-from', list_files[-1]])
+        else:
+            command.append(source_path)
         
         if tags:
             for tag in tags:
                 command.extend(['--tag', tag])
         
-        success, output = self._execute_command(command)
+        if excludes:
+            list_files.append(self._write_list_file('resticly-excludes-', excludes))
+            command.extend(['--exclude-file', list_files[-1]])
+        if exclude_caches:
+            command.append('--exclude-caches')
+        if exclude_larger_than:
+            command.extend(['--exclude-larger-than', str(exclude_larger_than)])
+        if one_file_system:
+            command.append('--one-file-system')
+        
+        try:
+            if on_progress:
+                def on_message(message):
+                    if message.get('message_type') == 'status':
+                        on_progress(message)
+                success, output = self._execute_streaming(command, on_message=on_message)
+            else:
+                success, output = self._execute_command(command)
+        finally:
+            for list_file in list_files:
+                os.unlink(list_file)
         
+        return self._backup_result(success, output, on_progress)
+    
+    def _backup_result(self, success, output, on_progress):
+        """Turn the output of restic backup --json into the result of create_backup"""
         if success:
-            # Extract relevant information from the output
+            # restic --json 输出NDJSON，最后一条summary消息包含统计信息
+            summary = output if on_progress else self._find_message(output, 'summary')
             result = {
                 'message': 'Backup completed successfully',
-                'snapshot_id': output.get('snapshot_id', ''),
-                'files_new': output.get('files_new', 0),
-                'files_changed': output.get('files_changed', 0),
-                'bytes_added': output.get('bytes_added', 0),
-                'hostname': output.get('hostname', '')
+                'snapshot_id': summary.get('snapshot_id', ''),
+                'files_new': summary.get('files_new', 0),
+                'files_changed': summary.get('files_changed', 0),
+                'bytes_added': summary.get('bytes_added', summary.get('data_added', 0)),
+                'hostname': summary.get('hostname', ''),
+                'data_added': summary.get('data_added'),
+                'data_added_packed': summary.get('data_added_packed'),
+                'total_files_processed': summary.get('total_files_processed'),
+                'total_bytes_processed': summary.get('total_bytes_processed')
             }
             return True, result
         else:
             return False, {'message': output.get('message', 'Backup failed')}
     
+    def _backup_stdin(self, command, stdin_command, stdin_filename, tags, on_progress):
+        """Back up the standard output of a command, see create_backup"""
+        for tag in tags or []:
+            command.extend(['--tag', tag])
+        if stdin_filename:
+            command.extend(['--stdin-filename', stdin_filename])
+        
+        def run(stdin=None):
+            if on_progress:
+                def on_message(message):
+                    if message.get('message_type') == 'status':
+                        on_progress(message)
+                return self._execute_streaming(command, on_message=on_message, stdin=stdin)
+            return self._execute_command(command, stdin=stdin)
+        
+        if STDIN_FROM_COMMAND:
+            # restic 运行命令，命令失败时不保存快照，命令的 stderr 会出现在 restic 的 stderr 中
+            command.extend(['--stdin-from-command', '--'] + list(stdin_command))
+            return self._backup_result(*run(), on_progress)
+        
+        command.append('--stdin')
+        read_fd, write_fd = os.pipe()
+        try:
+            # 命令同样在 restic_runner 的事件循环中等待，不占用线程
+            producer_pid, producer = restic_runner.spawn(stdin_command, stdout=write_fd)
+        except OSError as e:
+            os.close(read_fd)
+            return False, {'message': f'Cannot run {stdin_command[0]}: {str(e)}'}
+        finally:
+            os.close(write_fd)
+        job = current_job.get()
+        if job is not None:
+            job.attach_process(producer_pid)
+        reader = os.fdopen(read_fd, 'rb')
+        try:
+            success, output = run(reader)
+        finally:
+            # 关闭读端：restic 提前退出时命令写入管道会收到 SIGPIPE 而退出，不会一直阻塞
+            reader.close()
+            returncode, producer_stderr = producer.result()
+            if job is not None:
+                job.detach_process(producer_pid)
+            producer_stderr = producer_stderr.decode(errors='replace').strip()
+        
+        success, result = self._backup_result(success, output, on_progress)
+        if returncode == 0:
+            return success, result
+        
+        # 命令失败时 restic 已把截断的数据保存为快照，删除该快照
+        error = f'{stdin_command[0]} exited with code {returncode}'
+        if producer_stderr:
+            error += f': {producer_stderr}'
+        if success and result.get('snapshot_id'):
+            forgotten, message = self.forget_snapshots([result['snapshot_id']])
+            if not forgotten:
+                logger.warning(f"Cannot forget incomplete snapshot {result['snapshot_id']}: {message}")
+        else:
+            error += f"; restic: {result['message']}"
+        return False, {'message': error}
+    
+    @staticmethod
+    def _write_list_file(prefix, lines):
+        """Write one entry per line to a temporary file and return its path"""
+        with tempfile.NamedTemporaryFile('w', prefix=prefix, suffix='.txt',
+                                         delete=False, encoding='utf-8') as fh:
+            fh.write(''.join(f'{line}\n' for line in lines))
+        return fh.name
+    
+    def _from_repository_env(self):
+        """Environment selecting this repository as the source of restic copy"""
+        if self.repo_type == 'rest-server':
+            location = self.repository_path
+            if self.rest_user and self.rest_pass:
+                # RESTIC_REST_USER/PASS 只能配置一个仓库，源仓库的凭据放在 URL 中
+                scheme, _, rest = location.partition('://')
+                location = f"{scheme}://{quote(self.rest_user, safe='')}:{quote(self.rest_pass, safe='')}@{rest}"
+            location = f'rest:{location}'
+        else:
+            location = self.repository_path
+        return {'RESTIC_FROM_REPOSITORY': location, 'RESTIC_FROM_PASSWORD': self.password}
+    
+    def copy_snapshots(self, source, snapshot_ids=None, on_progress=None, limit_upload=None, limit_download=None):
+        """
+        Copy snapshots from another repository into this one (restic copy)
+        
+        Only repository data is transferred; the paths the snapshots were
+        taken from are not read. restic skips snapshots that already have a
+        copy in this repository.
+        
+        Args:
+            source (ResticWrapper): Wrapper of the source repository
+            snapshot_ids (list): Snapshots to copy, all snapshots when empty
+            on_progress (callable): Optional callback receiving a dict per
+                snapshot event: {'event': 'started'|'saved'|'skipped',
+                'snapshot_id': ..., 'copy_id': ...}
+            limit_upload (int): Upload limit in KiB/s (--limit-upload)
+            limit_download (int): Download limit in KiB/s (--limit-download)
+            
+        Returns:
+            tuple: (success (bool), output (dict)) with the copied and skipped
+                (source id, copy id) pairs as printed by restic (short ids)
+        """
+        # --verbose=2 才会输出跳过已复制快照的信息
+        command = ['restic', 'copy', '--verbose=2'] + self._write_options()
+        if limit_upload:
+            command.extend(['--limit-upload', str(int(limit_upload))])
+        if limit_download:
+            command.extend(['--limit-download', str(int(limit_download))])
+        command.extend(snapshot_ids or [])
+        
+        copied = []
+        skipped = []
+        current = None
+        
+        def on_text(line):
+            nonlocal current
+            started, saved, skip = (pattern.match(line) for pattern in (COPY_STARTED, COPY_SAVED, COPY_SKIPPED))
+            if started:
+                current = started.group(1)
+                event = {'event': 'started', 'snapshot_id': current}
+            elif saved:
+                copied.append((current, saved.group(1)))
+                event = {'event': 'saved', 'snapshot_id': current, 'copy_id': saved.group(1)}
+            elif skip:
+                skipped.append((skip.group(1), skip.group(2)))
+                event = {'event': 'skipped', 'snapshot_id': skip.group(1), 'copy_id': skip.group(2)}
+            else:
+                return
+            if on_progress:
+                on_progress(event)
+        
+        success, output = self._execute_streaming(command, env=source._from_repository_env(), on_text=on_text)
+        result = {'copied': copied, 'skipped': skipped}
+        if success:
+            result['message'] = f'Copied {len(copied)} snapshots, {len(skipped)} already present'
+        else:
+            result['message'] = output.get('message', 'Copy failed')
+        return success, result
+    
     def list_snapshots(self):
         """
         List all snapshots in the repository
@@ -391,6 +973,9 @@ class ResticWrapper:
         success, output = self._execute_command(command)
         
         if success:
+            # 真实restic输出NDJSON：第一行是快照信息，其余为文件节点
+            if isinstance(output, list):
+                output = [node for node in output if node.get('struct_type', 'node') == 'node']
             return True, output
         else:
             return False, {'message': output.get('message', 'Failed to get snapshot information')}
@@ -420,6 +1005,132 @@ class ResticWrapper:
         else:
             return False, output.get('message', 'Failed to restore snapshot')
     
+    def stat_path(self, snapshot_id, path):
+        """
+        Get the ls node of a single path in a snapshot
+        
+        Args:
+            snapshot_id (str): ID of the snapshot
+            path (str): Absolute path inside the snapshot
+            
+        Returns:
+            tuple: (success (bool), node (dict))
+        """
+        target = path.rstrip('/') or '/'
+        # -- 之后的参数不会被当作选项解析，路径来自用户输入
+        command = ['restic', 'ls', '--json', snapshot_id, '--', target]
+        success, output = self._execute_command(command)
+        
+        if not success:
+            return False, {'message': output.get('message', 'Failed to list snapshot path')}
+        
+        for node in output if isinstance(output, list) else []:
+            if node.get('struct_type', 'node') == 'node' and node.get('path') == target:
+                return True, node
+        return False, {'message': f'Path not found in snapshot: {target}'}
+    
+    def dump(self, snapshot_id, path, archive=None, chunk_size=DUMP_CHUNK_SIZE):
+        """
+        Stream a file, or a directory as an archive, out of a snapshot
+        
+        Nothing is written to disk and at most one chunk is held in memory.
+        
+        Args:
+            snapshot_id (str): ID of the snapshot
+            path (str): Absolute path inside the snapshot
+            archive (str): Optional archive format for directories ('tar' or 'zip')
+            chunk_size (int): Number of bytes read per chunk
+            
+        Returns:
+            tuple: (success (bool), stream (DumpStream) or message (str))
+        """
+        command = ['restic', 'dump']
+        if archive:
+            command.extend(['--archive', archive])
+        # -- 之后的参数不会被当作选项解析，路径来自用户输入
+        command.extend([snapshot_id, '--', path])
+        
+        logger.debug(f"Executing command: {' '.join(command)}")
+        command_env = self._build_env()
+        
+        try:
+            if MOCK_RESTIC:
+                stream = DumpStream(get_mock_backend().stream(command, command_env))
+            else:
+                stream = DumpStream(restic_runner.stream_bytes(command, command_env, chunk_size=chunk_size))
+        except Exception as e:
+            logger.error(f"Error starting restic dump: {str(e)}")
+            return False, str(e)
+        
+        error = stream.prefetch()
+        if error:
+            return False, error
+        return True, stream
+    
+    def list_directory(self, snapshot_id, path):
+        """
+        List the direct children of a directory in a snapshot
+        
+        Args:
+            snapshot_id (str): ID of the snapshot
+            path (str): Absolute directory path inside the snapshot
+            
+        Returns:
+            tuple: (success (bool), nodes (list) or error (dict))
+        """
+        target = path.rstrip('/') or '/'
+        # -- 之后的参数不会被当作选项解析，路径来自用户输入
+        command = ['restic', 'ls', '--json', snapshot_id, '--', target]
+        success, output = self._execute_command(command)
+        
+        if not success:
+            return False, {'message': output.get('message', 'Failed to list directory')}
+        
+        nodes = [
+            node for node in (output if isinstance(output, list) else [])
+            if node.get('struct_type', 'node') == 'node'
+            and node.get('path') != target
+            and posixpath.dirname(node.get('path', '')) == target
+        ]
+        return True, nodes
+    
+    def restore_with_progress(self, snapshot_id, target_path, include_paths=None,
+                              verify=False, overwrite=None, on_progress=None):
+        """
+        Restore a snapshot, reporting `restic restore --json` progress
+        
+        Args:
+            snapshot_id (str): ID of the snapshot to restore
+            target_path (str): Path where to restore the data
+            include_paths (list): Optional list of paths to include
+            verify (bool): Verify restored file content
+            overwrite (str): Optional --overwrite behaviour ('always', 'if-changed',
+                'if-newer', 'never'); 'if-changed' skips files already restored
+            on_progress (callable): Called with each status message
+            
+        Returns:
+            tuple: (success (bool), summary (dict))
+        """
+        command = ['restic', 'restore', '--json', snapshot_id, '--target', target_path]
+        
+        if include_paths:
+            for path in include_paths:
+                command.extend(['--include', path])
+        if verify:
+            command.append('--verify')
+        if overwrite:
+            command.extend(['--overwrite', overwrite])
+        
+        def handle(message):
+            if on_progress and message.get('message_type') == 'status':
+                on_progress(message)
+        
+        success, output = self._execute_streaming(command, on_message=handle)
+        
+        if success:
+            return True, output
+        return False, {'message': output.get('message', 'Failed to restore snapshot')}
+    
     def forget_snapshots(self, snapshot_ids=None, policy=None):
         """
         Remove snapshots according to a policy or specific IDs
@@ -448,7 +1159,9 @@ class ResticWrapper:
             if 'keep_yearly' in policy:
                 command.extend(['--keep-yearly', str(policy['keep_yearly'])])
             if policy.get('prune', False):
+                # prune 会重新打包数据，使用仓库的压缩和包大小设置
                 command.append('--prune')
+                command.extend(self._write_options())
         
         # Add specific snapshot IDs
         if snapshot_ids:
@@ -461,14 +1174,23 @@ class ResticWrapper:
         else:
             return False, output.get('message', 'Failed to forget snapshots')
     
-    def get_stats(self):
+    def get_stats(self, mode=None, snapshot_ids=None):
         """
         Get repository statistics
         
+        Args:
+            mode (str): Optional counting mode ('restore-size', 'files-by-contents',
+                'blobs-per-file', 'raw-data')
+            snapshot_ids (list): Optional snapshots to restrict the statistics to
+        
         Returns:
             tuple: (success (bool), stats (dict))
         """
         command = ['restic', 'stats', '--json']
+        if mode:
+            command.extend(['--mode', mode])
+        if snapshot_ids:
+            command.extend(snapshot_ids)
         success, output = self._execute_command(command)
         
         if success:
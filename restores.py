@@ -0,0 +1,221 @@
+import json
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from jobs import job_pool
+from events import event_broker
+from restic_wrapper import ResticWrapper
+
+logger = logging.getLogger(__name__)
+
+# 单个恢复任务最多并行的分区数
+MAX_PARALLEL = 8
+# 每个分区失败后的重试次数
+PARTITION_RETRIES = 2
+# 进度写入数据库的间隔（秒），同时作为心跳
+PROGRESS_INTERVAL = 2.0
+# 超过该时间没有心跳的运行中任务视为已中断
+HEARTBEAT_TIMEOUT = timedelta(seconds=60)
+
+
+def effective_status(restore):
+    """Return the restore status, reporting stale running restores as interrupted"""
+    if restore.status in ('queued', 'running') and restore.updated_at:
+        if datetime.utcnow() - restore.updated_at > HEARTBEAT_TIMEOUT:
+            return 'interrupted'
+    return restore.status
+
+
+def plan_partitions(restic, snapshot_id, root_paths, include_paths, parallel):
+    """
+    Split a restore into include-path partitions
+
+    Args:
+        restic (ResticWrapper): Wrapper for the repository
+        snapshot_id (str): ID of the snapshot
+        root_paths (list): Paths recorded in the snapshot
+        include_paths (list): Paths requested by the user (may be empty)
+        parallel (int): Maximum number of partitions
+
+    Returns:
+        list: List of include-path lists; [[]] restores the whole snapshot
+    """
+    paths = list(include_paths or [])
+    if parallel <= 1:
+        return [paths]
+
+    if not paths:
+        # 未指定包含路径时，按快照根目录下的一级子项拆分
+        for root in root_paths:
+            success, nodes = restic.list_directory(snapshot_id, root)
+            if success and nodes:
+                paths.extend(node['path'] for node in nodes)
+            else:
+                paths.append(root)
+
+    count = min(parallel, len(paths))
+    if count <= 1:
+        return [paths]
+    return [paths[i::count] for i in range(count)]
+
+
+def start_restore(restore):
+    """
+    Queue a restore on the job pool
+
+    Must be called inside an application context.
+
+    Args:
+        restore: Restore object (already committed)
+
+    Returns:
+        Job: The queued job
+    """
+    return job_pool.submit(
+        'restore',
+        run_restore,
+        current_app._get_current_object(),
+        restore.id,
+        repository_id=restore.repository_id,
+        description=f'Restore {restore.snapshot_id[:8]} to {restore.target_path}'
+    )
+
+
+def run_restore(job, app, restore_id):
+    """
+    Run (or resume) a restore, restoring pending partitions in parallel
+
+    Partitions that completed in an earlier run are skipped. Resumed and
+    retried partitions use --overwrite if-changed so files that were
+    already restored are not transferred again.
+
+    Args:
+        job (Job): The job running this restore
+        app: Flask application
+        restore_id (int): ID of the Restore record
+    """
+    from app import db
+    from models import Restore, Snapshot
+
+    with app.app_context():
+        restore = Restore.query.get(restore_id)
+        if not restore:
+            logger.error(f"Restore {restore_id} not found")
+            return None
+
+        restic = ResticWrapper.from_repository(restore.repository)
+        resuming = restore.completed_partitions is not None or restore.status in ('failed', 'interrupted')
+        restore.status = 'running'
+        restore.message = None
+        restore.end_time = None
+        restore.updated_at = datetime.utcnow()
+        db.session.commit()
+
+        try:
+            if restore.partitions:
+                partitions = json.loads(restore.partitions)
+            else:
+                snapshot = Snapshot.query.filter_by(
+                    repository_id=restore.repository_id,
+                    snapshot_id=restore.snapshot_id
+                ).first()
+                root_paths = snapshot.paths if snapshot and snapshot.paths else []
+                include_paths = json.loads(restore.include_paths) if restore.include_paths else []
+                partitions = plan_partitions(
+                    restic, restore.snapshot_id, root_paths, include_paths, restore.parallel or 1
+                )
+                restore.partitions = json.dumps(partitions)
+                db.session.commit()
+
+            completed = set(json.loads(restore.completed_partitions or '[]'))
+            pending = [i for i in range(len(partitions)) if i not in completed]
+            live = {}
+            lock = threading.Lock()
+            # 工作线程不访问 ORM 对象：作业线程提交后属性会过期，重新加载会跨线程使用会话
+            snapshot_id, target_path, verify = restore.snapshot_id, restore.target_path, restore.verify
+            workers = max(1, min(restore.parallel or 1, MAX_PARALLEL))
+
+            def on_progress(index, message):
+                with lock:
+                    live[index] = message
+                    job.update_progress(
+                        partitions=len(partitions),
+                        partitions_completed=len(completed),
+                        total_bytes=sum(m.get('total_bytes', 0) for m in live.values()),
+                        bytes_restored=sum(m.get('bytes_restored', 0) + m.get('bytes_skipped', 0)
+                                           for m in live.values()),
+                        files_restored=sum(m.get('files_restored', 0) for m in live.values())
+                    )
+
+            def run_partition(index):
+                summary = {}
+                for attempt in range(PARTITION_RETRIES + 1):
+                    if attempt:
+                        time.sleep(2 ** attempt)
+                        logger.info(f"Retrying restore {restore_id} partition {index} (attempt {attempt + 1})")
+                    success, summary = restic.restore_with_progress(
+                        snapshot_id,
+                        target_path,
+                        include_paths=partitions[index] or None,
+                        verify=verify,
+                        overwrite='if-changed' if resuming or attempt else None,
+                        on_progress=lambda message: on_progress(index, message)
+                    )
+                    if success:
+                        on_progress(index, dict(summary, message_type='status'))
+                        return True, summary
+                return False, summary
+
+            errors = []
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                futures = {pool.submit(run_partition, index): index for index in pending}
+                not_done = set(futures)
+                while not_done:
+                    done, not_done = wait(not_done, timeout=PROGRESS_INTERVAL, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        index = futures[future]
+                        success, summary = future.result()
+                        if success:
+                            completed.add(index)
+                            restore.files_restored = (restore.files_restored or 0) + summary.get('files_restored', 0)
+                            restore.bytes_restored = (restore.bytes_restored or 0) + summary.get('bytes_restored', 0)
+                            restore.total_bytes = (restore.total_bytes or 0) + summary.get('total_bytes', 0)
+                        else:
+                            errors.append(f"partition {index}: {summary.get('message', 'restore failed')}")
+                    # 只在作业线程中写数据库，同时刷新心跳
+                    restore.completed_partitions = json.dumps(sorted(completed))
+                    restore.updated_at = datetime.utcnow()
+                    db.session.commit()
+                    event_broker.publish('restore.progress', id=restore_id, job_id=job.id,
+                                         repository_id=restore.repository_id, **job.progress)
+
+            restore.end_time = datetime.utcnow()
+            restore.updated_at = restore.end_time
+            if errors:
+                restore.status = 'failed'
+                restore.message = '; '.join(errors)
+            else:
+                restore.status = 'completed'
+                restore.message = 'Snapshot restored successfully'
+            db.session.commit()
+            logger.info(f"Restore {restore_id} finished with status: {restore.status}")
+            event_broker.publish('restore.finished', id=restore_id, job_id=job.id,
+                                 repository_id=restore.repository_id, status=restore.status,
+                                 message=restore.message)
+            return {'status': restore.status, 'message': restore.message}
+
+        except Exception as e:
+            logger.error(f"Error running restore {restore_id}: {str(e)}")
+            db.session.rollback()
+            restore = Restore.query.get(restore_id)
+            if restore:
+                restore.status = 'failed'
+                restore.message = str(e)
+                restore.end_time = datetime.utcnow()
+                db.session.commit()
+            raise
@@ -1,18 +1,43 @@
 import json
 import logging
-from datetime import datetime
-from flask import render_template, request, redirect, url_for, jsonify, flash, abort
+import mimetypes
+import posixpath
+from collections import defaultdict
+from concurrent.futures import as_completed
+from datetime import datetime, timedelta, timezone
+from urllib.parse import quote
+from flask import Blueprint, current_app, render_template, request, redirect, url_for, jsonify, flash, abort, Response, stream_with_context
+from sqlalchemy import func, select, type_coerce
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import joinedload
 
-from app import app, db
-from models import Repository, Backup, Snapshot, ScheduledTask, Settings
-from restic_wrapper import ResticWrapper
-from scheduler import scheduler, schedule_backup_task
+from app import db
+from models import Repository, Backup, Snapshot, ScheduledTask, Settings, Restore, ExcludeFile, Replication, ReplicatedSnapshot
+from restic_wrapper import ResticWrapper, validate_write_options
+from scheduler import preview_next_run, preview_replication_next_run, CATCHUP_POLICIES
+from changes import CHANGE_DETECTION_MODES, discard_state
+from excludes import rules_for, parse_patterns, parse_size, estimate as estimate_excludes
+from hooks import parse_stdin_command, stdin_source_path
+from capacity import estimate_source, forecast_repository, CAPACITY_WARN_DAYS, CAPACITY_CRITICAL_DAYS
+from benchmark import run_benchmark, normalize_settings, BENCHMARK_SAMPLE_BYTES
+from planner import plan, backup_history, parse_deadline, schedule_planner
+from jobs import job_pool
+from restores import start_restore, effective_status, MAX_PARALLEL
+from replication import start_replication, SCHEDULE_TYPES as REPLICATION_SCHEDULE_TYPES
+from health import health_prober
+from stats import schedule_stats_refresh, get_cached_stats
+from enrichment import snapshot_enricher, apply_summary, ENRICHED_FIELDS
+from events import event_broker, backup_payload, progress_payload, format_sse, HEARTBEAT_INTERVAL
+from http_cache import conditional
+from serializers import snapshot_serializer, backup_serializer, task_serializer
 
 logger = logging.getLogger(__name__)
 
+bp = Blueprint('main', __name__)
+
 # Dashboard route
-@app.route('/')
+@bp.route('/')
 def dashboard():
     """Main dashboard page"""
     try:
@@ -46,17 +71,43 @@ def dashboard():
         return render_template('dashboard.html')
 
 # Repository routes
-@app.route('/repositories')
+@bp.route('/repositories')
 def repositories():
     """Repository management page"""
     repositories = Repository.query.all()
     return render_template('repositories.html', repositories=repositories)
 
-@app.route('/api/repositories', methods=['GET'])
+def _capacity_value(value):
+    """Parse a repository capacity given in bytes or as a size like '500G'; empty clears it"""
+    if value in (None, ''):
+        return None
+    capacity = value if isinstance(value, int) and not isinstance(value, bool) else parse_size(value)
+    if capacity <= 0:
+        raise ValueError('capacity_bytes must be positive')
+    return capacity
+
+WRITE_OPTION_FIELDS = ('compression', 'pack_size')
+
+def _write_options_error(data):
+    """Validate the compression and pack size in a request, returning an error message or None"""
+    try:
+        validate_write_options(data.get('compression') or None, data.get('pack_size') or None)
+    except ValueError as e:
+        return str(e)
+    return None
+
+def _apply_write_options(target, data):
+    """Copy the compression and pack size present in a validated request onto a repository or task"""
+    for field in WRITE_OPTION_FIELDS:
+        if field in data:
+            setattr(target, field, data[field] or None)
+
+@bp.route('/api/repositories', methods=['GET'])
+@conditional('repository', 'repository_health')
 def get_repositories():
     """API endpoint to get all repositories"""
     try:
-        repositories = Repository.query.all()
+        repositories = Repository.query.options(joinedload(Repository.health)).all()
         return jsonify([{
             'id': repo.id,
             'name': repo.name,
@@ -65,13 +116,17 @@ def get_repositories():
             'created_at': repo.created_at.isoformat(),
             'last_check': repo.last_check.isoformat() if repo.last_check else None,
             'status': repo.status,
-            'rest_user': repo.rest_user if repo.repo_type == 'rest-server' else None
+            'rest_user': repo.rest_user if repo.repo_type == 'rest-server' else None,
+            'capacity_bytes': repo.capacity_bytes,
+            'compression': repo.compression,
+            'pack_size': repo.pack_size,
+            'health': health_prober.get(repo)
         } for repo in repositories])
     except Exception as e:
         logger.error(f"Error fetching repositories: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/repositories', methods=['POST'])
+@bp.route('/api/repositories', methods=['POST'])
 def create_repository():
     """API endpoint to create a new repository"""
     try:
@@ -99,6 +154,16 @@ def create_repository():
             if not (data['location'].startswith('http://') or data['location'].startswith('https://')):
                 return jsonify({'error': 'REST server URL must start with http:// or https://'}), 400
         
+        try:
+            capacity_bytes = _capacity_value(data.get('capacity_bytes'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        error = _write_options_error(data)
+        if error:
+            return jsonify({'error': error}), 400
+        compression = data.get('compression') or None
+        pack_size = data.get('pack_size') or None
+        
         # Initialize repository using Restic
         if data['repo_type'] == 'rest-server':
             restic = ResticWrapper(
@@ -106,10 +171,13 @@ def create_repository():
                 data['password'], 
                 repo_type='rest-server',
                 rest_user=data.get('rest_user'),
-                rest_pass=data.get('rest_pass')
+                rest_pass=data.get('rest_pass'),
+                compression=compression,
+                pack_size=pack_size
             )
         else:
-            restic = ResticWrapper(data['location'], data['password'], repo_type=data['repo_type'])
+            restic = ResticWrapper(data['location'], data['password'], repo_type=data['repo_type'],
+                                   compression=compression, pack_size=pack_size)
             
         success, message = restic.init_repository()
         
@@ -124,12 +192,16 @@ def create_repository():
             password=data['password'],
             rest_user=data.get('rest_user'),
             rest_pass=data.get('rest_pass'),
+            capacity_bytes=capacity_bytes,
+            compression=compression,
+            pack_size=pack_size,
             status='ok',
             last_check=datetime.utcnow()
         )
         
         db.session.add(repository)
         db.session.commit()
+        event_broker.publish('repository.created', id=repository.id)
         
         return jsonify({
             'id': repository.id,
@@ -138,14 +210,17 @@ def create_repository():
             'location': repository.location,
             'created_at': repository.created_at.isoformat(),
             'status': repository.status,
-            'rest_user': repository.rest_user if repository.repo_type == 'rest-server' else None
+            'rest_user': repository.rest_user if repository.repo_type == 'rest-server' else None,
+            'capacity_bytes': repository.capacity_bytes,
+            'compression': repository.compression,
+            'pack_size': repository.pack_size
         }), 201
     except Exception as e:
         db.session.rollback()
         logger.error(f"Error creating repository: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/repositories/<int:repo_id>', methods=['GET'])
+@bp.route('/api/repositories/<int:repo_id>', methods=['GET'])
 def get_repository(repo_id):
     """API endpoint to get repository details"""
     try:
@@ -161,13 +236,59 @@ def get_repository(repo_id):
             'created_at': repository.created_at.isoformat(),
             'last_check': repository.last_check.isoformat() if repository.last_check else None,
             'status': repository.status,
-            'rest_user': repository.rest_user if repository.repo_type == 'rest-server' else None
+            'rest_user': repository.rest_user if repository.repo_type == 'rest-server' else None,
+            'capacity_bytes': repository.capacity_bytes,
+            'compression': repository.compression,
+            'pack_size': repository.pack_size,
+            'health': health_prober.get(repository)
         })
     except Exception as e:
         logger.error(f"Error fetching repository: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/repositories/<int:repo_id>/check', methods=['POST'])
+@bp.route('/api/repositories/<int:repo_id>', methods=['PUT'])
+def update_repository(repo_id):
+    """API endpoint to rename a repository or change its capacity, compression or pack size"""
+    try:
+        repository = Repository.query.get(repo_id)
+        if not repository:
+            return jsonify({'error': 'Repository not found'}), 404
+        
+        data = request.json or {}
+        if 'name' in data:
+            if not data['name']:
+                return jsonify({'error': 'Repository name cannot be empty'}), 400
+            existing = Repository.query.filter(Repository.name == data['name'], Repository.id != repo_id).first()
+            if existing:
+                return jsonify({'error': 'Repository with this name already exists'}), 400
+            repository.name = data['name']
+        if 'capacity_bytes' in data:
+            try:
+                repository.capacity_bytes = _capacity_value(data['capacity_bytes'])
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+        # 只影响之后写入的数据，已有的包不会重新压缩
+        error = _write_options_error(data)
+        if error:
+            return jsonify({'error': error}), 400
+        _apply_write_options(repository, data)
+        
+        db.session.commit()
+        event_broker.publish('repository.updated', id=repository.id)
+        
+        return jsonify({
+            'id': repository.id,
+            'name': repository.name,
+            'capacity_bytes': repository.capacity_bytes,
+            'compression': repository.compression,
+            'pack_size': repository.pack_size
+        })
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error updating repository: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/api/repositories/<int:repo_id>/check', methods=['POST'])
 def check_repository(repo_id):
     """API endpoint to check repository health"""
     try:
@@ -196,6 +317,7 @@ def check_repository(repo_id):
         repository.last_check = datetime.utcnow()
         repository.status = 'ok' if success else 'error'
         db.session.commit()
+        event_broker.publish('repository.checked', id=repository.id, status=repository.status)
         
         return jsonify({
             'status': repository.status,
@@ -207,7 +329,7 @@ def check_repository(repo_id):
         logger.error(f"Error checking repository: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/repositories/<int:repo_id>', methods=['DELETE'])
+@bp.route('/api/repositories/<int:repo_id>', methods=['DELETE'])
 def delete_repository(repo_id):
     """API endpoint to delete a repository"""
     try:
@@ -215,8 +337,16 @@ def delete_repository(repo_id):
         if not repository:
             return jsonify({'error': 'Repository not found'}), 404
         
+        # 以该仓库为源或目标的复制作业随仓库一起删除
+        replication_ids = [r.id for r in repository.replications_out + repository.replications_in]
+        
         db.session.delete(repository)
         db.session.commit()
+        health_prober.forget(repo_id)
+        # 调度器进程收到 replication.deleted 事件后移除作业
+        for replication_id in replication_ids:
+            event_broker.publish('replication.deleted', id=replication_id)
+        event_broker.publish('repository.deleted', id=repo_id)
         
         return jsonify({'success': True})
     except Exception as e:
@@ -224,38 +354,145 @@ def delete_repository(repo_id):
         logger.error(f"Error deleting repository: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@bp.route('/api/repositories/health/refresh', methods=['POST'])
+def refresh_repository_health():
+    """API endpoint to trigger an immediate background health probe of all repositories"""
+    health_prober.refresh()
+    return jsonify({'success': True, 'message': 'Health probe scheduled'}), 202
+
+@bp.route('/api/repositories/<int:repo_id>/stats', methods=['GET'])
+def get_repository_stats(repo_id):
+    """API endpoint to get cached repository statistics"""
+    try:
+        repository = Repository.query.get(repo_id)
+        if not repository:
+            return jsonify({'error': 'Repository not found'}), 404
+
+        # 直接返回缓存结果，过期时在后台刷新
+        result = get_cached_stats(repository)
+        force = request.args.get('refresh', 'false').lower() == 'true'
+        if result['stale'] or force:
+            job = schedule_stats_refresh(repo_id, force=force)
+            result['job_id'] = job.id if job else None
+
+        return jsonify(result)
+    except Exception as e:
+        logger.error(f"Error fetching repository stats: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/api/repository-stats', methods=['GET'])
+def get_all_repository_stats():
+    """API endpoint to get cached statistics of all repositories"""
+    try:
+        results = []
+        for repository in Repository.query.all():
+            result = get_cached_stats(repository)
+            if result['stale']:
+                schedule_stats_refresh(repository.id)
+            results.append(result)
+
+        return jsonify(results)
+    except Exception as e:
+        logger.error(f"Error fetching repository stats: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+def _ndjson(obj):
+    """Encode one line of a newline-delimited JSON stream"""
+    return json.dumps(obj) + '\n'
+
+@bp.route('/api/repositories/bulk/check', methods=['POST'])
+def bulk_check_repositories():
+    """API endpoint to check many repositories concurrently, streaming one result per line"""
+    try:
+        data = request.json or {}
+        repo_ids = data.get('repository_ids') or []
+        if not isinstance(repo_ids, list) or not all(
+                isinstance(repo_id, int) and not isinstance(repo_id, bool) for repo_id in repo_ids):
+            return jsonify({'error': 'repository_ids must be a list of repository ids'}), 400
+        # 重复的ID只检查一次
+        repo_ids = list(dict.fromkeys(repo_ids))
+        
+        query = Repository.query
+        if repo_ids:
+            query = query.filter(Repository.id.in_(repo_ids))
+        repositories = query.all()
+        missing = sorted(set(repo_ids) - {repo.id for repo in repositories})
+        
+        # 在作业池中并发检查，每个仓库一个restic进程
+        futures = {}
+        for repository in repositories:
+            restic = ResticWrapper.from_repository(repository)
+            job = job_pool.submit(
+                'check',
+                lambda job, restic=restic: restic.check_repository(),
+                repository_id=repository.id,
+                description=f'Check repository {repository.name}'
+            )
+            futures[job.future] = (job, repository.id)
+    except Exception as e:
+        logger.error(f"Error starting bulk repository check: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+    
+    def generate():
+        succeeded = 0
+        for repo_id in missing:
+            yield _ndjson({'type': 'item', 'repository_id': repo_id, 'status': 'error',
+                           'message': 'Repository not found'})
+        
+        for future in as_completed(futures):
+            job, repo_id = futures[future]
+            try:
+                success, message = future.result()
+            except Exception as e:
+                success, message = False, str(e)
+            
+            try:
+                repository = Repository.query.get(repo_id)
+                if repository:
+                    repository.last_check = job.finished_at or datetime.utcnow()
+                    repository.status = 'ok' if success else 'error'
+                    db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Error saving check result for repository {repo_id}: {str(e)}")
+            
+            succeeded += 1 if success else 0
+            yield _ndjson({
+                'type': 'item',
+                'repository_id': repo_id,
+                'job_id': job.id,
+                'status': 'ok' if success else 'error',
+                'message': message,
+                'last_check': (job.finished_at or datetime.utcnow()).isoformat()
+            })
+        
+        yield _ndjson({'type': 'summary', 'total': len(futures) + len(missing),
+                       'succeeded': succeeded, 'failed': len(futures) + len(missing) - succeeded})
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
 # Backup routes
-@app.route('/backups')
+@bp.route('/backups')
 def backups():
     """Backup management page"""
     backups = Backup.query.order_by(Backup.start_time.desc()).all()
     repositories = Repository.query.all()
     return render_template('backups.html', backups=backups, repositories=repositories)
 
-@app.route('/api/backups', methods=['GET'])
+@bp.route('/api/backups', methods=['GET'])
+@conditional('backup', 'repository')
 def get_backups():
     """API endpoint to get all backups"""
     try:
-        backups = Backup.query.order_by(Backup.start_time.desc()).all()
-        return jsonify([{
-            'id': backup.id,
-            'repository_id': backup.repository_id,
-            'repository_name': backup.repository.name,
-            'source_path': backup.source_path,
-            'start_time': backup.start_time.isoformat(),
-            'end_time': backup.end_time.isoformat() if backup.end_time else None,
-            'status': backup.status,
-            'message': backup.message,
-            'files_new': backup.files_new,
-            'files_changed': backup.files_changed,
-            'bytes_added': backup.bytes_added,
-            'snapshot_id': backup.snapshot_id
-        } for backup in backups])
+        query = backup_serializer.query() \
+            .join(Repository, Backup.repository_id == Repository.id) \
+            .order_by(Backup.start_time.desc())
+        return backup_serializer.response(query)
     except Exception as e:
         logger.error(f"Error fetching backups: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/backups', methods=['POST'])
+@bp.route('/api/backups', methods=['POST'])
 def create_backup():
     """API endpoint to create a new backup"""
     try:
@@ -272,6 +509,10 @@ def create_backup():
         if not repository:
             return jsonify({'error': 'Repository not found'}), 404
         
+        error = _write_options_error(data)
+        if error:
+            return jsonify({'error': error}), 400
+        
         # Create backup record
         backup = Backup(
             repository_id=data['repository_id'],
@@ -281,9 +522,9 @@ def create_backup():
         
         db.session.add(backup)
         db.session.commit()
+        event_broker.publish('backup.started', **backup_payload(backup, repository.name))
         
-        # Start backup in a separate thread
-        from threading import Thread
+        # Run the backup as a background job
         from sqlalchemy import create_engine
         from sqlalchemy.orm import sessionmaker, scoped_session
 
@@ -291,6 +532,7 @@ def create_backup():
         backup_id = backup.id
         repo_id = data['repository_id']
         source_path = data['source_path']
+        app = current_app._get_current_object()
         
         def run_backup():
             with app.app_context():
@@ -309,23 +551,21 @@ def create_backup():
                         logger.error("Backup or repository not found in thread")
                         return
                         
-                    # Create ResticWrapper with appropriate repository type
-                    if repo_obj.repo_type == 'rest-server':
-                        restic = ResticWrapper(
-                            repo_obj.location, 
-                            repo_obj.password, 
-                            repo_type='rest-server',
-                            rest_user=repo_obj.rest_user,
-                            rest_pass=repo_obj.rest_pass
-                        )
-                    else:
-                        restic = ResticWrapper(
-                            repo_obj.location, 
-                            repo_obj.password, 
-                            repo_type=repo_obj.repo_type
+                    # 使用仓库的压缩和包大小设置，请求中可单独覆盖
+                    restic = ResticWrapper.from_repository(repo_obj)
+                    
+                    def on_progress(message):
+                        event_broker.publish(
+                            'backup.progress',
+                            throttle=(f'backup-{backup_id}', 1),
+                            backup_id=backup_id,
+                            repository_id=repo_id,
+                            **progress_payload(message)
                         )
                     
-                    success, result = restic.create_backup(source_path)
+                    success, result = restic.create_backup(source_path, on_progress=on_progress,
+                                                           compression=data.get('compression') or None,
+                                                           pack_size=data.get('pack_size') or None)
                     
                     backup_obj.end_time = datetime.utcnow()
                     backup_obj.status = 'completed' if success else 'failed'
@@ -344,13 +584,19 @@ def create_backup():
                                 snapshot_id=backup_obj.snapshot_id,
                                 created_at=backup_obj.end_time,
                                 hostname=result.get('hostname', ''),
-                                paths=json.dumps([source_path]),
-                                size=result.get('bytes_added', 0)
+                                paths=[source_path]
                             )
+                            # 优先使用备份摘要中的统计，否则交给后台补全
+                            if not apply_summary(snapshot, result):
+                                snapshot_enricher.enqueue(repo_obj.id)
                             thread_session.add(snapshot)
                     
                     thread_session.commit()
                     logger.info(f"Backup {backup_obj.id} completed with status: {backup_obj.status}")
+                    event_broker.publish('backup.finished', **backup_payload(backup_obj, repo_obj.name))
+                    
+                    if success:
+                        schedule_stats_refresh(repo_id)
                     
                 except Exception as e:
                     logger.error(f"Error during backup process: {str(e)}")
@@ -364,6 +610,7 @@ def create_backup():
                             backup_obj.end_time = datetime.utcnow()
                             backup_obj.message = str(e)
                             thread_session.commit()
+                            event_broker.publish('backup.finished', **backup_payload(backup_obj))
                     except Exception as inner_e:
                         logger.error(f"Error updating backup status: {str(inner_e)}")
                 finally:
@@ -371,10 +618,14 @@ def create_backup():
                     thread_session.close()
                     Session.remove()
         
-        # 启动备份线程
-        backup_thread = Thread(target=run_backup, name="BackupThread")
-        backup_thread.daemon = True
-        backup_thread.start()
+        # 手动备份在作业池中以 manual 类别排队，优先于维护作业
+        job_pool.submit(
+            'backup',
+            lambda job: run_backup(),
+            repository_id=repo_id,
+            description=f'Backup of {source_path}',
+            job_class='manual'
+        )
         
         return jsonify({
             'id': backup.id,
@@ -388,7 +639,7 @@ def create_backup():
         logger.error(f"Error creating backup: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/backups/<int:backup_id>', methods=['GET'])
+@bp.route('/api/backups/<int:backup_id>', methods=['GET'])
 def get_backup(backup_id):
     """API endpoint to get backup details"""
     try:
@@ -415,19 +666,19 @@ def get_backup(backup_id):
         return jsonify({'error': str(e)}), 500
 
 # Snapshot routes
-@app.route('/snapshots')
+@bp.route('/snapshots')
 def snapshots():
     """Snapshot management page"""
     snapshots = Snapshot.query.order_by(Snapshot.created_at.desc()).all()
     repositories = Repository.query.all()
     return render_template('snapshots.html', snapshots=snapshots, repositories=repositories)
 
-@app.route('/snapshots/<string:snapshot_id>')
+@bp.route('/snapshots/<string:snapshot_id>')
 def snapshot_detail(snapshot_id):
     """Snapshot detail page"""
     snapshot = Snapshot.query.filter_by(snapshot_id=snapshot_id).first_or_404()
-    paths = json.loads(snapshot.paths) if snapshot.paths else []
-    tags = json.loads(snapshot.tags) if snapshot.tags else []
+    paths = snapshot.paths or []
+    tags = snapshot.tags or []
     # 将snapshot_id的前8个字符作为short_id
     snapshot.short_id = snapshot.snapshot_id[:8] if snapshot.snapshot_id else ""
     return render_template('snapshot_detail.html', 
@@ -435,60 +686,47 @@ def snapshot_detail(snapshot_id):
                           paths=paths, 
                           tags=tags)
 
-@app.route('/api/snapshots', methods=['GET'])
+def _json_list_contains(column, value):
+    """SQL condition matching rows whose JSON list column contains value"""
+    if db.engine.dialect.name == 'postgresql':
+        # JSONB @> 可以使用 GIN 索引
+        return type_coerce(column, JSONB).contains([value])
+    items = func.json_each(column).table_valued('value')
+    return select(items.c.value).where(items.c.value == value).exists()
+
+@bp.route('/api/snapshots', methods=['GET'])
+@conditional('snapshot', 'repository')
 def get_snapshots():
-    """API endpoint to get all snapshots"""
+    """
+    API endpoint to get all snapshots
+    
+    Optional filters (evaluated in the database): repository_id, host,
+    tag (repeatable, all must match), path (repeatable) and limit.
+    """
     try:
         repo_id = request.args.get('repository_id')
-        query = Snapshot.query
+        query = snapshot_serializer.query().join(Repository, Snapshot.repository_id == Repository.id)
         
         if repo_id:
-            query = query.filter_by(repository_id=repo_id)
-        
-        snapshots = query.order_by(Snapshot.created_at.desc()).all()
-        
-        result = []
-        for snapshot in snapshots:
-            try:
-                # 安全处理JSON解析，避免错误中断整个操作
-                paths = []
-                tags = []
-                
-                if snapshot.paths:
-                    try:
-                        paths = json.loads(snapshot.paths)
-                    except json.JSONDecodeError:
-                        paths = []
-                        
-                if snapshot.tags:
-                    try:
-                        tags = json.loads(snapshot.tags)
-                    except json.JSONDecodeError:
-                        tags = []
-                
-                snapshot_data = {
-                    'id': snapshot.id,
-                    'repository_id': snapshot.repository_id,
-                    'repository_name': snapshot.repository.name,
-                    'snapshot_id': snapshot.snapshot_id,
-                    'created_at': snapshot.created_at.isoformat(),
-                    'hostname': snapshot.hostname,
-                    'paths': paths,
-                    'tags': tags,
-                    'size': snapshot.size
-                }
-                result.append(snapshot_data)
-            except Exception as individual_error:
-                logger.warning(f"Error processing individual snapshot {snapshot.id}: {str(individual_error)}")
-                # 跳过有问题的快照，继续处理其他快照
-                continue
-        
-        return jsonify(result)
+            query = query.filter(Snapshot.repository_id == repo_id)
+        if request.args.get('host'):
+            query = query.filter(Snapshot.hostname == request.args['host'])
+        for tag in request.args.getlist('tag'):
+            query = query.filter(_json_list_contains(Snapshot.tags, tag))
+        for path in request.args.getlist('path'):
+            query = query.filter(_json_list_contains(Snapshot.paths, path))
+        
+        query = query.order_by(Snapshot.created_at.desc())
+        limit = request.args.get('limit', type=int)
+        if limit:
+            query = query.limit(limit)
+        
+        return snapshot_serializer.response(query)
     except Exception as e:
         logger.error(f"Error fetching snapshots: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/snapshots/<string:snapshot_id>/files', methods=['GET'])
+@bp.route('/api/snapshots/<string:snapshot_id>/files', methods=['GET'])
 def get_snapshot_files(snapshot_id):
     """API endpoint to get files in a snapshot"""
     try:
@@ -528,9 +766,85 @@ def get_snapshot_files(snapshot_id):
         logger.error(f"Error getting snapshot files: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/snapshots/<string:snapshot_id>/restore', methods=['POST'])
+@bp.route('/api/snapshots/<string:snapshot_id>/download', methods=['GET'])
+def download_snapshot_path(snapshot_id):
+    """API endpoint to stream a file, or a directory as tar/zip, out of a snapshot"""
+    try:
+        path = request.args.get('path')
+        if not path:
+            return jsonify({'error': 'Missing required parameter: path'}), 400
+        if not path.startswith('/'):
+            return jsonify({'error': 'path must be an absolute path inside the snapshot'}), 400
+        
+        archive = request.args.get('format')
+        if archive and archive not in ('tar', 'zip'):
+            return jsonify({'error': 'Invalid format. Must be "tar" or "zip"'}), 400
+        
+        snapshot = Snapshot.query.filter_by(snapshot_id=snapshot_id).first()
+        if not snapshot:
+            return jsonify({'error': 'Snapshot not found'}), 404
+        
+        repository = Repository.query.get(snapshot.repository_id)
+        if not repository:
+            return jsonify({'error': 'Repository not found'}), 404
+        
+        restic = ResticWrapper.from_repository(repository)
+        filename = posixpath.basename(path.rstrip('/')) or snapshot.snapshot_id[:8]
+        
+        node = None
+        if not archive:
+            success, node = restic.stat_path(snapshot.snapshot_id, path)
+            if not success:
+                return jsonify({'error': node.get('message', 'Path not found')}), 404
+            # 目录默认以tar格式导出
+            if node.get('type') == 'dir':
+                archive = 'tar'
+        
+        if archive:
+            success, stream = restic.dump(snapshot.snapshot_id, path, archive=archive)
+            if not success:
+                return jsonify({'error': stream}), 500
+            
+            response = Response(stream, mimetype='application/zip' if archive == 'zip' else 'application/x-tar')
+            response.headers['Content-Disposition'] = f"attachment; filename*=UTF-8''{quote(filename)}.{archive}"
+            response.call_on_close(stream.close)
+            return response
+        
+        # 单个文件：支持Range请求
+        size = node.get('size', 0)
+        byte_range = None
+        if request.range:
+            byte_range = request.range.range_for_length(size)
+            if byte_range is None:
+                response = Response(status=416)
+                response.headers['Content-Range'] = f'bytes */{size}'
+                return response
+        
+        success, stream = restic.dump(snapshot.snapshot_id, path)
+        if not success:
+            return jsonify({'error': stream}), 500
+        
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        if byte_range:
+            start, stop = byte_range
+            response = Response(stream.iter_range(start, stop), status=206, mimetype=mimetype)
+            response.headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+            response.headers['Content-Length'] = str(stop - start)
+        else:
+            response = Response(stream, mimetype=mimetype)
+            response.headers['Content-Length'] = str(size)
+        
+        response.headers['Accept-Ranges'] = 'bytes'
+        response.headers['Content-Disposition'] = f"attachment; filename*=UTF-8''{quote(filename)}"
+        response.call_on_close(stream.close)
+        return response
+    except Exception as e:
+        logger.error(f"Error downloading from snapshot: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/api/snapshots/<string:snapshot_id>/restore', methods=['POST'])
 def restore_snapshot(snapshot_id):
-    """API endpoint to restore a snapshot"""
+    """API endpoint to start restoring a snapshot as a background job"""
     try:
         data = request.json
         
@@ -546,42 +860,118 @@ def restore_snapshot(snapshot_id):
         repository = Repository.query.get(snapshot.repository_id)
         if not repository:
             return jsonify({'error': 'Repository not found'}), 404
-            
-        # Create ResticWrapper with appropriate repository type
-        if repository.repo_type == 'rest-server':
-            restic = ResticWrapper(
-                repository.location, 
-                repository.password, 
-                repo_type='rest-server',
-                rest_user=repository.rest_user,
-                rest_pass=repository.rest_pass
-            )
-        else:
-            restic = ResticWrapper(
-                repository.location, 
-                repository.password, 
-                repo_type=repository.repo_type
-            )
-            
-        # Get include paths if provided
-        include_paths = data.get('include_paths')
-        
-        # Restore snapshot
-        success, message = restic.restore_snapshot(
-            snapshot.snapshot_id, 
-            data['target_path'],
-            include_paths
+        
+        try:
+            parallel = int(data.get('parallel', 1))
+        except (TypeError, ValueError):
+            return jsonify({'error': 'parallel must be an integer'}), 400
+        if parallel < 1 or parallel > MAX_PARALLEL:
+            return jsonify({'error': f'parallel must be between 1 and {MAX_PARALLEL}'}), 400
+        
+        restore = Restore(
+            repository_id=repository.id,
+            snapshot_id=snapshot.snapshot_id,
+            target_path=data['target_path'],
+            include_paths=json.dumps(data['include_paths']) if data.get('include_paths') else None,
+            parallel=parallel,
+            verify=bool(data.get('verify', False)),
+            status='queued'
         )
+        db.session.add(restore)
+        db.session.commit()
         
-        if not success:
-            return jsonify({'error': message}), 500
-            
-        return jsonify({'success': True, 'message': message})
+        job = start_restore(restore)
+        restore.job_id = job.id
+        db.session.commit()
+        
+        return jsonify({
+            'success': True,
+            'message': 'Restore started',
+            'restore_id': restore.id,
+            'job_id': job.id
+        }), 202
     except Exception as e:
+        db.session.rollback()
         logger.error(f"Error restoring snapshot: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/snapshots/<string:snapshot_id>/forget', methods=['POST'])
+def _serialize_restore(restore):
+    job = job_pool.get(restore.job_id) if restore.job_id else None
+    return {
+        'id': restore.id,
+        'repository_id': restore.repository_id,
+        'snapshot_id': restore.snapshot_id,
+        'target_path': restore.target_path,
+        'include_paths': json.loads(restore.include_paths) if restore.include_paths else [],
+        'parallel': restore.parallel,
+        'verify': restore.verify,
+        'status': effective_status(restore),
+        'message': restore.message,
+        'partitions': len(json.loads(restore.partitions)) if restore.partitions else None,
+        'partitions_completed': len(json.loads(restore.completed_partitions or '[]')),
+        'total_bytes': restore.total_bytes,
+        'bytes_restored': restore.bytes_restored,
+        'files_restored': restore.files_restored,
+        'progress': job.progress if job else None,
+        'start_time': restore.start_time.isoformat() if restore.start_time else None,
+        'end_time': restore.end_time.isoformat() if restore.end_time else None
+    }
+
+@bp.route('/api/restores', methods=['GET'])
+def get_restores():
+    """API endpoint to list restore jobs"""
+    try:
+        query = Restore.query
+        repo_id = request.args.get('repository_id')
+        if repo_id:
+            query = query.filter_by(repository_id=repo_id)
+        restores = query.order_by(Restore.start_time.desc()).all()
+        return jsonify([_serialize_restore(restore) for restore in restores])
+    except Exception as e:
+        logger.error(f"Error fetching restores: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/api/restores/<int:restore_id>', methods=['GET'])
+def get_restore(restore_id):
+    """API endpoint to get restore progress"""
+    try:
+        restore = Restore.query.get(restore_id)
+        if not restore:
+            return jsonify({'error': 'Restore not found'}), 404
+        return jsonify(_serialize_restore(restore))
+    except Exception as e:
+        logger.error(f"Error fetching restore: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/api/restores/<int:restore_id>/resume', methods=['POST'])
+def resume_restore(restore_id):
+    """API endpoint to resume a failed or interrupted restore"""
+    try:
+        restore = Restore.query.get(restore_id)
+        if not restore:
+            return jsonify({'error': 'Restore not found'}), 404
+        
+        status = effective_status(restore)
+        if status not in ('failed', 'interrupted'):
+            return jsonify({'error': f'Restore cannot be resumed while {status}'}), 400
+        
+        # 已完成的分区会被跳过，其余分区以 --overwrite if-changed 继续
+        if restore.completed_partitions is None:
+            restore.completed_partitions = '[]'
+        restore.status = 'queued'
+        restore.updated_at = datetime.utcnow()
+        db.session.commit()
+        
+        job = start_restore(restore)
+        restore.job_id = job.id
+        db.session.commit()
+        return jsonify({'success': True, 'restore_id': restore.id, 'job_id': job.id}), 202
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error resuming restore: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/api/snapshots/<string:snapshot_id>/forget', methods=['POST'])
 def forget_snapshot(snapshot_id):
     """API endpoint to forget (delete) a snapshot"""
     try:
@@ -622,6 +1012,10 @@ def forget_snapshot(snapshot_id):
         # Delete from database
         db.session.delete(snapshot)
         db.session.commit()
+        
+        schedule_stats_refresh(repository.id)
+        event_broker.publish('snapshot.forgotten', repository_id=repository.id,
+                             snapshot_ids=[snapshot_id])
             
         return jsonify({'success': True, 'message': message})
     except Exception as e:
@@ -629,7 +1023,87 @@ def forget_snapshot(snapshot_id):
         logger.error(f"Error forgetting snapshot: {str(e)}")
         return jsonify({'error': str(e)}), 500
         
-@app.route('/api/repositories/<int:repo_id>/snapshots/sync', methods=['POST'])
+@bp.route('/api/snapshots/bulk/forget', methods=['POST'])
+def bulk_forget_snapshots():
+    """API endpoint to forget many snapshots, one restic forget per repository"""
+    try:
+        data = request.json or {}
+        snapshot_ids = data.get('snapshot_ids') or []
+        if not snapshot_ids:
+            return jsonify({'error': 'Missing required field: snapshot_ids'}), 400
+        if not isinstance(snapshot_ids, list) or not all(isinstance(snapshot_id, str) for snapshot_id in snapshot_ids):
+            return jsonify({'error': 'snapshot_ids must be a list of snapshot ids'}), 400
+        # 重复的ID只计一次，汇总中的数量与逐条结果一致
+        snapshot_ids = list(dict.fromkeys(snapshot_ids))
+        
+        snapshots = Snapshot.query.filter(Snapshot.snapshot_id.in_(snapshot_ids)).all()
+        missing = sorted(set(snapshot_ids) - {snapshot.snapshot_id for snapshot in snapshots})
+        
+        # 按仓库分组，每个仓库只执行一次 restic forget id1 id2 ...
+        grouped = defaultdict(list)
+        for snapshot in snapshots:
+            grouped[snapshot.repository_id].append(snapshot.snapshot_id)
+        
+        policy = {'prune': data.get('prune', False)}
+        futures = {}
+        for repository in Repository.query.filter(Repository.id.in_(list(grouped))).all():
+            restic = ResticWrapper.from_repository(repository)
+            ids = grouped.pop(repository.id)
+            job = job_pool.submit(
+                'forget',
+                lambda job, restic=restic, ids=ids: restic.forget_snapshots(ids, policy),
+                repository_id=repository.id,
+                description=f'Forget {len(ids)} snapshots in {repository.name}'
+            )
+            futures[job.future] = (job, repository.id, ids)
+        
+        # 剩余分组的仓库已不存在
+        orphaned = [snapshot_id for ids in grouped.values() for snapshot_id in ids]
+    except Exception as e:
+        logger.error(f"Error starting bulk snapshot forget: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+    
+    def generate():
+        succeeded = 0
+        total = len(snapshot_ids)
+        for snapshot_id in missing:
+            yield _ndjson({'type': 'item', 'snapshot_id': snapshot_id, 'success': False,
+                           'message': 'Snapshot not found'})
+        for snapshot_id in orphaned:
+            yield _ndjson({'type': 'item', 'snapshot_id': snapshot_id, 'success': False,
+                           'message': 'Repository not found'})
+        
+        for future in as_completed(futures):
+            job, repo_id, ids = futures[future]
+            try:
+                success, message = future.result()
+            except Exception as e:
+                success, message = False, str(e)
+            
+            if success:
+                try:
+                    Snapshot.query.filter(
+                        Snapshot.repository_id == repo_id,
+                        Snapshot.snapshot_id.in_(ids)
+                    ).delete(synchronize_session=False)
+                    db.session.commit()
+                    schedule_stats_refresh(repo_id)
+                    event_broker.publish('snapshot.forgotten', repository_id=repo_id, snapshot_ids=ids)
+                except Exception as e:
+                    db.session.rollback()
+                    logger.error(f"Error deleting forgotten snapshots of repository {repo_id}: {str(e)}")
+                succeeded += len(ids)
+            
+            for snapshot_id in ids:
+                yield _ndjson({'type': 'item', 'snapshot_id': snapshot_id, 'repository_id': repo_id,
+                               'job_id': job.id, 'success': success, 'message': message})
+        
+        yield _ndjson({'type': 'summary', 'total': total, 'succeeded': succeeded,
+                       'failed': total - succeeded})
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@bp.route('/api/repositories/<int:repo_id>/snapshots/sync', methods=['POST'])
 def sync_snapshots(repo_id):
     """API endpoint to sync snapshots from repository"""
     try:
@@ -661,24 +1135,43 @@ def sync_snapshots(repo_id):
             # 如果没有快照，返回空列表而不是错误
             return jsonify({'success': True, 'count': 0}), 200
         
+        # 保留已补全的快照大小，避免同步后重新计算
+        enriched = {
+            row[0]: dict(zip(ENRICHED_FIELDS, row[1:]))
+            for row in db.session.query(Snapshot.snapshot_id, *(getattr(Snapshot, f) for f in ENRICHED_FIELDS))
+            .filter(Snapshot.repository_id == repo_id, Snapshot.enriched_at.isnot(None)).all()
+        }
+        
         # Clear existing snapshots for this repository
         Snapshot.query.filter_by(repository_id=repo_id).delete()
         
         # Add new snapshots
+        needs_enrichment = False
         for snapshot_data in snapshots_data:
             snapshot = Snapshot(
                 repository_id=repo_id,
                 snapshot_id=snapshot_data.get('id', ''),
                 created_at=datetime.fromisoformat(snapshot_data.get('time', '').replace('Z', '+00:00')),
                 hostname=snapshot_data.get('hostname', ''),
-                paths=json.dumps(snapshot_data.get('paths', [])),
-                tags=json.dumps(snapshot_data.get('tags', [])),
-                size=snapshot_data.get('size', 0)
+                paths=snapshot_data.get('paths', []),
+                tags=snapshot_data.get('tags', []),
+                size=snapshot_data.get('size')
             )
+            if snapshot.snapshot_id in enriched:
+                for field, value in enriched[snapshot.snapshot_id].items():
+                    setattr(snapshot, field, value)
+            elif not apply_summary(snapshot, snapshot_data.get('summary')):
+                needs_enrichment = True
             db.session.add(snapshot)
         
         db.session.commit()
         
+        # 快照集合变化时在后台重新计算统计信息
+        schedule_stats_refresh(repo_id)
+        if needs_enrichment:
+            snapshot_enricher.enqueue(repo_id)
+        event_broker.publish('snapshot.synced', repository_id=repo_id, count=len(snapshots_data))
+        
         return jsonify({'success': True, 'count': len(snapshots_data)})
     except Exception as e:
         db.session.rollback()
@@ -686,58 +1179,149 @@ def sync_snapshots(repo_id):
         return jsonify({'error': str(e)}), 500
 
 # Scheduler routes
-@app.route('/scheduler')
+@bp.route('/scheduler')
 def scheduler_page():
     """Scheduled tasks management page"""
     tasks = ScheduledTask.query.all()
     repositories = Repository.query.all()
     return render_template('scheduler.html', tasks=tasks, repositories=repositories)
 
-@app.route('/api/scheduled-tasks', methods=['GET'])
+@bp.route('/api/scheduled-tasks', methods=['GET'])
+@conditional('scheduled_task', 'repository')
 def get_scheduled_tasks():
     """API endpoint to get all scheduled tasks"""
     try:
-        tasks = ScheduledTask.query.all()
-        result = []
-        
-        for task in tasks:
-            try:
-                # 安全处理JSON解析，避免错误中断整个操作
-                tags = []
-                
-                if task.tags and task.tags.strip():
-                    try:
-                        tags = json.loads(task.tags)
-                    except json.JSONDecodeError:
-                        tags = []
-                
-                task_data = {
-                    'id': task.id,
-                    'repository_id': task.repository_id,
-                    'repository_name': task.repository.name,
-                    'name': task.name,
-                    'source_path': task.source_path,
-                    'schedule_type': task.schedule_type,
-                    'cron_expression': task.cron_expression,
-                    'interval_seconds': task.interval_seconds,
-                    'enabled': task.enabled,
-                    'last_run': task.last_run.isoformat() if task.last_run else None,
-                    'next_run': task.next_run.isoformat() if task.next_run else None,
-                    'created_at': task.created_at.isoformat(),
-                    'tags': tags
-                }
-                result.append(task_data)
-            except Exception as individual_error:
-                logger.warning(f"Error processing individual task {task.id}: {str(individual_error)}")
-                # 跳过有问题的任务，继续处理其他任务
-                continue
-                
-        return jsonify(result)
+        query = task_serializer.query() \
+            .join(Repository, ScheduledTask.repository_id == Repository.id) \
+            .order_by(ScheduledTask.id)
+        return task_serializer.response(query)
     except Exception as e:
         logger.error(f"Error fetching scheduled tasks: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/scheduled-tasks', methods=['POST'])
+@bp.route('/api/scheduled-tasks/plan', methods=['GET'])
+def get_schedule_plan():
+    """
+    API endpoint to preview the staggered start times of the scheduled tasks
+    
+    Not served with @conditional: the plan is computed from the current
+    time, so it changes even when no table does.
+    """
+    try:
+        hours = request.args.get('hours', 24, type=int)
+        now = datetime.now(timezone.utc)
+        tasks = ScheduledTask.query.options(joinedload(ScheduledTask.repository)) \
+            .filter(ScheduledTask.enabled.is_(True)).all()
+        entries = plan(tasks, backup_history(), now=now, concurrency=schedule_planner.concurrency)
+
+        horizon = now + timedelta(hours=hours)
+        timeline = []
+        for entry in entries:
+            if entry['planned_start'] > horizon:
+                continue
+            # 与其他接口一致，时间以不带时区的UTC表示
+            for key in ('scheduled_time', 'planned_start', 'predicted_end', 'predicted_end_p90', 'sla_deadline'):
+                if entry[key]:
+                    entry[key] = entry[key].astimezone(timezone.utc).replace(tzinfo=None).isoformat()
+            timeline.append(entry)
+
+        return jsonify({
+            'generated_at': now.replace(tzinfo=None).isoformat(),
+            'hours': hours,
+            'target_concurrency': schedule_planner.concurrency,
+            'at_risk': [entry['task_id'] for entry in timeline if entry['sla_at_risk']],
+            'timeline': timeline
+        })
+    except Exception as e:
+        logger.error(f"Error planning scheduled tasks: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+ON_CHANGE_FIELDS = ('min_interval', 'debounce_seconds', 'change_threshold')
+
+def _on_change_error(data, max_interval=None, min_interval=None):
+    """Validate the on_change settings of a task request, returning an error message or None"""
+    for field in ON_CHANGE_FIELDS + ('interval_seconds',):
+        value = data.get(field)
+        if value is not None and (not isinstance(value, int) or isinstance(value, bool) or value < 0):
+            return f'{field} must be a non-negative integer'
+    max_interval = data.get('interval_seconds', max_interval)
+    min_interval = data.get('min_interval', min_interval)
+    if max_interval and min_interval and min_interval > max_interval:
+        return 'min_interval must not exceed interval_seconds'
+    return None
+
+EXCLUDE_FIELDS = ('exclude_patterns', 'exclude_file_ids', 'exclude_caches', 'exclude_larger_than', 'one_file_system')
+
+def _exclude_error(data):
+    """Validate the exclude settings of a task request, returning an error message or None"""
+    patterns = data.get('exclude_patterns')
+    if patterns is not None and (not isinstance(patterns, list) or not all(isinstance(p, str) for p in patterns)):
+        return 'exclude_patterns must be a list of strings'
+    file_ids = data.get('exclude_file_ids')
+    if file_ids is not None:
+        if not isinstance(file_ids, list) or not all(isinstance(i, int) for i in file_ids):
+            return 'exclude_file_ids must be a list of exclude file ids'
+        found = {row.id for row in ExcludeFile.query.filter(ExcludeFile.id.in_(file_ids)).all()}
+        missing = [str(i) for i in file_ids if i not in found]
+        if missing:
+            return f'Exclude file(s) not found: {", ".join(missing)}'
+    if data.get('exclude_larger_than'):
+        try:
+            parse_size(data['exclude_larger_than'])
+        except ValueError as e:
+            return str(e)
+    return None
+
+def _apply_excludes(task, data):
+    """Copy the exclude settings present in a validated request onto a task"""
+    if 'exclude_patterns' in data:
+        task.exclude_patterns = parse_patterns('\n'.join(data['exclude_patterns'] or [])) or None
+    if 'exclude_file_ids' in data:
+        task.exclude_file_ids = list(dict.fromkeys(data['exclude_file_ids'] or [])) or None
+    if 'exclude_caches' in data:
+        task.exclude_caches = bool(data['exclude_caches'])
+    if 'exclude_larger_than' in data:
+        task.exclude_larger_than = str(data['exclude_larger_than']).strip() if data['exclude_larger_than'] else None
+    if 'one_file_system' in data:
+        task.one_file_system = bool(data['one_file_system'])
+
+HOOK_FIELDS = ('pre_hook', 'post_hook', 'hook_timeout', 'stdin_command', 'stdin_filename')
+
+def _hooks_error(data, task=None):
+    """Validate the hooks and stdin settings of a task request, merged over an existing task; returns an error or None"""
+    for field in ('pre_hook', 'post_hook', 'stdin_command', 'stdin_filename'):
+        if data.get(field) is not None and not isinstance(data[field], str):
+            return f'{field} must be a string'
+    timeout = data.get('hook_timeout')
+    if timeout is not None and (not isinstance(timeout, int) or isinstance(timeout, bool) or timeout <= 0):
+        return 'hook_timeout must be a positive integer'
+    
+    def value(field):
+        return data[field] if field in data else (getattr(task, field) if task else None)
+    
+    if value('stdin_command'):
+        try:
+            parse_stdin_command(value('stdin_command'))
+        except ValueError as e:
+            return str(e)
+        # stdin 备份没有可监视或比较的源路径
+        if value('schedule_type') == 'on_change':
+            return 'Tasks backing up a stdin_command cannot use the on_change schedule type'
+        if value('change_detection'):
+            return 'Tasks backing up a stdin_command cannot use change_detection'
+    return None
+
+def _apply_hooks(task, data):
+    """Copy the hooks and stdin settings present in a validated request onto a task"""
+    for field in HOOK_FIELDS:
+        if field in data:
+            value = data[field]
+            setattr(task, field, (value.strip() or None) if isinstance(value, str) else value)
+    if task.stdin_command:
+        # 源路径为快照中记录的 stdin 文件路径，备份历史和计划按它归类
+        task.source_path = stdin_source_path(task.stdin_filename)
+
+@bp.route('/api/scheduled-tasks', methods=['POST'])
 def create_scheduled_task():
     """API endpoint to create a new scheduled task"""
     try:
@@ -746,6 +1330,9 @@ def create_scheduled_task():
         # Validate required fields
         required_fields = ['repository_id', 'name', 'source_path', 'schedule_type']
         for field in required_fields:
+            # 从命令输出备份的任务不需要源路径
+            if field == 'source_path' and data.get('stdin_command'):
+                continue
             if field not in data or not data[field]:
                 return jsonify({'error': f'Missing required field: {field}'}), 400
         
@@ -761,29 +1348,56 @@ def create_scheduled_task():
         elif data['schedule_type'] == 'interval':
             if not data.get('interval_seconds'):
                 return jsonify({'error': 'Missing interval_seconds for interval schedule type'}), 400
+        elif data['schedule_type'] == 'on_change':
+            # interval_seconds 可选，表示两次运行的最长间隔
+            error = _on_change_error(data)
+            if error:
+                return jsonify({'error': error}), 400
         else:
-            return jsonify({'error': 'Invalid schedule_type. Must be "cron" or "interval"'}), 400
+            return jsonify({'error': 'Invalid schedule_type. Must be "cron", "interval" or "on_change"'}), 400
+        
+        if data.get('catchup_policy') and data['catchup_policy'] not in CATCHUP_POLICIES:
+            return jsonify({'error': f'Invalid catchup_policy. Must be one of {", ".join(CATCHUP_POLICIES)}'}), 400
+        
+        if data.get('sla_deadline'):
+            try:
+                parse_deadline(data['sla_deadline'])
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+        
+        if data.get('change_detection') and data['change_detection'] not in CHANGE_DETECTION_MODES:
+            return jsonify({'error': f'Invalid change_detection. Must be one of {", ".join(CHANGE_DETECTION_MODES)}'}), 400
+        
+        error = _exclude_error(data) or _write_options_error(data) or _hooks_error(data)
+        if error:
+            return jsonify({'error': error}), 400
         
         # Create scheduled task
         task = ScheduledTask(
             repository_id=data['repository_id'],
             name=data['name'],
-            source_path=data['source_path'],
+            source_path=data.get('source_path'),
             schedule_type=data['schedule_type'],
             cron_expression=data.get('cron_expression'),
             interval_seconds=data.get('interval_seconds'),
             enabled=data.get('enabled', True),
-            tags=json.dumps(data.get('tags', [])) if data.get('tags') is not None else None
+            tags=data.get('tags'),
+            catchup_policy=data.get('catchup_policy') or None,
+            sla_deadline=data.get('sla_deadline') or None,
+            change_detection=data.get('change_detection') or None,
+            min_interval=data.get('min_interval'),
+            debounce_seconds=data.get('debounce_seconds'),
+            change_threshold=data.get('change_threshold')
         )
+        _apply_excludes(task, data)
+        _apply_write_options(task, data)
+        _apply_hooks(task, data)
         
+        # 调度器进程收到 task.created 事件后创建作业，并写回包含错峰偏移的下次运行时间
+        task.next_run = preview_next_run(task)
         db.session.add(task)
         db.session.commit()
-        
-        # Schedule the task
-        next_run = schedule_backup_task(task)
-        if next_run:
-            task.next_run = next_run
-            db.session.commit()
+        event_broker.publish('task.created', id=task.id, repository_id=task.repository_id)
         
         return jsonify({
             'id': task.id,
@@ -791,6 +1405,25 @@ def create_scheduled_task():
             'name': task.name,
             'schedule_type': task.schedule_type,
             'enabled': task.enabled,
+            'catchup_policy': task.catchup_policy,
+            'sla_deadline': task.sla_deadline,
+            'change_detection': task.change_detection,
+            'min_interval': task.min_interval,
+            'debounce_seconds': task.debounce_seconds,
+            'change_threshold': task.change_threshold,
+            'exclude_patterns': task.exclude_patterns or [],
+            'exclude_file_ids': task.exclude_file_ids or [],
+            'exclude_caches': bool(task.exclude_caches),
+            'exclude_larger_than': task.exclude_larger_than,
+            'one_file_system': bool(task.one_file_system),
+            'compression': task.compression,
+            'pack_size': task.pack_size,
+            'pre_hook': task.pre_hook,
+            'post_hook': task.post_hook,
+            'hook_timeout': task.hook_timeout,
+            'stdin_command': task.stdin_command,
+            'stdin_filename': task.stdin_filename,
+            'source_path': task.source_path,
             'next_run': task.next_run.isoformat() if task.next_run else None
         }), 201
     except Exception as e:
@@ -798,7 +1431,7 @@ def create_scheduled_task():
         logger.error(f"Error creating scheduled task: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/scheduled-tasks/<int:task_id>', methods=['PUT'])
+@bp.route('/api/scheduled-tasks/<int:task_id>', methods=['PUT'])
 def update_scheduled_task(task_id):
     """API endpoint to update a scheduled task"""
     try:
@@ -828,26 +1461,52 @@ def update_scheduled_task(task_id):
             elif task.schedule_type == 'interval' and 'interval_seconds' in data:
                 task.interval_seconds = data['interval_seconds']
                 task.cron_expression = None
+            elif task.schedule_type == 'on_change':
+                task.cron_expression = None
+                task.interval_seconds = data.get('interval_seconds')
+            elif task.schedule_type not in ('cron', 'interval'):
+                return jsonify({'error': 'Invalid schedule_type. Must be "cron", "interval" or "on_change"'}), 400
+        
+        if task.schedule_type == 'on_change':
+            error = _on_change_error(data, task.interval_seconds, task.min_interval)
+            if error:
+                return jsonify({'error': error}), 400
+            for field in ON_CHANGE_FIELDS + ('interval_seconds',):
+                if field in data:
+                    setattr(task, field, data[field])
         
         if 'tags' in data:
-            task.tags = json.dumps(data['tags']) if data['tags'] is not None else None
+            task.tags = data['tags']
         
-        db.session.commit()
+        if 'catchup_policy' in data:
+            if data['catchup_policy'] and data['catchup_policy'] not in CATCHUP_POLICIES:
+                return jsonify({'error': f'Invalid catchup_policy. Must be one of {", ".join(CATCHUP_POLICIES)}'}), 400
+            task.catchup_policy = data['catchup_policy'] or None
         
-        # Reschedule the task
-        if task.enabled:
-            next_run = schedule_backup_task(task)
-            if next_run:
-                task.next_run = next_run
-                db.session.commit()
-        else:
-            # Remove from scheduler if disabled
-            try:
-                scheduler.remove_job(f'backup_task_{task.id}')
-                task.next_run = None
-                db.session.commit()
-            except:
-                pass
+        if 'sla_deadline' in data:
+            if data['sla_deadline']:
+                try:
+                    parse_deadline(data['sla_deadline'])
+                except ValueError as e:
+                    return jsonify({'error': str(e)}), 400
+            task.sla_deadline = data['sla_deadline'] or None
+        
+        if 'change_detection' in data:
+            if data['change_detection'] and data['change_detection'] not in CHANGE_DETECTION_MODES:
+                return jsonify({'error': f'Invalid change_detection. Must be one of {", ".join(CHANGE_DETECTION_MODES)}'}), 400
+            task.change_detection = data['change_detection'] or None
+        
+        error = _exclude_error(data) or _write_options_error(data) or _hooks_error(data, task)
+        if error:
+            return jsonify({'error': error}), 400
+        _apply_excludes(task, data)
+        _apply_write_options(task, data)
+        _apply_hooks(task, data)
+        
+        # 作业由调度器进程在收到 task.updated 事件后重新安排
+        task.next_run = preview_next_run(task)
+        db.session.commit()
+        event_broker.publish('task.updated', id=task.id, repository_id=task.repository_id)
         
         return jsonify({
             'id': task.id,
@@ -855,6 +1514,25 @@ def update_scheduled_task(task_id):
             'name': task.name,
             'schedule_type': task.schedule_type,
             'enabled': task.enabled,
+            'catchup_policy': task.catchup_policy,
+            'sla_deadline': task.sla_deadline,
+            'change_detection': task.change_detection,
+            'min_interval': task.min_interval,
+            'debounce_seconds': task.debounce_seconds,
+            'change_threshold': task.change_threshold,
+            'exclude_patterns': task.exclude_patterns or [],
+            'exclude_file_ids': task.exclude_file_ids or [],
+            'exclude_caches': bool(task.exclude_caches),
+            'exclude_larger_than': task.exclude_larger_than,
+            'one_file_system': bool(task.one_file_system),
+            'compression': task.compression,
+            'pack_size': task.pack_size,
+            'pre_hook': task.pre_hook,
+            'post_hook': task.post_hook,
+            'hook_timeout': task.hook_timeout,
+            'stdin_command': task.stdin_command,
+            'stdin_filename': task.stdin_filename,
+            'source_path': task.source_path,
             'next_run': task.next_run.isoformat() if task.next_run else None
         })
     except Exception as e:
@@ -862,7 +1540,7 @@ def update_scheduled_task(task_id):
         logger.error(f"Error updating scheduled task: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/scheduled-tasks/<int:task_id>', methods=['DELETE'])
+@bp.route('/api/scheduled-tasks/<int:task_id>', methods=['DELETE'])
 def delete_scheduled_task(task_id):
     """API endpoint to delete a scheduled task"""
     try:
@@ -870,14 +1548,11 @@ def delete_scheduled_task(task_id):
         if not task:
             return jsonify({'error': 'Scheduled task not found'}), 404
         
-        # Remove from scheduler
-        try:
-            scheduler.remove_job(f'backup_task_{task.id}')
-        except:
-            pass
-        
+        # 调度器进程收到 task.deleted 事件后移除作业
         db.session.delete(task)
         db.session.commit()
+        discard_state(task_id)
+        event_broker.publish('task.deleted', id=task_id)
         
         return jsonify({'success': True})
     except Exception as e:
@@ -885,14 +1560,548 @@ def delete_scheduled_task(task_id):
         logger.error(f"Error deleting scheduled task: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@bp.route('/api/scheduled-tasks/exclude-estimate', methods=['POST'])
+def estimate_task_excludes():
+    """
+    API endpoint to estimate what exclude rules keep out of a backup
+    
+    Walks the source path without running restic. The body takes the
+    task fields (source_path and the exclude settings); with task_id, the
+    settings of that task are used for the fields not given.
+    """
+    try:
+        data = request.json or {}
+        base = ScheduledTask.query.get(data['task_id']) if data.get('task_id') else None
+        if data.get('task_id') and not base:
+            return jsonify({'error': 'Scheduled task not found'}), 404
+        
+        source_path = data.get('source_path') or (base.source_path if base else None)
+        if not source_path:
+            return jsonify({'error': 'Missing required field: source_path'}), 400
+        error = _exclude_error(data)
+        if error:
+            return jsonify({'error': error}), 400
+        
+        # 未保存的任务对象，只用于组合排除规则
+        task = ScheduledTask(id=base.id if base else None, source_path=source_path)
+        for field in EXCLUDE_FIELDS:
+            setattr(task, field, getattr(base, field) if base else None)
+        _apply_excludes(task, data)
+        rules = rules_for(task)
+        
+        result = estimate_excludes(source_path, rules)
+        result['options'] = rules.to_dict()
+        return jsonify(result)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error estimating exclude rules: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/api/scheduled-tasks/source-estimate', methods=['POST'])
+def estimate_task_source():
+    """
+    API endpoint to estimate how much data a backup would push to a repository
+    
+    Scans the source path in parallel and predicts the bytes added from
+    the history of the source path, or exactly with `dry_run: true`
+    (restic backup --dry-run, which reads the whole source). The result
+    includes the capacity forecast of the repository and whether the new
+    data fits. Takes the same fields as the exclude estimate plus
+    repository_id.
+    
+    A dry run can take as long as a backup, so the estimate runs as a job:
+    the response is 202 with job_id and the estimate becomes the result
+    of /api/jobs/<job_id>.
+    """
+    try:
+        data = request.json or {}
+        base = ScheduledTask.query.get(data['task_id']) if data.get('task_id') else None
+        if data.get('task_id') and not base:
+            return jsonify({'error': 'Scheduled task not found'}), 404
+        
+        source_path = data.get('source_path') or (base.source_path if base else None)
+        repository_id = data.get('repository_id') or (base.repository_id if base else None)
+        if not source_path:
+            return jsonify({'error': 'Missing required field: source_path'}), 400
+        if not repository_id:
+            return jsonify({'error': 'Missing required field: repository_id'}), 400
+        repository = Repository.query.get(repository_id)
+        if not repository:
+            return jsonify({'error': 'Repository not found'}), 404
+        error = _exclude_error(data)
+        if error:
+            return jsonify({'error': error}), 400
+        
+        task = ScheduledTask(id=base.id if base else None, source_path=source_path)
+        for field in EXCLUDE_FIELDS:
+            setattr(task, field, getattr(base, field) if base else None)
+        _apply_excludes(task, data)
+        rules = rules_for(task)
+        
+        # 在作业池中运行，dry run 会启动 restic 进程并读取整个源路径
+        app = current_app._get_current_object()
+        
+        def run(job):
+            with app.app_context():
+                repo = db.session.get(Repository, repository.id)
+                return estimate_source(repo, source_path, rules, dry_run=bool(data.get('dry_run')))
+        
+        job = job_pool.submit('estimate', run, repository_id=repository.id,
+                              description=f'Estimate backup of {source_path}')
+        return jsonify({'success': True, 'message': 'Estimate started', 'job_id': job.id}), 202
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error estimating backup source: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/api/scheduled-tasks/compression-benchmark', methods=['POST'])
+def benchmark_task_compression():
+    """
+    API endpoint to compare compression and pack size settings on a source
+    
+    Backs up a random sample of the source path (sample_bytes, default
+    RESTICLY_BENCHMARK_SAMPLE_BYTES) once per setting into temporary
+    repositories and reports throughput and compression ratio for each.
+    settings is a list of {compression, pack_size}, by default every
+    compression mode. With upload_rate (bytes/s to the repository) the
+    setting giving the shortest full backup is recommended. Takes the
+    same source and exclude fields as the exclude estimate.
+    
+    Returns 202 with job_id; progress and the results are served by
+    /api/jobs/<job_id>.
+    """
+    try:
+        data = request.json or {}
+        base = ScheduledTask.query.get(data['task_id']) if data.get('task_id') else None
+        if data.get('task_id') and not base:
+            return jsonify({'error': 'Scheduled task not found'}), 404
+        
+        source_path = data.get('source_path') or (base.source_path if base else None)
+        if not source_path:
+            return jsonify({'error': 'Missing required field: source_path'}), 400
+        error = _exclude_error(data)
+        if error:
+            return jsonify({'error': error}), 400
+        settings = normalize_settings(data.get('settings'))
+        sample_bytes = data.get('sample_bytes') or BENCHMARK_SAMPLE_BYTES
+        upload_rate = data.get('upload_rate') or None
+        for field, value in (('sample_bytes', sample_bytes), ('upload_rate', upload_rate)):
+            if value is not None and (not isinstance(value, (int, float)) or isinstance(value, bool) or value <= 0):
+                return jsonify({'error': f'{field} must be a positive number'}), 400
+        
+        task = ScheduledTask(id=base.id if base else None, source_path=source_path)
+        for field in EXCLUDE_FIELDS:
+            setattr(task, field, getattr(base, field) if base else None)
+        _apply_excludes(task, data)
+        rules = rules_for(task)
+        
+        def run(job):
+            return run_benchmark(source_path, rules, settings, int(sample_bytes), upload_rate,
+                                 on_progress=job.update_progress)
+        
+        job = job_pool.submit('benchmark', run, repository_id=base.repository_id if base else None,
+                              description=f'Benchmark compression of {source_path}')
+        return jsonify({'success': True, 'message': 'Benchmark started', 'job_id': job.id}), 202
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error benchmarking compression: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/api/capacity-forecast', methods=['GET'])
+def get_capacity_forecast():
+    """
+    API endpoint to forecast when repositories run out of space
+    
+    Query parameters:
+        repository_id: Only forecast this repository
+    """
+    try:
+        query = Repository.query
+        repository_id = request.args.get('repository_id', type=int)
+        if repository_id is not None:
+            query = query.filter_by(id=repository_id)
+        repositories = query.all()
+        if repository_id is not None and not repositories:
+            return jsonify({'error': 'Repository not found'}), 404
+        
+        forecasts = [forecast_repository(repository) for repository in repositories]
+        # 最先写满的仓库排在前面
+        forecasts.sort(key=lambda item: (item['days_until_full'] is None, item['days_until_full'] or 0))
+        return jsonify({
+            'warn_days': CAPACITY_WARN_DAYS,
+            'critical_days': CAPACITY_CRITICAL_DAYS,
+            'repositories': forecasts
+        })
+    except Exception as e:
+        logger.error(f"Error forecasting repository capacity: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+# Exclude file library
+def _serialize_exclude_file(exclude_file, used_by=None):
+    return {
+        'id': exclude_file.id,
+        'name': exclude_file.name,
+        'description': exclude_file.description,
+        'patterns': parse_patterns(exclude_file.patterns),
+        'used_by': used_by or [],
+        'created_at': exclude_file.created_at.isoformat() if exclude_file.created_at else None,
+        'updated_at': exclude_file.updated_at.isoformat() if exclude_file.updated_at else None
+    }
+
+def _exclude_file_users():
+    """Map exclude file ids to the ids of the tasks referencing them"""
+    users = defaultdict(list)
+    for task_id, file_ids in db.session.query(ScheduledTask.id, ScheduledTask.exclude_file_ids).all():
+        for file_id in file_ids or []:
+            users[file_id].append(task_id)
+    return users
+
+def _exclude_file_patterns(data):
+    """Accept patterns as a list or as the text of a restic exclude file"""
+    patterns = data.get('patterns') or []
+    if isinstance(patterns, list):
+        patterns = '\n'.join(str(p) for p in patterns)
+    return '\n'.join(parse_patterns(patterns))
+
+@bp.route('/api/exclude-files', methods=['GET'])
+def get_exclude_files():
+    """API endpoint to list the exclude file library"""
+    try:
+        users = _exclude_file_users()
+        exclude_files = ExcludeFile.query.order_by(ExcludeFile.name).all()
+        return jsonify([_serialize_exclude_file(f, users.get(f.id)) for f in exclude_files])
+    except Exception as e:
+        logger.error(f"Error fetching exclude files: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/api/exclude-files', methods=['POST'])
+def create_exclude_file():
+    """API endpoint to add an exclude file to the library"""
+    try:
+        data = request.json or {}
+        if not data.get('name'):
+            return jsonify({'error': 'Missing required field: name'}), 400
+        if ExcludeFile.query.filter_by(name=data['name']).first():
+            return jsonify({'error': f'Exclude file {data["name"]} already exists'}), 409
+        
+        exclude_file = ExcludeFile(
+            name=data['name'],
+            description=data.get('description'),
+            patterns=_exclude_file_patterns(data)
+        )
+        db.session.add(exclude_file)
+        db.session.commit()
+        return jsonify(_serialize_exclude_file(exclude_file)), 201
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error creating exclude file: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/api/exclude-files/<int:file_id>', methods=['PUT'])
+def update_exclude_file(file_id):
+    """API endpoint to update an exclude file; tasks using it pick up the change on their next run"""
+    try:
+        exclude_file = ExcludeFile.query.get(file_id)
+        if not exclude_file:
+            return jsonify({'error': 'Exclude file not found'}), 404
+        
+        data = request.json or {}
+        if data.get('name') and data['name'] != exclude_file.name:
+            if ExcludeFile.query.filter_by(name=data['name']).first():
+                return jsonify({'error': f'Exclude file {data["name"]} already exists'}), 409
+            exclude_file.name = data['name']
+        if 'description' in data:
+            exclude_file.description = data['description']
+        if 'patterns' in data:
+            exclude_file.patterns = _exclude_file_patterns(data)
+        db.session.commit()
+        return jsonify(_serialize_exclude_file(exclude_file, _exclude_file_users().get(file_id)))
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error updating exclude file: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/api/exclude-files/<int:file_id>', methods=['DELETE'])
+def delete_exclude_file(file_id):
+    """API endpoint to remove an exclude file that no task uses"""
+    try:
+        exclude_file = ExcludeFile.query.get(file_id)
+        if not exclude_file:
+            return jsonify({'error': 'Exclude file not found'}), 404
+        
+        used_by = _exclude_file_users().get(file_id)
+        if used_by:
+            return jsonify({'error': f'Exclude file is used by task(s) {", ".join(map(str, used_by))}'}), 409
+        
+        db.session.delete(exclude_file)
+        db.session.commit()
+        return jsonify({'success': True})
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error deleting exclude file: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+# Replication routes
+def _serialize_replication(replication, copied=None):
+    job = job_pool.get(replication.job_id) if replication.job_id else None
+    return {
+        'id': replication.id,
+        'name': replication.name,
+        'source_repository_id': replication.source_repository_id,
+        'destination_repository_id': replication.destination_repository_id,
+        'schedule_type': replication.schedule_type,
+        'cron_expression': replication.cron_expression,
+        'interval_seconds': replication.interval_seconds,
+        'enabled': replication.enabled,
+        'limit_upload': replication.limit_upload,
+        'limit_download': replication.limit_download,
+        'status': replication.status,
+        'message': replication.message,
+        'snapshots_copied': copied or 0,
+        'job_id': replication.job_id,
+        'progress': job.progress if job and replication.status == 'running' else None,
+        'last_run': replication.last_run.isoformat() if replication.last_run else None,
+        'next_run': replication.next_run.isoformat() if replication.next_run else None,
+        'created_at': replication.created_at.isoformat() if replication.created_at else None
+    }
+
+def _replication_copied_counts():
+    """Map replication ids to the number of snapshots they copied"""
+    return dict(db.session.query(ReplicatedSnapshot.replication_id, func.count(ReplicatedSnapshot.id))
+                .group_by(ReplicatedSnapshot.replication_id).all())
+
+def _replication_error(data, replication=None):
+    """Validate the fields of a replication, merged over an existing one; returns an error or None"""
+    def value(field):
+        return data[field] if field in data else getattr(replication, field, None)
+    
+    source_id = value('source_repository_id')
+    destination_id = value('destination_repository_id')
+    if not source_id or not destination_id:
+        return 'Missing required field: source_repository_id and destination_repository_id'
+    if source_id == destination_id:
+        return 'Source and destination repositories must differ'
+    for repo_id in (source_id, destination_id):
+        if not Repository.query.get(repo_id):
+            return f'Repository {repo_id} not found'
+    
+    schedule_type = value('schedule_type') or 'manual'
+    if schedule_type not in REPLICATION_SCHEDULE_TYPES:
+        return f'Invalid schedule_type. Must be one of {", ".join(REPLICATION_SCHEDULE_TYPES)}'
+    if schedule_type == 'cron' and not value('cron_expression'):
+        return 'Missing cron_expression for cron schedule type'
+    if schedule_type == 'interval' and not value('interval_seconds'):
+        return 'Missing interval_seconds for interval schedule type'
+    
+    for field in ('limit_upload', 'limit_download'):
+        limit = data.get(field)
+        if limit is not None and (not isinstance(limit, int) or isinstance(limit, bool) or limit < 0):
+            return f'{field} must be a non-negative number of KiB/s'
+    return None
+
+@bp.route('/api/replications', methods=['GET'])
+def get_replications():
+    """API endpoint to list replication jobs"""
+    try:
+        counts = _replication_copied_counts()
+        replications = Replication.query.order_by(Replication.name).all()
+        return jsonify([_serialize_replication(r, counts.get(r.id)) for r in replications])
+    except Exception as e:
+        logger.error(f"Error fetching replications: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/api/replications', methods=['POST'])
+def create_replication():
+    """API endpoint to create a replication job copying snapshots from one repository to another"""
+    try:
+        data = request.json or {}
+        if not data.get('name'):
+            return jsonify({'error': 'Missing required field: name'}), 400
+        if Replication.query.filter_by(name=data['name']).first():
+            return jsonify({'error': f'Replication {data["name"]} already exists'}), 409
+        error = _replication_error(data)
+        if error:
+            return jsonify({'error': error}), 400
+        
+        replication = Replication(
+            name=data['name'],
+            source_repository_id=data['source_repository_id'],
+            destination_repository_id=data['destination_repository_id'],
+            schedule_type=data.get('schedule_type') or 'manual',
+            cron_expression=data.get('cron_expression'),
+            interval_seconds=data.get('interval_seconds'),
+            enabled=data.get('enabled', True),
+            limit_upload=data.get('limit_upload') or None,
+            limit_download=data.get('limit_download') or None
+        )
+        # 调度器进程收到 replication.created 事件后创建作业
+        replication.next_run = preview_replication_next_run(replication)
+        db.session.add(replication)
+        db.session.commit()
+        event_broker.publish('replication.created', id=replication.id)
+        return jsonify(_serialize_replication(replication)), 201
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error creating replication: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/api/replications/<int:replication_id>', methods=['GET'])
+def get_replication(replication_id):
+    """API endpoint to get a replication job with the progress of its current run"""
+    try:
+        replication = Replication.query.get(replication_id)
+        if not replication:
+            return jsonify({'error': 'Replication not found'}), 404
+        return jsonify(_serialize_replication(replication, _replication_copied_counts().get(replication_id)))
+    except Exception as e:
+        logger.error(f"Error fetching replication: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/api/replications/<int:replication_id>', methods=['PUT'])
+def update_replication(replication_id):
+    """API endpoint to update a replication job"""
+    try:
+        replication = Replication.query.get(replication_id)
+        if not replication:
+            return jsonify({'error': 'Replication not found'}), 404
+        
+        data = request.json or {}
+        if data.get('name') and data['name'] != replication.name:
+            if Replication.query.filter_by(name=data['name']).first():
+                return jsonify({'error': f'Replication {data["name"]} already exists'}), 409
+            replication.name = data['name']
+        error = _replication_error(data, replication)
+        if error:
+            return jsonify({'error': error}), 400
+        
+        # 更换仓库后已记录的复制不再有效，下次运行重新比对
+        if any(field in data and data[field] != getattr(replication, field)
+               for field in ('source_repository_id', 'destination_repository_id')):
+            ReplicatedSnapshot.query.filter_by(replication_id=replication_id).delete()
+        for field in ('source_repository_id', 'destination_repository_id', 'schedule_type',
+                      'cron_expression', 'interval_seconds', 'enabled'):
+            if field in data:
+                setattr(replication, field, data[field])
+        for field in ('limit_upload', 'limit_download'):
+            if field in data:
+                setattr(replication, field, data[field] or None)
+        replication.next_run = preview_replication_next_run(replication)
+        db.session.commit()
+        event_broker.publish('replication.updated', id=replication.id)
+        return jsonify(_serialize_replication(replication, _replication_copied_counts().get(replication_id)))
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error updating replication: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/api/replications/<int:replication_id>', methods=['DELETE'])
+def delete_replication(replication_id):
+    """API endpoint to delete a replication job; snapshots already copied stay in the destination"""
+    try:
+        replication = Replication.query.get(replication_id)
+        if not replication:
+            return jsonify({'error': 'Replication not found'}), 404
+        
+        db.session.delete(replication)
+        db.session.commit()
+        event_broker.publish('replication.deleted', id=replication_id)
+        return jsonify({'success': True})
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error deleting replication: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/api/replications/run', methods=['POST'])
+def run_replications():
+    """
+    API endpoint to run replication jobs now
+    
+    Runs the replications given as replication_ids, or all enabled ones,
+    as parallel jobs; progress is reported on the job and as
+    replication.progress events.
+    """
+    try:
+        data = request.json or {}
+        query = Replication.query
+        if data.get('replication_ids'):
+            query = query.filter(Replication.id.in_([int(i) for i in data['replication_ids']]))
+        else:
+            query = query.filter_by(enabled=True)
+        
+        jobs = []
+        for replication in query.all():
+            job = start_replication(replication)
+            jobs.append({'replication_id': replication.id, 'job_id': job.id})
+        return jsonify({'jobs': jobs}), 202
+    except Exception as e:
+        logger.error(f"Error starting replications: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/api/replications/<int:replication_id>/run', methods=['POST'])
+def run_replication_now(replication_id):
+    """API endpoint to run a replication job now"""
+    try:
+        replication = Replication.query.get(replication_id)
+        if not replication:
+            return jsonify({'error': 'Replication not found'}), 404
+        job = start_replication(replication)
+        return jsonify({'replication_id': replication.id, 'job_id': job.id}), 202
+    except Exception as e:
+        logger.error(f"Error starting replication: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+# Event stream
+@bp.route('/api/events')
+def event_stream():
+    """Server-Sent Events stream of domain events (backup, snapshot, task, repository, ...)"""
+    types = [t for t in request.args.get('types', '').split(',') if t] or None
+    subscription = event_broker.subscribe(types)
+    
+    def generate():
+        try:
+            # 告知浏览器断线后的重连间隔
+            yield f'retry: 3000\n\n'
+            while True:
+                event = subscription.get(timeout=HEARTBEAT_INTERVAL)
+                if event is None:
+                    yield ': ping\n\n'
+                else:
+                    yield format_sse(event)
+        finally:
+            event_broker.unsubscribe(subscription)
+    
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+# Job routes
+@bp.route('/api/jobs', methods=['GET'])
+def get_jobs():
+    """API endpoint to list background jobs"""
+    jobs = job_pool.list(kind=request.args.get('kind'))
+    return jsonify([job.to_dict() for job in reversed(jobs)])
+
+@bp.route('/api/jobs/<string:job_id>', methods=['GET'])
+def get_job(job_id):
+    """API endpoint to get a background job"""
+    job = job_pool.get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict())
+
 # Settings routes
-@app.route('/settings')
+@bp.route('/settings')
 def settings():
     """Settings page"""
     settings = {setting.key: setting.value for setting in Settings.query.all()}
     return render_template('settings.html', settings=settings)
 
-@app.route('/api/settings', methods=['GET'])
+@bp.route('/api/settings', methods=['GET'])
+@conditional('settings')
 def get_settings():
     """API endpoint to get all settings"""
     try:
@@ -902,7 +2111,7 @@ def get_settings():
         logger.error(f"Error fetching settings: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/settings', methods=['POST'])
+@bp.route('/api/settings', methods=['POST'])
 def update_settings():
     """API endpoint to update settings"""
     try:
@@ -925,10 +2134,10 @@ def update_settings():
         return jsonify({'error': str(e)}), 500
 
 # Error handlers
-@app.errorhandler(404)
+@bp.app_errorhandler(404)
 def not_found(error):
     return render_template('404.html'), 404
 
-@app.errorhandler(500)
+@bp.app_errorhandler(500)
 def server_error(error):
     return render_template('500.html'), 500
@@ -1,65 +1,362 @@
+import os
+import random
 import logging
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
 from apscheduler.triggers.interval import IntervalTrigger
 from apscheduler.jobstores.memory import MemoryJobStore
+from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+from apscheduler.executors.pool import ThreadPoolExecutor
+from apscheduler.events import EVENT_JOB_SUBMITTED, EVENT_JOB_MISSED
 from flask import current_app
 
 from restic_wrapper import ResticWrapper
+from events import event_broker, backup_payload, progress_payload
+from jobs import job_pool
+from changes import plan_run, commit_run, PARTIAL_TAG
+from excludes import rules_for
+from hooks import run_hook, hook_env, parse_stdin_command, DEFAULT_STDIN_FILENAME
+from capacity import check_capacity
+from watcher import file_watcher
+from planner import (OffsetTrigger, schedule_planner, backup_history, estimate_for,
+                     sla_deadline_after, sla_status_of, target_of, DEFAULT_DURATION)
 
 logger = logging.getLogger(__name__)
 
+# 停机期间错过的运行如何补跑：skip（跳过）、once（补跑一次）、all（逐次补跑）
+CATCHUP_POLICIES = ('skip', 'once', 'all')
+DEFAULT_CATCHUP_POLICY = os.environ.get('RESTICLY_CATCHUP_POLICY', 'once')
+# 'all' 策略最多补跑的次数
+CATCHUP_MAX_RUNS = int(os.environ.get('RESTICLY_CATCHUP_MAX_RUNS', '10'))
+# 补跑在启动后随机延迟的最大秒数，避免所有仓库同时开始
+CATCHUP_JITTER = int(os.environ.get('RESTICLY_CATCHUP_JITTER', '300'))
+# 调度器运行期间允许的延迟（秒），超过则视为错过
+MISFIRE_GRACE_TIME = int(os.environ.get('RESTICLY_MISFIRE_GRACE_TIME', '300'))
+# 持久化作业的表名
+JOBS_TABLE = 'apscheduler_jobs'
+# 重新规划计划任务错峰时间的间隔（秒），备份时长变化后及时调整
+REPLAN_INTERVAL = int(os.environ.get('RESTICLY_REPLAN_INTERVAL', str(6 * 3600)))
+# 运行备份和复制的线程数。等待备份目标槽位的运行会一直占用线程，因此与 replan、SLA 检查
+# 使用不同的执行器；线程按需创建，等待中的线程只占用很少的内存
+RUN_WORKERS = int(os.environ.get('RESTICLY_SCHEDULER_RUN_WORKERS', '100'))
+RUN_EXECUTOR = 'runs'
+
 # Create scheduler
+# 未运行调度器的进程只使用内存存储；init_scheduler 会切换到数据库存储
 scheduler = BackgroundScheduler(
     jobstores={'default': MemoryJobStore()},
-    job_defaults={'coalesce': True, 'max_instances': 5},
+    executors={'default': ThreadPoolExecutor(10), RUN_EXECUTOR: ThreadPoolExecutor(RUN_WORKERS)},
+    job_defaults={'coalesce': True, 'max_instances': 5, 'misfire_grace_time': MISFIRE_GRACE_TIME},
     timezone='UTC'
 )
 
+# 运行调度器的应用，由 init_scheduler 设置
+_app = None
+
 def init_scheduler(app):
-    """Initialize the scheduler with the Flask app context"""
-    scheduler.start()
-    logger.info("Scheduler started")
+    """
+    Start the scheduler and load the enabled tasks
+    
+    Only one process per deployment should call this (see app.start_services).
+    Task changes made in other processes arrive as task events.
+    
+    Args:
+        app: Flask application
+    """
+    global _app
+    from app import db
+    
+    _app = app
+    with app.app_context():
+        engine = db.engine
+    # 作业状态（触发器、下次运行时间）保存在数据库中，重启后不会丢失
+    # configure() 会替换全部执行器，需要一并传入
+    scheduler.configure(jobstores={'default': SQLAlchemyJobStore(engine=engine, tablename=JOBS_TABLE)},
+                        executors={'default': ThreadPoolExecutor(10), RUN_EXECUTOR: ThreadPoolExecutor(RUN_WORKERS)})
+    scheduler.add_listener(_on_job_submitted, EVENT_JOB_SUBMITTED | EVENT_JOB_MISSED)
     
-    # Register scheduler to be shut down when Flask exits
-    app.teardown_appcontext(lambda _: safe_shutdown_scheduler())
+    # 暂停启动：先处理停机期间错过的运行，再开始调度
+    scheduler.start(paused=True)
     
     # Load scheduled tasks from database and add them to the scheduler
     with app.app_context():
-        from models import ScheduledTask, Repository
+        from models import ScheduledTask
         from sqlalchemy.exc import SQLAlchemyError
         
         try:
-            tasks = ScheduledTask.query.filter_by(enabled=True).all()
-            for task in tasks:
-                schedule_backup_task(task)
-            logger.info(f"Loaded {len(tasks)} scheduled tasks")
+            tasks = {task.id: task for task in ScheduledTask.query.all()}
+            catchup_missed_runs(tasks)
+            enabled = [task for task in tasks.values() if task.enabled]
+            schedule_planner.replan(enabled, backup_history())
+            for task in tasks.values():
+                task.next_run = schedule_backup_task(task)
+            for job in scheduler.get_jobs():
+                task_id = _task_id_of(job.id)
+                if job.id.startswith('backup_task_') and task_id not in tasks:
+                    job.remove()
+            db.session.commit()
+            logger.info(f"Loaded {len(enabled)} scheduled tasks")
         except SQLAlchemyError as e:
+            db.session.rollback()
             logger.error(f"Error loading scheduled tasks: {str(e)}")
+    
+    # 仓库间的复制作业
+    with app.app_context():
+        from models import Replication
+        from sqlalchemy.exc import SQLAlchemyError
+        
+        try:
+            replications = Replication.query.all()
+            for replication in replications:
+                replication.next_run = schedule_replication(replication)
+            ids = {replication.id for replication in replications}
+            for job in scheduler.get_jobs():
+                if job.id.startswith('replication_') and _task_id_of(job.id) not in ids:
+                    job.remove()
+            db.session.commit()
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            logger.error(f"Error loading replications: {str(e)}")
+    
+    # on_change 任务由文件监视器在变更积累到一定程度后排队运行
+    file_watcher.start(queue_change_backup)
+    
+    if REPLAN_INTERVAL > 0:
+        scheduler.add_job(replan, trigger='interval', seconds=REPLAN_INTERVAL,
+                          id='replan_schedule', replace_existing=True)
+    
+    scheduler.resume()
+    logger.info("Scheduler started")
+    
+    # 其他工作进程中新建/修改/删除的任务通过事件同步到本进程
+    event_broker.on(['task'], _on_task_event, name='SchedulerTaskSync')
+    event_broker.on(['replication'], _on_replication_event, name='SchedulerReplicationSync')
+
+def _task_id_of(job_id):
+    try:
+        return int(job_id.rsplit('_', 1)[1])
+    except (IndexError, ValueError):
+        return None
+
+def _to_naive_utc(value):
+    """Convert an aware datetime to the naive UTC used by the models"""
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+def _missed_run_times(job, now, limit):
+    """Return up to limit fire times of a job between its stored next run and now"""
+    run_times = []
+    run_time = job.next_run_time
+    while run_time and run_time <= now and len(run_times) < limit:
+        run_times.append(run_time)
+        run_time = job.trigger.get_next_fire_time(run_time, now)
+    return run_times
+
+def catchup_missed_runs(tasks):
+    """
+    Apply the catch-up policy to runs missed while no scheduler was running
+    
+    Must be called while the scheduler is paused, before the jobs are
+    processed. The regular job is moved to its next future fire time and the
+    missed runs are either dropped ('skip'), run once ('once') or run one
+    after the other ('all', at most CATCHUP_MAX_RUNS), starting after a
+    random delay of up to CATCHUP_JITTER seconds.
+    
+    Args:
+        tasks (dict): Mapping of task id to ScheduledTask
+    
+    Returns:
+        dict: Mapping of task id to the number of catch-up runs queued
+    """
+    now = datetime.now(timezone.utc)
+    queued = {}
+    for job in scheduler.get_jobs():
+        if not job.id.startswith('backup_task_'):
+            continue
+        task = tasks.get(_task_id_of(job.id))
+        if not task or not task.enabled:
+            continue
+        missed = _missed_run_times(job, now, CATCHUP_MAX_RUNS + 1)
+        if not missed:
+            continue
+        
+        job.modify(next_run_time=job.trigger.get_next_fire_time(missed[-1], now))
+        policy = task.catchup_policy or DEFAULT_CATCHUP_POLICY
+        count = {'skip': 0, 'once': 1}.get(policy, min(len(missed), CATCHUP_MAX_RUNS))
+        logger.info(f"Task {task.id} missed {len(missed)}{'+' if len(missed) > CATCHUP_MAX_RUNS else ''} "
+                    f"run(s) since {missed[0]}, catch-up policy '{policy}': {count} run(s)")
+        if count:
+            scheduler.add_job(
+                run_catchup,
+                trigger='date',
+                run_date=now + timedelta(seconds=random.uniform(0, CATCHUP_JITTER)),
+                args=[task.id, count],
+                id=f'catchup_task_{task.id}',
+                executor=RUN_EXECUTOR,
+                replace_existing=True,
+                misfire_grace_time=None
+            )
+            queued[task.id] = count
+    return queued
+
+def run_catchup(task_id, count):
+    """Run the backups of a task missed during downtime, one after the other"""
+    for i in range(count):
+        logger.info(f"Catch-up run {i + 1}/{count} of task {task_id}")
+        run_backup_task(task_id)
+
+def _on_job_submitted(event):
+    """Keep ScheduledTask.next_run and Replication.next_run in sync with the scheduler"""
+    from app import db
+    from models import ScheduledTask, Replication
+    
+    if event.job_id.startswith('backup_task_'):
+        model = ScheduledTask
+    elif event.job_id.startswith('replication_'):
+        model = Replication
+    else:
+        return
+    job = scheduler.get_job(event.job_id)
+    if not job:
+        return
+    # 与 APScheduler 计算下次运行时间的方式一致（事件发出时作业尚未更新）
+    last_run_time = event.scheduled_run_times[-1] if getattr(event, 'scheduled_run_times', None) \
+        else event.scheduled_run_time
+    next_run = job.trigger.get_next_fire_time(last_run_time, datetime.now(timezone.utc))
+    task_id = _task_id_of(event.job_id)
+    try:
+        with _app.app_context():
+            model.query.filter_by(id=task_id).update(
+                {'next_run': _to_naive_utc(next_run)}, synchronize_session=False)
+            db.session.commit()
+    except Exception as e:
+        logger.error(f"Error saving next run of {event.job_id}: {str(e)}")
+
+def _on_task_event(event):
+    """Reschedule a task changed by any process"""
+    from models import ScheduledTask
+    
+    # task.updated 也会在每次运行开始时发出，此时计划无需改变
+    if event['type'] not in ('task.created', 'task.updated', 'task.deleted') or event['data'].get('run'):
+        return
+    task_id = event['data'].get('id')
+    with _app.app_context():
+        task = ScheduledTask.query.get(task_id) if task_id else None
+        if not task:
+            for job_id in (f'backup_task_{task_id}', f'catchup_task_{task_id}', f'change_task_{task_id}'):
+                try:
+                    scheduler.remove_job(job_id)
+                except Exception:
+                    pass
+            file_watcher.unwatch(task_id)
+    # 任务的增删改会影响同一目标上其他任务的错峰时间
+    replan()
+
+def _on_replication_event(event):
+    """Reschedule a replication changed by any process"""
+    from app import db
+    from models import Replication
+    
+    if event['type'] not in ('replication.created', 'replication.updated', 'replication.deleted'):
+        return
+    replication_id = event['data'].get('id')
+    with _app.app_context():
+        replication = Replication.query.get(replication_id) if replication_id else None
+        if replication:
+            replication.next_run = schedule_replication(replication)
+            db.session.commit()
+        else:
+            try:
+                scheduler.remove_job(f'replication_{replication_id}')
+            except Exception:
+                pass
+
+def replan():
+    """
+    Recompute the staggered start times of all tasks and reschedule them
+    
+    Runs in the scheduler process at startup, after every task change and
+    every REPLAN_INTERVAL seconds so the plan follows the actual backup
+    durations. See planner.plan().
+    
+    Returns:
+        list: The plan entries
+    """
+    from app import db
+    from models import ScheduledTask
+    from sqlalchemy.orm import joinedload
+    
+    with _app.app_context():
+        try:
+            tasks = ScheduledTask.query.options(joinedload(ScheduledTask.repository)).all()
+            entries = schedule_planner.replan([task for task in tasks if task.enabled], backup_history())
+            for task in tasks:
+                task.next_run = schedule_backup_task(task)
+            db.session.commit()
+            delayed = sum(1 for entry in entries if entry['offset'])
+            logger.info(f"Planned {len(entries)} scheduled tasks, {delayed} with a delayed start")
+            return entries
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error planning scheduled tasks: {str(e)}")
+            return []
 
 def safe_shutdown_scheduler():
     """Safely shut down the scheduler"""
     try:
+        file_watcher.stop()
         if scheduler.running:
             scheduler.shutdown(wait=False)
     except:
         logger.warning("Error shutting down scheduler, possibly not running")
 
-def run_backup_task(task_id):
+def queue_change_backup(task_id):
+    """Queue a run of an on_change task; called by the file watcher"""
+    scheduler.add_job(
+        run_change_backup,
+        trigger='date',
+        args=[task_id],
+        id=f'change_task_{task_id}',
+        executor=RUN_EXECUTOR,
+        replace_existing=True,
+        misfire_grace_time=None
+    )
+
+def run_change_backup(task_id):
+    """Run a backup queued by the file watcher"""
+    from app import db
+    from models import ScheduledTask
+    
+    try:
+        run_backup_task(task_id)
+    finally:
+        next_run = file_watcher.finished(task_id)
+        if next_run:
+            try:
+                with _app.app_context():
+                    ScheduledTask.query.filter_by(id=task_id).update(
+                        {'next_run': next_run}, synchronize_session=False)
+                    db.session.commit()
+            except Exception as e:
+                logger.error(f"Error saving next run of task {task_id}: {str(e)}")
+
+def run_backup_task(task_id, app=None):
     """
     Run a backup task
     
     Args:
         task_id (int): ID of the scheduled task
+        app: Flask application, defaults to the one running the scheduler
     """
-    from app import app, db
+    from app import db
     from models import ScheduledTask, Repository, Backup, Snapshot
     from sqlalchemy import create_engine
     from sqlalchemy.orm import sessionmaker, scoped_session
-    import json
     
     logger.info(f"Starting scheduled backup task {task_id}")
+    app = app or _app
     
     # 使用应用上下文
     with app.app_context():
@@ -68,6 +365,9 @@ def run_backup_task(task_id):
         session_factory = sessionmaker(bind=engine)
         Session = scoped_session(session_factory)
         session = Session()
+        release_slot = None
+        backup_id = None
+        change_plan = None
         
         try:
             # 获取任务详情
@@ -86,39 +386,104 @@ def run_backup_task(task_id):
                 logger.error(f"Repository {task.repository_id} not found")
                 return
             
+            # 变更检测：源路径没有变化时跳过本次运行，或只备份变化的子树（stdin 备份没有源路径可比较）
+            if task.change_detection and not task.stdin_command:
+                change_plan = plan_run(task)
+                logger.info(f"Change detection of task {task_id}: {change_plan.action} ({change_plan.reason})")
+                if change_plan.action == 'skip':
+                    event_broker.publish('task.updated', id=task.id, repository_id=task.repository_id, run=True)
+                    return
+            partial = change_plan is not None and change_plan.action == 'partial'
+            
+            # 根据历史记录预测本次运行的时长
+            estimate = estimate_for(backup_history(session, repository.id, task.source_path),
+                                    repository.id, task.source_path)
+            
+            # 同一备份目标上同时运行的备份数量有限，超出计划预测时在此排队，预测时长最长的先运行
+            release_slot = schedule_planner.acquire(repository, estimate.p50 if estimate else DEFAULT_DURATION)
+            
             # 创建备份记录
+            start_time = datetime.utcnow()
+            budget_end = start_time + timedelta(seconds=estimate.budget) \
+                if estimate and estimate.reliable else None
             backup = Backup(
                 repository_id=repository.id,
                 source_path=task.source_path,
-                status='running'
+                start_time=start_time,
+                status='running',
+                predicted_end=start_time + timedelta(seconds=estimate.p50) if estimate else None,
+                sla_deadline=sla_deadline_after(task.sla_deadline, start_time)
             )
             session.add(backup)
             session.commit()
+            backup_id = backup.id
+            _watch_backup(backup_id, budget_end, backup.sla_deadline)
+            event_broker.publish('backup.started', **backup_payload(backup, repository.name))
+            event_broker.publish('task.updated', id=task.id, repository_id=task.repository_id, run=True)
             
-            # 使用适当的仓库类型运行备份
-            if repository.repo_type == 'rest-server':
-                restic = ResticWrapper(
-                    repository.location, 
-                    repository.password, 
-                    repo_type='rest-server',
-                    rest_user=repository.rest_user,
-                    rest_pass=repository.rest_pass
-                )
-            else:
-                restic = ResticWrapper(
-                    repository.location, 
-                    repository.password, 
-                    repo_type=repository.repo_type
-                )
+            # 使用仓库的压缩和包大小设置，任务上的设置优先
+            restic = ResticWrapper.from_repository(repository)
             
             # 处理标签
-            tags = json.loads(task.tags) if task.tags else []
-            success, result = restic.create_backup(task.source_path, tags)
+            tags = list(task.tags or [])
+            if partial:
+                tags.append(PARTIAL_TAG)
+            
+            # 任务的排除规则（部分备份同样适用）
+            exclude_rules = rules_for(task, session)
+            
+            def on_progress(message):
+                event_broker.publish(
+                    'backup.progress',
+                    throttle=(f'backup-{backup_id}', 1),
+                    backup_id=backup_id,
+                    repository_id=repository.id,
+                    **progress_payload(message)
+                )
+            
+            # 计划备份不占用作业池，但登记为 scheduled 类作业，便于查看和优先级调度
+            post_hook_error = None
+            with job_pool.track('backup', repository_id=repository.id, job_class='scheduled',
+                                description=f'Scheduled backup of {task.source_path}'):
+                success, result = True, {}
+                # 前置钩子失败时不运行 restic
+                if task.pre_hook:
+                    success, message = run_hook('pre', task.pre_hook, hook_env(task, repository, backup_id),
+                                                task.hook_timeout)
+                    if not success:
+                        result = {'message': f'Backup not run: {message}'}
+                if success and task.stdin_command:
+                    success, result = restic.create_backup(task.source_path, tags, on_progress=on_progress,
+                                                           compression=task.compression, pack_size=task.pack_size,
+                                                           stdin_command=parse_stdin_command(task.stdin_command),
+                                                           stdin_filename=task.stdin_filename or DEFAULT_STDIN_FILENAME)
+                elif success:
+                    success, result = restic.create_backup(task.source_path, tags, on_progress=on_progress,
+                                                           files_from=change_plan.paths if partial else None,
+                                                           compression=task.compression, pack_size=task.pack_size,
+                                                           **exclude_rules.backup_args())
+                # 后置钩子总是运行（例如重新启动前置钩子停止的服务），通过环境变量得知备份结果
+                if task.post_hook:
+                    post_env = hook_env(task, repository, backup_id, backup_status='completed' if success else 'failed',
+                                        snapshot_id=result.get('snapshot_id'))
+                    hook_ok, message = run_hook('post', task.post_hook, post_env, task.hook_timeout)
+                    if not hook_ok:
+                        post_hook_error = message
             
             # 更新备份记录
             backup.end_time = datetime.utcnow()
             backup.status = 'completed' if success else 'failed'
             backup.message = result.get('message', '')
+            if success and partial:
+                backup.message = f"Partial backup of {len(change_plan.paths)} changed path(s)"
+            if post_hook_error:
+                # 快照已保存，备份仍算成功，但在消息中保留钩子的错误
+                backup.message = f"{backup.message}; {post_hook_error}" if backup.message else post_hook_error
+            backup.sla_status = sla_status_of(backup.end_time, budget_end, backup.sla_deadline)
+            if backup.sla_status in ('over_budget', 'sla_missed'):
+                logger.warning(f"Scheduled backup task {task_id} finished {backup.sla_status}: "
+                               f"took {backup.end_time - backup.start_time}, predicted end {backup.predicted_end}, "
+                               f"deadline {backup.sla_deadline}")
             
             if success:
                 backup.files_new = result.get('files_new', 0)
@@ -133,13 +498,29 @@ def run_backup_task(task_id):
                         snapshot_id=backup.snapshot_id,
                         created_at=backup.end_time,
                         hostname=result.get('hostname', ''),
-                        paths=json.dumps([task.source_path]),
-                        size=result.get('bytes_added', 0)
+                        paths=change_plan.paths if partial else [task.source_path],
+                        tags=tags
                     )
+                    # 优先使用备份摘要中的统计，否则交给后台补全
+                    from enrichment import apply_summary, snapshot_enricher
+                    if not apply_summary(snapshot, result):
+                        snapshot_enricher.enqueue(repository.id)
                     session.add(snapshot)
             
             session.commit()
+            # 只有成功的运行才更新指纹，失败时下次运行仍会看到同样的变化
+            if change_plan is not None and success:
+                commit_run(task, change_plan)
             logger.info(f"Completed scheduled backup task {task_id}: {backup.status}")
+            event_broker.publish('backup.finished', **backup_payload(backup, repository.name))
+            
+            if success:
+                from stats import schedule_stats_refresh
+                schedule_stats_refresh(repository.id)
+                try:
+                    check_capacity(repository, session)
+                except Exception as e:
+                    logger.warning(f"Could not forecast capacity of repository {repository.id}: {str(e)}")
         
         except Exception as e:
             logger.error(f"Error running scheduled backup task {task_id}: {str(e)}")
@@ -148,10 +529,107 @@ def run_backup_task(task_id):
             except Exception as rollback_error:
                 logger.error(f"Error rolling back session: {str(rollback_error)}")
         finally:
+            if release_slot:
+                release_slot()
+            if backup_id:
+                _unwatch_backup(backup_id)
             # 清理会话
             session.close()
             Session.remove()
 
+def _base_of(trigger):
+    return trigger.trigger if isinstance(trigger, OffsetTrigger) else trigger
+
+def _offset_of(trigger):
+    return trigger.offset if isinstance(trigger, OffsetTrigger) else 0
+
+def _watch_backup(backup_id, budget_end, deadline):
+    """Schedule checks flagging a running backup once it passes its budget or SLA deadline"""
+    if not scheduler.running:
+        return
+    for flag, run_date in (('over_budget', budget_end), ('sla_missed', deadline)):
+        if run_date:
+            scheduler.add_job(
+                check_backup_sla,
+                trigger='date',
+                run_date=run_date.replace(tzinfo=timezone.utc),
+                args=[backup_id, flag],
+                id=f'sla_backup_{flag}_{backup_id}',
+                replace_existing=True,
+                misfire_grace_time=None
+            )
+
+def _unwatch_backup(backup_id):
+    for flag in ('over_budget', 'sla_missed'):
+        try:
+            scheduler.remove_job(f'sla_backup_{flag}_{backup_id}')
+        except Exception:
+            pass
+
+def check_backup_sla(backup_id, flag):
+    """
+    Flag a backup that is still running at its budget or SLA deadline
+    
+    Args:
+        backup_id (int): ID of the backup
+        flag (str): 'over_budget' or 'sla_missed'
+    """
+    from app import db
+    from models import Backup
+    
+    with _app.app_context():
+        try:
+            backup = Backup.query.get(backup_id)
+            if not backup or backup.status != 'running' or backup.sla_status == 'sla_missed':
+                return
+            backup.sla_status = flag
+            db.session.commit()
+            logger.warning(f"Backup {backup_id} of {backup.source_path} is still running: {flag} "
+                           f"(predicted end {backup.predicted_end}, deadline {backup.sla_deadline})")
+            event_broker.publish('backup.overrun', **backup_payload(backup, backup.repository.name))
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error checking SLA of backup {backup_id}: {str(e)}")
+
+def _task_trigger(task):
+    """Build the trigger of a cron or interval task, or None if its schedule is invalid"""
+    if task.schedule_type == 'cron' and task.cron_expression:
+        try:
+            trigger = CronTrigger.from_crontab(task.cron_expression)
+        except Exception as e:
+            logger.error(f"Invalid cron expression '{task.cron_expression}': {str(e)}")
+            return None
+        # 按规划结果错开同一时刻触发的任务（只有调度器进程中有规划结果）
+        offset = schedule_planner.offset(task.id)
+        if offset:
+            trigger = OffsetTrigger(trigger, offset)
+        return trigger
+    if task.schedule_type == 'interval' and task.interval_seconds:
+        return IntervalTrigger(seconds=task.interval_seconds)
+    logger.error(f"Invalid schedule configuration for task {task.id}")
+    return None
+
+def preview_next_run(task):
+    """
+    Compute a provisional next run of a task without touching the scheduler
+    
+    Web workers do not run the scheduler, so they must not add or remove
+    jobs; the scheduler process reschedules the task when it receives the
+    task event and stores the planned next run, including its offset.
+    
+    Args:
+        task: ScheduledTask object
+        
+    Returns:
+        datetime: Next run time (naive UTC) or None for disabled and on_change tasks
+    """
+    if not task.enabled or task.schedule_type == 'on_change':
+        return None
+    trigger = _task_trigger(task)
+    if trigger is None:
+        return None
+    return _to_naive_utc(trigger.get_next_fire_time(None, datetime.now(timezone.utc)))
+
 def schedule_backup_task(task):
     """
     Schedule a backup task
@@ -160,42 +638,159 @@ def schedule_backup_task(task):
         task: ScheduledTask object
         
     Returns:
-        datetime: Next run time or None if scheduling failed
+        datetime: Next run time (naive UTC) or None if scheduling failed
     """
     job_id = f'backup_task_{task.id}'
     
-    # Remove existing job if it exists
-    try:
-        scheduler.remove_job(job_id)
-    except:
-        pass
-    
+    if not task.enabled or task.schedule_type == 'on_change':
+        # Remove existing job if it exists
+        try:
+            scheduler.remove_job(job_id)
+        except:
+            pass
+    if not task.enabled or task.schedule_type != 'on_change':
+        file_watcher.unwatch(task.id)
     if not task.enabled:
         return None
     
-    # Create trigger based on schedule type
-    if task.schedule_type == 'cron' and task.cron_expression:
+    if task.schedule_type == 'on_change':
+        # 由文件监视器触发，返回最迟的下次运行时间
+        next_run_time = file_watcher.sync(task)
+        logger.info(f"Watching {task.source_path} for backup task {task.id}, next run at the latest {next_run_time}")
+        return next_run_time
+    
+    trigger = _task_trigger(task)
+    if trigger is None:
+        return None
+    
+    # 触发器未变化时保留已有作业，间隔任务的相位和持久化的下次运行时间不受影响
+    existing = scheduler.get_job(job_id)
+    # 旧版本创建的作业在默认执行器中运行，重新创建
+    if existing and getattr(existing, 'next_run_time', None) and existing.executor == RUN_EXECUTOR:
+        if str(existing.trigger) == str(trigger):
+            return _to_naive_utc(existing.next_run_time)
+        if str(_base_of(existing.trigger)) == str(_base_of(trigger)):
+            # 只有错峰时间变化：平移待运行的那一次，避免已运行的时刻再次触发
+            next_run_time = existing.next_run_time + timedelta(
+                seconds=_offset_of(trigger) - _offset_of(existing.trigger))
+            scheduler.modify_job(job_id, trigger=trigger, next_run_time=next_run_time)
+            logger.info(f"Rescheduled backup task {task.id} with next run at {next_run_time}")
+            return _to_naive_utc(next_run_time)
+    
+    # Add the job to the scheduler
+    job = scheduler.add_job(
+        run_backup_task,
+        trigger=trigger,
+        args=[task.id],
+        id=job_id,
+        executor=RUN_EXECUTOR,
+        replace_existing=True
+    )
+    
+    # 调度器未在本进程运行时任务处于待定状态，下次运行时间由触发器计算
+    next_run_time = getattr(job, 'next_run_time', None)
+    if next_run_time is None:
+        next_run_time = trigger.get_next_fire_time(None, datetime.now(timezone.utc))
+    
+    logger.info(f"Scheduled backup task {task.id} with next run at {next_run_time}")
+    return _to_naive_utc(next_run_time)
+
+def _replication_trigger(replication):
+    """Build the trigger of a cron or interval replication, or None if its schedule is invalid"""
+    if replication.schedule_type == 'cron':
         try:
-            trigger = CronTrigger.from_crontab(task.cron_expression)
+            return CronTrigger.from_crontab(replication.cron_expression)
         except Exception as e:
-            logger.error(f"Invalid cron expression '{task.cron_expression}': {str(e)}")
+            logger.error(f"Invalid cron expression '{replication.cron_expression}': {str(e)}")
             return None
+    if replication.schedule_type == 'interval' and replication.interval_seconds:
+        return IntervalTrigger(seconds=replication.interval_seconds)
+    logger.error(f"Invalid schedule configuration for replication {replication.id}")
+    return None
+
+def preview_replication_next_run(replication):
+    """
+    Compute a provisional next run of a replication without touching the scheduler
     
-    elif task.schedule_type == 'interval' and task.interval_seconds:
-        trigger = IntervalTrigger(seconds=task.interval_seconds)
+    Like preview_next_run(); the scheduler process schedules the
+    replication when it receives the replication event.
     
-    else:
-        logger.error(f"Invalid schedule configuration for task {task.id}")
+    Returns:
+        datetime: Next run time (naive UTC) or None for manual or disabled replications
+    """
+    if not replication.enabled or replication.schedule_type not in ('cron', 'interval'):
+        return None
+    trigger = _replication_trigger(replication)
+    if trigger is None:
         return None
+    return _to_naive_utc(trigger.get_next_fire_time(None, datetime.now(timezone.utc)))
+
+def schedule_replication(replication):
+    """
+    Schedule a replication
+    
+    Args:
+        replication: Replication object
+        
+    Returns:
+        datetime: Next run time (naive UTC) or None for manual or disabled replications
+    """
+    job_id = f'replication_{replication.id}'
+    if not replication.enabled or replication.schedule_type not in ('cron', 'interval'):
+        try:
+            scheduler.remove_job(job_id)
+        except Exception:
+            pass
+        return None
+    
+    trigger = _replication_trigger(replication)
+    if trigger is None:
+        return None
+    
+    existing = scheduler.get_job(job_id)
+    if existing and getattr(existing, 'next_run_time', None) and str(existing.trigger) == str(trigger) \
+            and existing.executor == RUN_EXECUTOR:
+        return _to_naive_utc(existing.next_run_time)
     
-    # Add the job to the scheduler
     job = scheduler.add_job(
-        run_backup_task,
+        run_scheduled_replication,
         trigger=trigger,
-        args=[task.id],
+        args=[replication.id],
         id=job_id,
+        executor=RUN_EXECUTOR,
         replace_existing=True
     )
+    next_run_time = getattr(job, 'next_run_time', None)
+    if next_run_time is None:
+        next_run_time = trigger.get_next_fire_time(None, datetime.now(timezone.utc))
+    logger.info(f"Scheduled replication {replication.id} with next run at {next_run_time}")
+    return _to_naive_utc(next_run_time)
+
+def _acquire_replication_slots(source, destination):
+    """Hold a slot on the source and the destination target while copying"""
+    targets = sorted({target_of(source): source, target_of(destination): destination}.items())
+    # 按目标名称的顺序加锁，两个方向相反的复制作业不会互相等待
+    releases = [schedule_planner.acquire(repository) for _, repository in targets]
+    
+    def release():
+        for release_slot in reversed(releases):
+            release_slot()
+    return release
+
+def run_scheduled_replication(replication_id):
+    """Run a replication from its schedule, tracked as a scheduled job"""
+    from models import Replication
+    from replication import run_replication
+    
+    with _app.app_context():
+        replication = Replication.query.get(replication_id)
+        if not replication:
+            logger.error(f"Replication {replication_id} not found")
+            return
+        destination_id = replication.destination_repository_id
+        description = f'Replicate {replication.name}'
     
-    logger.info(f"Scheduled backup task {task.id} with next run at {job.next_run_time}")
-    return job.next_run_time
+    # 与计划备份一样不占用作业池，同一目标上的并发由规划器的槽位限制
+    with job_pool.track('copy', repository_id=destination_id, job_class='scheduled',
+                        description=description) as job:
+        run_replication(job, _app, replication_id, acquire_slots=_acquire_replication_slots)
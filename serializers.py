@@ -0,0 +1,157 @@
+import json
+import logging
+from datetime import datetime
+
+from flask import Response, stream_with_context
+
+from app import db
+from models import Repository, Backup, Snapshot, ScheduledTask
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+# 每次从数据库取出的行数，同时也是每个输出块包含的元素数量
+STREAM_BATCH_SIZE = 500
+
+
+def _default(obj):
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+
+def dumps(obj):
+    """
+    Encode an object as JSON bytes, using orjson when it is installed
+
+    Datetimes are encoded in ISO 8601 format by both encoders.
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default)
+    return json.dumps(obj, default=_default, separators=(',', ':')).encode('utf-8')
+
+
+class RowSerializer:
+    """
+    Serialize column-level query rows without loading ORM objects
+
+    Args:
+        fields (list): (key, column) pairs selected by the query
+        list_fields (tuple): Keys of JSON list columns, encoded as [] when NULL
+    """
+
+    def __init__(self, fields, list_fields=()):
+        self.keys = tuple(key for key, _ in fields)
+        self.columns = tuple(column for _, column in fields)
+        self.list_fields = tuple(list_fields)
+
+    def query(self):
+        return db.session.query(*self.columns)
+
+    def to_dict(self, row):
+        item = dict(zip(self.keys, row))
+        for key in self.list_fields:
+            if item[key] is None:
+                item[key] = []
+        return item
+
+    def iter_json(self, query, batch_size=STREAM_BATCH_SIZE):
+        """
+        Encode the rows of a query as a JSON array, chunk by chunk
+
+        Rows are fetched with yield_per so the full result is never held
+        in memory at once.
+        """
+        yield b'['
+        first = True
+        batch = []
+        try:
+            for row in query.yield_per(batch_size):
+                batch.append(dumps(self.to_dict(row)))
+                if len(batch) >= batch_size:
+                    yield (b'' if first else b',') + b','.join(batch)
+                    first = False
+                    batch = []
+            if batch:
+                yield (b'' if first else b',') + b','.join(batch)
+        except Exception as e:
+            # 响应头已经发出，只能记录错误并截断输出
+            logger.error(f"Error streaming query results: {str(e)}")
+            raise
+        yield b']'
+
+    def response(self, query):
+        """Stream a query as a JSON array response"""
+        return Response(stream_with_context(self.iter_json(query)), mimetype='application/json')
+
+
+snapshot_serializer = RowSerializer([
+    ('id', Snapshot.id),
+    ('repository_id', Snapshot.repository_id),
+    ('repository_name', Repository.name),
+    ('snapshot_id', Snapshot.snapshot_id),
+    ('created_at', Snapshot.created_at),
+    ('hostname', Snapshot.hostname),
+    ('paths', Snapshot.paths),
+    ('tags', Snapshot.tags),
+    ('size', Snapshot.size),
+    ('file_count', Snapshot.file_count),
+    ('data_added', Snapshot.data_added),
+    ('size_source', Snapshot.size_source),
+], list_fields=('paths', 'tags'))
+
+backup_serializer = RowSerializer([
+    ('id', Backup.id),
+    ('repository_id', Backup.repository_id),
+    ('repository_name', Repository.name),
+    ('source_path', Backup.source_path),
+    ('start_time', Backup.start_time),
+    ('end_time', Backup.end_time),
+    ('status', Backup.status),
+    ('message', Backup.message),
+    ('files_new', Backup.files_new),
+    ('files_changed', Backup.files_changed),
+    ('bytes_added', Backup.bytes_added),
+    ('snapshot_id', Backup.snapshot_id),
+    ('predicted_end', Backup.predicted_end),
+    ('sla_deadline', Backup.sla_deadline),
+    ('sla_status', Backup.sla_status),
+])
+
+task_serializer = RowSerializer([
+    ('id', ScheduledTask.id),
+    ('repository_id', ScheduledTask.repository_id),
+    ('repository_name', Repository.name),
+    ('name', ScheduledTask.name),
+    ('source_path', ScheduledTask.source_path),
+    ('schedule_type', ScheduledTask.schedule_type),
+    ('cron_expression', ScheduledTask.cron_expression),
+    ('interval_seconds', ScheduledTask.interval_seconds),
+    ('enabled', ScheduledTask.enabled),
+    ('last_run', ScheduledTask.last_run),
+    ('next_run', ScheduledTask.next_run),
+    ('created_at', ScheduledTask.created_at),
+    ('tags', ScheduledTask.tags),
+    ('catchup_policy', ScheduledTask.catchup_policy),
+    ('sla_deadline', ScheduledTask.sla_deadline),
+    ('change_detection', ScheduledTask.change_detection),
+    ('min_interval', ScheduledTask.min_interval),
+    ('debounce_seconds', ScheduledTask.debounce_seconds),
+    ('change_threshold', ScheduledTask.change_threshold),
+    ('exclude_patterns', ScheduledTask.exclude_patterns),
+    ('exclude_file_ids', ScheduledTask.exclude_file_ids),
+    ('exclude_caches', ScheduledTask.exclude_caches),
+    ('exclude_larger_than', ScheduledTask.exclude_larger_than),
+    ('one_file_system', ScheduledTask.one_file_system),
+    ('compression', ScheduledTask.compression),
+    ('pack_size', ScheduledTask.pack_size),
+    ('pre_hook', ScheduledTask.pre_hook),
+    ('post_hook', ScheduledTask.post_hook),
+    ('hook_timeout', ScheduledTask.hook_timeout),
+    ('stdin_command', ScheduledTask.stdin_command),
+    ('stdin_filename', ScheduledTask.stdin_filename),
+], list_fields=('tags', 'exclude_patterns', 'exclude_file_ids'))
@@ -9,6 +9,51 @@ function initBackupsPage() {
   loadBackups();
   loadRepositoriesForSelector();
   setupBackupFormHandlers();
+  setupBackupEvents();
+}
+
+// Backups currently shown in the table, updated in place by pushed events
+let backupsState = [];
+
+/**
+ * Apply pushed backup events to the table
+ */
+function setupBackupEvents() {
+  if (!connectAppEvents()) return;
+  
+  onAppEvent('backup.started', upsertBackup);
+  onAppEvent('backup.finished', backup => {
+    upsertBackup(backup);
+    showToast(`Backup ${backup.status}`, backup.status === 'completed' ? 'success' : 'danger');
+  });
+  onAppEvent('backup.overrun', backup => {
+    upsertBackup(backup);
+    showToast(`Backup of ${backup.source_path} is taking longer than expected`, 'warning');
+  });
+  onAppEvent('backup.progress', data => {
+    const cell = document.querySelector(`#backupsTableBody tr[data-backup-id="${data.backup_id}"] .backup-progress`);
+    if (!cell) return;
+    const percent = data.percent_done !== undefined ? `${Math.round(data.percent_done * 100)}%` : '';
+    const bytes = data.bytes_done !== undefined ? ` (${formatSize(data.bytes_done)})` : '';
+    cell.textContent = `Running... ${percent}${bytes}`;
+  });
+  onAppEvent('resync', loadBackups);
+}
+
+/**
+ * Insert or replace a single backup row
+ * @param {Object} backup - Backup from a backup event
+ */
+function upsertBackup(backup) {
+  const existing = backupsState.find(b => b.id === backup.id);
+  if (existing) {
+    Object.keys(backup).forEach(key => {
+      if (backup[key] !== null && backup[key] !== undefined) existing[key] = backup[key];
+    });
+  } else {
+    backupsState.unshift(backup);
+  }
+  renderBackups(backupsState);
 }
 
 /**
@@ -19,6 +64,7 @@ function loadBackups() {
   
   apiRequest('/api/backups')
     .then(backups => {
+      backupsState = backups;
       renderBackups(backups);
     })
     .catch(error => {
@@ -53,14 +99,14 @@ function renderBackups(backups) {
       <td><small class="text-muted">${backup.source_path}</small></td>
       <td>${formatDate(backup.start_time)}</td>
       <td>${backup.end_time ? formatDate(backup.end_time) : '-'}</td>
-      <td>${createStatusBadge(backup.status)}</td>
+      <td>${createStatusBadge(backup.status)}${createSlaBadge(backup)}</td>
       <td>
         ${backup.status === 'completed' ? 
           `<small>Files: ${backup.files_new} new, ${backup.files_changed} changed<br>
            Size: ${formatSize(backup.bytes_added)}</small>` : 
           (backup.status === 'failed' ? 
             `<small class="text-danger">${backup.message}</small>` : 
-            '<small>Running...</small>')}
+            '<small class="backup-progress">Running...</small>')}
       </td>
       <td>
         ${backup.status === 'completed' ? 
@@ -84,6 +130,22 @@ function renderBackups(backups) {
   });
 }
 
+/**
+ * Create a badge flagging a scheduled backup that ran over its prediction or SLA
+ * @param {Object} backup - Backup
+ * @returns {string} Badge HTML, empty when on time
+ */
+function createSlaBadge(backup) {
+  const title = backup.predicted_end ? `Predicted end: ${formatDate(backup.predicted_end)}` : '';
+  if (backup.sla_status === 'sla_missed') {
+    return ` <span class="badge bg-danger" title="${title}">SLA missed</span>`;
+  }
+  if (backup.sla_status === 'over_budget') {
+    return ` <span class="badge bg-warning text-dark" title="${title}">Over budget</span>`;
+  }
+  return '';
+}
+
 /**
  * Load repositories for the repository selector
  */
@@ -165,24 +227,25 @@ function createBackup() {
       
       bootstrap.Modal.getInstance(document.getElementById('newBackupModal')).hide();
       
-      // Reload backups
-      loadBackups();
-      
-      // Set up refresh interval to show progress
-      const refreshInterval = setInterval(() => {
-        apiRequest(`/api/backups/${result.id}`)
-          .then(backup => {
-            if (backup.status !== 'running') {
+      // Progress and completion arrive as pushed events; poll only without SSE support
+      if (!appEvents.source) {
+        loadBackups();
+        
+        const refreshInterval = setInterval(() => {
+          apiRequest(`/api/backups/${result.id}`)
+            .then(backup => {
+              if (backup.status !== 'running') {
+                clearInterval(refreshInterval);
+                showToast(`Backup ${backup.status}`, backup.status === 'completed' ? 'success' : 'danger');
+                loadBackups();
+              }
+            })
+            .catch(error => {
+              console.error('Error checking backup status:', error);
               clearInterval(refreshInterval);
-              showToast(`Backup ${backup.status}`, backup.status === 'completed' ? 'success' : 'danger');
-              loadBackups();
-            }
-          })
-          .catch(error => {
-            console.error('Error checking backup status:', error);
-            clearInterval(refreshInterval);
-          });
-      }, 5000);
+            });
+        }, 5000);
+      }
     })
     .catch(error => {
       console.error('Error creating backup:', error);
@@ -9,8 +9,61 @@ function initDashboardPage() {
   fetchDashboardData();
   setupCharts();
   
-  // Set up auto-refresh every 30 seconds
-  setInterval(fetchDashboardData, 30000);
+  // Apply pushed events instead of polling; fall back to polling without SSE support
+  if (!setupDashboardEvents()) {
+    setInterval(fetchDashboardData, 30000);
+  }
+}
+
+// Latest data shown on the dashboard, updated in place by pushed events
+const dashboardState = {
+  backups: []
+};
+
+/**
+ * Subscribe the dashboard widgets to server events
+ * @returns {boolean} - Whether push updates are available
+ */
+function setupDashboardEvents() {
+  if (!connectAppEvents()) return false;
+  
+  const refreshRepositories = debounce(() => {
+    apiRequest('/api/repositories').then(updateRepositoriesWidget).catch(() => {});
+  });
+  const refreshTasks = debounce(() => {
+    apiRequest('/api/scheduled-tasks').then(updateScheduledTasksWidget).catch(() => {});
+  });
+  
+  onAppEvent('backup.started', upsertDashboardBackup);
+  onAppEvent('backup.finished', upsertDashboardBackup);
+  onAppEvent('backup.progress', data => {
+    const row = document.querySelector(`#backupList [data-backup-id="${data.backup_id}"] .backup-progress`);
+    if (row && data.percent_done !== undefined) {
+      row.textContent = `${Math.round(data.percent_done * 100)}%`;
+    }
+  });
+  onAppEvent('repository', refreshRepositories);
+  onAppEvent('task', refreshTasks);
+  onAppEvent('resync', fetchDashboardData);
+  return true;
+}
+
+/**
+ * Insert or replace a backup in the recent backups widget
+ * @param {Object} backup - Backup from a backup event
+ */
+function upsertDashboardBackup(backup) {
+  const existing = dashboardState.backups.find(b => b.id === backup.id);
+  if (existing) {
+    // Keep fields the event may not carry
+    Object.keys(backup).forEach(key => {
+      if (backup[key] !== null && backup[key] !== undefined) existing[key] = backup[key];
+    });
+  } else {
+    dashboardState.backups.unshift(backup);
+  }
+  dashboardState.backups.sort((a, b) => new Date(b.start_time) - new Date(a.start_time));
+  updateRecentBackupsWidget(dashboardState.backups.slice(0, 5));
 }
 
 /**
@@ -29,7 +82,8 @@ function fetchDashboardData() {
   // Fetch recent backups
   apiRequest('/api/backups')
     .then(backups => {
-      updateRecentBackupsWidget(backups.slice(0, 5));
+      dashboardState.backups = backups.slice(0, 5);
+      updateRecentBackupsWidget(dashboardState.backups);
     })
     .catch(error => {
       console.error('Error fetching backups:', error);
@@ -98,13 +152,16 @@ function updateRecentBackupsWidget(backups) {
     }
     
     backupList.innerHTML = backups.map(backup => `
-      <div class="d-flex justify-content-between align-items-center mb-2">
+      <div class="d-flex justify-content-between align-items-center mb-2" data-backup-id="${backup.id}">
         <div>
           <strong>${backup.repository_name}</strong>
           <small class="d-block text-muted">${backup.source_path}</small>
           <small class="d-block text-muted">${formatDate(backup.start_time)}</small>
         </div>
-        <div>${createStatusBadge(backup.status)}</div>
+        <div>
+          ${backup.status === 'running' ? '<small class="backup-progress text-muted me-1"></small>' : ''}
+          ${createStatusBadge(backup.status)}
+        </div>
       </div>
     `).join('');
   }
@@ -168,6 +225,7 @@ function updateScheduledTasksWidget(tasks) {
 function setupCharts() {
   setupBackupStatusChart();
   setupBackupSizeChart();
+  setupRepositoryStorageChart();
 }
 
 /**
@@ -287,3 +345,72 @@ function setupBackupSizeChart() {
       console.error('Error fetching data for backup size chart:', error);
     });
 }
+
+/**
+ * Setup the repository storage chart (restore size vs. stored data)
+ */
+function setupRepositoryStorageChart() {
+  const chartCanvas = document.getElementById('repositoryStorageChart');
+  if (!chartCanvas) return;
+  
+  // Stats are cached on the server, so this does not wait for restic
+  apiRequest('/api/repository-stats')
+    .then(stats => {
+      const labels = stats.map(s => s.repository_name);
+      const restoreSizes = stats.map(s => s.restore_size || 0);
+      const rawSizes = stats.map(s => s.raw_data_size || 0);
+      
+      // Create the chart
+      const ctx = chartCanvas.getContext('2d');
+      new Chart(ctx, {
+        type: 'bar',
+        data: {
+          labels: labels,
+          datasets: [{
+            label: 'Restore Size',
+            data: restoreSizes,
+            backgroundColor: '#0d6efd',
+            borderWidth: 0
+          }, {
+            label: 'Stored Data',
+            data: rawSizes,
+            backgroundColor: '#198754',
+            borderWidth: 0
+          }]
+        },
+        options: {
+          responsive: true,
+          maintainAspectRatio: false,
+          scales: {
+            y: {
+              beginAtZero: true,
+              ticks: {
+                callback: function(value) {
+                  return formatSize(value);
+                }
+              }
+            }
+          },
+          plugins: {
+            tooltip: {
+              callbacks: {
+                label: function(context) {
+                  return `${context.dataset.label}: ${formatSize(context.raw)}`;
+                },
+                footer: function(items) {
+                  const ratio = stats[items[0].dataIndex].dedup_ratio;
+                  return ratio ? `Dedup ratio: ${ratio}x` : '';
+                }
+              }
+            },
+            legend: {
+              position: 'bottom'
+            }
+          }
+        }
+      });
+    })
+    .catch(error => {
+      console.error('Error fetching data for repository storage chart:', error);
+    });
+}
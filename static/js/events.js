@@ -0,0 +1,87 @@
+/**
+ * Push updates from the server over a single Server-Sent Events stream
+ */
+
+const appEvents = {
+  source: null,
+  handlers: [],
+  hadError: false
+};
+
+/**
+ * Register a handler for server events
+ * @param {string} type - Event type ('backup.progress'), prefix ('backup') or
+ *   'resync' (sent when events may have been missed)
+ * @param {Function} handler - Called with (data, event)
+ */
+function onAppEvent(type, handler) {
+  appEvents.handlers.push({ type, handler });
+  connectAppEvents();
+}
+
+/**
+ * Open the shared event stream (one per tab)
+ * @returns {boolean} - Whether push updates are available
+ */
+function connectAppEvents() {
+  if (appEvents.source) return true;
+  if (typeof EventSource === 'undefined') return false;
+
+  appEvents.source = new EventSource(`${app.apiBaseUrl}/api/events`);
+
+  appEvents.source.onmessage = (message) => {
+    let event;
+    try {
+      event = JSON.parse(message.data);
+    } catch (error) {
+      console.error('Invalid event:', message.data);
+      return;
+    }
+    dispatchAppEvent(event);
+  };
+
+  appEvents.source.onopen = () => {
+    // Events may have been missed while disconnected, reload once
+    if (appEvents.hadError) {
+      appEvents.hadError = false;
+      dispatchAppEvent({ type: 'resync', data: {} });
+    }
+  };
+
+  appEvents.source.onerror = () => {
+    // EventSource reconnects by itself
+    appEvents.hadError = true;
+  };
+
+  return true;
+}
+
+/**
+ * Call the handlers matching an event
+ * @param {Object} event - Event with type and data
+ */
+function dispatchAppEvent(event) {
+  appEvents.handlers.forEach(({ type, handler }) => {
+    if (event.type === type || event.type.startsWith(type + '.')) {
+      try {
+        handler(event.data, event);
+      } catch (error) {
+        console.error(`Error handling event ${event.type}:`, error);
+      }
+    }
+  });
+}
+
+/**
+ * Delay a function until it has not been called for a while
+ * @param {Function} fn - Function to call
+ * @param {number} wait - Delay in ms
+ * @returns {Function} - Debounced function
+ */
+function debounce(fn, wait = 500) {
+  let timer = null;
+  return (...args) => {
+    clearTimeout(timer);
+    timer = setTimeout(() => fn(...args), wait);
+  };
+}
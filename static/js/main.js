@@ -297,6 +297,37 @@ function apiRequest(url, options = {}) {
     });
 }
 
+/**
+ * Wait for a background job started by an endpoint that answered 202
+ * @param {string} jobId - Job ID returned by the endpoint
+ * @param {Function} onProgress - Optional callback receiving the job progress
+ * @param {number} interval - Polling interval in ms
+ * @returns {Promise} - Resolves with the job result, rejects with the job error
+ */
+function waitForJob(jobId, onProgress = null, interval = 1000) {
+  return new Promise((resolve, reject) => {
+    const poll = () => {
+      fetch(`${app.apiBaseUrl}/api/jobs/${jobId}`)
+        .then(response => response.json().then(data => {
+          if (!response.ok) throw new Error(data.error || `HTTP error ${response.status}`);
+          return data;
+        }))
+        .then(job => {
+          if (job.status === 'completed') {
+            resolve(job.result);
+          } else if (job.status === 'failed' || job.status === 'cancelled') {
+            reject(new Error(job.error || `Job ${job.status}`));
+          } else {
+            if (onProgress) onProgress(job.progress || {});
+            setTimeout(poll, interval);
+          }
+        })
+        .catch(reject);
+    };
+    poll();
+  });
+}
+
 /**
  * Format a date string in local format
  * @param {string} dateString - ISO date string
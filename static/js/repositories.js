@@ -8,8 +8,25 @@
 function initRepositoriesPage() {
   loadRepositories();
   setupRepositoryFormHandlers();
+  setupReplicationFormHandlers();
+  
+  // Reload when repositories are changed elsewhere
+  if (connectAppEvents()) {
+    const reload = debounce(loadRepositories);
+    ['repository.created', 'repository.updated', 'repository.deleted', 'repository.checked', 'resync'].forEach(type => {
+      onAppEvent(type, reload);
+    });
+    const reloadReplications = debounce(loadReplications);
+    ['replication.created', 'replication.updated', 'replication.deleted', 'replication.started',
+     'replication.progress', 'replication.finished'].forEach(type => {
+      onAppEvent(type, reloadReplications);
+    });
+  }
 }
 
+// Repositories of the last load, used to name the ends of replications
+let knownRepositories = [];
+
 /**
  * Load repositories from the API
  */
@@ -18,7 +35,9 @@ function loadRepositories() {
   
   apiRequest('/api/repositories')
     .then(repositories => {
+      knownRepositories = repositories;
       renderRepositories(repositories);
+      loadReplications();
     })
     .catch(error => {
       console.error('Error loading repositories:', error);
@@ -52,6 +71,7 @@ function renderRepositories(repositories) {
       <td>
         <span class="badge bg-secondary me-1">${repo.repo_type}</span>
         <small class="text-muted">${repo.location}</small>
+        ${repo.compression ? `<span class="badge bg-light text-dark ms-1">${repo.compression}</span>` : ''}
       </td>
       <td>${formatDate(repo.created_at)}</td>
       <td>${formatDate(repo.last_check)}</td>
@@ -186,6 +206,11 @@ function createRepository() {
     password: password
   };
   
+  const compressionSelect = document.getElementById('repositoryCompression');
+  const packSizeInput = document.getElementById('repositoryPackSize');
+  if (compressionSelect && compressionSelect.value) repoData.compression = compressionSelect.value;
+  if (packSizeInput && packSizeInput.value) repoData.pack_size = parseInt(packSizeInput.value, 10);
+  
   // Add REST server authentication if provided
   if (repo_type === 'rest-server' && restUserInput && restPassInput) {
     const rest_user = restUserInput.value.trim();
@@ -217,6 +242,9 @@ function createRepository() {
         toggleRestServerFields(false);
       }
       
+      if (compressionSelect) compressionSelect.selectedIndex = 0;
+      if (packSizeInput) packSizeInput.value = '';
+      
       // Reset REST server fields if they exist
       if (restUserInput) restUserInput.value = '';
       if (restPassInput) restPassInput.value = '';
@@ -287,3 +315,250 @@ function deleteRepository(repoId) {
       hideLoading();
     });
 }
+
+/**
+ * Load replications from the API
+ */
+function loadReplications() {
+  apiRequest('/api/replications')
+    .then(replications => {
+      renderReplications(replications);
+    })
+    .catch(error => {
+      console.error('Error loading replications:', error);
+      showToast('Failed to load replications: ' + error.message, 'danger');
+    });
+}
+
+/**
+ * Describe the schedule of a replication
+ * @param {Object} replication - Replication
+ * @returns {string} Schedule description
+ */
+function formatReplicationSchedule(replication) {
+  if (replication.schedule_type === 'cron') {
+    return `<code>${replication.cron_expression}</code>`;
+  }
+  if (replication.schedule_type === 'interval') {
+    return `every ${replication.interval_seconds}s`;
+  }
+  return 'manual';
+}
+
+/**
+ * Render replications in the table
+ * @param {Array} replications - List of replications
+ */
+function renderReplications(replications) {
+  const tableBody = document.getElementById('replicationsTableBody');
+  if (!tableBody) return;
+  
+  if (replications.length === 0) {
+    tableBody.innerHTML = `
+      <tr>
+        <td colspan="6" class="text-center">No replications found</td>
+      </tr>
+    `;
+    return;
+  }
+  
+  const names = {};
+  knownRepositories.forEach(repo => { names[repo.id] = repo.name; });
+  
+  tableBody.innerHTML = replications.map(replication => {
+    let status = createStatusBadge(replication.status);
+    const progress = replication.progress;
+    if (replication.status === 'running' && progress && progress.snapshots_total) {
+      const done = (progress.snapshots_copied || 0) + (progress.snapshots_skipped || 0);
+      status += ` <small class="text-muted">${done}/${progress.snapshots_total}</small>`;
+    } else if (replication.message) {
+      status += `<br><small class="text-muted">${replication.message}</small>`;
+    }
+    return `
+    <tr data-replication-id="${replication.id}">
+      <td>${replication.name}${replication.enabled ? '' : ' <span class="badge bg-secondary">disabled</span>'}</td>
+      <td>${names[replication.source_repository_id] || replication.source_repository_id}
+        <i class="bi bi-arrow-right"></i>
+        ${names[replication.destination_repository_id] || replication.destination_repository_id}</td>
+      <td>${formatReplicationSchedule(replication)}
+        ${replication.last_run ? `<br><small class="text-muted">${formatDate(replication.last_run)}</small>` : ''}</td>
+      <td>${replication.snapshots_copied}</td>
+      <td>${status}</td>
+      <td>
+        <div class="btn-group btn-group-sm" role="group">
+          <button type="button" class="btn btn-outline-primary btn-run-replication" title="Run replication"
+                  ${replication.status === 'running' ? 'disabled' : ''}>
+            <i class="bi bi-play"></i>
+          </button>
+          <button type="button" class="btn btn-outline-danger btn-delete-replication" title="Delete replication">
+            <i class="bi bi-trash"></i>
+          </button>
+        </div>
+      </td>
+    </tr>
+  `;
+  }).join('');
+  
+  tableBody.querySelectorAll('.btn-run-replication').forEach(button => {
+    button.addEventListener('click', () => {
+      runReplication(button.closest('tr').dataset.replicationId);
+    });
+  });
+  
+  tableBody.querySelectorAll('.btn-delete-replication').forEach(button => {
+    button.addEventListener('click', () => {
+      const replicationId = button.closest('tr').dataset.replicationId;
+      if (confirm('Are you sure you want to delete this replication? Copied snapshots stay in the destination repository.')) {
+        deleteReplication(replicationId);
+      }
+    });
+  });
+}
+
+/**
+ * Setup handlers for replication forms
+ */
+function setupReplicationFormHandlers() {
+  const form = document.getElementById('newReplicationForm');
+  if (form) {
+    form.addEventListener('submit', (e) => {
+      e.preventDefault();
+      createReplication();
+    });
+  }
+  
+  const scheduleSelect = document.getElementById('replicationScheduleType');
+  if (scheduleSelect) {
+    scheduleSelect.addEventListener('change', () => {
+      document.getElementById('replicationCronGroup').style.display = scheduleSelect.value === 'cron' ? 'block' : 'none';
+      document.getElementById('replicationIntervalGroup').style.display = scheduleSelect.value === 'interval' ? 'block' : 'none';
+    });
+  }
+  
+  const newButton = document.getElementById('newReplicationButton');
+  if (newButton) {
+    newButton.addEventListener('click', () => {
+      const options = knownRepositories.map(repo => `<option value="${repo.id}">${repo.name}</option>`).join('');
+      document.getElementById('replicationSource').innerHTML = options;
+      document.getElementById('replicationDestination').innerHTML = options;
+      const modal = new bootstrap.Modal(document.getElementById('newReplicationModal'));
+      modal.show();
+    });
+  }
+  
+  const runAllButton = document.getElementById('runAllReplicationsButton');
+  if (runAllButton) {
+    runAllButton.addEventListener('click', () => {
+      runReplications();
+    });
+  }
+}
+
+/**
+ * Create a new replication
+ */
+function createReplication() {
+  const name = document.getElementById('replicationName').value.trim();
+  const source = document.getElementById('replicationSource').value;
+  const destination = document.getElementById('replicationDestination').value;
+  const scheduleType = document.getElementById('replicationScheduleType').value;
+  
+  if (!name || !source || !destination) {
+    showToast('Please fill in all required fields', 'warning');
+    return;
+  }
+  if (source === destination) {
+    showToast('Source and destination must be different repositories', 'warning');
+    return;
+  }
+  
+  const data = {
+    name: name,
+    source_repository_id: parseInt(source),
+    destination_repository_id: parseInt(destination),
+    schedule_type: scheduleType
+  };
+  if (scheduleType === 'cron') {
+    data.cron_expression = document.getElementById('replicationCron').value.trim();
+  } else if (scheduleType === 'interval') {
+    data.interval_seconds = parseInt(document.getElementById('replicationInterval').value) || null;
+  }
+  const limitUpload = parseInt(document.getElementById('replicationLimitUpload').value);
+  const limitDownload = parseInt(document.getElementById('replicationLimitDownload').value);
+  if (limitUpload > 0) data.limit_upload = limitUpload;
+  if (limitDownload > 0) data.limit_download = limitDownload;
+  
+  showLoading();
+  
+  apiRequest('/api/replications', {
+    method: 'POST',
+    body: JSON.stringify(data)
+  })
+    .then(result => {
+      showToast('Replication created successfully', 'success');
+      document.getElementById('newReplicationForm').reset();
+      document.getElementById('replicationCronGroup').style.display = 'none';
+      document.getElementById('replicationIntervalGroup').style.display = 'none';
+      bootstrap.Modal.getInstance(document.getElementById('newReplicationModal')).hide();
+      loadReplications();
+    })
+    .catch(error => {
+      console.error('Error creating replication:', error);
+      showToast('Failed to create replication: ' + error.message, 'danger');
+    })
+    .finally(() => {
+      hideLoading();
+    });
+}
+
+/**
+ * Run one replication now
+ * @param {string} replicationId - Replication ID
+ */
+function runReplication(replicationId) {
+  apiRequest(`/api/replications/${replicationId}/run`, { method: 'POST' })
+    .then(result => {
+      showToast('Replication started', 'success');
+      loadReplications();
+    })
+    .catch(error => {
+      console.error('Error running replication:', error);
+      showToast('Failed to run replication: ' + error.message, 'danger');
+    });
+}
+
+/**
+ * Run all enabled replications in parallel
+ */
+function runReplications() {
+  apiRequest('/api/replications/run', { method: 'POST', body: JSON.stringify({}) })
+    .then(result => {
+      showToast(`Started ${result.jobs.length} replication(s)`, 'success');
+      loadReplications();
+    })
+    .catch(error => {
+      console.error('Error running replications:', error);
+      showToast('Failed to run replications: ' + error.message, 'danger');
+    });
+}
+
+/**
+ * Delete a replication
+ * @param {string} replicationId - Replication ID
+ */
+function deleteReplication(replicationId) {
+  showLoading();
+  
+  apiRequest(`/api/replications/${replicationId}`, { method: 'DELETE' })
+    .then(result => {
+      showToast('Replication deleted successfully', 'success');
+      loadReplications();
+    })
+    .catch(error => {
+      console.error('Error deleting replication:', error);
+      showToast('Failed to delete replication: ' + error.message, 'danger');
+    })
+    .finally(() => {
+      hideLoading();
+    });
+}
@@ -8,7 +8,15 @@
 function initSchedulerPage() {
   loadScheduledTasks();
   loadRepositoriesForSelector();
+  loadExcludeFilesForSelector();
   setupSchedulerFormHandlers();
+  
+  // Reload when tasks are changed elsewhere or run by the scheduler
+  if (connectAppEvents()) {
+    const reload = debounce(loadScheduledTasks);
+    onAppEvent('task', reload);
+    onAppEvent('resync', reload);
+  }
 }
 
 /**
@@ -55,6 +63,8 @@ function renderScheduledTasks(tasks) {
       <td>
         ${task.schedule_type === 'cron' ? 
           `<small>Cron: ${task.cron_expression}</small>` : 
+          task.schedule_type === 'on_change' ?
+          `<small>On change${task.interval_seconds ? ` (max ${formatDuration(task.interval_seconds)})` : ''}</small>` :
           `<small>Interval: ${formatDuration(task.interval_seconds)}</small>`}
       </td>
       <td>${formatDate(task.next_run)}</td>
@@ -115,6 +125,198 @@ function loadRepositoriesForSelector() {
     });
 }
 
+/**
+ * Load the exclude file library for the exclude file selector
+ */
+function loadExcludeFilesForSelector() {
+  const excludeFilesSelect = document.getElementById('excludeFiles');
+  if (!excludeFilesSelect) return;
+  
+  apiRequest('/api/exclude-files')
+    .then(excludeFiles => {
+      excludeFilesSelect.innerHTML = '';
+      excludeFiles.forEach(excludeFile => {
+        const option = document.createElement('option');
+        option.value = excludeFile.id;
+        option.textContent = `${excludeFile.name} (${excludeFile.patterns.length})`;
+        option.title = excludeFile.patterns.join('\n');
+        excludeFilesSelect.appendChild(option);
+      });
+    })
+    .catch(error => {
+      console.error('Error loading exclude files:', error);
+    });
+}
+
+/**
+ * Read the exclude settings from the task form
+ * @returns {Object} Exclude fields of a task request
+ */
+function getExcludeFormData() {
+  const patternsInput = document.getElementById('excludePatterns');
+  const excludeFilesSelect = document.getElementById('excludeFiles');
+  const largerThanInput = document.getElementById('excludeLargerThan');
+  const cachesInput = document.getElementById('excludeCaches');
+  const oneFileSystemInput = document.getElementById('oneFileSystem');
+  
+  return {
+    exclude_patterns: patternsInput ? patternsInput.value.split('\n').map(p => p.trim()).filter(p => p) : [],
+    exclude_file_ids: excludeFilesSelect ? Array.from(excludeFilesSelect.selectedOptions).map(o => parseInt(o.value, 10)) : [],
+    exclude_larger_than: largerThanInput ? largerThanInput.value.trim() : '',
+    exclude_caches: cachesInput ? cachesInput.checked : false,
+    one_file_system: oneFileSystemInput ? oneFileSystemInput.checked : false
+  };
+}
+
+/**
+ * Estimate how much the exclude settings in the form save for the source path
+ */
+function estimateExcludes() {
+  const sourcePathInput = document.getElementById('taskSourcePath');
+  const resultContainer = document.getElementById('excludeEstimate');
+  if (!sourcePathInput || !resultContainer) return;
+  
+  const sourcePath = sourcePathInput.value.trim();
+  if (!sourcePath) {
+    showToast('Please enter a source path', 'warning');
+    return;
+  }
+  
+  resultContainer.innerHTML = '<div class="spinner-border spinner-border-sm" role="status"></div>';
+  
+  apiRequest('/api/scheduled-tasks/exclude-estimate', {
+    method: 'POST',
+    body: JSON.stringify({ source_path: sourcePath, ...getExcludeFormData() })
+  })
+    .then(result => {
+      const rows = result.rules.map(rule => `
+        <tr>
+          <td><code>${rule.rule}</code> <small class="text-muted">${rule.source}</small></td>
+          <td class="text-end">${rule.files}</td>
+          <td class="text-end">${formatSize(rule.bytes)}</td>
+        </tr>
+      `).join('');
+      resultContainer.innerHTML = `
+        <small>Backed up: ${result.included.files} files, ${formatSize(result.included.bytes)} of
+          ${formatSize(result.total.bytes)}${result.truncated ? ' (partial scan)' : ''}</small>
+        <table class="table table-sm mt-1 mb-0">
+          <thead><tr><th>Rule</th><th class="text-end">Files</th><th class="text-end">Saved</th></tr></thead>
+          <tbody>${rows}</tbody>
+        </table>
+      `;
+    })
+    .catch(error => {
+      resultContainer.innerHTML = '';
+      showToast('Failed to estimate exclusions: ' + error.message, 'danger');
+    });
+}
+
+/**
+ * Estimate the data the task would push and whether the repository has room
+ */
+function estimateSource() {
+  const repositorySelect = document.getElementById('taskRepository');
+  const sourcePathInput = document.getElementById('taskSourcePath');
+  const resultContainer = document.getElementById('excludeEstimate');
+  if (!repositorySelect || !sourcePathInput || !resultContainer) return;
+  
+  const sourcePath = sourcePathInput.value.trim();
+  if (!repositorySelect.value || !sourcePath) {
+    showToast('Please select a repository and enter a source path', 'warning');
+    return;
+  }
+  
+  resultContainer.innerHTML = '<div class="spinner-border spinner-border-sm" role="status"></div>';
+  
+  apiRequest('/api/scheduled-tasks/source-estimate', {
+    method: 'POST',
+    body: JSON.stringify({
+      repository_id: parseInt(repositorySelect.value),
+      source_path: sourcePath,
+      ...getExcludeFormData()
+    })
+  })
+    // The estimate runs as a job (a dry run can take hours), poll it for the result
+    .then(response => waitForJob(response.job_id))
+    .then(result => {
+      const forecast = result.forecast;
+      const statusClass = { ok: 'success', warning: 'warning', critical: 'danger' }[forecast.status] || 'secondary';
+      const remaining = forecast.remaining_bytes !== null ? formatSize(forecast.remaining_bytes) + ' free' : 'free space unknown';
+      const fullIn = forecast.days_until_full !== null ? `, full in ${forecast.days_until_full} days` : '';
+      resultContainer.innerHTML = `
+        <small>Source: ${result.scan.files} files, ${formatSize(result.scan.bytes)}${result.scan.truncated ? ' (partial scan)' : ''}</small><br>
+        <small>Expected new data: ${formatSize(result.expected_bytes_added)}
+          (${Math.round(result.new_data_ratio * 100)}%, ${result.ratio_basis.replace('_', ' ')})</small><br>
+        <small>Repository: <span class="badge bg-${statusClass}">${forecast.status}</span>
+          ${remaining}${fullIn}</small>
+        ${result.fits === false ? '<div class="text-danger small">The repository does not have room for this backup</div>' : ''}
+      `;
+    })
+    .catch(error => {
+      resultContainer.innerHTML = '';
+      showToast('Failed to estimate backup size: ' + error.message, 'danger');
+    });
+}
+
+/**
+ * Back up a sample of the source path once per compression mode and show the results
+ */
+function benchmarkCompression() {
+  const sourcePathInput = document.getElementById('taskSourcePath');
+  const resultContainer = document.getElementById('excludeEstimate');
+  if (!sourcePathInput || !resultContainer) return;
+  
+  const sourcePath = sourcePathInput.value.trim();
+  if (!sourcePath) {
+    showToast('Please enter a source path', 'warning');
+    return;
+  }
+  
+  const packSizeInput = document.getElementById('taskPackSize');
+  const packSize = packSizeInput ? parseInt(packSizeInput.value, 10) || null : null;
+  
+  resultContainer.innerHTML = '<div class="spinner-border spinner-border-sm" role="status"></div>';
+  
+  apiRequest('/api/scheduled-tasks/compression-benchmark', {
+    method: 'POST',
+    body: JSON.stringify({
+      source_path: sourcePath,
+      settings: ['auto', 'max', 'off'].map(compression => ({ compression: compression, pack_size: packSize })),
+      ...getExcludeFormData()
+    })
+  })
+    // The benchmark runs as a job, show which setting it is at until the results arrive
+    .then(response => waitForJob(response.job_id, progress => {
+      if (progress.settings_total) {
+        resultContainer.innerHTML = `<div class="spinner-border spinner-border-sm" role="status"></div>
+          <small>${progress.settings_done || 0} / ${progress.settings_total}</small>`;
+      }
+    }))
+    .then(result => {
+      const rows = result.results.map(item => {
+        if (item.error) {
+          return `<tr><td>${item.compression}</td><td colspan="3" class="text-danger">${item.error}</td></tr>`;
+        }
+        const ratio = item.ratio !== null ? `${Math.round(item.ratio * 100)}%` : '-';
+        const throughput = item.throughput_bytes_per_sec !== null ? formatSize(item.throughput_bytes_per_sec) + '/s' : '-';
+        const projected = item.projected_stored_bytes !== null ? formatSize(item.projected_stored_bytes) : '-';
+        return `<tr><td>${item.compression}</td><td>${throughput}</td><td>${ratio}</td><td>${projected}</td></tr>`;
+      }).join('');
+      resultContainer.innerHTML = `
+        <small>Sample: ${result.sample.files} files, ${formatSize(result.sample.bytes)}
+          of ${formatSize(result.source.bytes)}</small>
+        <table class="table table-sm mb-0">
+          <thead><tr><th>Compression</th><th>Throughput</th><th>Stored</th><th>Projected size</th></tr></thead>
+          <tbody>${rows}</tbody>
+        </table>
+      `;
+    })
+    .catch(error => {
+      resultContainer.innerHTML = '';
+      showToast('Failed to benchmark compression: ' + error.message, 'danger');
+    });
+}
+
 /**
  * Setup handlers for scheduler forms
  */
@@ -136,19 +338,42 @@ function setupSchedulerFormHandlers() {
     });
   }
   
+  const estimateExcludesButton = document.getElementById('estimateExcludesButton');
+  if (estimateExcludesButton) {
+    estimateExcludesButton.addEventListener('click', estimateExcludes);
+  }
+  const estimateSourceButton = document.getElementById('estimateSourceButton');
+  if (estimateSourceButton) {
+    estimateSourceButton.addEventListener('click', estimateSource);
+  }
+  
+  const benchmarkCompressionButton = document.getElementById('benchmarkCompressionButton');
+  if (benchmarkCompressionButton) {
+    benchmarkCompressionButton.addEventListener('click', benchmarkCompression);
+  }
+  
+  // A task backing up a command's output does not need a source path
+  const stdinCommandInput = document.getElementById('taskStdinCommand');
+  const sourcePathInput = document.getElementById('taskSourcePath');
+  if (stdinCommandInput && sourcePathInput) {
+    stdinCommandInput.addEventListener('input', () => {
+      sourcePathInput.required = !stdinCommandInput.value.trim();
+      sourcePathInput.disabled = !!stdinCommandInput.value.trim();
+    });
+  }
+  
   // Setup schedule type toggle
   const scheduleTypeSelect = document.getElementById('scheduleType');
   const cronExpressionGroup = document.getElementById('cronExpressionGroup');
   const intervalSecondsGroup = document.getElementById('intervalSecondsGroup');
+  const onChangeGroup = document.getElementById('onChangeGroup');
   
   if (scheduleTypeSelect && cronExpressionGroup && intervalSecondsGroup) {
     scheduleTypeSelect.addEventListener('change', () => {
-      if (scheduleTypeSelect.value === 'cron') {
-        cronExpressionGroup.style.display = 'block';
-        intervalSecondsGroup.style.display = 'none';
-      } else if (scheduleTypeSelect.value === 'interval') {
-        cronExpressionGroup.style.display = 'none';
-        intervalSecondsGroup.style.display = 'block';
+      cronExpressionGroup.style.display = scheduleTypeSelect.value === 'cron' ? 'block' : 'none';
+      intervalSecondsGroup.style.display = scheduleTypeSelect.value === 'interval' ? 'block' : 'none';
+      if (onChangeGroup) {
+        onChangeGroup.style.display = scheduleTypeSelect.value === 'on_change' ? 'block' : 'none';
       }
     });
   }
@@ -165,6 +390,10 @@ function createScheduledTask() {
   const cronExpressionInput = document.getElementById('cronExpression');
   const intervalHoursInput = document.getElementById('intervalHours');
   const intervalMinutesInput = document.getElementById('intervalMinutes');
+  const catchupPolicySelect = document.getElementById('catchupPolicy');
+  const slaDeadlineInput = document.getElementById('slaDeadline');
+  const changeDetectionSelect = document.getElementById('changeDetection');
+  const stdinCommandInput = document.getElementById('taskStdinCommand');
   
   if (!nameInput || !repositorySelect || !sourcePathInput || !scheduleTypeSelect) return;
   
@@ -172,8 +401,9 @@ function createScheduledTask() {
   const repositoryId = repositorySelect.value;
   const sourcePath = sourcePathInput.value.trim();
   const scheduleType = scheduleTypeSelect.value;
+  const stdinCommand = stdinCommandInput ? stdinCommandInput.value.trim() : '';
   
-  if (!name || !repositoryId || !sourcePath || !scheduleType) {
+  if (!name || !repositoryId || (!sourcePath && !stdinCommand) || !scheduleType) {
     showToast('Please fill in all required fields', 'warning');
     return;
   }
@@ -186,6 +416,43 @@ function createScheduledTask() {
     enabled: true
   };
   
+  const excludeData = getExcludeFormData();
+  if (excludeData.exclude_patterns.length) taskData.exclude_patterns = excludeData.exclude_patterns;
+  if (excludeData.exclude_file_ids.length) taskData.exclude_file_ids = excludeData.exclude_file_ids;
+  if (excludeData.exclude_larger_than) taskData.exclude_larger_than = excludeData.exclude_larger_than;
+  if (excludeData.exclude_caches) taskData.exclude_caches = true;
+  if (excludeData.one_file_system) taskData.one_file_system = true;
+  
+  const compressionSelect = document.getElementById('taskCompression');
+  const packSizeInput = document.getElementById('taskPackSize');
+  if (compressionSelect && compressionSelect.value) taskData.compression = compressionSelect.value;
+  if (packSizeInput && packSizeInput.value) taskData.pack_size = parseInt(packSizeInput.value, 10);
+  
+  // Hooks and backups of a command's output
+  if (stdinCommand) {
+    taskData.stdin_command = stdinCommand;
+    const stdinFilenameInput = document.getElementById('taskStdinFilename');
+    if (stdinFilenameInput && stdinFilenameInput.value.trim()) taskData.stdin_filename = stdinFilenameInput.value.trim();
+  }
+  [['taskPreHook', 'pre_hook'], ['taskPostHook', 'post_hook']].forEach(([inputId, field]) => {
+    const input = document.getElementById(inputId);
+    if (input && input.value.trim()) taskData[field] = input.value.trim();
+  });
+  const hookTimeoutInput = document.getElementById('taskHookTimeout');
+  if (hookTimeoutInput && hookTimeoutInput.value) taskData.hook_timeout = parseInt(hookTimeoutInput.value, 10);
+  
+  if (catchupPolicySelect && catchupPolicySelect.value) {
+    taskData.catchup_policy = catchupPolicySelect.value;
+  }
+  
+  if (slaDeadlineInput && slaDeadlineInput.value) {
+    taskData.sla_deadline = slaDeadlineInput.value;
+  }
+  
+  if (changeDetectionSelect && changeDetectionSelect.value) {
+    taskData.change_detection = changeDetectionSelect.value;
+  }
+  
   if (scheduleType === 'cron') {
     const cronExpression = cronExpressionInput.value.trim();
     if (!cronExpression) {
@@ -203,6 +470,20 @@ function createScheduledTask() {
     }
     
     taskData.interval_seconds = (hours * 3600) + (minutes * 60);
+  } else if (scheduleType === 'on_change') {
+    // Empty fields keep the server defaults
+    const onChangeFields = [
+      ['onChangeDebounce', 'debounce_seconds', 1],
+      ['onChangeThreshold', 'change_threshold', 1024 * 1024],
+      ['onChangeMinInterval', 'min_interval', 60],
+      ['onChangeMaxInterval', 'interval_seconds', 3600]
+    ];
+    onChangeFields.forEach(([inputId, field, unit]) => {
+      const input = document.getElementById(inputId);
+      if (input && input.value !== '') {
+        taskData[field] = Math.round(parseFloat(input.value) * unit);
+      }
+    });
   }
   
   showLoading();
@@ -222,6 +503,24 @@ function createScheduledTask() {
       cronExpressionInput.value = '';
       intervalHoursInput.value = '0';
       intervalMinutesInput.value = '0';
+      if (catchupPolicySelect) catchupPolicySelect.selectedIndex = 0;
+      if (slaDeadlineInput) slaDeadlineInput.value = '';
+      if (changeDetectionSelect) changeDetectionSelect.selectedIndex = 0;
+      if (compressionSelect) compressionSelect.selectedIndex = 0;
+      ['onChangeDebounce', 'onChangeThreshold', 'onChangeMinInterval', 'onChangeMaxInterval',
+       'excludePatterns', 'excludeLargerThan', 'taskPackSize', 'taskStdinCommand', 'taskStdinFilename',
+       'taskPreHook', 'taskPostHook', 'taskHookTimeout'].forEach(inputId => {
+        const input = document.getElementById(inputId);
+        if (input) input.value = '';
+      });
+      ['excludeCaches', 'oneFileSystem'].forEach(inputId => {
+        const input = document.getElementById(inputId);
+        if (input) input.checked = false;
+      });
+      const excludeFilesSelect = document.getElementById('excludeFiles');
+      if (excludeFilesSelect) excludeFilesSelect.selectedIndex = -1;
+      const excludeEstimate = document.getElementById('excludeEstimate');
+      if (excludeEstimate) excludeEstimate.innerHTML = '';
       
       bootstrap.Modal.getInstance(document.getElementById('newTaskModal')).hide();
       
@@ -69,6 +69,10 @@ function renderFilesList(files) {
                     <button class="btn btn-sm btn-outline-primary restore-file" data-path="${file.path}">
                         恢复
                     </button>
+                    <a class="btn btn-sm btn-outline-secondary"
+                       href="/api/snapshots/${window.snapshotId}/download?path=${encodeURIComponent(file.path)}">
+                        下载
+                    </a>
                 </td>
             </tr>
         `;
@@ -175,7 +179,7 @@ function restoreSnapshot() {
         // 关闭模态框
         bootstrap.Modal.getInstance(document.getElementById('restoreModal')).hide();
         
-        showToast('快照恢复成功', 'success');
+        showToast('恢复任务已开始', 'success');
     })
     .catch(error => {
         console.error('Error restoring snapshot:', error);
@@ -24,6 +24,29 @@ function initSnapshotsPage() {
   
   // Initial load of snapshots
   loadSnapshots(repoId);
+  setupSnapshotEvents();
+}
+
+/**
+ * Reload the list when snapshots of the shown repository change
+ */
+function setupSnapshotEvents() {
+  if (!connectAppEvents()) return;
+  
+  const reload = debounce(() => {
+    const repositorySelect = document.getElementById('repositorySelector');
+    loadSnapshots(repositorySelect ? repositorySelect.value : null);
+  }, 1000);
+  
+  ['snapshot', 'backup.finished', 'resync'].forEach(type => {
+    onAppEvent(type, data => {
+      const repositorySelect = document.getElementById('repositorySelector');
+      const shown = repositorySelect ? repositorySelect.value : '';
+      if (!shown || !data.repository_id || String(data.repository_id) === shown) {
+        reload();
+      }
+    });
+  });
 }
 
 /**
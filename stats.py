@@ -0,0 +1,213 @@
+import json
+import hashlib
+import logging
+import threading
+from datetime import datetime
+
+from flask import current_app
+
+from jobs import job_pool
+from restic_wrapper import ResticWrapper
+from events import event_broker
+
+logger = logging.getLogger(__name__)
+
+# 缓存的 restic stats 统计模式
+STATS_MODES = ('restore-size', 'raw-data')
+
+# 正在刷新统计的仓库，避免重复提交作业
+_in_flight = set()
+_in_flight_lock = threading.Lock()
+
+
+def snapshot_set_hash(snapshot_ids):
+    """
+    Hash a set of snapshot IDs independently of their order
+
+    Args:
+        snapshot_ids (iterable): Snapshot IDs
+
+    Returns:
+        str: Hex sha256 digest
+    """
+    digest = hashlib.sha256()
+    for snapshot_id in sorted(snapshot_ids):
+        digest.update(snapshot_id.encode('utf-8'))
+        digest.update(b'\n')
+    return digest.hexdigest()
+
+
+def _current_snapshot_ids(repository_id):
+    from app import db
+    from models import Snapshot
+
+    rows = db.session.query(Snapshot.snapshot_id).filter_by(repository_id=repository_id).all()
+    return [row[0] for row in rows]
+
+
+def stats_are_stale(repository_id, snapshot_hash=None):
+    """
+    Check whether the cached stats of a repository cover the current snapshot set
+
+    Args:
+        repository_id (int): ID of the repository
+        snapshot_hash (str): Hash of the current snapshot set, computed when omitted
+
+    Returns:
+        bool: True when any mode is missing or was computed for another snapshot set
+    """
+    from models import RepositoryStats
+
+    if snapshot_hash is None:
+        snapshot_hash = snapshot_set_hash(_current_snapshot_ids(repository_id))
+    cached = {row.mode: row.snapshot_set_hash
+              for row in RepositoryStats.query.filter_by(repository_id=repository_id).all()}
+    return any(cached.get(mode) != snapshot_hash for mode in STATS_MODES)
+
+
+def schedule_stats_refresh(repository_id, force=False):
+    """
+    Queue a background stats refresh if the snapshot set changed
+
+    Must be called inside an application context.
+
+    Args:
+        repository_id (int): ID of the repository
+        force (bool): Refresh even if the cached stats are current
+
+    Returns:
+        Job: The queued job, or None if nothing needed to be done
+    """
+    try:
+        if not force and not stats_are_stale(repository_id):
+            return None
+    except Exception as e:
+        logger.error(f"Error checking stats of repository {repository_id}: {str(e)}")
+        return None
+
+    with _in_flight_lock:
+        if repository_id in _in_flight:
+            return None
+        _in_flight.add(repository_id)
+
+    try:
+        return job_pool.submit(
+            'stats',
+            refresh_stats,
+            current_app._get_current_object(),
+            repository_id,
+            force=force,
+            repository_id=repository_id,
+            description=f'Refresh stats of repository {repository_id}'
+        )
+    except Exception:
+        with _in_flight_lock:
+            _in_flight.discard(repository_id)
+        raise
+
+
+def refresh_stats(job, app, repository_id, force=False):
+    """
+    Compute restic stats for every cached mode and store them
+
+    Only modes whose cached snapshot set differs from the current one are
+    recomputed, unless force is set.
+
+    Args:
+        job (Job): The job running the refresh
+        app: Flask application
+        repository_id (int): ID of the repository
+        force (bool): Recompute all modes
+
+    Returns:
+        dict: Mapping of mode to refreshed stats
+    """
+    from app import db
+    from models import Repository, RepositoryStats
+
+    try:
+        with app.app_context():
+            repository = Repository.query.get(repository_id)
+            if not repository:
+                logger.error(f"Repository {repository_id} not found")
+                return None
+
+            restic = ResticWrapper.from_repository(repository)
+            snapshot_ids = _current_snapshot_ids(repository_id)
+            snapshot_hash = snapshot_set_hash(snapshot_ids)
+            rows = {row.mode: row for row in
+                    RepositoryStats.query.filter_by(repository_id=repository_id).all()}
+            db.session.remove()
+
+            refreshed = {}
+            for mode in STATS_MODES:
+                row = rows.get(mode)
+                if row and row.snapshot_set_hash == snapshot_hash and not force:
+                    continue
+                job.update_progress(mode=mode)
+
+                # 空仓库无需调用 restic
+                if snapshot_ids:
+                    success, result = restic.get_stats(mode=mode)
+                    if not success:
+                        raise RuntimeError(f"restic stats --mode {mode} failed: {result.get('message', '')}")
+                else:
+                    result = {'total_size': 0, 'snapshots_count': 0}
+
+                row = RepositoryStats.query.filter_by(repository_id=repository_id, mode=mode).first()
+                if not row:
+                    row = RepositoryStats(repository_id=repository_id, mode=mode)
+                    db.session.add(row)
+                row.snapshot_set_hash = snapshot_hash
+                row.snapshot_count = len(snapshot_ids)
+                row.stats = json.dumps(result)
+                row.computed_at = datetime.utcnow()
+                db.session.commit()
+                refreshed[mode] = result
+
+            logger.info(f"Refreshed stats of repository {repository_id}: {', '.join(refreshed) or 'up to date'}")
+            if refreshed:
+                event_broker.publish('stats.updated', repository_id=repository_id)
+            return refreshed
+    finally:
+        with _in_flight_lock:
+            _in_flight.discard(repository_id)
+
+
+def get_cached_stats(repository):
+    """
+    Return the cached stats of a repository without calling restic
+
+    Args:
+        repository: Repository object
+
+    Returns:
+        dict: Stats per mode, dedup ratio and a 'stale' flag
+    """
+    from models import RepositoryStats
+
+    snapshot_hash = snapshot_set_hash(_current_snapshot_ids(repository.id))
+    rows = {row.mode: row for row in
+            RepositoryStats.query.filter_by(repository_id=repository.id).all()}
+
+    modes = {}
+    for mode, row in rows.items():
+        modes[mode] = {
+            'stats': json.loads(row.stats) if row.stats else {},
+            'snapshot_count': row.snapshot_count,
+            'computed_at': row.computed_at.isoformat() if row.computed_at else None,
+            'current': row.snapshot_set_hash == snapshot_hash
+        }
+
+    restore_size = modes.get('restore-size', {}).get('stats', {}).get('total_size')
+    raw_data = modes.get('raw-data', {}).get('stats', {}).get('total_size')
+    return {
+        'repository_id': repository.id,
+        'repository_name': repository.name,
+        'restore_size': restore_size,
+        'raw_data_size': raw_data,
+        # 去重比例：恢复后的数据量 / 仓库实际存储量
+        'dedup_ratio': round(restore_size / raw_data, 2) if restore_size and raw_data else None,
+        'modes': modes,
+        'stale': any(mode not in modes or not modes[mode]['current'] for mode in STATS_MODES)
+    }
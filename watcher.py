@@ -0,0 +1,464 @@
+import os
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+
+from changes import change_tracker, scan_directories
+
+logger = logging.getLogger(__name__)
+
+# 变更监视后端：auto（优先 inotify，不可用时轮询）、inotify、poll
+WATCH_BACKEND = os.environ.get('RESTICLY_WATCH_BACKEND', 'auto')
+# 轮询后端比较目录指纹的间隔（秒）
+WATCH_POLL_INTERVAL = int(os.environ.get('RESTICLY_WATCH_POLL_INTERVAL', '60'))
+# on_change 任务的默认值：变更平息多久后才备份、两次备份的最短和最长间隔（秒）
+DEFAULT_DEBOUNCE = int(os.environ.get('RESTICLY_WATCH_DEBOUNCE', '30'))
+DEFAULT_MIN_INTERVAL = int(os.environ.get('RESTICLY_WATCH_MIN_INTERVAL', '300'))
+DEFAULT_MAX_INTERVAL = int(os.environ.get('RESTICLY_WATCH_MAX_INTERVAL', str(24 * 3600)))
+# 监视循环检查任务是否到期的间隔（秒）
+TICK = 1.0
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONTFOLLOW = 0x02000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+WATCH_MASK = (IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+              | IN_DELETE_SELF | IN_ONLYDIR | IN_DONTFOLLOW)
+EVENT_HEADER = struct.Struct('iIII')
+
+
+class Inotify:
+    """
+    Recursive inotify watch over a set of directory trees
+
+    inotify watches single directories, so every directory below a root
+    gets its own watch and directories created or moved in later are added
+    as their events arrive. Raises OSError when inotify is unavailable or
+    the watch limit (fs.inotify.max_user_watches) is reached.
+    """
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or None, use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._rm_watch = libc.inotify_rm_watch
+        self._rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, f'inotify_init1: {os.strerror(err)}')
+        self._paths = {}
+        self._wds = {}
+
+    def fileno(self):
+        return self.fd
+
+    def add_tree(self, root):
+        """
+        Watch a directory and every directory below it
+
+        Returns:
+            int: Total size of the files found, used to account for trees
+                created or moved into a watched directory
+        """
+        size = 0
+        stack = [root]
+        while stack:
+            path = stack.pop()
+            self._watch(path)
+            try:
+                with os.scandir(path) as entries:
+                    for entry in entries:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                stack.append(entry.path)
+                            else:
+                                size += entry.stat(follow_symlinks=False).st_size
+                        except OSError:
+                            continue
+            except OSError:
+                continue
+        return size
+
+    def _watch(self, path):
+        wd = self._add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err in (errno.ENOSPC, errno.ENOMEM):
+                raise OSError(err, f'inotify watch limit reached at {path}')
+            # 目录在遍历过程中被删除或不可读
+            return
+        self._wds[wd] = path
+        self._paths[path] = wd
+
+    def remove_tree(self, root):
+        prefix = root.rstrip('/') + '/'
+        for path in [path for path in self._paths if path == root or path.startswith(prefix)]:
+            wd = self._paths.pop(path)
+            self._wds.pop(wd, None)
+            self._rm_watch(self.fd, wd)
+
+    def read(self):
+        """
+        Read the queued events
+
+        Returns:
+            list: (mask, path) tuples; path is None for a queue overflow
+        """
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                return events
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = data[offset:offset + length].rstrip(b'\0')
+                offset += length
+                if mask & IN_Q_OVERFLOW:
+                    events.append((mask, None))
+                    continue
+                if mask & IN_IGNORED:
+                    path = self._wds.pop(wd, None)
+                    if path and self._paths.get(path) == wd:
+                        del self._paths[path]
+                    continue
+                directory = self._wds.get(wd)
+                if directory is None:
+                    continue
+                events.append((mask, os.path.join(directory, os.fsdecode(name)) if name else directory))
+
+    def close(self):
+        os.close(self.fd)
+
+
+class WatchState:
+    """Pending changes of one on_change task"""
+
+    def __init__(self, task):
+        self.task_id = task.id
+        self.configure(task)
+        self.last_run = task.last_run
+        self.running = False
+        self.polling = False
+        self.fingerprint = None
+        self.polled_at = None
+        self.reset()
+
+    def configure(self, task):
+        self.root = task.source_path
+        self.debounce = task.debounce_seconds if task.debounce_seconds is not None else DEFAULT_DEBOUNCE
+        self.min_interval = task.min_interval if task.min_interval is not None else DEFAULT_MIN_INTERVAL
+        self.max_interval = task.interval_seconds or DEFAULT_MAX_INTERVAL
+        self.threshold = task.change_threshold or 0
+
+    def reset(self):
+        # 路径 -> 最近一次写入完成时的大小；同一文件反复写入只计一次
+        self.pending = {}
+        self.extra_bytes = 0
+        self.first_change = None
+        self.last_change = None
+
+    def contains(self, path):
+        return path == self.root or path.startswith(self.root.rstrip('/') + '/')
+
+    def record(self, path, size, now):
+        if path is not None:
+            self.pending[path] = max(size, self.pending.get(path, 0))
+        else:
+            self.extra_bytes += size
+        self.first_change = self.first_change or now
+        self.last_change = now
+
+    @property
+    def pending_bytes(self):
+        return sum(self.pending.values()) + self.extra_bytes
+
+    def deadline(self, now):
+        """Latest time the next run happens: max_interval after the previous one"""
+        return (self.last_run or now) + timedelta(seconds=self.max_interval)
+
+    def due(self, now):
+        """
+        Whether the task should run now
+
+        A run is due once the changes have been quiet for `debounce`
+        seconds and add up to `threshold` bytes, but never sooner than
+        `min_interval` after the previous run; `max_interval` after the
+        previous run it is due regardless, as a safety net for changes the
+        watcher could not see.
+        """
+        if self.running:
+            return False
+        since_last = (now - self.last_run).total_seconds() if self.last_run else None
+        if since_last is None or since_last >= self.max_interval:
+            return True
+        if self.first_change is None or since_last < self.min_interval:
+            return False
+        if (now - self.last_change).total_seconds() < self.debounce:
+            return False
+        return self.pending_bytes >= self.threshold
+
+    def to_dict(self):
+        return {
+            'task_id': self.task_id,
+            'backend': 'poll' if self.polling else 'inotify',
+            'pending_paths': len(self.pending),
+            'pending_bytes': self.pending_bytes,
+            'first_change': self.first_change.isoformat() if self.first_change else None,
+            'last_change': self.last_change.isoformat() if self.last_change else None,
+            'running': self.running
+        }
+
+
+class FileWatcher:
+    """
+    Resident watcher queueing backups of on_change tasks
+
+    File system events below the source paths of on_change tasks are
+    collected per task (inotify, or a periodic directory fingerprint
+    comparison where inotify is unavailable) and fed to the change
+    tracker as hints for change detection. A backup is queued through the
+    callback given to start() once a task is due (see WatchState.due).
+    """
+
+    def __init__(self, backend=WATCH_BACKEND, poll_interval=WATCH_POLL_INTERVAL):
+        self.backend = backend
+        self.poll_interval = poll_interval
+        self._states = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._inotify = None
+        self._on_due = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, on_due):
+        """
+        Start the watch loop in a daemon thread
+
+        Args:
+            on_due (callable): Called with the task id when a task should run
+        """
+        if self.running:
+            return
+        self._on_due = on_due
+        if self.backend != 'poll':
+            try:
+                self._inotify = Inotify()
+            except (OSError, AttributeError) as e:
+                if self.backend == 'inotify':
+                    raise
+                logger.warning(f"inotify is not available, polling every {self.poll_interval}s: {str(e)}")
+        with self._lock:
+            for state in self._states.values():
+                self._attach(state)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name='FileWatcher', daemon=True)
+        self._thread.start()
+        logger.info(f"File watcher started ({'inotify' if self._inotify else 'poll'})")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+        if self._inotify:
+            self._inotify.close()
+            self._inotify = None
+
+    def sync(self, task):
+        """
+        Watch the source path of an enabled on_change task
+
+        Safe to call repeatedly and in processes not running the watcher.
+
+        Returns:
+            datetime: Latest time of the next run (naive UTC)
+        """
+        now = datetime.utcnow()
+        with self._lock:
+            state = self._states.get(task.id)
+            if state is None:
+                state = self._states[task.id] = WatchState(task)
+                if self.running:
+                    self._attach(state)
+            elif state.root != task.source_path:
+                self._detach(state)
+                state.configure(task)
+                state.reset()
+                if self.running:
+                    self._attach(state)
+            else:
+                state.configure(task)
+            return state.deadline(now)
+
+    def unwatch(self, task_id):
+        with self._lock:
+            state = self._states.pop(task_id, None)
+            if state:
+                self._detach(state)
+
+    def finished(self, task_id):
+        """
+        Record the end of a run queued by the watcher
+
+        Returns:
+            datetime: Latest time of the next run, or None if the task is
+                no longer watched
+        """
+        with self._lock:
+            state = self._states.get(task_id)
+            if not state:
+                return None
+            state.running = False
+            return state.deadline(datetime.utcnow())
+
+    def status(self, task_id):
+        with self._lock:
+            state = self._states.get(task_id)
+            return state.to_dict() if state and self.running else None
+
+    def _attach(self, state):
+        state.polling = self._inotify is None
+        if not state.polling:
+            try:
+                self._inotify.add_tree(state.root)
+                return
+            except OSError as e:
+                logger.warning(f"Cannot watch {state.root} of task {state.task_id} with inotify, "
+                               f"polling instead: {str(e)}")
+                self._detach(state)
+                state.polling = True
+        state.fingerprint = scan_directories(state.root)
+        state.polled_at = datetime.utcnow()
+
+    def _detach(self, state):
+        if self._inotify is None or state.polling:
+            return
+        # 其他任务仍在监视的目录保留
+        others = [other.root for other in self._states.values()
+                  if other is not state and not other.polling]
+        if not any(state.contains(root) for root in others):
+            self._inotify.remove_tree(state.root)
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                if self._inotify:
+                    readable, _, _ = select.select([self._inotify], [], [], TICK)
+                    if readable:
+                        self._handle(self._inotify.read())
+                else:
+                    self._stop.wait(TICK)
+                self._poll()
+                self._check()
+            except Exception as e:
+                logger.error(f"Error watching source paths: {str(e)}")
+                self._stop.wait(TICK)
+
+    def _handle(self, events):
+        now = datetime.utcnow()
+        with self._lock:
+            states = [state for state in self._states.values() if not state.polling]
+            for mask, path in events:
+                if path is None:
+                    # 事件队列溢出：变化未知，按整个源路径都已变化处理
+                    logger.warning("inotify event queue overflowed, treating all watched paths as changed")
+                    for state in states:
+                        change_tracker.mark(state.root)
+                        state.record(state.root, state.threshold, now)
+                    continue
+                size = 0
+                if mask & IN_ISDIR:
+                    if mask & (IN_CREATE | IN_MOVED_TO):
+                        try:
+                            size = self._inotify.add_tree(path)
+                        except OSError as e:
+                            logger.warning(f"Cannot watch new directory {path}: {str(e)}")
+                    elif mask & IN_MOVED_FROM:
+                        self._inotify.remove_tree(path)
+                elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                    try:
+                        size = os.stat(path, follow_symlinks=False).st_size
+                    except OSError:
+                        pass
+                elif mask & IN_DELETE_SELF:
+                    continue
+                matched = [state for state in states if state.contains(path)]
+                if matched:
+                    change_tracker.mark(path)
+                for state in matched:
+                    state.record(path, size, now)
+
+    def _poll(self):
+        now = datetime.utcnow()
+        with self._lock:
+            states = [state for state in self._states.values() if state.polling
+                      and (now - state.polled_at).total_seconds() >= self.poll_interval]
+        for state in states:
+            # 目录修改时间只反映条目的增删改名；新文件的大小按修改时间晚于上次轮询的文件累计
+            fingerprint = scan_directories(state.root)
+            # polled_at 为不带时区的 UTC 时间，直接 timestamp() 会按本地时区换算
+            since = state.polled_at.replace(tzinfo=timezone.utc).timestamp()
+            changed = [path for path, mtime in fingerprint.items() if state.fingerprint.get(path) != mtime]
+            size = 0
+            for path in changed:
+                if path == state.root and not os.path.isdir(path):
+                    size += fingerprint[path][1]
+                    continue
+                try:
+                    with os.scandir(path) as entries:
+                        for entry in entries:
+                            try:
+                                stat = entry.stat(follow_symlinks=False)
+                            except OSError:
+                                continue
+                            if not entry.is_dir(follow_symlinks=False) and stat.st_mtime >= since:
+                                size += stat.st_size
+                except OSError:
+                    continue
+            with self._lock:
+                state.fingerprint = fingerprint
+                state.polled_at = now
+                if changed:
+                    state.record(None, size, now)
+
+    def _check(self):
+        now = datetime.utcnow()
+        with self._lock:
+            due = [state for state in self._states.values() if state.due(now)]
+            for state in due:
+                logger.info(f"Queueing backup of on_change task {state.task_id}: "
+                            f"{len(state.pending)} changed path(s), {state.pending_bytes} bytes")
+                state.running = True
+                state.last_run = now
+                state.reset()
+        for state in due:
+            try:
+                self._on_due(state.task_id)
+            except Exception as e:
+                logger.error(f"Could not queue backup of task {state.task_id}: {str(e)}")
+                self.finished(state.task_id)
+
+
+file_watcher = FileWatcher()